@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -151,6 +152,31 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
+# Caché
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# 'stock': disponibilidad por producto / MP (ver stock/services.py). Es en
+# archivos para que todos los workers de gunicorn compartan las entradas y
+# las invalidaciones; el TIMEOUT solo acota una invalidación perdida.
+# 'versiones': versión vigente de los datos que cada proceso guarda en memoria
+# (explosión de recetas, calendario laboral). Cuando cambia, el proceso recarga.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'stock': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': str(Path(tempfile.gettempdir()) / 'frozen_back_stock'),
+        'TIMEOUT': 600,
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    'versiones': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': str(Path(tempfile.gettempdir()) / 'frozen_back_versiones'),
+        'TIMEOUT': None,
+    },
+}
+
+
 
 REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': [
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class PlanificacionConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'planificacion'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,243 @@
+import contextlib
+import io
+import random
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+from django.db import connection
+from django.utils import timezone
+
+from productos.models import Producto, Unidad, TipoProducto
+from materias_primas.models import MateriaPrima, Proveedor, TipoMateriaPrima
+from recetas.models import Receta, RecetaMateriaPrima, ProductoLinea
+from produccion.models import (
+    LineaProduccion, estado_linea_produccion, EstadoOrdenProduccion, EstadoOrdenTrabajo
+)
+from stock.models import (
+    LoteProduccion, LoteMateriaPrima, ReservaStock, ReservaMateriaPrima,
+    EstadoLoteProduccion, EstadoLoteMateriaPrima, EstadoReserva, EstadoReservaMateria
+)
+from stock.services import recalcular_disponibilidad_lotes
+from ventas.models import OrdenVenta, OrdenVentaProducto, EstadoVenta, Cliente, Prioridad
+from compras.models import EstadoOrdenCompra
+
+# Días sobre los que se reparten las fechas de entrega de las OVs
+HORIZONTE_DIAS = 30
+# Productos por familia: comparten MPs y líneas (ver componentes del MRP en paralelo)
+PRODUCTOS_POR_FAMILIA = 5
+
+
+# ===================================================================
+# PLANTA SINTÉTICA
+# ===================================================================
+def generar_planta(ordenes: int, hoy: date, semilla: int = 7) -> dict:
+    """
+    Genera una planta sintética proporcional a 'ordenes' (cantidad de OVs):
+    productos agrupados en familias (comparten MPs, proveedores y líneas),
+    recetas, líneas, lotes de PT y MP, OVs repartidas en el horizonte y
+    algunas reservas de PT ya hechas. Todo con bulk_create.
+
+    Devuelve la cantidad de filas creadas por modelo.
+    """
+    rnd = random.Random(semilla)
+    n_productos = min(max(ordenes // 50, 10), 400)
+    n_familias = max(n_productos // PRODUCTOS_POR_FAMILIA, 1)
+
+    estados = _crear_estados()
+    unidad = Unidad.objects.create(descripcion="kg")
+    tipo_producto = TipoProducto.objects.create(descripcion="Congelados")
+    tipo_mp = TipoMateriaPrima.objects.create(descripcion="Insumo")
+
+    proveedores = Proveedor.objects.bulk_create([
+        Proveedor(nombre=f"Proveedor {i}", lead_time_days=rnd.randint(1, 7))
+        for i in range(max(n_productos // 10, 5))
+    ])
+
+    materias_primas, lineas, productos = [], [], []
+    mps_por_familia, lineas_por_familia = [], []
+    for familia in range(n_familias):
+        mps_familia = [
+            MateriaPrima(
+                nombre=f"MP {familia}-{i}", precio=1, id_tipo_materia_prima=tipo_mp, id_unidad=unidad,
+                id_proveedor=rnd.choice(proveedores), cantidad_minima_pedido=rnd.choice([1, 10, 50, 100])
+            )
+            for i in range(rnd.randint(4, 8))
+        ]
+        lineas_familia = [
+            LineaProduccion(descripcion=f"Línea {familia}-{i}", id_estado_linea_produccion=estados["linea_disponible"])
+            for i in range(rnd.randint(1, 2))
+        ]
+        materias_primas += mps_familia
+        lineas += lineas_familia
+        mps_por_familia.append(mps_familia)
+        lineas_por_familia.append(lineas_familia)
+    MateriaPrima.objects.bulk_create(materias_primas)
+    LineaProduccion.objects.bulk_create(lineas)
+
+    familia_de_producto = []
+    for i in range(n_productos):
+        familia_de_producto.append(i % n_familias)
+        productos.append(Producto(
+            nombre=f"Producto {i}", precio=rnd.randint(100, 900), id_tipo_producto=tipo_producto,
+            id_unidad=unidad, dias_duracion=rnd.randint(30, 180), umbral_minimo=rnd.randint(5, 50)
+        ))
+    Producto.objects.bulk_create(productos)
+
+    recetas = Receta.objects.bulk_create([Receta(id_producto=producto) for producto in productos])
+    ingredientes, capacidades = [], []
+    for producto, receta, familia in zip(productos, recetas, familia_de_producto):
+        for mp in rnd.sample(mps_por_familia[familia], rnd.randint(2, min(5, len(mps_por_familia[familia])))):
+            ingredientes.append(RecetaMateriaPrima(id_receta=receta, id_materia_prima=mp, cantidad=rnd.randint(1, 4)))
+        for linea in rnd.sample(lineas_por_familia[familia], rnd.randint(1, len(lineas_por_familia[familia]))):
+            capacidades.append(ProductoLinea(
+                id_producto=producto, id_linea_produccion=linea,
+                cant_por_hora=rnd.choice([20, 35, 50, 80]), cantidad_minima=5
+            ))
+    RecetaMateriaPrima.objects.bulk_create(ingredientes)
+    ProductoLinea.objects.bulk_create(capacidades)
+
+    lotes_pt = LoteProduccion.objects.bulk_create([
+        LoteProduccion(
+            id_producto=producto, cantidad=rnd.randint(20, 200),
+            id_estado_lote_produccion=estados["lote_pt_disponible"],
+            fecha_vencimiento=hoy + timedelta(days=rnd.randint(5, 60))
+        )
+        for producto in productos for _ in range(rnd.randint(0, 3))
+    ])
+    lotes_mp = LoteMateriaPrima.objects.bulk_create([
+        LoteMateriaPrima(
+            id_materia_prima=mp, cantidad=rnd.randint(100, 5000),
+            id_estado_lote_materia_prima=estados["lote_mp_disponible"],
+            fecha_vencimiento=hoy + timedelta(days=rnd.randint(10, 120))
+        )
+        for mp in materias_primas for _ in range(rnd.randint(1, 3))
+    ])
+
+    prioridad = Prioridad.objects.create(descripcion="Normal")
+    clientes = Cliente.objects.bulk_create([Cliente(nombre=f"Cliente {i}") for i in range(max(ordenes // 20, 5))])
+    ovs = OrdenVenta.objects.bulk_create([
+        OrdenVenta(
+            id_cliente=rnd.choice(clientes), id_estado_venta=estados["ov_creada"], id_prioridad=prioridad,
+            fecha_entrega=timezone.make_aware(datetime.combine(
+                hoy + timedelta(days=rnd.randint(1, HORIZONTE_DIAS)), datetime.min.time()
+            ))
+        )
+        for _ in range(ordenes)
+    ])
+
+    # La mayoría de las OVs piden productos de una misma familia
+    productos_por_familia = [[] for _ in range(n_familias)]
+    for producto, familia in zip(productos, familia_de_producto):
+        productos_por_familia[familia].append(producto)
+    lineas_ov = []
+    for ov in ovs:
+        candidatos = productos if rnd.random() < 0.2 else productos_por_familia[rnd.randrange(n_familias)]
+        for producto in rnd.sample(candidatos, rnd.randint(1, min(3, len(candidatos)))):
+            lineas_ov.append(OrdenVentaProducto(id_orden_venta=ov, id_producto=producto, cantidad=rnd.randint(10, 300)))
+    OrdenVentaProducto.objects.bulk_create(lineas_ov)
+
+    lotes_por_producto = {}
+    for lote in lotes_pt:
+        lotes_por_producto.setdefault(lote.id_producto_id, []).append(lote)
+    reservas = []
+    for linea_ov in rnd.sample(lineas_ov, len(lineas_ov) // 10):
+        lotes = lotes_por_producto.get(linea_ov.id_producto_id)
+        if lotes:
+            reservas.append(ReservaStock(
+                id_orden_venta_producto=linea_ov, id_lote_produccion=rnd.choice(lotes),
+                cantidad_reservada=rnd.randint(1, 10), id_estado_reserva=estados["reserva_activa"]
+            ))
+    ReservaStock.objects.bulk_create(reservas)
+    # bulk_create no pasa por save() ni por las señales: se calcula la disponibilidad de los lotes
+    recalcular_disponibilidad_lotes(ReservaStock)
+    recalcular_disponibilidad_lotes(ReservaMateriaPrima)
+
+    return {
+        "productos": len(productos),
+        "materias_primas": len(materias_primas),
+        "proveedores": len(proveedores),
+        "lineas_produccion": len(lineas),
+        "lotes_produccion": len(lotes_pt),
+        "lotes_materia_prima": len(lotes_mp),
+        "ordenes_venta": len(ovs),
+        "lineas_orden_venta": len(lineas_ov),
+        "reservas_stock": len(reservas),
+    }
+
+
+def _crear_estados() -> dict:
+    """Estados con las descripciones que buscan el MRP, el solver y el replanificador."""
+    for descripcion in ["Creada", "En Preparación", "Pendiente de Pago", "Cancelada"]:
+        EstadoVenta.objects.create(descripcion=descripcion)
+    for descripcion in ["En espera", "Pendiente de inicio", "Planificada", "En proceso", "Finalizada", "Cancelado"]:
+        EstadoOrdenProduccion.objects.create(descripcion=descripcion)
+    for descripcion in ["Pendiente", "En progreso", "Completada"]:
+        EstadoOrdenTrabajo.objects.create(descripcion=descripcion)
+    EstadoOrdenCompra.objects.create(descripcion="En proceso")
+    EstadoLoteProduccion.objects.create(descripcion="En espera")
+    EstadoReservaMateria.objects.create(descripcion="Activa")
+    return {
+        "ov_creada": EstadoVenta.objects.get(descripcion="Creada"),
+        "linea_disponible": estado_linea_produccion.objects.create(descripcion="Disponible"),
+        "lote_pt_disponible": EstadoLoteProduccion.objects.create(descripcion="Disponible"),
+        "lote_mp_disponible": EstadoLoteMateriaPrima.objects.create(descripcion="disponible"),
+        "reserva_activa": EstadoReserva.objects.create(descripcion="Activa"),
+    }
+
+
+# ===================================================================
+# MEDICIÓN
+# ===================================================================
+@contextlib.contextmanager
+def medir(resultado: dict, silencioso: bool = True):
+    """
+    Completa 'resultado' con el tiempo (s), la cantidad de consultas y el pico
+    de memoria Python (MB, tracemalloc) del bloque. Con 'silencioso' se
+    descarta lo que imprimen los planificadores.
+    """
+    consultas = [0]
+
+    def contar(execute, sql, params, many, context):
+        consultas[0] += 1
+        return execute(sql, params, many, context)
+
+    salida = io.StringIO() if silencioso else None
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    try:
+        with connection.execute_wrapper(contar), contextlib.ExitStack() as pila:
+            if salida is not None:
+                pila.enter_context(contextlib.redirect_stdout(salida))
+            yield resultado
+    except Exception as e:
+        resultado["error"] = str(e)
+    finally:
+        resultado["segundos"] = round(time.perf_counter() - inicio, 3)
+        resultado["consultas"] = consultas[0]
+        resultado["memoria_pico_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 2)
+        tracemalloc.stop()
+
+
+def correr_escala(ordenes: int, hoy: date, semilla: int = 7, silencioso: bool = True) -> dict:
+    """Genera la planta y corre MRP -> solver -> replanificación por capacidad, midiendo cada uno."""
+    from planificacion.planificador import ejecutar_planificacion_diaria_mrp
+    from planificacion.planner_service import ejecutar_planificador
+    from planificacion.replanificador import replanificar_ops_por_capacidad
+
+    resultado = {"ordenes": ordenes, "datos": {}, "generacion": {}, "mrp": {}, "solver": {}, "replanificacion": {}}
+
+    with medir(resultado["generacion"], silencioso):
+        resultado["datos"] = generar_planta(ordenes, hoy, semilla)
+
+    with medir(resultado["mrp"], silencioso):
+        resumen = ejecutar_planificacion_diaria_mrp(hoy)
+        resultado["mrp"]["totales"] = resumen["totales"]
+
+    with medir(resultado["solver"], silencioso):
+        ejecutar_planificador(hoy)
+
+    with medir(resultado["replanificacion"], silencioso):
+        replanificar_ops_por_capacidad(hoy)
+
+    return resultado
@@ -0,0 +1,154 @@
+import uuid
+from datetime import date, timedelta
+
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from .models import DiaNoLaborable
+
+# Sábado (5) y domingo (6)
+DIAS_FIN_DE_SEMANA = (5, 6)
+# Margen con el que se (re)construye el índice alrededor de la fecha pedida
+DIAS_INDICE = 730
+
+
+class CalendarioLaboral:
+    """
+    Calendario de días hábiles: no son hábiles los fines de semana ni los
+    DiaNoLaborable (feriados y paradas de planta).
+
+    Precalcula un índice ORDINAL de días hábiles sobre un rango de fechas
+    (se extiende solo si se consulta fuera de él), así que todas las
+    consultas son O(1):
+
+        calendario = get_calendario_laboral()
+        calendario.proximo_habil(fecha)        # fecha si es hábil, si no el siguiente
+        calendario.anterior_habil(fecha)       # fecha si es hábil, si no el anterior
+        calendario.sumar_habiles(fecha, n)     # n-ésimo hábil después (n < 0: antes)
+        calendario.habiles_entre(desde, hasta) # hábiles en [desde, hasta)
+    """
+
+    def __init__(self, no_laborables, desde: date = None, hasta: date = None):
+        self._no_laborables = frozenset(no_laborables)
+        desde = desde or timezone.localdate() - timedelta(days=DIAS_INDICE // 2)
+        hasta = hasta or desde + timedelta(days=DIAS_INDICE)
+        self._indexar(desde, hasta)
+
+    @classmethod
+    def cargar(cls, desde: date = None, hasta: date = None):
+        """1 consulta: TODOS los días no laborables (la tabla es chica)."""
+        return cls(DiaNoLaborable.objects.values_list('fecha', flat=True), desde, hasta)
+
+    # ------------------------------------------------------------------
+    # Índice
+    # ------------------------------------------------------------------
+    def _indexar(self, desde: date, hasta: date):
+        # previos[i]: cantidad de días hábiles en [desde, desde + i)
+        # habiles[k]: el k-ésimo día hábil desde 'desde'
+        base = desde.toordinal()
+        dias = (hasta - desde).days + 1
+        previos = [0] * (dias + 1)
+        habiles = []
+        for i in range(dias):
+            fecha = date.fromordinal(base + i)
+            if self._es_habil(fecha):
+                habiles.append(fecha)
+            previos[i + 1] = len(habiles)
+        # Se reemplaza de una sola vez (el calendario se comparte entre hilos)
+        self._indice = (base, previos, habiles)
+
+    def _es_habil(self, fecha: date) -> bool:
+        return fecha.weekday() not in DIAS_FIN_DE_SEMANA and fecha not in self._no_laborables
+
+    def _extender(self, fecha: date):
+        base, previos, _habiles = self._indice
+        desde = date.fromordinal(base)
+        hasta = date.fromordinal(base + len(previos) - 2)
+        self._indexar(
+            min(desde, fecha - timedelta(days=DIAS_INDICE)),
+            max(hasta, fecha + timedelta(days=DIAS_INDICE))
+        )
+
+    def _posicion(self, fecha: date) -> int:
+        """Cantidad de días hábiles anteriores a 'fecha' (dentro del índice)."""
+        base, previos, _habiles = self._indice
+        i = fecha.toordinal() - base
+        if not 0 <= i < len(previos) - 1:
+            self._extender(fecha)
+            base, previos, _habiles = self._indice
+            i = fecha.toordinal() - base
+        return previos[i]
+
+    def _habil_numero(self, k: int, referencia: date) -> date:
+        _base, _previos, habiles = self._indice
+        if not 0 <= k < len(habiles):
+            # Se pidió un hábil fuera del índice: se extiende y se vuelve a ubicar
+            posicion = self._posicion(referencia)
+            self._extender(referencia + timedelta(days=(k - posicion) * 2))
+            return self._habil_numero(self._posicion(referencia) + (k - posicion), referencia)
+        return habiles[k]
+
+    # ------------------------------------------------------------------
+    # Consultas
+    # ------------------------------------------------------------------
+    def es_habil(self, fecha: date) -> bool:
+        return self._es_habil(fecha)
+
+    def proximo_habil(self, fecha: date) -> date:
+        return self._habil_numero(self._posicion(fecha), fecha)
+
+    def anterior_habil(self, fecha: date) -> date:
+        return self._habil_numero(self._posicion(fecha + timedelta(days=1)) - 1, fecha)
+
+    def sumar_habiles(self, fecha: date, dias: int) -> date:
+        if dias > 0:
+            return self._habil_numero(self._posicion(fecha + timedelta(days=1)) - 1 + dias, fecha)
+        if dias < 0:
+            return self._habil_numero(self._posicion(fecha) + dias, fecha)
+        return self.proximo_habil(fecha)
+
+    def habiles_entre(self, desde: date, hasta: date) -> int:
+        """Días hábiles en [desde, hasta) (negativo si hasta < desde)."""
+        return self._posicion(hasta) - self._posicion(desde)
+
+
+# ===================================================================
+# CACHÉ EN MEMORIA (por proceso)
+# ===================================================================
+# Como la explosión de recetas (recetas/services.py): cada proceso guarda el
+# calendario con la versión con la que lo cargó, y las señales de
+# planificacion/signals.py (DiaNoLaborable) publican una versión nueva en el
+# caché compartido 'versiones' al confirmarse la transacción.
+CACHE_VERSIONES = 'versiones'
+CLAVE_VERSION_CALENDARIO = "version:calendario_laboral"
+
+_cache = {"calendario": None, "version": None}
+
+
+def _version_calendario():
+    cache = caches[CACHE_VERSIONES]
+    version = cache.get(CLAVE_VERSION_CALENDARIO)
+    if version is None:
+        cache.add(CLAVE_VERSION_CALENDARIO, uuid.uuid4().hex)
+        version = cache.get(CLAVE_VERSION_CALENDARIO)
+    return version
+
+
+def get_calendario_laboral() -> CalendarioLaboral:
+    """Devuelve el calendario laboral cacheado (lo recarga si cambió la versión o se invalidó)."""
+    version = _version_calendario()
+    calendario = _cache["calendario"]
+    if calendario is None or _cache["version"] != version:
+        calendario = CalendarioLaboral.cargar()
+        _cache["calendario"] = calendario
+        _cache["version"] = version
+    return calendario
+
+
+def invalidar_calendario_laboral():
+    """Este proceso recarga ya; los demás, cuando se confirma la transacción."""
+    _cache["calendario"] = None
+    transaction.on_commit(
+        lambda: caches[CACHE_VERSIONES].set(CLAVE_VERSION_CALENDARIO, uuid.uuid4().hex)
+    )
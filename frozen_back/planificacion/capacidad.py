@@ -0,0 +1,191 @@
+from collections import defaultdict
+from datetime import date
+
+from produccion.models import CalendarioProduccion
+
+
+class CapacidadLineas:
+    """
+    Libro (ledger) de capacidad en memoria para los bucles "Walk the Calendar".
+
+    - Carga en UNA sola consulta las horas ya reservadas por (línea, fecha)
+      desde 'fecha_desde' en adelante, contando solo las OPs en 'estados_op'.
+    - El planificador consulta las horas libres y registra/libera reservas
+      en memoria, sin volver a la BD por cada día candidato.
+    - 'guardar()' vuelca los cambios pendientes: un DELETE por cada fecha de
+      corte y un único bulk_create de las nuevas filas de CalendarioProduccion.
+      Se puede llamar más de una vez (p. ej. al final de cada paso del MRP).
+    - 'movimientos' registra las altas y bajas en orden, para el resumen
+      de una simulación.
+    """
+
+    def __init__(self, fecha_desde: date, estados_op, horas_por_dia):
+        self.horas_por_dia = horas_por_dia
+
+        # (linea_id, fecha) -> horas reservadas
+        self._carga = defaultdict(float)
+        # op_id -> [(linea_id, fecha, horas)] de las filas que ya están en la BD
+        self._filas_por_op = defaultdict(list)
+        # Filas nuevas (CalendarioProduccion sin guardar)
+        self._altas = []
+        # fecha de corte (None = todas) -> {op_id} cuyas filas hay que borrar
+        self._bajas = defaultdict(set)
+        # [('alta', CalendarioProduccion) | ('baja', op, desde)]
+        self.movimientos = []
+
+        filas = CalendarioProduccion.objects.filter(
+            fecha__gte=fecha_desde,
+            id_orden_produccion__id_estado_orden_produccion__in=estados_op
+        ).values_list('id_orden_produccion_id', 'id_linea_produccion_id', 'fecha', 'horas_reservadas')
+
+        for op_id, linea_id, fecha, horas in filas:
+            horas = float(horas)
+            self._carga[(linea_id, fecha)] += horas
+            self._filas_por_op[op_id].append((linea_id, fecha, horas))
+
+    # ------------------------------------------------------------------
+    # Lectura
+    # ------------------------------------------------------------------
+    def carga(self, linea_id, fecha: date) -> float:
+        return self._carga.get((linea_id, fecha), 0.0)
+
+    def horas_libres(self, lineas_ids, fecha: date) -> float:
+        """
+        Horas libres del cuello de botella (la línea más cargada) en 'fecha'.
+        """
+        horas_libres_cuello_botella = self.horas_por_dia
+        for linea_id in lineas_ids:
+            horas_libres_linea = max(0, self.horas_por_dia - self.carga(linea_id, fecha))
+            horas_libres_cuello_botella = min(horas_libres_cuello_botella, horas_libres_linea)
+        return horas_libres_cuello_botella
+
+    def liberada(self, op_id, fecha: date) -> bool:
+        """¿Se liberaron (en memoria) las filas de la BD de la OP en 'fecha'?"""
+        return any(
+            op_id in op_ids and (desde is None or desde <= fecha)
+            for desde, op_ids in self._bajas.items()
+        )
+
+    def altas_del_dia(self, fecha: date):
+        """Filas nuevas (sin guardar) de 'fecha' que siguen en pie."""
+        return [reserva for reserva in self._altas if reserva.fecha == fecha]
+
+    # ------------------------------------------------------------------
+    # Escritura (en memoria)
+    # ------------------------------------------------------------------
+    def registrar(self, reservas):
+        """
+        Registra filas nuevas de CalendarioProduccion (todavía sin guardar).
+        La OP de cada fila debe estar guardada antes de llamar a 'guardar()'.
+        """
+        for reserva in reservas:
+            self._carga[(reserva.id_linea_produccion_id, reserva.fecha)] += float(reserva.horas_reservadas)
+            self._altas.append(reserva)
+            self.movimientos.append(('alta', reserva))
+
+    def liberar_op(self, op, desde: date = None):
+        """
+        Libera las horas de una OP (todas, o solo desde 'desde' inclusive).
+        Equivale a CalendarioProduccion.objects.filter(id_orden_produccion=op[, fecha__gte=desde]).delete()
+        """
+        op_id = op.pk
+
+        conservadas = []
+        for linea_id, fecha, horas in self._filas_por_op.pop(op_id, []):
+            if desde is None or fecha >= desde:
+                self._carga[(linea_id, fecha)] -= horas
+            else:
+                conservadas.append((linea_id, fecha, horas))
+        if conservadas:
+            self._filas_por_op[op_id] = conservadas
+
+        self._descartar_altas(op, desde)
+
+        if op_id is not None:
+            self._bajas[desde].add(op_id)
+        self.movimientos.append(('baja', op, desde))
+
+    def _descartar_altas(self, op, desde):
+        altas = []
+        for reserva in self._altas:
+            es_de_la_op = reserva.id_orden_produccion is op or (
+                op.pk is not None and reserva.id_orden_produccion_id == op.pk
+            )
+            if es_de_la_op and (desde is None or reserva.fecha >= desde):
+                self._carga[(reserva.id_linea_produccion_id, reserva.fecha)] -= float(reserva.horas_reservadas)
+            else:
+                altas.append(reserva)
+        self._altas = altas
+
+    # ------------------------------------------------------------------
+    # MRP en paralelo (cada componente tiene sus propias líneas)
+    # ------------------------------------------------------------------
+    def acotar(self, lineas_ids, ops_ids) -> "CapacidadLineas":
+        """
+        Ledger nuevo con la carga de 'lineas_ids' y las filas de 'ops_ids' (copiadas)
+        y sin cambios pendientes: un componente arranca sin lo de otro y sin
+        tocar este ledger.
+        """
+        acotada = CapacidadLineas.__new__(CapacidadLineas)
+        acotada.horas_por_dia = self.horas_por_dia
+        acotada._carga = defaultdict(float, {
+            clave: horas for clave, horas in self._carga.items() if clave[0] in lineas_ids
+        })
+        acotada._filas_por_op = defaultdict(list, {
+            op_id: list(filas) for op_id, filas in self._filas_por_op.items() if op_id in ops_ids
+        })
+        acotada._altas = []
+        acotada._bajas = defaultdict(set)
+        acotada.movimientos = []
+        return acotada
+
+    def exportar(self, lineas_ids, ops_ids) -> dict:
+        """Carga de 'lineas_ids', filas de 'ops_ids' y cambios pendientes, para 'incorporar'."""
+        return {
+            "carga": {clave: horas for clave, horas in self._carga.items() if clave[0] in lineas_ids},
+            "filas_por_op": {op_id: self._filas_por_op.get(op_id, []) for op_id in ops_ids},
+            "altas": self._altas,
+            "bajas": dict(self._bajas),
+            "movimientos": self.movimientos,
+        }
+
+    def incorporar(self, datos):
+        """Suma lo exportado por el ledger de otro proceso (sobre líneas y OPs disjuntas)."""
+        self._carga.update(datos["carga"])
+        for op_id, filas in datos["filas_por_op"].items():
+            if filas:
+                self._filas_por_op[op_id] = filas
+            else:
+                self._filas_por_op.pop(op_id, None)
+        self._altas.extend(datos["altas"])
+        for desde, op_ids in datos["bajas"].items():
+            self._bajas[desde] |= op_ids
+        self.movimientos.extend(datos["movimientos"])
+
+    # ------------------------------------------------------------------
+    # Volcado a la BD
+    # ------------------------------------------------------------------
+    def guardar(self):
+        """
+        Escribe los cambios acumulados: primero las bajas, después las altas.
+        """
+        borradas = 0
+        for desde, op_ids in self._bajas.items():
+            filtro = CalendarioProduccion.objects.filter(id_orden_produccion_id__in=op_ids)
+            if desde is not None:
+                filtro = filtro.filter(fecha__gte=desde)
+            borradas += filtro.delete()[0]
+
+        # bulk_create toma la PK de las OPs que se guardaron después de crear la fila
+        creadas = CalendarioProduccion.objects.bulk_create(self._altas)
+
+        # Lo recién insertado pasa a ser una fila "de la BD": un 'liberar_op'
+        # posterior tiene que descontarla y borrarla igual que a las cargadas.
+        for reserva in creadas:
+            self._filas_por_op[reserva.id_orden_produccion_id].append(
+                (reserva.id_linea_produccion_id, reserva.fecha, float(reserva.horas_reservadas))
+            )
+
+        self._bajas = defaultdict(set)
+        self._altas = []
+        return borradas, len(creadas)
@@ -0,0 +1,815 @@
+import copy
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+from simple_history.utils import bulk_create_with_history
+
+from ventas.models import OrdenVenta, OrdenVentaProducto, EstadoVenta
+from produccion.models import OrdenProduccion, EstadoOrdenProduccion, OrdenProduccionPegging
+from compras.models import OrdenCompra, OrdenCompraMateriaPrima, EstadoOrdenCompra
+from materias_primas.models import Proveedor
+from stock.models import (
+    EstadoLoteProduccion, ReservaStock, ReservaMateriaPrima,
+    EstadoReserva, EstadoReservaMateria
+)
+from stock.services import StockSnapshot
+from recetas.services import ExplosionRecetas
+from trazabilidad.views import get_config
+from .capacidad import CapacidadLineas
+from .calendario import CalendarioLaboral
+from .signals import suspender_marcas
+
+
+def a_datetime(fecha: date) -> datetime:
+    """Fecha -> datetime 'aware' a las 00:00 (como se guardan las fechas de OP/OV)."""
+    return timezone.make_aware(datetime.combine(fecha, datetime.min.time()))
+
+
+def a_fecha(valor):
+    """DateTimeField (aware) -> fecha local. Deja pasar 'date' y None."""
+    if isinstance(valor, datetime):
+        return timezone.localtime(valor).date() if timezone.is_aware(valor) else valor.date()
+    return valor
+
+
+class ContextoMRP:
+    """
+    Todo lo que el MRP necesita leer, cargado UNA vez al inicio de la corrida:
+
+    - Estados, configuración, explosión de recetas, calendario laboral y capacidad de líneas.
+    - Pools de stock (real y virtual) de MP y PT, y MP en camino (OCs).
+    - OPs activas, sus peggings y sus reservas de MP (agregadas por MP).
+    - OVs del horizonte + las vinculadas a esas OPs, con sus líneas y reservas PT.
+
+    Los pasos del MRP trabajan sobre estos objetos en memoria y anotan lo que
+    hay que escribir en 'plan' (PlanMRP). En modo simulación no se escribe nada.
+
+    'productos' (MRP incremental) acota OPs, peggings, reservas de MP y OVs a
+    esos productos. Stock, OCs en proceso y capacidad de líneas se cargan
+    siempre completos: son compartidos con el resto del plan.
+    """
+
+    def __init__(self, fecha_simulada: date, simular: bool = False, productos=None, explosion=None):
+        self.simular = simular
+        self.productos = set(productos) if productos is not None else None
+        self.hoy = fecha_simulada
+        self.tomorrow = self.hoy + timedelta(days=1)
+        self.fecha_limite_ov = self.hoy + timedelta(days=7)
+
+        # --- Configuración (fresca en cada corrida) ---
+        self.horas_laborables_por_dia = get_config('HORAS_LABORABLES_POR_DIA', 16)
+        self.dias_buffer_entrega_pt = get_config('DIAS_BUFFER_ENTREGA_PT', 1)
+        self.dias_buffer_recepcion_mp = get_config('DIAS_BUFFER_RECEPCION_MP', 1)
+        # Procesos para el MRP en paralelo por componentes. Por defecto 1 (secuencial):
+        # el pool se habilita a mano, según los núcleos que el servidor le pueda dar
+        self.procesos_paralelos = get_config('MRP_PROCESOS_PARALELOS', 1)
+
+        # --- Estados ---
+        self.estado_ov_creada = EstadoVenta.objects.get(descripcion="Creada")
+        self.estado_ov_en_preparacion = self._estado(EstadoVenta, "En Preparación")
+        self.estado_ov_pendiente_pago = self._estado(EstadoVenta, "Pendiente de Pago")
+        self.estados_ov_cancelada = list(EstadoVenta.objects.filter(descripcion__icontains="Cancelada"))
+
+        self.estado_op_en_espera = self._estado(EstadoOrdenProduccion, "En espera")
+        self.estado_op_pendiente_inicio = self._estado(EstadoOrdenProduccion, "Pendiente de inicio")
+        self.estado_op_cancelada = self._estado(EstadoOrdenProduccion, "Cancelado")
+        self.estado_op_en_proceso = self._estado(EstadoOrdenProduccion, "En proceso")
+
+        self.estado_oc_en_proceso = self._estado(EstadoOrdenCompra, "En proceso")
+        self.estado_reserva_activa = self._estado(EstadoReserva, "Activa")
+        self.estado_reserva_mp_activa = self._estado(EstadoReservaMateria, "Activa")
+        self.estado_lote_espera = EstadoLoteProduccion.objects.filter(descripcion__iexact="En espera").first()
+
+        self.estados_ov_activos = [self.estado_ov_creada, self.estado_ov_en_preparacion]
+        self.estados_op_activos = [self.estado_op_en_espera, self.estado_op_pendiente_inicio, self.estado_op_en_proceso]
+
+        # --- Recetas, líneas, calendario laboral y capacidad ---
+        self.explosion = explosion or ExplosionRecetas.cargar()
+        self.calendario = CalendarioLaboral.cargar()
+        self.capacidad = CapacidadLineas(
+            fecha_desde=self.hoy,
+            estados_op=_ids([self.estado_op_en_espera, self.estado_op_pendiente_inicio]),
+            horas_por_dia=self.horas_laborables_por_dia
+        )
+
+        # --- Pools de stock ---
+        snapshot_stock = StockSnapshot()
+        self.stock_real_pt = dict(snapshot_stock.pt)
+        self.stock_real_mp = dict(snapshot_stock.mp)
+        self.stock_virtual_mp = dict(snapshot_stock.mp)
+
+        self.stock_virtual_oc = defaultdict(int)
+        compras_en_proceso = OrdenCompraMateriaPrima.objects.filter(
+            id_orden_compra__id_estado_orden_compra__descripcion="En proceso"
+        ).values_list('id_materia_prima_id', 'cantidad')
+        for mp_id, cantidad in compras_en_proceso:
+            self.stock_virtual_oc[mp_id] += cantidad
+
+        self._reiniciar_decisiones()
+
+        self._cargar_ops()
+        self._cargar_ovs()
+        self._cargar_reservas_pt_canceladas()
+
+        self.plan = PlanMRP(self)
+
+    def _reiniciar_decisiones(self):
+        """Acumuladores que llenan los pasos del MRP (vacíos al arrancar)."""
+        # Compras agregadas por proveedor (PASOS 0.6 y 5 -> PASO 6)
+        self.compras_agregadas_por_proveedor = defaultdict(lambda: {
+            "proveedor": None,
+            "fecha_requerida_mas_temprana": date(9999, 12, 31),
+            "items": defaultdict(int)
+        })
+        # (linea_ov, cantidad_a_producir, fecha_entrega_ov) que salen del PASO 1-3
+        self.lineas_para_producir = []
+
+    def _estado(self, modelo, descripcion):
+        """get_or_create del estado; en simulación no se crea (instancia sin guardar)."""
+        if self.simular:
+            return modelo.objects.filter(descripcion=descripcion).first() or modelo(descripcion=descripcion)
+        estado, _ = modelo.objects.get_or_create(descripcion=descripcion)
+        return estado
+
+    # ------------------------------------------------------------------
+    # Carga
+    # ------------------------------------------------------------------
+    def _cargar_ops(self):
+        filtro_ops = Q(id_orden_produccion__id_estado_orden_produccion__in=_ids(self.estados_op_activos))
+        if self.productos is not None:
+            filtro_ops &= Q(id_orden_produccion__id_producto__in=self.productos)
+
+        self.ops = {
+            op.pk: op for op in OrdenProduccion.objects.filter(
+                id_estado_orden_produccion__in=_ids(self.estados_op_activos),
+                **self._filtro_productos('id_producto')
+            ).select_related('id_producto').order_by('id_orden_produccion')
+        }
+        self.ops_nuevas = []
+
+        # op_id -> [(linea_ov_id, ov_id, cantidad)] y linea_ov_id -> [(op_id, cantidad)]
+        self.peggings = defaultdict(list)
+        self.peggings_por_linea = defaultdict(list)
+        peggings = OrdenProduccionPegging.objects.filter(filtro_ops).order_by('pk').values_list(
+            'id_orden_produccion_id', 'id_orden_venta_producto_id',
+            'id_orden_venta_producto__id_orden_venta_id', 'cantidad_asignada'
+        )
+        for op_id, linea_id, ov_id, cantidad in peggings:
+            self.peggings[op_id].append((linea_id, ov_id, cantidad))
+            self.peggings_por_linea[linea_id].append((op_id, cantidad))
+
+        # op (PK, o etiqueta si es nueva) -> mp_id -> {'total', 'activa', 'activa_disponible'}
+        self.reservado_mp = defaultdict(lambda: defaultdict(lambda: {'total': 0, 'activa': 0, 'activa_disponible': 0}))
+        activa = Q(id_estado_reserva_materia__descripcion='Activa')
+        reservas = ReservaMateriaPrima.objects.filter(filtro_ops).order_by().values(
+            'id_orden_produccion_id', 'id_lote_materia_prima__id_materia_prima_id'
+        ).annotate(
+            total=Sum('cantidad_reservada'),
+            activa=Sum('cantidad_reservada', filter=activa),
+            activa_disponible=Sum('cantidad_reservada', filter=activa & Q(
+                id_lote_materia_prima__id_estado_lote_materia_prima__descripcion="disponible"
+            )),
+        ).values_list('id_orden_produccion_id', 'id_lote_materia_prima__id_materia_prima_id',
+                      'total', 'activa', 'activa_disponible')
+        for op_id, mp_id, total, activa_total, activa_disponible in reservas:
+            self.reservado_mp[op_id][mp_id] = {
+                'total': total or 0,
+                'activa': activa_total or 0,
+                'activa_disponible': activa_disponible or 0,
+            }
+
+    def _cargar_ovs(self):
+        # OVs del horizonte (PASOS 0 y 1-3) + las vinculadas a OPs activas (PASOS 0.6 y 4)
+        filtro_horizonte = Q(
+            id_estado_venta__in=_ids(self.estados_ov_activos),
+            fecha_entrega__range=[a_datetime(self.hoy), a_datetime(self.fecha_limite_ov)]
+        )
+        if self.productos is not None:
+            filtro_horizonte &= Q(id_orden_venta__in=OrdenVentaProducto.objects.filter(
+                id_producto__in=self.productos
+            ).values('id_orden_venta_id'))
+        filtro_vinculadas = Q(id_orden_venta__in=OrdenProduccionPegging.objects.filter(
+            id_orden_produccion__id_estado_orden_produccion__in=_ids(self.estados_op_activos),
+            **self._filtro_productos('id_orden_produccion__id_producto')
+        ).values('id_orden_venta_producto__id_orden_venta_id'))
+        ovs_ids = OrdenVenta.objects.filter(filtro_horizonte | filtro_vinculadas).values('pk')
+
+        self.ovs = {ov.pk: ov for ov in OrdenVenta.objects.filter(pk__in=ovs_ids).order_by('pk')}
+
+        self.lineas = {}
+        self.lineas_por_ov = defaultdict(list)
+        for linea in OrdenVentaProducto.objects.filter(
+            id_orden_venta__in=ovs_ids
+        ).select_related('id_producto').order_by('id_orden_venta_producto'):
+            ov = self.ovs.get(linea.id_orden_venta_id)
+            if ov is None:  # OV creada entre las dos consultas
+                continue
+            linea.id_orden_venta = ov  # Todas las líneas comparten la misma instancia de OV
+            self.lineas[linea.pk] = linea
+            self.lineas_por_ov[ov.pk].append(linea)
+
+        # linea_ov_id -> cantidad reservada (reservas PT 'Activas')
+        self.reservado_pt_linea = defaultdict(int)
+        reservas = ReservaStock.objects.filter(
+            id_orden_venta_producto__id_orden_venta__in=ovs_ids,
+            id_estado_reserva__descripcion='Activa'
+        ).order_by().values('id_orden_venta_producto_id').annotate(
+            total=Sum('cantidad_reservada')
+        ).values_list('id_orden_venta_producto_id', 'total')
+        for linea_id, total in reservas:
+            self.reservado_pt_linea[linea_id] = total or 0
+
+    def _cargar_reservas_pt_canceladas(self):
+        # ov_id -> {'reservas': n, 'liberado': {producto_id: cantidad}} (PASO 0.5)
+        self.reservas_pt_canceladas = {}
+        if not self.estados_ov_cancelada:
+            return
+
+        filas = ReservaStock.objects.filter(
+            id_orden_venta_producto__id_orden_venta__id_estado_venta__in=self.estados_ov_cancelada
+        ).order_by().values(
+            'id_orden_venta_producto__id_orden_venta_id', 'id_lote_produccion__id_producto_id'
+        ).annotate(
+            reservas=Count('pk'),
+            liberado=Sum('cantidad_reservada', filter=Q(
+                id_estado_reserva__descripcion='Activa',
+                id_lote_produccion__id_estado_lote_produccion__descripcion="Disponible"
+            )),
+        ).values_list('id_orden_venta_producto__id_orden_venta_id', 'id_lote_produccion__id_producto_id',
+                      'reservas', 'liberado')
+        for ov_id, producto_id, cantidad_reservas, liberado in filas:
+            info = self.reservas_pt_canceladas.setdefault(ov_id, {'reservas': 0, 'liberado': defaultdict(int)})
+            info['reservas'] += cantidad_reservas
+            info['liberado'][producto_id] += liberado or 0
+
+    def _filtro_productos(self, campo):
+        """kwargs para acotar una consulta a los productos del alcance (si hay)."""
+        return {} if self.productos is None else {f"{campo}__in": self.productos}
+
+    def en_alcance(self, producto_id) -> bool:
+        return self.productos is None or producto_id in self.productos
+
+    # ------------------------------------------------------------------
+    # Checkpoint (estado que solo vive en memoria entre pasos)
+    # ------------------------------------------------------------------
+    def exportar_memoria(self) -> dict:
+        """
+        Lo que NO se puede reconstruir leyendo la BD después de un paso:
+        pools virtuales, compras agregadas y líneas a producir.
+        (Se guarda en EjecucionMRP.estado_memoria, con DjangoJSONEncoder.)
+        """
+        return {
+            "stock_virtual_mp": self.stock_virtual_mp,
+            "stock_virtual_oc": dict(self.stock_virtual_oc),
+            "compras_agregadas_por_proveedor": {
+                proveedor_id: {
+                    "fecha_requerida_mas_temprana": info["fecha_requerida_mas_temprana"],
+                    "items": dict(info["items"]),
+                }
+                for proveedor_id, info in self.compras_agregadas_por_proveedor.items()
+            },
+            "lineas_para_producir": [
+                [linea_ov.pk, cantidad, fecha_entrega_ov]
+                for linea_ov, cantidad, fecha_entrega_ov in self.lineas_para_producir
+            ],
+        }
+
+    def restaurar_memoria(self, memoria: dict):
+        """Inversa de 'exportar_memoria' (las claves JSON vuelven a ser int)."""
+        if not memoria:
+            return
+
+        self.stock_virtual_mp = {int(mp_id): _numero(c) for mp_id, c in memoria["stock_virtual_mp"].items()}
+        self.stock_virtual_oc = defaultdict(int, {
+            int(mp_id): _numero(c) for mp_id, c in memoria["stock_virtual_oc"].items()
+        })
+
+        compras = memoria["compras_agregadas_por_proveedor"]
+        proveedores = Proveedor.objects.in_bulk([int(proveedor_id) for proveedor_id in compras])
+        for proveedor_id, info in compras.items():
+            compra_agregada = self.compras_agregadas_por_proveedor[int(proveedor_id)]
+            compra_agregada["proveedor"] = proveedores.get(int(proveedor_id))
+            compra_agregada["fecha_requerida_mas_temprana"] = date.fromisoformat(info["fecha_requerida_mas_temprana"])
+            for mp_id, cantidad in info["items"].items():
+                compra_agregada["items"][int(mp_id)] += _numero(cantidad)
+
+        self.lineas_para_producir = []
+        for linea_id, cantidad, fecha_entrega_ov in memoria["lineas_para_producir"]:
+            linea_ov = self.lineas.get(linea_id)
+            if linea_ov is None:
+                print(f"   ⚠️ La línea de OV {linea_id} ya no está activa. Se omite al reanudar.")
+                continue
+            self.lineas_para_producir.append((linea_ov, _numero(cantidad), date.fromisoformat(fecha_entrega_ov)))
+
+    # ------------------------------------------------------------------
+    # Componentes independientes (MRP en paralelo, ver planificacion/paralelo.py)
+    # ------------------------------------------------------------------
+    def componente(self, productos) -> "ContextoMRP":
+        """
+        Contexto de un componente del MRP en paralelo: una copia superficial
+        acotada a 'productos' en la que después se copia en profundidad SOLO
+        lo acotado (OPs, OVs, reservas y stock del componente). Lo de solo
+        lectura (recetas, calendario, estados) se comparte y el contexto
+        completo no se toca: cada proceso del pool puede planificar varios.
+        """
+        ctx = copy.copy(self)
+        ctx.acotar(productos)
+        (
+            ctx.ops, ctx.peggings, ctx.peggings_por_linea, ctx.reservado_mp, ctx.ovs, ctx.lineas,
+            ctx.lineas_por_ov, ctx.reservado_pt_linea, ctx.reservas_pt_canceladas,
+        ) = copy.deepcopy((
+            ctx.ops, ctx.peggings, ctx.peggings_por_linea, ctx.reservado_mp, ctx.ovs, ctx.lineas,
+            ctx.lineas_por_ov, ctx.reservado_pt_linea, ctx.reservas_pt_canceladas,
+        ))
+        return ctx
+
+    def acotar(self, productos):
+        """
+        Acota lo ya cargado a 'productos', como si el contexto se hubiera
+        cargado con ContextoMRP(..., productos=productos). Arma contenedores
+        nuevos (no modifica los anteriores), así que se puede hacer sobre una
+        copia superficial (ver 'componente'). El stock y la capacidad quedan
+        solo con las MPs y líneas de esos productos.
+        Las reservas de OVs canceladas también se acotan: cada una la libera
+        el componente de sus productos (y no todos).
+        """
+        self.productos = set(productos)
+        mps, lineas_produccion = self._recursos_de_productos()
+
+        self.ops = {op_id: op for op_id, op in self.ops.items() if op.id_producto_id in self.productos}
+        self.peggings = defaultdict(list, {
+            op_id: peggings for op_id, peggings in self.peggings.items() if op_id in self.ops
+        })
+        peggings_por_linea = defaultdict(list)
+        for linea_id, peggings in self.peggings_por_linea.items():
+            for op_id, cantidad in peggings:
+                if op_id in self.ops:
+                    peggings_por_linea[linea_id].append((op_id, cantidad))
+        self.peggings_por_linea = peggings_por_linea
+        self.reservado_mp = defaultdict(self.reservado_mp.default_factory, {
+            op_id: reservas for op_id, reservas in self.reservado_mp.items() if op_id in self.ops
+        })
+
+        ovs_ids = {
+            ov_id for ov_id, lineas in self.lineas_por_ov.items()
+            if any(linea.id_producto_id in self.productos for linea in lineas)
+        }
+        ovs_ids |= {ov_id for peggings in self.peggings.values() for _linea_id, ov_id, _cantidad in peggings}
+        self.ovs = {ov_id: ov for ov_id, ov in self.ovs.items() if ov_id in ovs_ids}
+        self.lineas = {pk: linea for pk, linea in self.lineas.items() if linea.id_orden_venta_id in ovs_ids}
+        self.lineas_por_ov = defaultdict(list, {ov_id: list(self.lineas_por_ov[ov_id]) for ov_id in self.ovs})
+        self.reservado_pt_linea = defaultdict(int, {
+            linea_id: cantidad for linea_id, cantidad in self.reservado_pt_linea.items() if linea_id in self.lineas
+        })
+
+        self.reservas_pt_canceladas = {
+            ov_id: info for ov_id, info in self.reservas_pt_canceladas.items()
+            if self.productos.intersection(info['liberado'])
+        }
+
+        self.stock_real_pt = {p: c for p, c in self.stock_real_pt.items() if p in self.productos}
+        self.stock_real_mp = {mp: c for mp, c in self.stock_real_mp.items() if mp in mps}
+        self.stock_virtual_mp = {mp: c for mp, c in self.stock_virtual_mp.items() if mp in mps}
+        self.stock_virtual_oc = defaultdict(int, {mp: c for mp, c in self.stock_virtual_oc.items() if mp in mps})
+        self.capacidad = self.capacidad.acotar(lineas_produccion, set(self.ops))
+
+        # Lo decidido hasta acá no es de este componente: se arranca de cero
+        self._reiniciar_decisiones()
+        self.ops_nuevas = []
+        self.plan = PlanMRP(self)
+
+    def _recursos_de_productos(self):
+        """(MPs de las recetas, líneas de producción) de 'productos'."""
+        mps = {
+            ingrediente.id_materia_prima
+            for producto_id in self.productos if self.explosion.tiene_receta(producto_id)
+            for ingrediente in self.explosion.ingredientes(producto_id)
+        }
+        lineas_produccion = {
+            capacidad_linea.id_linea_produccion_id
+            for producto_id in self.productos for capacidad_linea in self.explosion.lineas(producto_id)
+        }
+        return mps, lineas_produccion
+
+    def exportar_componente(self) -> dict:
+        """
+        Lo que decidió este componente (acotado), para sumarlo al contexto
+        completo con 'incorporar_componente'. Se devuelve entero desde el
+        proceso: las acciones del plan y el calendario siguen apuntando a las
+        mismas OPs/OVs que 'ops', 'ops_nuevas' y 'ovs'.
+        """
+        mps, lineas_produccion = self._recursos_de_productos()
+        return {
+            "ops": self.ops,
+            "ops_nuevas": self.ops_nuevas,
+            "ovs": self.ovs,
+            "lineas": self.lineas,
+            "reservado_pt_linea": dict(self.reservado_pt_linea),
+            "stock_real_pt": {p: c for p, c in self.stock_real_pt.items() if p in self.productos},
+            "stock_real_mp": {mp: c for mp, c in self.stock_real_mp.items() if mp in mps},
+            "stock_virtual_mp": {mp: c for mp, c in self.stock_virtual_mp.items() if mp in mps},
+            "stock_virtual_oc": {mp: c for mp, c in self.stock_virtual_oc.items() if mp in mps},
+            "compras_agregadas_por_proveedor": {
+                proveedor_id: {**info, "items": dict(info["items"])}
+                for proveedor_id, info in self.compras_agregadas_por_proveedor.items()
+            },
+            "lineas_para_producir": self.lineas_para_producir,
+            "acciones": self.plan.historial,
+            "capacidad": self.capacidad.exportar(lineas_produccion, set(self.ops)),
+        }
+
+    def incorporar_componente(self, componente: dict):
+        """
+        Suma al contexto completo lo que decidió un componente en su proceso.
+        Los componentes no comparten productos, MPs ni líneas: cada uno
+        reemplaza sus propias entradas, salvo las compras, que se agregan
+        por proveedor (el PASO 6 las junta en una OC por proveedor).
+        """
+        self.ops.update(componente["ops"])
+        self.ops_nuevas.extend(componente["ops_nuevas"])
+        self.ovs.update(componente["ovs"])
+        self.lineas.update(componente["lineas"])
+        for ov_id in componente["ovs"]:
+            self.lineas_por_ov[ov_id] = [linea for linea in componente["lineas"].values() if linea.id_orden_venta_id == ov_id]
+        self.reservado_pt_linea.update(componente["reservado_pt_linea"])
+
+        self.stock_real_pt.update(componente["stock_real_pt"])
+        self.stock_real_mp.update(componente["stock_real_mp"])
+        self.stock_virtual_mp.update(componente["stock_virtual_mp"])
+        self.stock_virtual_oc.update(componente["stock_virtual_oc"])
+
+        for proveedor_id, info in componente["compras_agregadas_por_proveedor"].items():
+            compra_agregada = self.compras_agregadas_por_proveedor[proveedor_id]
+            compra_agregada["proveedor"] = info["proveedor"]
+            compra_agregada["fecha_requerida_mas_temprana"] = min(
+                compra_agregada["fecha_requerida_mas_temprana"], info["fecha_requerida_mas_temprana"]
+            )
+            for mp_id, cantidad in info["items"].items():
+                compra_agregada["items"][mp_id] += cantidad
+
+        self.lineas_para_producir.extend(componente["lineas_para_producir"])
+        self.capacidad.incorporar(componente["capacidad"])
+        self.plan.incorporar(componente["acciones"])
+
+    # ------------------------------------------------------------------
+    # Lectura
+    # ------------------------------------------------------------------
+    def ops_en_estado(self, *estados):
+        """
+        OPs (cargadas y nuevas) cuyo estado ACTUAL en memoria es uno de 'estados',
+        ordenadas por fecha planificada (las que no tienen fecha, al final).
+        """
+        estados_ids = {e.pk for e in estados}
+        ops = [
+            op for op in list(self.ops.values()) + self.ops_nuevas
+            if op.id_estado_orden_produccion_id in estados_ids
+        ]
+        ops.sort(key=lambda op: (op.fecha_planificada is None, op.fecha_planificada or 0, op.pk or 0))
+        return ops
+
+    def ocs_en_proceso(self, claves):
+        """
+        OCs 'En proceso' existentes para cada (proveedor_id, fecha_entrega) pedido,
+        en UNA consulta. Si hubiera más de una para la misma clave, la más antigua.
+        """
+        claves = set(claves)
+        if not claves:
+            return {}
+        ocs = {}
+        for oc in OrdenCompra.objects.filter(
+            id_estado_orden_compra__descripcion="En proceso",
+            id_proveedor_id__in={proveedor_id for proveedor_id, _fecha in claves},
+            fecha_entrega_estimada__in={fecha for _proveedor_id, fecha in claves}
+        ).order_by('-id_orden_compra'):
+            clave = (oc.id_proveedor_id, oc.fecha_entrega_estimada)
+            if clave in claves:
+                ocs[clave] = oc
+        return ocs
+
+    def reservas_mp_de_op(self, op):
+        return self.reservado_mp[self.plan.etiqueta(op)]
+
+    # ------------------------------------------------------------------
+    # Escritura (en memoria + plan)
+    # ------------------------------------------------------------------
+    def modificar_op(self, op, motivo, **campos):
+        self.plan.registrar_cambios('guardar_op', op, campos, motivo=motivo)
+
+    def modificar_ov(self, ov, **campos):
+        self.plan.registrar_cambios('guardar_ov', ov, campos)
+
+    def reservar_pt(self, linea_ov, cantidad, paso):
+        self.reservado_pt_linea[linea_ov.pk] += cantidad
+        self.stock_real_pt[linea_ov.id_producto_id] = self.stock_real_pt.get(linea_ov.id_producto_id, 0) - cantidad
+        self.plan.registrar('reservar_pt', linea_ov=linea_ov, cantidad=cantidad, paso=paso)
+
+    def reservar_mp(self, op, mp_id, cantidad, paso):
+        reservado = self.reservas_mp_de_op(op)[mp_id]
+        for clave in ('total', 'activa', 'activa_disponible'):
+            reservado[clave] += cantidad
+        self.stock_real_mp[mp_id] = self.stock_real_mp.get(mp_id, 0) - cantidad
+        self.plan.registrar('reservar_mp', op=op, mp_id=mp_id, cantidad=cantidad, paso=paso)
+
+
+class PlanMRP:
+    """
+    Lista ORDENADA de las escrituras que decidió el MRP.
+
+    - En modo real, 'aplicar()' las ejecuta (al final de cada paso) y vuelca
+      el calendario de capacidad.
+    - En modo simulación no se aplica nada: 'resumen()' devuelve el diff
+      (OPs a crear/modificar/cancelar, reservas, calendario, OVs y OCs).
+    """
+
+    def __init__(self, ctx: ContextoMRP):
+        self.ctx = ctx
+        self._pendientes = []
+        self.historial = []
+        self._etiquetas = {}
+        self.calendario_borradas = 0
+        self.calendario_creadas = 0
+
+    # ------------------------------------------------------------------
+    # Registro
+    # ------------------------------------------------------------------
+    def registrar(self, tipo, **datos):
+        accion = (tipo, datos)
+        self._pendientes.append(accion)
+        self.historial.append(accion)
+
+    def incorporar(self, acciones):
+        """Agrega (al final y en orden) las acciones que decidió otro plan."""
+        self._pendientes.extend(acciones)
+        self.historial.extend(acciones)
+
+    def registrar_cambios(self, tipo, obj, campos, **datos):
+        cambios = {}
+        for campo, valor in campos.items():
+            anterior = getattr(obj, campo)
+            if anterior != valor:
+                cambios[campo] = (anterior, valor)
+            setattr(obj, campo, valor)
+        self.registrar(tipo, obj=obj, cambios=cambios, **datos)
+
+    def etiqueta(self, op):
+        """PK de la OP, o 'nueva-N' si todavía no está guardada."""
+        if op.pk:
+            return op.pk
+        return self._etiquetas.setdefault(id(op), f"nueva-{len(self._etiquetas) + 1}")
+
+    # ------------------------------------------------------------------
+    # Aplicación
+    # ------------------------------------------------------------------
+    def aplicar(self):
+        from .planificador import _reservar_stock_pt, _reservar_stock_mp
+
+        ctx = self.ctx
+        # Reservas consecutivas se hacen juntas (una consulta de lotes + un bulk_create);
+        # cualquier otra acción las vuelca antes, para respetar el orden del plan.
+        reservas_pt, reservas_mp, compras = [], [], []
+
+        def volcar_reservas():
+            if compras:
+                self._aplicar_compras(compras)
+                compras.clear()
+            if reservas_pt:
+                _reservar_stock_pt(reservas_pt, ctx.estado_reserva_activa)
+                reservas_pt.clear()
+            if reservas_mp:
+                _reservar_stock_mp(reservas_mp, ctx.estado_reserva_mp_activa)
+                reservas_mp.clear()
+
+        # Lo que escribe el MRP ya está contemplado en el plan: no lo marcamos como pendiente
+        with suspender_marcas():
+            for tipo, datos in self._pendientes:
+                if tipo == 'reservar_pt':
+                    reservas_pt.append((datos['linea_ov'], datos['cantidad']))
+                    continue
+                if tipo == 'reservar_mp':
+                    reservas_mp.append((datos['op'], datos['mp_id'], datos['cantidad']))
+                    continue
+                if tipo == 'comprar':
+                    compras.append(datos)
+                    continue
+                volcar_reservas()
+
+                if tipo == 'crear_op':
+                    lote = datos.get('lote')
+                    if lote is not None:
+                        lote.save()
+                        datos['op'].id_lote_produccion = lote
+                    datos['op'].save()
+                elif tipo == 'guardar_op':
+                    datos['obj'].save()
+                elif tipo == 'guardar_ov':
+                    datos['obj'].save(update_fields=list(datos['cambios']))
+                elif tipo == 'crear_pegging':
+                    OrdenProduccionPegging.objects.create(
+                        id_orden_produccion=datos['op'],
+                        id_orden_venta_producto=datos['linea_ov'],
+                        cantidad_asignada=datos['cantidad']
+                    )
+                elif tipo == 'liberar_reservas_pt':
+                    ReservaStock.objects.filter(
+                        id_orden_venta_producto__id_orden_venta_id__in=datos['ovs']
+                    ).delete()
+                elif tipo == 'liberar_reservas_mp':
+                    ReservaMateriaPrima.objects.filter(id_orden_produccion=datos['op']).delete()
+            volcar_reservas()
+
+            self._pendientes = []
+            borradas, creadas = ctx.capacidad.guardar()
+            self.calendario_borradas += borradas
+            self.calendario_creadas += creadas
+
+    def _aplicar_compras(self, compras):
+        """
+        Todas las OCs del PASO 6 juntas, con una cantidad FIJA de consultas:
+        una OC 'En proceso' por (proveedor, fecha de entrega) -se reutiliza la
+        existente o se crea- y sus ítems se suman a los existentes o se crean.
+        """
+        ocs = self.ctx.ocs_en_proceso((datos['proveedor'].pk, datos['fecha_entrega']) for datos in compras)
+
+        nuevas = [
+            OrdenCompra(
+                id_proveedor=datos['proveedor'],
+                id_estado_orden_compra=self.ctx.estado_oc_en_proceso,
+                fecha_entrega_estimada=datos['fecha_entrega'],
+                fecha_solicitud=datos['fecha_solicitud']
+            )
+            for datos in compras if (datos['proveedor'].pk, datos['fecha_entrega']) not in ocs
+        ]
+        for oc in bulk_create_with_history(nuevas, OrdenCompra):
+            ocs[(oc.id_proveedor_id, oc.fecha_entrega_estimada)] = oc
+
+        items_existentes = {
+            (item.id_orden_compra_id, item.id_materia_prima_id): item
+            for item in OrdenCompraMateriaPrima.objects.filter(id_orden_compra__in=[oc.pk for oc in ocs.values()])
+        }
+        items_nuevos, items_modificados = [], []
+
+        ids_nuevas = {oc.pk for oc in nuevas}
+        for datos in compras:
+            proveedor = datos['proveedor']
+            oc = ocs[(proveedor.pk, datos['fecha_entrega'])]
+            datos['oc'], datos['oc_nueva'] = oc.id_orden_compra, oc.pk in ids_nuevas
+            if datos['oc_nueva']:
+                print(f"   > Generando NUEVA OC {oc.id_orden_compra} para {proveedor.nombre} (Entrega: {datos['fecha_entrega']})")
+            else:
+                print(f"   > Usando OC EXISTENTE {oc.id_orden_compra} para {proveedor.nombre} (Entrega: {datos['fecha_entrega']})")
+
+            for item in datos['items']:
+                mp_id, cantidad_final = item['materia_prima'], item['cantidad']
+                item_oc = items_existentes.get((oc.pk, mp_id))
+                if item_oc is None:
+                    items_nuevos.append(OrdenCompraMateriaPrima(
+                        id_orden_compra=oc, id_materia_prima_id=mp_id, cantidad=cantidad_final
+                    ))
+                    print(f"      - NUEVO Item: {cantidad_final} de MP {mp_id} (necesitaba {item['necesaria']}, lote: {item['lote_minimo']})")
+                else:
+                    cantidad_anterior = item_oc.cantidad
+                    item_oc.cantidad += cantidad_final
+                    items_modificados.append(item_oc)
+                    print(f"      - Item existente (MP {mp_id}) en OC {oc.id_orden_compra} AUMENTADO de {cantidad_anterior} a {item_oc.cantidad} (lote: {item['lote_minimo']})")
+
+        OrdenCompraMateriaPrima.objects.bulk_create(items_nuevos)
+        OrdenCompraMateriaPrima.objects.bulk_update(items_modificados, ['cantidad'])
+
+    # ------------------------------------------------------------------
+    # Resumen (diff)
+    # ------------------------------------------------------------------
+    def resumen(self):
+        ctx = self.ctx
+        ops_creadas, ops_modificadas, ovs_modificadas = [], {}, {}
+        reservas_pt, reservas_mp, reservas_mp_liberadas = [], [], []
+        reservas_pt_liberadas = {"reservas": 0, "ovs": [], "por_producto": {}}
+        ordenes_compra = []
+
+        for tipo, datos in self.historial:
+            if tipo == 'crear_op':
+                op = datos['op']
+                ops_creadas.append({
+                    "op": self.etiqueta(op),
+                    "producto": op.id_producto_id,
+                    "cantidad": op.cantidad,
+                    "estado": op.id_estado_orden_produccion.descripcion,
+                    "fecha_planificada": a_fecha(op.fecha_planificada),
+                    "fecha_fin_planificada": op.fecha_fin_planificada,
+                    "fecha_inicio": a_fecha(op.fecha_inicio),
+                    "linea_ov": datos['linea_ov'].pk,
+                    "ov": datos['linea_ov'].id_orden_venta_id,
+                    "crea_lote": datos.get('lote') is not None,
+                })
+            elif tipo in ('guardar_op', 'guardar_ov'):
+                obj = datos['obj']
+                destino = ops_modificadas if tipo == 'guardar_op' else ovs_modificadas
+                entrada = destino.setdefault(id(obj), {
+                    ("op" if tipo == 'guardar_op' else "ov"): self.etiqueta(obj) if tipo == 'guardar_op' else obj.pk,
+                    "cambios": {},
+                    **({"motivos": []} if tipo == 'guardar_op' else {}),
+                })
+                if tipo == 'guardar_op' and datos.get('motivo') and datos['motivo'] not in entrada["motivos"]:
+                    entrada["motivos"].append(datos['motivo'])
+                for campo, (antes, despues) in datos['cambios'].items():
+                    previo = entrada["cambios"].get(campo)
+                    entrada["cambios"][campo] = {
+                        "antes": previo["antes"] if previo else _valor(antes),
+                        "despues": _valor(despues),
+                    }
+            elif tipo == 'reservar_pt':
+                linea_ov = datos['linea_ov']
+                reservas_pt.append({
+                    "paso": datos['paso'], "ov": linea_ov.id_orden_venta_id, "linea_ov": linea_ov.pk,
+                    "producto": linea_ov.id_producto_id, "cantidad": datos['cantidad'],
+                })
+            elif tipo == 'reservar_mp':
+                reservas_mp.append({
+                    "paso": datos['paso'], "op": self.etiqueta(datos['op']),
+                    "materia_prima": datos['mp_id'], "cantidad": datos['cantidad'],
+                })
+            elif tipo == 'liberar_reservas_pt':
+                reservas_pt_liberadas["reservas"] += datos['reservas']
+                reservas_pt_liberadas["ovs"].extend(datos['ovs'])
+                for producto_id, cantidad in datos['liberado'].items():
+                    reservas_pt_liberadas["por_producto"][producto_id] = \
+                        reservas_pt_liberadas["por_producto"].get(producto_id, 0) + cantidad
+            elif tipo == 'liberar_reservas_mp':
+                for mp_id, cantidad in datos['liberado'].items():
+                    reservas_mp_liberadas.append({
+                        "op": self.etiqueta(datos['op']), "materia_prima": mp_id, "cantidad": cantidad,
+                    })
+            elif tipo == 'comprar':
+                ordenes_compra.append({
+                    "proveedor": datos['proveedor'].pk,
+                    "oc": datos.get('oc'),
+                    "oc_nueva": datos.get('oc_nueva'),
+                    "fecha_solicitud": datos['fecha_solicitud'],
+                    "fecha_entrega": datos['fecha_entrega'],
+                    "items": datos['items'],
+                })
+
+        # Las OPs nuevas no figuran como "modificadas"
+        etiquetas_nuevas = {op["op"] for op in ops_creadas}
+        ops_modificadas = [e for e in ops_modificadas.values() if e["op"] not in etiquetas_nuevas and e["cambios"]]
+        ops_canceladas = [e["op"] for e in ops_modificadas if "cancelada" in e["motivos"]]
+
+        calendario = {"altas": [], "bajas": []}
+        for movimiento in ctx.capacidad.movimientos:
+            if movimiento[0] == 'alta':
+                reserva = movimiento[1]
+                calendario["altas"].append({
+                    "op": self.etiqueta(reserva.id_orden_produccion),
+                    "linea": reserva.id_linea_produccion_id,
+                    "fecha": reserva.fecha,
+                    "horas": reserva.horas_reservadas,
+                    "cantidad": reserva.cantidad_a_producir,
+                })
+            else:
+                _, op, desde = movimiento
+                calendario["bajas"].append({"op": self.etiqueta(op), "desde": desde})
+
+        return {
+            "fecha": ctx.hoy,
+            "simulacion": ctx.simular,
+            "ops_creadas": ops_creadas,
+            "ops_modificadas": ops_modificadas,
+            "ops_canceladas": ops_canceladas,
+            "ovs_modificadas": list(ovs_modificadas.values()),
+            "reservas_pt": reservas_pt,
+            "reservas_pt_liberadas": reservas_pt_liberadas,
+            "reservas_mp": reservas_mp,
+            "reservas_mp_liberadas": reservas_mp_liberadas,
+            "calendario": calendario,
+            "ordenes_compra": ordenes_compra,
+            "totales": {
+                "ops_creadas": len(ops_creadas),
+                "ops_modificadas": len(ops_modificadas),
+                "ops_canceladas": len(ops_canceladas),
+                "ovs_modificadas": len(ovs_modificadas),
+                "reservas_pt": len(reservas_pt),
+                "reservas_mp": len(reservas_mp),
+                "calendario_altas": len(calendario["altas"]),
+                "calendario_bajas": len(calendario["bajas"]),
+                "ordenes_compra": len(ordenes_compra),
+            },
+        }
+
+
+def _numero(valor):
+    """Los Decimal se serializan como texto en el checkpoint."""
+    return Decimal(valor) if isinstance(valor, str) else valor
+
+
+def _ids(estados):
+    """PKs de los estados (en simulación puede haber estados sin guardar)."""
+    return [e.pk for e in estados if e.pk]
+
+
+def _valor(valor):
+    """Valor "legible" para el diff: estados por descripción, datetimes como fecha."""
+    if hasattr(valor, 'descripcion'):
+        return valor.descripcion
+    return a_fecha(valor)
@@ -0,0 +1,379 @@
+import copy
+import multiprocessing
+import time as reloj
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+from django.db import connections
+
+from materias_primas.models import Proveedor
+from produccion.models import LineaProduccion, CalendarioProduccion, EstadoOrdenProduccion
+from productos.models import Producto
+from ventas.models import OrdenVenta, OrdenVentaProducto, Prioridad
+from .contexto import ContextoMRP, a_datetime, a_fecha
+from .paralelo import puede_paralelizar
+from .planificador import PASOS_MRP
+from . import planner_service, solver_tandas
+
+# Máximo de escenarios por pedido (además del escenario base)
+MAX_ESCENARIOS = 10
+# Tiempo límite del solver táctico en cada escenario (es una estimación, no el plan real)
+ESCENARIO_SOLVER_MAX_SECONDS = 10
+
+# Lo mismo que mira el solver táctico (planner_service)
+ESTADOS_OP_DESPACHO = ["Pendiente de inicio", "En proceso", "Finalizada"]
+ESTADOS_LINEA_DESPACHO = ["disponible", "ocupada"]
+
+# KPIs que se comparan lado a lado (ver _comparar)
+KPIS_COMPARADOS = (
+    ("mrp", "ovs_retrasadas"),
+    ("mrp", "dias_retraso_total"),
+    ("mrp", "dias_retraso_max"),
+    ("mrp", "ops_creadas"),
+    ("mrp", "ordenes_compra"),
+    ("mrp", "ordenes_compra_nuevas"),
+    ("mrp", "unidades_compradas"),
+    ("mrp", "utilizacion_promedio"),
+    ("despacho", "estado"),
+    ("despacho", "unidades_objetivo"),
+    ("despacho", "unidades_programadas"),
+    ("despacho", "utilizacion_promedio"),
+)
+
+# Datos base que heredan los procesos del pool (fork), como en paralelo.py
+_compartido = {}
+
+
+def simular_escenarios(fecha: date, escenarios) -> dict:
+    """
+    Escenarios "qué pasa si" sobre UNA foto de la planta: el contexto del MRP
+    (ContextoMRP en modo simulación), las líneas y el calendario de mañana se
+    leen una sola vez y cada escenario trabaja sobre su propia copia.
+
+    Cada escenario puede cambiar:
+    - horas_laborables_por_dia: horas por día de cada línea (p. ej. un turno más).
+    - lead_times: {proveedor_id: días} (p. ej. un proveedor que se atrasa).
+    - lineas_fuera_de_servicio: líneas que no se usan (ni en el MRP ni en el despacho).
+    - ovs_adicionales: OVs que no existen (p. ej. un pedido grande a confirmar):
+      [{"fecha_entrega", "prioridad"?, "productos": [{"producto", "cantidad"}]}]
+
+    En cada escenario corren los PASOS del MRP (sin escribir nada) y, sobre
+    el calendario resultante de mañana, el solver táctico (sin crear OTs).
+    Siempre se agrega primero el escenario "base" (sin cambios).
+
+    Con MRP_PROCESOS_PARALELOS > 1 los escenarios corren a la vez en un pool
+    de procesos (fork: heredan la foto ya cargada, no hay que serializarla).
+    Devuelve los KPIs de cada escenario y una tabla que los compara.
+    """
+    inicio = reloj.perf_counter()
+    escenarios = _nombrar([{"nombre": "base"}] + list(escenarios))
+    base = _cargar_base(fecha, escenarios)
+
+    procesos = min(base["ctx"].procesos_paralelos, len(escenarios))
+    print(f"🔮 Simulando {len(escenarios)} escenarios para {fecha} en {procesos} procesos...")
+
+    if procesos > 1 and puede_paralelizar():
+        # Cada proceso abre su propia conexión si la necesita: no se hereda la del padre
+        connections.close_all()
+        _compartido.update(base=base)
+        try:
+            with ProcessPoolExecutor(
+                max_workers=procesos,
+                mp_context=multiprocessing.get_context("fork")
+            ) as pool:
+                resultados = list(pool.map(_correr_en_proceso, escenarios))
+        finally:
+            _compartido.clear()
+    else:
+        procesos = 1
+        resultados = [_correr_escenario(escenario, base) for escenario in escenarios]
+
+    segundos = round(reloj.perf_counter() - inicio, 3)
+    print(f"🔮 {len(escenarios)} escenarios simulados en {segundos}s.")
+
+    return {
+        "fecha": fecha,
+        "procesos": procesos,
+        "segundos": segundos,
+        "escenarios": resultados,
+        "comparacion": _comparar(resultados),
+    }
+
+
+def validar_escenarios(escenarios):
+    """Los mismos chequeos que simular_escenarios, sin cargar nada (ValueError si no pasan)."""
+    _nombrar([{"nombre": "base"}] + list(escenarios))
+
+
+# ===================================================================
+# FOTO COMPARTIDA
+# ===================================================================
+def _nombrar(escenarios):
+    nombres = set()
+    for k, escenario in enumerate(escenarios):
+        escenario = escenarios[k] = dict(escenario)
+        escenario.setdefault("nombre", f"escenario-{k}")
+        if escenario["nombre"] in nombres:
+            raise ValueError(f"Nombre de escenario repetido: '{escenario['nombre']}'.")
+        nombres.add(escenario["nombre"])
+    if len(escenarios) > MAX_ESCENARIOS + 1:
+        raise ValueError(f"Se pueden simular hasta {MAX_ESCENARIOS} escenarios por pedido.")
+    return escenarios
+
+
+def _cargar_base(fecha: date, escenarios) -> dict:
+    ctx = ContextoMRP(fecha, simular=True)
+
+    lineas = {
+        linea.id_linea_produccion: linea
+        for linea in LineaProduccion.objects.select_related('id_estado_linea_produccion')
+    }
+    # Calendario de mañana (lo que leería el solver táctico); el estado de
+    # cada OP se mira después del MRP de cada escenario.
+    calendario_manana = list(
+        CalendarioProduccion.objects.filter(fecha=ctx.tomorrow).select_related(
+            'id_orden_produccion__id_producto'
+        ).order_by('id_orden_produccion_id', 'id')
+    )
+    estados_op_despacho = set(
+        EstadoOrdenProduccion.objects.filter(descripcion__in=ESTADOS_OP_DESPACHO).values_list('pk', flat=True)
+    )
+
+    productos_ids = {
+        item["producto"]
+        for escenario in escenarios
+        for ov in escenario.get("ovs_adicionales") or []
+        for item in ov["productos"]
+    }
+    productos = Producto.objects.in_bulk(productos_ids)
+    proveedores_ids = {int(p) for escenario in escenarios for p in (escenario.get("lead_times") or {})}
+    proveedores = set(Proveedor.objects.filter(pk__in=proveedores_ids).values_list('pk', flat=True))
+    lineas_ids = {l for escenario in escenarios for l in escenario.get("lineas_fuera_de_servicio") or []}
+
+    faltantes = [
+        f"{tipo} {sorted(ids)}" for tipo, ids in (
+            ("productos", productos_ids - set(productos)),
+            ("proveedores", proveedores_ids - proveedores),
+            ("líneas", lineas_ids - set(lineas)),
+        ) if ids
+    ]
+    if faltantes:
+        raise ValueError(f"No existen: {', '.join(faltantes)}.")
+
+    return {
+        "ctx": ctx,
+        "parametros_solver": planner_service.parametros_solver(),
+        "lineas": lineas,
+        "calendario_manana": calendario_manana,
+        "estados_op_despacho": estados_op_despacho,
+        "productos": productos,
+        # Las OVs adicionales sin prioridad van con la última (no se adelantan a las existentes)
+        "prioridad": Prioridad.objects.order_by('-id_prioridad').values_list('pk', flat=True).first(),
+    }
+
+
+# ===================================================================
+# UN ESCENARIO
+# ===================================================================
+def _correr_en_proceso(escenario):
+    try:
+        return _correr_escenario(escenario, _compartido["base"])
+    finally:
+        connections.close_all()
+
+
+def _correr_escenario(escenario, base) -> dict:
+    """Aplica los cambios del escenario a SU copia de la foto, corre MRP y despacho y mide."""
+    inicio = reloj.perf_counter()
+    # Un proceso del pool puede correr más de un escenario: la foto heredada no se toca
+    base = copy.deepcopy(base)
+    ctx = base["ctx"]
+    print(f"\n=== ESCENARIO '{escenario['nombre']}' ===")
+
+    horas = escenario.get("horas_laborables_por_dia")
+    if horas:
+        ctx.horas_laborables_por_dia = horas
+        ctx.capacidad.horas_por_dia = horas
+
+    lead_times = {int(proveedor_id): dias for proveedor_id, dias in (escenario.get("lead_times") or {}).items()}
+    fuera_de_servicio = set(escenario.get("lineas_fuera_de_servicio") or [])
+    if lead_times or fuera_de_servicio:
+        ctx.explosion = ctx.explosion.variante(lead_times, fuera_de_servicio)
+
+    ovs_adicionales = _agregar_ovs(ctx, escenario.get("ovs_adicionales") or [], base)
+
+    for _clave, paso in PASOS_MRP:
+        paso(ctx)
+    resumen = ctx.plan.resumen()
+
+    return {
+        "nombre": escenario["nombre"],
+        "parametros": {clave: valor for clave, valor in escenario.items() if clave != "nombre"},
+        "mrp": _kpis_mrp(ctx, resumen, ovs_adicionales, base["lineas"]),
+        "despacho": _simular_despacho(ctx, base, fuera_de_servicio, horas),
+        "segundos": round(reloj.perf_counter() - inicio, 3),
+    }
+
+
+def _agregar_ovs(ctx: ContextoMRP, ovs, base):
+    """
+    OVs del escenario, solo en memoria y con PKs negativas (no chocan con las
+    de la BD). Entran al MRP como cualquier OV 'Creada' del horizonte.
+    """
+    agregadas = []
+    siguiente_linea = -1
+    for k, datos in enumerate(ovs, start=1):
+        ov = OrdenVenta(
+            id_orden_venta=-k,
+            id_estado_venta=ctx.estado_ov_creada,
+            id_prioridad_id=datos.get("prioridad") or base["prioridad"],
+            fecha_entrega=a_datetime(datos["fecha_entrega"]),
+        )
+        ctx.ovs[ov.pk] = ov
+        for item in datos["productos"]:
+            linea = OrdenVentaProducto(
+                id_orden_venta_producto=siguiente_linea,
+                id_orden_venta=ov,
+                id_producto=base["productos"][item["producto"]],
+                cantidad=item["cantidad"],
+            )
+            siguiente_linea -= 1
+            ctx.lineas[linea.pk] = linea
+            ctx.lineas_por_ov[ov.pk].append(linea)
+        agregadas.append((ov, datos["fecha_entrega"]))
+    return agregadas
+
+
+# ===================================================================
+# KPIs
+# ===================================================================
+def _kpis_mrp(ctx: ContextoMRP, resumen, ovs_adicionales, lineas) -> dict:
+    retrasos = []
+    for ov in resumen["ovs_modificadas"]:
+        cambio = ov["cambios"].get("fecha_entrega")
+        if cambio and cambio["antes"] and cambio["despues"] and cambio["despues"] > cambio["antes"]:
+            retrasos.append((cambio["despues"] - cambio["antes"]).days)
+
+    compras = resumen["ordenes_compra"]
+
+    # Utilización de cada línea en los días hábiles del horizonte del MRP (mañana a una semana)
+    dias = []
+    dia = ctx.calendario.proximo_habil(ctx.tomorrow)
+    while dia <= ctx.fecha_limite_ov:
+        dias.append(dia)
+        dia = ctx.calendario.sumar_habiles(dia, 1)
+    horas_totales = ctx.horas_laborables_por_dia * len(dias)
+    utilizacion = {
+        linea_id: round(100 * sum(ctx.capacidad.carga(linea_id, dia) for dia in dias) / horas_totales, 1)
+        if horas_totales else 0.0
+        for linea_id in lineas
+    }
+
+    return {
+        "ovs_retrasadas": len(retrasos),
+        "dias_retraso_total": sum(retrasos),
+        "dias_retraso_max": max(retrasos, default=0),
+        "ops_creadas": resumen["totales"]["ops_creadas"],
+        "ops_canceladas": resumen["totales"]["ops_canceladas"],
+        "ordenes_compra": len(compras),
+        "ordenes_compra_nuevas": sum(1 for compra in compras if compra.get("oc_nueva")),
+        "unidades_compradas": sum(item["cantidad"] for compra in compras for item in compra["items"]),
+        "utilizacion_lineas": utilizacion,
+        "utilizacion_promedio": round(sum(utilizacion.values()) / len(utilizacion), 1) if utilizacion else 0.0,
+        "dias_horizonte": [dia.isoformat() for dia in dias],
+        "ovs_adicionales": [
+            {
+                "ov": ov.pk,
+                "fecha_entrega_pedida": fecha_pedida,
+                "fecha_entrega_posible": a_fecha(ov.fecha_entrega),
+                "dias_retraso": max(0, (a_fecha(ov.fecha_entrega) - fecha_pedida).days),
+            }
+            for ov, fecha_pedida in ovs_adicionales
+        ],
+        "totales": resumen["totales"],
+    }
+
+
+def _simular_despacho(ctx: ContextoMRP, base, fuera_de_servicio, horas=None) -> dict:
+    """
+    Solver táctico sobre el calendario de mañana que dejó el MRP del escenario:
+    filas de la BD que siguen en pie + filas nuevas, de OPs en los estados que
+    despacha el solver. Solo mañana (sin horizonte rodante ni pistas) y sin crear OTs.
+    """
+    dia = ctx.tomorrow
+    estados = base["estados_op_despacho"]
+
+    tareas_calendario = []
+    for fila in base["calendario_manana"]:
+        op = ctx.ops.get(fila.id_orden_produccion_id, fila.id_orden_produccion)
+        if ctx.capacidad.liberada(op.pk, dia) or op.id_estado_orden_produccion_id not in estados:
+            continue
+        fila.id_orden_produccion = op
+        tareas_calendario.append((fila.id, fila, 0))
+    for k, reserva in enumerate(ctx.capacidad.altas_del_dia(dia), start=1):
+        if reserva.id_orden_produccion.id_estado_orden_produccion_id in estados:
+            tareas_calendario.append((f"nueva-{k}", reserva, 0))
+
+    lineas_activas = {
+        linea_id: linea for linea_id, linea in base["lineas"].items()
+        if linea.id_estado_linea_produccion.descripcion.lower() in ESTADOS_LINEA_DESPACHO
+        and linea_id not in fuera_de_servicio
+    }
+    capacidad_lookup = {
+        (cap.id_producto_id, cap.id_linea_produccion_id): {
+            "cant_por_hora": cap.cant_por_hora or 0,
+            "cantidad_minima": cap.cantidad_minima or 0,
+        }
+        for producto_id in {fila.id_orden_produccion.id_producto_id for _clave, fila, _dia in tareas_calendario}
+        for cap in ctx.explosion.lineas(producto_id)
+    }
+    tareas, todas_tandas = planner_service._armar_tareas(tareas_calendario, lineas_activas, capacidad_lookup)
+
+    # Con otras horas laborables (p. ej. un turno más) la ventana del día cambia igual
+    parametros = base["parametros_solver"]
+    ventana = horas * 60 if horas else parametros["horizonte_minutos"]
+    despacho = {
+        "fecha": dia,
+        "estado": None,
+        "tareas_calendario": len(tareas_calendario),
+        "tareas": len(tareas),
+        "tandas": len(todas_tandas),
+        "unidades_objetivo": sum(tarea["objetivo"] for tarea in tareas),
+        "unidades_programadas": 0,
+        "utilizacion_lineas": {linea_id: 0.0 for linea_id in lineas_activas},
+        "utilizacion_promedio": 0.0,
+        "segundos_solver": 0.0,
+    }
+    if not tareas:
+        return despacho
+
+    resultado = solver_tandas.resolver(
+        tareas,
+        max_segundos=min(ESCENARIO_SOLVER_MAX_SECONDS, parametros["max_segundos"]),
+        max_segundos_subproblema=min(ESCENARIO_SOLVER_MAX_SECONDS, parametros["max_segundos_subproblema"]),
+        workers=parametros["workers"],
+        compacto=planner_service.SOLVER_MODELO_COMPACTO,
+        horizonte=ventana
+    )
+    despacho["estado"] = resultado["estado"]
+    despacho["segundos_solver"] = resultado["segundos"]
+    if resultado["estado"] not in ("FEASIBLE", "OPTIMAL"):
+        return despacho
+
+    minutos = {linea_id: 0 for linea_id in lineas_activas}
+    for tanda in todas_tandas:
+        activa, ini, fin = resultado["valores"][(tanda["cal_task_id"], tanda["t"])]
+        if activa:
+            despacho["unidades_programadas"] += tanda["tamano"]
+            minutos[tanda["linea"].id_linea_produccion] += fin - ini
+    despacho["utilizacion_lineas"] = {linea_id: round(100 * m / ventana, 1) for linea_id, m in minutos.items()}
+    despacho["utilizacion_promedio"] = round(sum(despacho["utilizacion_lineas"].values()) / len(minutos), 1)
+    return despacho
+
+
+def _comparar(resultados) -> dict:
+    """{kpi: {escenario: valor}}: una fila por KPI, una columna por escenario."""
+    return {
+        f"{seccion}.{kpi}": {resultado["nombre"]: resultado[seccion][kpi] for resultado in resultados}
+        for seccion, kpi in KPIS_COMPARADOS
+    }
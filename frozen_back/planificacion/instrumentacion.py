@@ -0,0 +1,154 @@
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.db import connection
+from django.utils import timezone
+
+from .models import MetricaPlanificador
+
+_SENTENCIAS_ESCRITURA = ("INSERT", "UPDATE", "DELETE")
+
+
+class MedidorPlanificador:
+    """
+    Mide cada etapa de una corrida del planificador (pasos del MRP, fases del
+    solver): tiempo total, cantidad de consultas, tiempo en BD y filas escritas.
+
+    Uso:
+        medidor = MedidorPlanificador(MetricaPlanificador.Proceso.MRP, fecha)
+        with medidor:
+            with medidor.etapa("0.6"):
+                ...
+            medidor.pasar_a("modelo")   # etapas secuenciales sin re-indentar
+            ...
+        medidor.guardar()
+
+    Las consultas se cuentan con 'connection.execute_wrapper', así que no hace
+    falta DEBUG=True. 'guardar()' va FUERA de las transacciones de la corrida:
+    si un paso falla (y se revierte) su métrica igual queda registrada.
+    """
+
+    def __init__(self, proceso, fecha_planificacion, ejecucion=None):
+        self.proceso = proceso
+        self.fecha_planificacion = fecha_planificacion
+        self.ejecucion = ejecucion
+        self.corrida = uuid.uuid4().hex
+        self.metricas = []
+        self._actual = None
+        self._wrapper = None
+
+    # ------------------------------------------------------------------
+    # Conexión
+    # ------------------------------------------------------------------
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self._contar)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        self._cerrar(error=valor)
+        self._wrapper.__exit__(tipo, valor, traza)
+        self._wrapper = None
+        return False
+
+    def _contar(self, execute, sql, params, many, context):
+        if self._actual is None:
+            return execute(sql, params, many, context)
+
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self._actual["consultas"] += 1
+            self._actual["tiempo_db"] += time.perf_counter() - inicio
+            sentencia = sql.lstrip()[:6].upper()
+            if sentencia in _SENTENCIAS_ESCRITURA:
+                filas = context["cursor"].rowcount
+                if sentencia == "INSERT" and (filas is None or filas <= 0):
+                    # Con RETURNING, algunos motores (SQLite) no informan rowcount hasta leer
+                    filas = len(params) if many else sql.count("), (") + 1
+                self._actual["filas_escritas"] += max(filas or 0, 0)
+
+    # ------------------------------------------------------------------
+    # Etapas
+    # ------------------------------------------------------------------
+    @contextmanager
+    def etapa(self, nombre):
+        self._abrir(nombre)
+        try:
+            yield
+        except Exception as e:
+            self._cerrar(error=e)
+            raise
+        self._cerrar()
+
+    def pasar_a(self, nombre):
+        """Cierra la etapa en curso (si hay) y abre la siguiente."""
+        self._cerrar()
+        self._abrir(nombre)
+
+    def _abrir(self, nombre):
+        self._actual = {
+            "etapa": nombre,
+            "fecha_inicio": timezone.now(),
+            "inicio": time.perf_counter(),
+            "consultas": 0,
+            "tiempo_db": 0.0,
+            "filas_escritas": 0,
+        }
+
+    def _cerrar(self, error=None):
+        actual, self._actual = self._actual, None
+        if actual is None:
+            return
+        self.metricas.append({
+            "etapa": actual["etapa"],
+            "orden": len(self.metricas) + 1,
+            "fecha_inicio": actual["fecha_inicio"],
+            "duracion_ms": round((time.perf_counter() - actual["inicio"]) * 1000, 2),
+            "consultas": actual["consultas"],
+            "tiempo_db_ms": round(actual["tiempo_db"] * 1000, 2),
+            "filas_escritas": actual["filas_escritas"],
+            "error": str(error) if error else None,
+        })
+
+    # ------------------------------------------------------------------
+    # Resultado
+    # ------------------------------------------------------------------
+    def imprimir(self):
+        print(f"\n   ⏱️ Métricas ({self.get_proceso_display()}, corrida {self.corrida}):")
+        for m in self.metricas:
+            print(f"      - {m['etapa']}: {m['duracion_ms']} ms, {m['consultas']} consultas "
+                  f"({m['tiempo_db_ms']} ms en BD), {m['filas_escritas']} filas escritas"
+                  f"{' ❌ ' + m['error'] if m['error'] else ''}")
+
+    def get_proceso_display(self):
+        return MetricaPlanificador.Proceso(self.proceso).label
+
+    def guardar(self):
+        if not self.metricas:
+            return
+        MetricaPlanificador.objects.bulk_create([
+            MetricaPlanificador(
+                corrida=self.corrida,
+                proceso=self.proceso,
+                id_ejecucion_mrp=self.ejecucion,
+                fecha_planificacion=self.fecha_planificacion,
+                **m
+            )
+            for m in self.metricas
+        ])
+
+
+@contextmanager
+def medir_corrida(proceso, fecha_planificacion, guardar=True):
+    """Mide una corrida completa; al terminar (bien o mal) imprime y guarda las métricas."""
+    medidor = MedidorPlanificador(proceso, fecha_planificacion)
+    try:
+        with medidor:
+            yield medidor
+    finally:
+        medidor.imprimir()
+        if guardar:
+            medidor.guardar()
@@ -0,0 +1,62 @@
+import json
+from datetime import datetime
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from planificacion.benchmark import correr_escala
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark del MRP diario, el solver (CP-SAT) y la replanificación por capacidad "
+        "sobre una planta sintética, a varias escalas (cantidad de OVs). "
+        "Corre en una BD de PRUEBA que crea y borra (nunca toca los datos reales) "
+        "e informa tiempo, consultas y pico de memoria en JSON. "
+        "Para medir en SQLite local, usar --settings con una BD sqlite3."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--escalas", type=int, nargs="+", default=[1000, 10000, 100000],
+            help="Cantidades de órdenes de venta a generar (default: 1000 10000 100000)."
+        )
+        parser.add_argument("--fecha", help="Fecha de planificación YYYY-MM-DD (default: hoy).")
+        parser.add_argument("--semilla", type=int, default=7, help="Semilla de los datos sintéticos.")
+        parser.add_argument("--salida", help="Archivo donde guardar el JSON (además de imprimirlo).")
+        parser.add_argument("--keepdb", action="store_true", help="No borrar la BD de prueba al terminar.")
+
+    def handle(self, *args, **options):
+        if options["fecha"]:
+            try:
+                hoy = datetime.strptime(options["fecha"], "%Y-%m-%d").date()
+            except ValueError:
+                raise CommandError("Formato de fecha inválido. Use YYYY-MM-DD.")
+        else:
+            hoy = timezone.localdate()
+
+        silencioso = options["verbosity"] < 2
+        nombre_original = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options["keepdb"])
+        try:
+            escalas = []
+            for ordenes in options["escalas"]:
+                self.stderr.write(f"Escala {ordenes} OVs...")
+                call_command("flush", interactive=False, verbosity=0)
+                escalas.append(correr_escala(ordenes, hoy, options["semilla"], silencioso))
+        finally:
+            connection.creation.destroy_test_db(nombre_original, verbosity=0, keepdb=options["keepdb"])
+
+        reporte = {
+            "motor": connection.vendor,
+            "fecha": hoy,
+            "semilla": options["semilla"],
+            "escalas": escalas,
+        }
+        texto = json.dumps(reporte, indent=2, default=str, ensure_ascii=False)
+        if options["salida"]:
+            with open(options["salida"], "w", encoding="utf-8") as archivo:
+                archivo.write(texto)
+        self.stdout.write(texto)
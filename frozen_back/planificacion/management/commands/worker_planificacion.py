@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from planificacion.trabajos import correr_worker
+
+
+class Command(BaseCommand):
+    help = (
+        "Worker local de los trabajos de planificación encolados por la API "
+        "(MRP + solver, solver, replanificación por capacidad). "
+        "Toma los trabajos de la tabla trabajo_planificacion: no necesita broker."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--intervalo", type=float, default=2,
+            help="Segundos entre consultas a la cola cuando está vacía (default: 2)."
+        )
+        parser.add_argument("--una-vez", action="store_true", help="Vaciar la cola y terminar.")
+
+    def handle(self, *args, **options):
+        correr_worker(intervalo=options["intervalo"], una_vez=options["una_vez"])
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.6 on 2026-10-18 03:56
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EjecucionMRP',
+            fields=[
+                ('id_ejecucion_mrp', models.AutoField(primary_key=True, serialize=False)),
+                ('fecha_planificacion', models.DateField()),
+                ('estado', models.CharField(choices=[('EN_CURSO', 'En curso'), ('COMPLETADA', 'Completada'), ('FALLIDA', 'Fallida')], default='EN_CURSO', max_length=20)),
+                ('fecha_inicio', models.DateTimeField(auto_now_add=True)),
+                ('fecha_fin', models.DateTimeField(blank=True, null=True)),
+                ('ultimo_paso_completado', models.CharField(blank=True, max_length=10, null=True)),
+                ('estado_memoria', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('error', models.TextField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'ejecucion_mrp',
+                'ordering': ['-id_ejecucion_mrp'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PasoEjecucionMRP',
+            fields=[
+                ('id_paso_ejecucion_mrp', models.AutoField(primary_key=True, serialize=False)),
+                ('paso', models.CharField(max_length=10)),
+                ('estado', models.CharField(choices=[('COMPLETADO', 'Completado'), ('FALLIDO', 'Fallido')], max_length=20)),
+                ('fecha_inicio', models.DateTimeField()),
+                ('fecha_fin', models.DateTimeField()),
+                ('error', models.TextField(blank=True, null=True)),
+                ('id_ejecucion_mrp', models.ForeignKey(db_column='id_ejecucion_mrp', on_delete=django.db.models.deletion.CASCADE, related_name='pasos', to='planificacion.ejecucionmrp')),
+            ],
+            options={
+                'db_table': 'paso_ejecucion_mrp',
+                'ordering': ['id_paso_ejecucion_mrp'],
+            },
+        ),
+    ]
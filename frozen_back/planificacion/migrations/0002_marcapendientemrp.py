@@ -0,0 +1,27 @@
+# Generated by Django 5.2.6 on 2026-10-18 04:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planificacion', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MarcaPendienteMRP',
+            fields=[
+                ('id_marca_pendiente_mrp', models.AutoField(primary_key=True, serialize=False)),
+                ('tipo', models.CharField(choices=[('PRODUCTO', 'Producto'), ('MATERIA_PRIMA', 'Materia prima')], max_length=20)),
+                ('id_referencia', models.IntegerField()),
+                ('motivo', models.CharField(max_length=50)),
+                ('fecha_marca', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'marca_pendiente_mrp',
+                'unique_together': {('tipo', 'id_referencia')},
+            },
+        ),
+    ]
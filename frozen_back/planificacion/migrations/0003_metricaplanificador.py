@@ -0,0 +1,36 @@
+# Generated by Django 5.2.6 on 2026-10-18 04:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planificacion', '0002_marcapendientemrp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricaPlanificador',
+            fields=[
+                ('id_metrica_planificador', models.AutoField(primary_key=True, serialize=False)),
+                ('corrida', models.CharField(db_index=True, max_length=32)),
+                ('proceso', models.CharField(choices=[('MRP', 'MRP diario'), ('MRP_INCREMENTAL', 'MRP incremental'), ('SOLVER', 'Solver táctico')], max_length=20)),
+                ('fecha_planificacion', models.DateField()),
+                ('etapa', models.CharField(max_length=30)),
+                ('orden', models.PositiveSmallIntegerField()),
+                ('fecha_inicio', models.DateTimeField()),
+                ('duracion_ms', models.FloatField()),
+                ('consultas', models.IntegerField()),
+                ('tiempo_db_ms', models.FloatField()),
+                ('filas_escritas', models.IntegerField()),
+                ('error', models.TextField(blank=True, null=True)),
+                ('id_ejecucion_mrp', models.ForeignKey(blank=True, db_column='id_ejecucion_mrp', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='metricas', to='planificacion.ejecucionmrp')),
+            ],
+            options={
+                'db_table': 'metrica_planificador',
+                'ordering': ['-id_metrica_planificador'],
+            },
+        ),
+    ]
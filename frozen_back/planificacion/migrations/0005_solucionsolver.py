@@ -0,0 +1,37 @@
+# Generated by Django 5.2.6 on 2026-10-18 04:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planificacion', '0004_dianolaborable'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SolucionSolver',
+            fields=[
+                ('id_solucion_solver', models.AutoField(primary_key=True, serialize=False)),
+                ('fecha_planificacion', models.DateField(db_index=True)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('estado', models.CharField(max_length=20)),
+                ('objetivo', models.FloatField(blank=True, null=True)),
+                ('tandas', models.JSONField(default=list)),
+                ('tandas_total', models.IntegerField(default=0)),
+                ('tandas_con_pista', models.IntegerField(default=0)),
+                ('tandas_igual_pista', models.IntegerField(default=0)),
+                ('segundos_solver', models.FloatField()),
+                ('segundos_primera_solucion', models.FloatField(blank=True, null=True)),
+                ('conflictos', models.BigIntegerField(default=0)),
+                ('ramas', models.BigIntegerField(default=0)),
+                ('id_solucion_pista', models.ForeignKey(blank=True, db_column='id_solucion_pista', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='usada_como_pista', to='planificacion.solucionsolver')),
+            ],
+            options={
+                'db_table': 'solucion_solver',
+                'ordering': ['-id_solucion_solver'],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.6 on 2026-10-18 04:31
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planificacion', '0005_solucionsolver'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrabajoPlanificacion',
+            fields=[
+                ('id_trabajo_planificacion', models.AutoField(primary_key=True, serialize=False)),
+                ('tipo', models.CharField(choices=[('MRP_Y_SOLVER', 'MRP diario + solver táctico'), ('SOLVER', 'Solver táctico'), ('REPLANIFICACION_CAPACIDAD', 'Replanificación por capacidad')], max_length=30)),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('EN_CURSO', 'En curso'), ('COMPLETADO', 'Completado'), ('FALLIDO', 'Fallido')], db_index=True, default='PENDIENTE', max_length=20)),
+                ('parametros', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('progreso', models.PositiveSmallIntegerField(default=0)),
+                ('fase_actual', models.CharField(blank=True, max_length=30, null=True)),
+                ('fases', models.JSONField(default=list, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('resultado', models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('worker', models.CharField(blank=True, max_length=100, null=True)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_inicio', models.DateTimeField(blank=True, null=True)),
+                ('fecha_fin', models.DateTimeField(blank=True, null=True)),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'trabajo_planificacion',
+                'ordering': ['-id_trabajo_planificacion'],
+            },
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.2.6 on 2026-10-18 04:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planificacion', '0006_trabajoplanificacion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='solucionsolver',
+            name='cota',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='solucionsolver',
+            name='dias_horizonte',
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='solucionsolver',
+            name='estadisticas_subproblemas',
+            field=models.JSONField(default=list),
+        ),
+        migrations.AddField(
+            model_name='solucionsolver',
+            name='gap',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='solucionsolver',
+            name='horizonte_minutos',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='solucionsolver',
+            name='intervalos',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='solucionsolver',
+            name='max_segundos',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='solucionsolver',
+            name='max_segundos_subproblema',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='solucionsolver',
+            name='modelo_compacto',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='solucionsolver',
+            name='restricciones',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='solucionsolver',
+            name='subproblemas',
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='solucionsolver',
+            name='variables',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='solucionsolver',
+            name='workers',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
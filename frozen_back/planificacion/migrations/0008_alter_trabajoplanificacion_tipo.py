@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planificacion', '0007_solucionsolver_parametros_estadisticas'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='trabajoplanificacion',
+            name='tipo',
+            field=models.CharField(choices=[('MRP_Y_SOLVER', 'MRP diario + solver táctico'), ('SOLVER', 'Solver táctico'), ('REPLANIFICACION_CAPACIDAD', 'Replanificación por capacidad'), ('ESCENARIOS', 'Escenarios "qué pasa si"')], max_length=30),
+        ),
+    ]
@@ -1,3 +1,250 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 
-# Create your models here.
+
+class EjecucionMRP(models.Model):
+    """
+    Una corrida del Planificador MRP diario. Cada paso (PASO 0.6, 0, ..., 6)
+    se confirma en su propia transacción y deja un PasoEjecucionMRP.
+    Si la corrida falla, la próxima para la misma fecha se reanuda desde el
+    primer paso no completado, usando 'estado_memoria'.
+    """
+
+    class Estado(models.TextChoices):
+        EN_CURSO = 'EN_CURSO', ('En curso')
+        COMPLETADA = 'COMPLETADA', ('Completada')
+        FALLIDA = 'FALLIDA', ('Fallida')
+
+    id_ejecucion_mrp = models.AutoField(primary_key=True)
+    fecha_planificacion = models.DateField()
+    estado = models.CharField(max_length=20, choices=Estado.choices, default=Estado.EN_CURSO)
+    fecha_inicio = models.DateTimeField(auto_now_add=True)
+    fecha_fin = models.DateTimeField(null=True, blank=True)
+    ultimo_paso_completado = models.CharField(max_length=10, null=True, blank=True)
+    # Lo que vive solo en memoria entre pasos (pools virtuales, compras agregadas,
+    # líneas a producir), tal como quedó después del último paso completado.
+    estado_memoria = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    error = models.TextField(null=True, blank=True)
+
+    class Meta:
+        db_table = "ejecucion_mrp"
+        ordering = ['-id_ejecucion_mrp']
+
+    def __str__(self):
+        return f"MRP {self.fecha_planificacion} ({self.estado})"
+
+
+class PasoEjecucionMRP(models.Model):
+    """Checkpoint de un paso de una corrida del MRP."""
+
+    class Estado(models.TextChoices):
+        COMPLETADO = 'COMPLETADO', ('Completado')
+        FALLIDO = 'FALLIDO', ('Fallido')
+
+    id_paso_ejecucion_mrp = models.AutoField(primary_key=True)
+    id_ejecucion_mrp = models.ForeignKey(
+        EjecucionMRP,
+        on_delete=models.CASCADE,
+        db_column="id_ejecucion_mrp",
+        related_name="pasos"
+    )
+    paso = models.CharField(max_length=10)
+    estado = models.CharField(max_length=20, choices=Estado.choices)
+    fecha_inicio = models.DateTimeField()
+    fecha_fin = models.DateTimeField()
+    error = models.TextField(null=True, blank=True)
+
+    class Meta:
+        db_table = "paso_ejecucion_mrp"
+        ordering = ['id_paso_ejecucion_mrp']
+
+
+class MarcaPendienteMRP(models.Model):
+    """
+    "Dirty set" del MRP incremental: productos y materias primas cuya oferta
+    o demanda cambió desde la última corrida (ver planificacion/signals.py).
+    Las consume (borra) la corrida que los replanifica.
+    """
+
+    class Tipo(models.TextChoices):
+        PRODUCTO = 'PRODUCTO', ('Producto')
+        MATERIA_PRIMA = 'MATERIA_PRIMA', ('Materia prima')
+
+    id_marca_pendiente_mrp = models.AutoField(primary_key=True)
+    tipo = models.CharField(max_length=20, choices=Tipo.choices)
+    id_referencia = models.IntegerField()
+    motivo = models.CharField(max_length=50)
+    fecha_marca = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "marca_pendiente_mrp"
+        unique_together = (("tipo", "id_referencia"),)
+
+
+class MetricaPlanificador(models.Model):
+    """
+    Instrumentación de una etapa (paso del MRP o fase del solver) en una
+    corrida: tiempo, consultas, tiempo en BD y filas escritas.
+    Las filas de una misma invocación comparten 'corrida'.
+    """
+
+    class Proceso(models.TextChoices):
+        MRP = 'MRP', ('MRP diario')
+        MRP_INCREMENTAL = 'MRP_INCREMENTAL', ('MRP incremental')
+        SOLVER = 'SOLVER', ('Solver táctico')
+
+    id_metrica_planificador = models.AutoField(primary_key=True)
+    corrida = models.CharField(max_length=32, db_index=True)
+    proceso = models.CharField(max_length=20, choices=Proceso.choices)
+    id_ejecucion_mrp = models.ForeignKey(
+        EjecucionMRP,
+        on_delete=models.SET_NULL,
+        db_column="id_ejecucion_mrp",
+        related_name="metricas",
+        null=True,
+        blank=True
+    )
+    fecha_planificacion = models.DateField()
+    etapa = models.CharField(max_length=30)
+    orden = models.PositiveSmallIntegerField()
+    fecha_inicio = models.DateTimeField()
+    duracion_ms = models.FloatField()
+    consultas = models.IntegerField()
+    tiempo_db_ms = models.FloatField()
+    filas_escritas = models.IntegerField()
+    error = models.TextField(null=True, blank=True)
+
+    class Meta:
+        db_table = "metrica_planificador"
+        ordering = ['-id_metrica_planificador']
+
+
+class DiaNoLaborable(models.Model):
+    """
+    Feriados y paradas de planta. Junto con los fines de semana definen el
+    calendario laboral que usan los planificadores (ver planificacion/calendario.py).
+    """
+
+    class Tipo(models.TextChoices):
+        FERIADO = 'FERIADO', ('Feriado')
+        PARADA_PLANTA = 'PARADA_PLANTA', ('Parada de planta')
+
+    id_dia_no_laborable = models.AutoField(primary_key=True)
+    fecha = models.DateField(unique=True)
+    tipo = models.CharField(max_length=20, choices=Tipo.choices, default=Tipo.FERIADO)
+    descripcion = models.CharField(max_length=100, blank=True, default="")
+
+    class Meta:
+        db_table = "dia_no_laborable"
+        ordering = ['fecha']
+
+    def __str__(self):
+        return f"{self.fecha} ({self.get_tipo_display()})"
+
+
+class SolucionSolver(models.Model):
+    """
+    Solución del solver táctico (CP-SAT) para un día: inicio y literal de
+    cada tanda de cada tarea del calendario. La corrida siguiente la usa como
+    pista (warm start); las estadísticas muestran cuánto ayudó.
+
+    También guarda los parámetros con que corrió (leídos de Configuracion) y
+    el tamaño del modelo, la cota y el gap, para ajustar workers y tiempos
+    límite contra los modelos reales de cada día.
+    """
+
+    id_solucion_solver = models.AutoField(primary_key=True)
+    fecha_planificacion = models.DateField(db_index=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    estado = models.CharField(max_length=20)
+    objetivo = models.FloatField(null=True, blank=True)
+    # [{"cal", "op", "producto", "linea", "t", "activa", "inicio"}]
+    tandas = models.JSONField(default=list)
+
+    # --- Warm start ---
+    id_solucion_pista = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        db_column="id_solucion_pista",
+        related_name="usada_como_pista",
+        null=True,
+        blank=True
+    )
+    tandas_total = models.IntegerField(default=0)
+    tandas_con_pista = models.IntegerField(default=0)
+    # Tandas cuya decisión final (activa o no) coincidió con la pista
+    tandas_igual_pista = models.IntegerField(default=0)
+
+    # --- Parámetros del solver (ver planner_service.parametros_solver) ---
+    max_segundos = models.FloatField(null=True, blank=True)
+    max_segundos_subproblema = models.FloatField(null=True, blank=True)
+    workers = models.IntegerField(null=True, blank=True)
+    horizonte_minutos = models.IntegerField(null=True, blank=True)
+    dias_horizonte = models.IntegerField(default=1)
+    modelo_compacto = models.BooleanField(default=True)
+
+    # --- Estadísticas del solver ---
+    segundos_solver = models.FloatField()
+    segundos_primera_solucion = models.FloatField(null=True, blank=True)
+    conflictos = models.BigIntegerField(default=0)
+    ramas = models.BigIntegerField(default=0)
+    # Mejor cota del objetivo y gap relativo (0 = óptimo probado)
+    cota = models.FloatField(null=True, blank=True)
+    gap = models.FloatField(null=True, blank=True)
+    # Tamaño del modelo (suma de todos los subproblemas)
+    subproblemas = models.IntegerField(default=1)
+    variables = models.IntegerField(default=0)
+    restricciones = models.IntegerField(default=0)
+    intervalos = models.IntegerField(default=0)
+    # [{"lineas", "tareas", "tandas", "estado", "objetivo", "cota", "gap", "segundos", ...}]
+    estadisticas_subproblemas = models.JSONField(default=list)
+
+    class Meta:
+        db_table = "solucion_solver"
+        ordering = ['-id_solucion_solver']
+
+    def __str__(self):
+        return f"Solución {self.fecha_planificacion} ({self.estado})"
+
+
+class TrabajoPlanificacion(models.Model):
+    """
+    Corrida del planificador encolada desde la API: el endpoint responde al
+    instante con el ID y un proceso aparte (manage.py worker_planificacion)
+    la ejecuta. Ver planificacion/trabajos.py.
+    """
+
+    class Tipo(models.TextChoices):
+        MRP_Y_SOLVER = 'MRP_Y_SOLVER', ('MRP diario + solver táctico')
+        SOLVER = 'SOLVER', ('Solver táctico')
+        REPLANIFICACION_CAPACIDAD = 'REPLANIFICACION_CAPACIDAD', ('Replanificación por capacidad')
+        ESCENARIOS = 'ESCENARIOS', ('Escenarios "qué pasa si"')
+
+    class Estado(models.TextChoices):
+        PENDIENTE = 'PENDIENTE', ('Pendiente')
+        EN_CURSO = 'EN_CURSO', ('En curso')
+        COMPLETADO = 'COMPLETADO', ('Completado')
+        FALLIDO = 'FALLIDO', ('Fallido')
+
+    id_trabajo_planificacion = models.AutoField(primary_key=True)
+    tipo = models.CharField(max_length=30, choices=Tipo.choices)
+    estado = models.CharField(max_length=20, choices=Estado.choices, default=Estado.PENDIENTE, db_index=True)
+    parametros = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    progreso = models.PositiveSmallIntegerField(default=0)
+    fase_actual = models.CharField(max_length=30, null=True, blank=True)
+    # [{"fase", "fecha_inicio", "fecha_fin", "segundos"}]
+    fases = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+    resultado = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    error = models.TextField(null=True, blank=True)
+    worker = models.CharField(max_length=100, null=True, blank=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_inicio = models.DateTimeField(null=True, blank=True)
+    fecha_fin = models.DateTimeField(null=True, blank=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "trabajo_planificacion"
+        ordering = ['-id_trabajo_planificacion']
+
+    def __str__(self):
+        return f"Trabajo {self.id_trabajo_planificacion} {self.tipo} ({self.estado})"
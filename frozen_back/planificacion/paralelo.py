@@ -0,0 +1,112 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from django.db import connection, connections
+
+# Contexto completo y pasos que heredan los procesos del pool (fork):
+# así no hay que serializar el contexto para mandarlo a cada proceso.
+_compartido = {}
+
+
+def puede_paralelizar() -> bool:
+    """
+    Los procesos se crean con 'fork' (heredan el contexto ya cargado). Dentro
+    de una transacción abierta no se puede: hay que cerrar la conexión antes.
+    """
+    return "fork" in multiprocessing.get_all_start_methods() and not connection.in_atomic_block
+
+
+def componentes_independientes(ctx) -> list:
+    """
+    Agrupa los productos a planificar en componentes conexos del grafo
+    producto–MP–línea (RecetaMateriaPrima y ProductoLinea): dos componentes
+    no compiten por stock ni por capacidad, así que se pueden planificar
+    por separado.
+
+    También se unen los productos de una misma OV (el cierre y el
+    desplazamiento de una OV miran todas sus líneas) y los de una misma OV
+    cancelada con reservas (se liberan juntas).
+
+    Devuelve listas de IDs de producto, las más grandes primero.
+    """
+    padre = {}
+
+    def raiz(nodo):
+        padre.setdefault(nodo, nodo)
+        while padre[nodo] != nodo:
+            padre[nodo] = padre[padre[nodo]]
+            nodo = padre[nodo]
+        return nodo
+
+    def unir(a, b):
+        padre[raiz(a)] = raiz(b)
+
+    productos = {op.id_producto_id for op in ctx.ops.values()}
+    productos |= {linea.id_producto_id for linea in ctx.lineas.values()}
+    for info in ctx.reservas_pt_canceladas.values():
+        productos |= set(info['liberado'])
+
+    for producto_id in productos:
+        raiz(("producto", producto_id))
+        if ctx.explosion.tiene_receta(producto_id):
+            for ingrediente in ctx.explosion.ingredientes(producto_id):
+                unir(("producto", producto_id), ("mp", ingrediente.id_materia_prima))
+        for capacidad_linea in ctx.explosion.lineas(producto_id):
+            unir(("producto", producto_id), ("linea", capacidad_linea.id_linea_produccion_id))
+
+    for lineas in ctx.lineas_por_ov.values():
+        for linea in lineas[1:]:
+            unir(("producto", lineas[0].id_producto_id), ("producto", linea.id_producto_id))
+    for op_id, peggings in ctx.peggings.items():
+        op = ctx.ops.get(op_id)
+        for linea_id, _ov_id, _cantidad in peggings:
+            linea = ctx.lineas.get(linea_id)
+            if op is not None and linea is not None:
+                unir(("producto", op.id_producto_id), ("producto", linea.id_producto_id))
+    for info in ctx.reservas_pt_canceladas.values():
+        productos_ov = list(info['liberado'])
+        for producto_id in productos_ov[1:]:
+            unir(("producto", productos_ov[0]), ("producto", producto_id))
+
+    componentes = {}
+    for producto_id in productos:
+        componentes.setdefault(raiz(("producto", producto_id)), []).append(producto_id)
+    return sorted((sorted(c) for c in componentes.values()), key=lambda c: (-len(c), c[0]))
+
+
+def planificar_componentes(ctx, componentes, pasos, procesos: int):
+    """
+    Corre 'pasos' para cada componente en un pool de procesos, sobre una
+    copia del contexto acotada al componente (ContextoMRP.componente), y suma
+    lo decidido al contexto completo: plan, calendario, OPs, compras.
+    Nada se escribe en la BD: eso queda para la fase de escritura.
+    """
+    # Cada proceso abre su propia conexión si la necesita: no se hereda la del padre
+    connections.close_all()
+
+    _compartido.update(ctx=ctx, pasos=pasos)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=min(procesos, len(componentes)),
+            mp_context=multiprocessing.get_context("fork")
+        ) as pool:
+            resultados = list(pool.map(_planificar_componente, componentes))
+    finally:
+        _compartido.clear()
+
+    for resultado in resultados:
+        ctx.incorporar_componente(resultado)
+
+
+def _planificar_componente(productos):
+    # Un proceso del pool puede planificar más de un componente: el contexto
+    # heredado no se toca, cada componente trabaja sobre su propia copia acotada
+    pasos = _compartido["pasos"]
+    try:
+        ctx = _compartido["ctx"].componente(productos)
+        print(f"\n=== COMPONENTE {productos} ===")
+        for _clave, paso in pasos:
+            paso(ctx)
+        return ctx.exportar_componente()
+    finally:
+        connections.close_all()
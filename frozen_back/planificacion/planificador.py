@@ -1,255 +1,390 @@
 import math
-from datetime import timedelta, date, datetime
+from datetime import timedelta, date
 from django.utils import timezone
 from django.db import transaction
-from django.db.models import Sum, Q, F, Value
-from django.db.models.functions import Coalesce
 from collections import defaultdict
 
 # --- Importar Modelos de todas las apps ---
-from ventas.models import OrdenVenta, OrdenVentaProducto, EstadoVenta
-from productos.models import Producto
-from produccion.models import (
-    OrdenProduccion, EstadoOrdenProduccion, LineaProduccion, 
-    CalendarioProduccion, OrdenProduccionPegging
-)
-from compras.models import OrdenCompra, OrdenCompraMateriaPrima, EstadoOrdenCompra
-from stock.models import (
-    LoteProduccion, LoteMateriaPrima, EstadoLoteProduccion,
-    EstadoLoteMateriaPrima, ReservaStock, ReservaMateriaPrima,
-    EstadoReserva, EstadoReservaMateria
-)
-from stock.services import get_stock_disponible_para_producto, get_stock_disponible_para_materia_prima
-from recetas.models import ProductoLinea, Receta, RecetaMateriaPrima
-from materias_primas.models import MateriaPrima, Proveedor
-from trazabilidad.views import get_config
-
-# --- Constantes de Planificación (Centralizadas) ---
-#HORAS_LABORABLES_POR_DIA = 16
-#DIAS_BUFFER_ENTREGA_PT = 1
-#DIAS_BUFFER_RECEPCION_MP = 1
+from produccion.models import OrdenProduccion, CalendarioProduccion
+from stock.models import LoteProduccion, EstadoReserva, EstadoReservaMateria
+from stock.services import reservar_stock_pt_fefo, reservar_stock_mp_fefo
+from recetas.models import Receta
+from recetas.services import ExplosionRecetas
+from .contexto import ContextoMRP, a_datetime, a_fecha
+from .models import EjecucionMRP, PasoEjecucionMRP, MarcaPendienteMRP, MetricaPlanificador
+from .instrumentacion import MedidorPlanificador, medir_corrida
+from .paralelo import puede_paralelizar, componentes_independientes, planificar_componentes
 
 # ===================================================================
 # FUNCIONES HELPER
-# (_reservar_stock_pt y _reservar_stock_mp no cambian)
+# (Reservas FEFO de todo un paso juntas: ver stock.services)
 # ===================================================================
-@transaction.atomic
-def _reservar_stock_pt(linea_ov: OrdenVentaProducto, cantidad_a_reservar: int, estado_activa: EstadoReserva):
-    # ... (Tu código helper _reservar_stock_pt) ...
-    filtro_reservas_activas = Q(reservas__id_estado_reserva__descripcion='Activa')
-    lotes_disponibles = LoteProduccion.objects.filter(
-        id_producto=linea_ov.id_producto,
-        id_estado_lote_produccion__descripcion="Disponible"
-    ).annotate(
-        total_reservado=Coalesce(Sum('reservas__cantidad_reservada', filter=filtro_reservas_activas), 0)
-    ).annotate(
-        disponible=F('cantidad') - F('total_reservado')
-    ).filter(
-        disponible__gt=0
-    ).order_by('fecha_vencimiento')
-    cantidad_pendiente = cantidad_a_reservar
-    for lote in lotes_disponibles:
-        if cantidad_pendiente <= 0: break
-        disponible_lote = lote.disponible 
-        cantidad_a_tomar = min(disponible_lote, cantidad_pendiente)
-        if cantidad_a_tomar > 0:
-            ReservaStock.objects.create(
-                id_orden_venta_producto=linea_ov,
-                id_lote_produccion=lote,
-                cantidad_reservada=cantidad_a_tomar,
-                id_estado_reserva=estado_activa
-            )
-            cantidad_pendiente -= cantidad_a_tomar
-    print(f"      > (OV {linea_ov.id_orden_venta_id}) Reservados {cantidad_a_reservar - cantidad_pendiente} de {cantidad_a_reservar} de {linea_ov.id_producto.nombre}")
-
-@transaction.atomic
-def _reservar_stock_mp(op: OrdenProduccion, mp_id: int, cantidad_a_reservar: int, estado_activa: EstadoReservaMateria):
-    # ... (Tu código helper _reservar_stock_mp) ...
-    filtro_reservas_activas = Q(reservas__id_estado_reserva_materia__descripcion='Activa')
-    lotes_disponibles_mp = LoteMateriaPrima.objects.filter(
-        id_materia_prima_id=mp_id,
-        id_estado_lote_materia_prima__descripcion="disponible"
-    ).annotate(
-        total_reservado=Coalesce(Sum('reservas__cantidad_reservada', filter=filtro_reservas_activas), 0)
-    ).annotate(
-        disponible=F('cantidad') - F('total_reservado')
-    ).filter(
-        disponible__gt=0
-    ).order_by('fecha_vencimiento')
-    cantidad_pendiente = cantidad_a_reservar
-    for lote_mp in lotes_disponibles_mp:
-        if cantidad_pendiente <= 0: break
-        disponible_lote = lote_mp.disponible 
-        cantidad_a_tomar = min(disponible_lote, cantidad_pendiente)
-        if cantidad_a_tomar > 0:
-            ReservaMateriaPrima.objects.create(
-                id_orden_produccion=op,
-                id_lote_materia_prima=lote_mp,
-                cantidad_reservada=cantidad_a_tomar,
-                id_estado_reserva_materia=estado_activa
-            )
-            cantidad_pendiente -= cantidad_a_tomar
-    print(f"      > (OP {op.id_orden_produccion}) Reservados {cantidad_a_reservar - cantidad_pendiente} de {cantidad_a_reservar} de MP {mp_id}")
+def _reservar_stock_pt(demandas, estado_activa: EstadoReserva):
+    """demandas: [(linea_ov, cantidad_a_reservar)]"""
+    reservados = reservar_stock_pt_fefo(demandas, estado_activa)
+    for (linea_ov, cantidad_a_reservar), reservado in zip(demandas, reservados):
+        print(f"      > (OV {linea_ov.id_orden_venta_id}) Reservados {reservado} de {cantidad_a_reservar} de {linea_ov.id_producto.nombre}")
+
+def _reservar_stock_mp(demandas, estado_activa: EstadoReservaMateria):
+    """demandas: [(op, mp_id, cantidad_a_reservar)]"""
+    reservados = reservar_stock_mp_fefo(
+        [(op, {mp_id: cantidad}) for op, mp_id, cantidad in demandas], estado_activa
+    )
+    for (op, mp_id, cantidad_a_reservar), reservado in zip(demandas, reservados):
+        print(f"      > (OP {op.id_orden_produccion}) Reservados {reservado[mp_id]} de {cantidad_a_reservar} de MP {mp_id}")
 
 
 # ===================================================================
 # FUNCIÓN PRINCIPAL DEL PLANIFICADOR
 # ===================================================================
 
-@transaction.atomic
-def ejecutar_planificacion_diaria_mrp(fecha_simulada: date):
-    
-    # 1. CARGA DINÁMICA DE CONFIGURACIÓN (Fresh data)
-    # Esto consulta la BD cada vez que corres el planificador, permitiendo cambios en caliente.
-    HORAS_LABORABLES_POR_DIA = get_config('HORAS_LABORABLES_POR_DIA', 16)
-    DIAS_BUFFER_ENTREGA_PT = get_config('DIAS_BUFFER_ENTREGA_PT', 1)
-    DIAS_BUFFER_RECEPCION_MP = get_config('DIAS_BUFFER_RECEPCION_MP', 1)
-
-    hoy = fecha_simulada
-    tomorrow = hoy + timedelta(days=1)
-    fecha_limite_ov = hoy + timedelta(days=7)
-    
-    print(f"--- INICIANDO PLANIFICADOR MRP DIARIO ({hoy}) ---")
-    print(f"--- Alcance: Órdenes de Venta hasta {fecha_limite_ov} ---")
-    print(f"--- Día de Reserva JIT: {tomorrow} ---")
-
-    # --- Obtener Estados ---
-    estado_ov_creada = EstadoVenta.objects.get(descripcion="Creada")
-    estado_ov_en_preparacion, _ = EstadoVenta.objects.get_or_create(descripcion="En Preparación")
-    estado_ov_pendiente_pago, _ = EstadoVenta.objects.get_or_create(descripcion="Pendiente de Pago")
-    
-    estado_op_en_espera, _ = EstadoOrdenProduccion.objects.get_or_create(descripcion="En espera")
-    estado_op_pendiente_inicio, _ = EstadoOrdenProduccion.objects.get_or_create(descripcion="Pendiente de inicio")
-    estado_op_cancelada, _ = EstadoOrdenProduccion.objects.get_or_create(descripcion="Cancelado")
-    estado_op_en_proceso, _ = EstadoOrdenProduccion.objects.get_or_create(descripcion="En proceso")
-    
-    estado_oc_en_proceso, _ = EstadoOrdenCompra.objects.get_or_create(descripcion="En proceso")
-    estado_reserva_activa, _ = EstadoReserva.objects.get_or_create(descripcion="Activa")
-    estado_reserva_mp_activa, _ = EstadoReservaMateria.objects.get_or_create(descripcion="Activa")
-    
-    # --- Pools de Stock (Se inicializan 1 vez) ---
-    print("   > Obteniendo pools de stock (MP y OCs)...")
-    stock_virtual_mp = {
-        mp.id_materia_prima: get_stock_disponible_para_materia_prima(mp.id_materia_prima)
-        for mp in MateriaPrima.objects.all()
-    }
-    compras_en_proceso = OrdenCompraMateriaPrima.objects.filter(
-        id_orden_compra__id_estado_orden_compra=estado_oc_en_proceso
+def ejecutar_planificacion_diaria_mrp(fecha_simulada: date, simular: bool = False):
+    """
+    Corre el MRP diario. Todo se lee al inicio (ContextoMRP), cada paso decide
+    en memoria y anota sus escrituras en 'ctx.plan'.
+
+    - simular=False: cada paso aplica sus escrituras en su PROPIA transacción
+      (corta) junto con su checkpoint (EjecucionMRP / PasoEjecucionMRP).
+      Si un paso falla, solo se pierde ese paso: la próxima corrida para la
+      misma fecha se reanuda desde ahí.
+    - simular=True: NO escribe nada en la BD.
+
+    Si hay más de un componente independiente de productos (no comparten MPs,
+    líneas ni OVs) y MRP_PROCESOS_PARALELOS > 1, los PASOS 0.6 a 5 de cada
+    componente corren en paralelo (ver planificacion/paralelo.py) y todo se
+    escribe junto al final, en UNA transacción (sin checkpoints intermedios).
+
+    En ambos casos devuelve el diff (ver PlanMRP.resumen()).
+    Cada paso queda medido en MetricaPlanificador (solo en modo real).
+    """
+    with medir_corrida(MetricaPlanificador.Proceso.MRP, fecha_simulada, guardar=not simular) as medidor:
+        return _ejecutar_mrp_diario(fecha_simulada, simular, medidor)
+
+
+def _ejecutar_mrp_diario(fecha_simulada: date, simular: bool, medidor: MedidorPlanificador):
+    with medidor.etapa("contexto"):
+        ctx = ContextoMRP(fecha_simulada, simular=simular)
+
+    print(f"--- INICIANDO PLANIFICADOR MRP DIARIO ({ctx.hoy}){' [SIMULACIÓN]' if simular else ''} ---")
+    print(f"--- Alcance: Órdenes de Venta hasta {ctx.fecha_limite_ov} ---")
+    print(f"--- Día de Reserva JIT: {ctx.tomorrow} ---")
+
+    componentes = []
+    if ctx.procesos_paralelos > 1 and puede_paralelizar():
+        with medidor.etapa("componentes"):
+            componentes = componentes_independientes(ctx)
+
+    if simular:
+        if len(componentes) > 1:
+            _decidir_en_paralelo(ctx, componentes, medidor)
+            with medidor.etapa("6"):
+                _paso_6_ordenes_compra(ctx)
+        else:
+            for clave, paso in PASOS_MRP:
+                with medidor.etapa(clave):
+                    paso(ctx)
+        return ctx.plan.resumen()
+
+    ejecucion, pasos_completados = _iniciar_o_reanudar_ejecucion(ctx)
+    medidor.ejecucion = ejecucion
+
+    # Una corrida que se reanuda sigue paso a paso desde su checkpoint
+    if len(componentes) > 1 and not pasos_completados:
+        _aplicar_en_paralelo(ctx, ejecucion, componentes, medidor)
+    else:
+        _aplicar_pasos(ctx, ejecucion, pasos_completados, medidor)
+
+    ejecucion.estado = EjecucionMRP.Estado.COMPLETADA
+    ejecucion.fecha_fin = timezone.now()
+    ejecucion.save(update_fields=['estado', 'fecha_fin'])
+
+    # La corrida completa replanificó todo lo que estaba marcado antes de empezar
+    MarcaPendienteMRP.objects.filter(fecha_marca__lte=ejecucion.fecha_inicio).delete()
+
+    print(f"\n   > Calendario de producción: {ctx.plan.calendario_borradas} reservas borradas, {ctx.plan.calendario_creadas} creadas.")
+    print(f"--- PLANIFICADOR MRP FINALIZADO (corrida {ejecucion.id_ejecucion_mrp}) ---")
+
+    return ctx.plan.resumen()
+
+
+def _aplicar_pasos(ctx: ContextoMRP, ejecucion: EjecucionMRP, pasos_completados, medidor: MedidorPlanificador):
+    """Cada paso decide y aplica sus escrituras en su PROPIA transacción, con su checkpoint."""
+    for clave, paso in PASOS_MRP:
+        if clave in pasos_completados:
+            print(f"\n[PASO {clave}] Ya completado en la corrida {ejecucion.id_ejecucion_mrp}. Se omite.")
+            continue
+
+        inicio_paso = timezone.now()
+        try:
+            with medidor.etapa(clave), transaction.atomic():
+                paso(ctx)
+                ctx.plan.aplicar()
+                _registrar_pasos_completados(ctx, ejecucion, [clave], inicio_paso)
+        except Exception as e:
+            print(f"\n   !ERROR en el PASO {clave}: {e}. Los pasos anteriores quedan confirmados.")
+            _registrar_paso_fallido(ejecucion, clave, inicio_paso, e)
+            raise
+
+
+def _decidir_en_paralelo(ctx: ContextoMRP, componentes, medidor: MedidorPlanificador):
+    """PASOS 0.6 a 5 de cada componente en un proceso distinto (solo en memoria)."""
+    procesos = min(ctx.procesos_paralelos, len(componentes))
+    print(f"\n--- MRP EN PARALELO: {len(componentes)} componentes independientes en {procesos} procesos ---")
+    with medidor.etapa("paralelo"):
+        planificar_componentes(ctx, componentes, PASOS_POR_COMPONENTE, procesos)
+
+
+def _aplicar_en_paralelo(ctx: ContextoMRP, ejecucion: EjecucionMRP, componentes, medidor: MedidorPlanificador):
+    """
+    Los componentes deciden en paralelo; las OCs (PASO 6, agrupadas por
+    proveedor) y TODAS las escrituras se hacen juntas, en una transacción.
+    Si falla, no queda ningún paso confirmado: la próxima corrida empieza de cero.
+    """
+    inicio = timezone.now()
+    try:
+        _decidir_en_paralelo(ctx, componentes, medidor)
+        with medidor.etapa("6"):
+            _paso_6_ordenes_compra(ctx)
+        with medidor.etapa("escritura"), transaction.atomic():
+            ctx.plan.aplicar()
+            _registrar_pasos_completados(ctx, ejecucion, [clave for clave, _paso in PASOS_MRP], inicio)
+    except Exception as e:
+        print(f"\n   !ERROR en el MRP en paralelo: {e}. No se confirmó ningún paso.")
+        _registrar_paso_fallido(ejecucion, "paralelo", inicio, e)
+        raise
+
+
+def _registrar_pasos_completados(ctx: ContextoMRP, ejecucion: EjecucionMRP, claves, inicio):
+    ejecucion.ultimo_paso_completado = claves[-1]
+    ejecucion.estado_memoria = ctx.exportar_memoria()
+    ejecucion.save(update_fields=['ultimo_paso_completado', 'estado_memoria'])
+    fin = timezone.now()
+    PasoEjecucionMRP.objects.bulk_create([
+        PasoEjecucionMRP(
+            id_ejecucion_mrp=ejecucion,
+            paso=clave,
+            estado=PasoEjecucionMRP.Estado.COMPLETADO,
+            fecha_inicio=inicio,
+            fecha_fin=fin
+        )
+        for clave in claves
+    ])
+
+
+def _registrar_paso_fallido(ejecucion: EjecucionMRP, clave, inicio, error):
+    ejecucion.estado = EjecucionMRP.Estado.FALLIDA
+    ejecucion.error = f"PASO {clave}: {error}"
+    ejecucion.fecha_fin = timezone.now()
+    ejecucion.save(update_fields=['estado', 'error', 'fecha_fin'])
+    PasoEjecucionMRP.objects.create(
+        id_ejecucion_mrp=ejecucion,
+        paso=clave,
+        estado=PasoEjecucionMRP.Estado.FALLIDO,
+        fecha_inicio=inicio,
+        fecha_fin=timezone.now(),
+        error=str(error)
     )
-    stock_virtual_oc = defaultdict(int)
-    for item in compras_en_proceso:
-        stock_virtual_oc[item.id_materia_prima_id] += item.cantidad
-    
-    # Diccionario para agrupar compras (Se inicializa 1 vez)
-    compras_agregadas_por_proveedor = defaultdict(lambda: {
-        "proveedor": None,
-        "fecha_requerida_mas_temprana": date(9999, 12, 31),
-        "items": defaultdict(int) 
-    })
-
-    # ===================================================================
-    # 🆕 PASO 0.6: BALANCE GLOBAL DE MP Y REPLANIFICACIÓN DE OPs EXISTENTES
-    # (Revisa OPs 'En espera', genera OCs Y replanifica la OP si la MP se retrasa)
-    # ===================================================================
+
+
+def ejecutar_planificacion_incremental_mrp(fecha_simulada: date, simular: bool = False):
+    """
+    MRP incremental: replanifica SOLO los productos marcados como pendientes
+    (MarcaPendienteMRP, ver planificacion/signals.py) y los que comparten
+    materias primas con ellos. Corre los mismos pasos que el MRP diario pero
+    con el ContextoMRP acotado a esos productos, en UNA transacción (es corto,
+    no deja checkpoints). Las marcas consumidas se borran al terminar.
+
+    Lo que queda fuera del alcance (p. ej. cierre de OVs de otros productos)
+    lo sigue resolviendo la corrida diaria completa.
+    """
+    inicio = timezone.now()
+    marcas = list(MarcaPendienteMRP.objects.filter(fecha_marca__lte=inicio).values_list('tipo', 'id_referencia'))
+
+    if not marcas:
+        print(f"--- MRP INCREMENTAL ({fecha_simulada}): no hay productos pendientes de replanificar ---")
+        return {"fecha": fecha_simulada, "simulacion": simular, "productos": []}
+
+    explosion = ExplosionRecetas.cargar()
+    productos = _productos_a_replanificar(marcas, explosion)
+
+    with medir_corrida(MetricaPlanificador.Proceso.MRP_INCREMENTAL, fecha_simulada, guardar=not simular) as medidor:
+        return _ejecutar_mrp_incremental(fecha_simulada, simular, medidor, inicio, marcas, productos, explosion)
+
+
+def _ejecutar_mrp_incremental(fecha_simulada, simular, medidor, inicio, marcas, productos, explosion):
+    with medidor.etapa("contexto"):
+        ctx = ContextoMRP(fecha_simulada, simular=simular, productos=productos, explosion=explosion)
+
+    print(f"--- INICIANDO MRP INCREMENTAL ({ctx.hoy}){' [SIMULACIÓN]' if simular else ''} ---")
+    print(f"--- {len(marcas)} marcas pendientes -> {len(productos)} productos a replanificar: {sorted(productos)} ---")
+
+    if simular:
+        for clave, paso in PASOS_MRP:
+            with medidor.etapa(clave):
+                paso(ctx)
+    else:
+        with transaction.atomic():
+            for clave, paso in PASOS_MRP:
+                with medidor.etapa(clave):
+                    paso(ctx)
+                    ctx.plan.aplicar()
+            MarcaPendienteMRP.objects.filter(fecha_marca__lte=inicio).delete()
+
+        print(f"\n   > Calendario de producción: {ctx.plan.calendario_borradas} reservas borradas, {ctx.plan.calendario_creadas} creadas.")
+        print(f"--- MRP INCREMENTAL FINALIZADO ---")
+
+    return {**ctx.plan.resumen(), "productos": sorted(productos)}
+
+
+def _productos_a_replanificar(marcas, explosion) -> set:
+    """
+    Productos marcados + los que usan una MP marcada, y después los que
+    comparten alguna MP con ese conjunto (compiten por el mismo stock).
+    """
+    productos = set()
+    for tipo, referencia in marcas:
+        if tipo == MarcaPendienteMRP.Tipo.PRODUCTO:
+            productos.add(referencia)
+        else:
+            productos |= explosion.productos_que_usan(referencia)
+
+    relacionados = set(productos)
+    for producto_id in productos:
+        if not explosion.tiene_receta(producto_id):
+            continue
+        for ingrediente in explosion.ingredientes(producto_id):
+            relacionados |= explosion.productos_que_usan(ingrediente.id_materia_prima)
+    return relacionados
+
+
+def _iniciar_o_reanudar_ejecucion(ctx: ContextoMRP):
+    """
+    Si la última corrida para esta fecha no terminó (falló o se cortó el
+    proceso), se reanuda: se restaura la memoria del último paso completado
+    y se omiten los pasos ya confirmados. Si no, se crea una corrida nueva.
+    """
+    ultima = EjecucionMRP.objects.filter(fecha_planificacion=ctx.hoy).first()
+
+    if ultima and ultima.estado != EjecucionMRP.Estado.COMPLETADA:
+        pasos_completados = set(ultima.pasos.filter(
+            estado=PasoEjecucionMRP.Estado.COMPLETADO
+        ).values_list('paso', flat=True))
+
+        if pasos_completados:
+            print(f"--- REANUDANDO corrida {ultima.id_ejecucion_mrp} desde el PASO siguiente a {ultima.ultimo_paso_completado} ---")
+            ctx.restaurar_memoria(ultima.estado_memoria)
+            ultima.estado = EjecucionMRP.Estado.EN_CURSO
+            ultima.error = None
+            ultima.fecha_fin = None
+            ultima.save(update_fields=['estado', 'error', 'fecha_fin'])
+            return ultima, pasos_completados
+
+        # Falló antes de completar un paso: no hay nada que reanudar
+        ultima.estado = EjecucionMRP.Estado.FALLIDA
+        ultima.save(update_fields=['estado'])
+
+    return EjecucionMRP.objects.create(fecha_planificacion=ctx.hoy), set()
+
+
+# ===================================================================
+# 🆕 PASO 0.6: BALANCE GLOBAL DE MP Y REPLANIFICACIÓN DE OPs EXISTENTES
+# (Revisa OPs 'En espera', genera OCs Y replanifica la OP si la MP se retrasa)
+# ===================================================================
+def _paso_0_6_balance_mp(ctx: ContextoMRP):
+    hoy = ctx.hoy
+    explosion, capacidad = ctx.explosion, ctx.capacidad
+    stock_virtual_mp, stock_virtual_oc = ctx.stock_virtual_mp, ctx.stock_virtual_oc
+    compras_agregadas_por_proveedor = ctx.compras_agregadas_por_proveedor
+    DIAS_BUFFER_ENTREGA_PT = ctx.dias_buffer_entrega_pt
+    DIAS_BUFFER_RECEPCION_MP = ctx.dias_buffer_recepcion_mp
+
     print(f"\n[PASO 0.6] Balanceando MP para OPs existentes (pre-asignación y OCs)...")
 
-    ops_activas_balance = OrdenProduccion.objects.filter(
-        id_estado_orden_produccion__in=[estado_op_en_espera, estado_op_pendiente_inicio]
-    ).select_related('id_producto').order_by('fecha_planificada')
+    ops_activas_balance = ctx.ops_en_estado(ctx.estado_op_en_espera, ctx.estado_op_pendiente_inicio)
 
-    print(f"   > Analizando {ops_activas_balance.count()} OPs existentes ('En espera', 'Pendiente')...")
+    print(f"   > Analizando {len(ops_activas_balance)} OPs existentes ('En espera', 'Pendiente')...")
 
     for op in ops_activas_balance:
         if not op.fecha_planificada:
             print(f"     ⚠️ OP {op.id_orden_produccion} no tiene fecha planificada, usando 'hoy'.")
             fecha_requerida_mp = hoy - timedelta(days=DIAS_BUFFER_RECEPCION_MP)
         else:
-            fecha_requerida_mp = op.fecha_planificada.date() - timedelta(days=DIAS_BUFFER_RECEPCION_MP)
-        
+            fecha_requerida_mp = a_fecha(op.fecha_planificada) - timedelta(days=DIAS_BUFFER_RECEPCION_MP)
+
         max_lead_time_op = 0 # Para esta OP específica
-        
+
         try:
-            receta = Receta.objects.get(id_producto=op.id_producto)
-            ingredientes = RecetaMateriaPrima.objects.filter(id_receta=receta).select_related('id_materia_prima__id_proveedor')
-            
+            ingredientes = explosion.ingredientes(op.id_producto_id)
+            reservas_op = ctx.reservas_mp_de_op(op)
+
             for ing in ingredientes:
-                mp_id = ing.id_materia_prima_id
-                mp = ing.id_materia_prima
-                proveedor = mp.id_proveedor
-                
+                mp_id = ing.id_materia_prima
+                proveedor = ing.proveedor
+
                 cantidad_total_requerida = ing.cantidad * op.cantidad
-                
-                reservas_fisicas = ReservaMateriaPrima.objects.filter(
-                    id_orden_produccion=op,
-                    id_lote_materia_prima__id_materia_prima_id=mp_id,
-                    id_estado_reserva_materia=estado_reserva_mp_activa
-                ).aggregate(total=Sum('cantidad_reservada'))['total'] or 0
-                
+
+                reservas_fisicas = reservas_op[mp_id]['activa']
+
                 demanda_pendiente = cantidad_total_requerida - reservas_fisicas
-                
+
                 if demanda_pendiente <= 0:
-                    continue 
+                    continue
 
                 stock_mp_disponible = stock_virtual_mp.get(mp_id, 0)
                 tomar_de_stock = min(stock_mp_disponible, demanda_pendiente)
-                
+
                 if tomar_de_stock > 0:
                     stock_virtual_mp[mp_id] -= tomar_de_stock
                     demanda_pendiente -= tomar_de_stock
                     print(f"     > (OP {op.id_orden_produccion}) pre-asigna {tomar_de_stock} de MP {mp_id} (del stock físico).")
 
                 if demanda_pendiente <= 0:
-                    continue 
+                    continue
 
                 stock_oc_disponible = stock_virtual_oc.get(mp_id, 0)
                 tomar_de_oc = min(stock_oc_disponible, demanda_pendiente)
-                
+
                 if tomar_de_oc > 0:
                     stock_virtual_oc[mp_id] -= tomar_de_oc
                     demanda_pendiente -= tomar_de_oc
                     print(f"     > (OP {op.id_orden_produccion}) pre-asigna {tomar_de_oc} de MP {mp_id} (de OCs en camino).")
 
                 if demanda_pendiente <= 0:
-                    continue 
+                    continue
 
                 cantidad_a_comprar = demanda_pendiente
-                
+
                 if cantidad_a_comprar > 0:
                     print(f"     ⚠️ (OP {op.id_orden_produccion}) NECESITA COMPRAR {cantidad_a_comprar} de MP {mp_id}.")
-                    
+
                     # 1. Registrar el lead time de esta compra
-                    lead_proveedor = proveedor.lead_time_days
+                    lead_proveedor = ing.lead_time_days
                     max_lead_time_op = max(max_lead_time_op, lead_proveedor)
-                    
+
                     # 2. Agregar al diccionario GLOBAL de compras
                     compra_agregada = compras_agregadas_por_proveedor[proveedor.id_proveedor]
                     compra_agregada["proveedor"] = proveedor
                     compra_agregada["items"][mp_id] += cantidad_a_comprar
-                    
+
                     if fecha_requerida_mp < compra_agregada["fecha_requerida_mas_temprana"]:
                         compra_agregada["fecha_requerida_mas_temprana"] = fecha_requerida_mp
 
             # --- FIN DEL BUCLE DE INGREDIENTES ---
             # Ahora, verificamos si esta OP necesita replanificación
-            
+
             if max_lead_time_op > 0:
                 # Esta OP ha disparado una nueva compra. Debemos RECALCULAR su fecha de inicio.
                 print(f"     > OP {op.id_orden_produccion} requiere comprar MP (Lead time: {max_lead_time_op} dias). Verificando replanificación...")
 
                 # 1. Calcular cuándo llega la MP (Lógica de PASO 6, ajustada a dias hábiles)
-                fecha_solicitud_oc = hoy
-                fecha_entrega_oc = hoy + timedelta(days=max_lead_time_op)
-                while fecha_entrega_oc.weekday() >= 5: # Mover a Lunes si cae finde
-                    fecha_entrega_oc += timedelta(days=1)
-                
+                fecha_entrega_oc = ctx.calendario.proximo_habil(hoy + timedelta(days=max_lead_time_op)) # Mover al próximo hábil si cae finde/feriado
+
                 # 2. Calcular cuándo puede empezar la OP
-                fecha_inicio_por_materiales = fecha_entrega_oc + timedelta(days=DIAS_BUFFER_RECEPCION_MP)
-                while fecha_inicio_por_materiales.weekday() >= 5: # Mover a Lunes
-                    fecha_inicio_por_materiales += timedelta(days=1)
+                fecha_inicio_por_materiales = ctx.calendario.proximo_habil(fecha_entrega_oc + timedelta(days=DIAS_BUFFER_RECEPCION_MP))
 
                 # 3. Comparar con la fecha actual
                 if op.fecha_planificada:
-                    fecha_inicio_actual = op.fecha_planificada.date()
+                    fecha_inicio_actual = a_fecha(op.fecha_planificada)
                 else:
                     # Fallback: Si la OP es 'zombie' o manual sin fecha, asumimos que empieza HOY
                     # para forzar el cálculo de replanificación si hace falta material.
@@ -260,26 +395,26 @@ def ejecutar_planificacion_diaria_mrp(fecha_simulada: date):
                     print(f"    🚨 ¡RETRASO DETECTADO! OP {op.id_orden_produccion}")
                     print(f"       Fecha actual: {fecha_inicio_actual}. Nueva fecha por MP: {fecha_inicio_por_materiales}.")
                     print(f"       REPLANIFICANDO esta OP...")
-                    
+
                     # --- INICIO LÓGICA DE REPLANIFICACIÓN (Copiada de PASO 5) ---
-                    
-                    # 1. Borrar calendario viejo
-                    CalendarioProduccion.objects.filter(id_orden_produccion=op).delete()
-                    
+
+                    # 1. Borrar calendario viejo (se libera en el ledger)
+                    capacidad.liberar_op(op)
+
                     # 2. Recalcular horas necesarias
-                    capacidades_linea = ProductoLinea.objects.filter(id_producto=op.id_producto)
-                    if not capacidades_linea.exists():
+                    capacidades_linea = explosion.lineas(op.id_producto_id)
+                    if not capacidades_linea:
                         print(f"    !ERROR: {op.id_producto.nombre} no tiene líneas. No se puede replanificar.")
                         continue
 
-                    cant_total_por_hora = capacidades_linea.aggregate(total=Sum('cant_por_hora'))['total'] or 0
+                    cant_total_por_hora = explosion.capacidad_total(op.id_producto_id)
                     if cant_total_por_hora <= 0:
                         print(f"    !ERROR: {op.id_producto.nombre} capacidad 0/hr. No se puede replanificar.")
                         continue
-                    
+
                     horas_necesarias_float = float(op.cantidad) / float(cant_total_por_hora)
                     horas_necesarias_totales = math.ceil(horas_necesarias_float)
-                    
+
                     # 3. Walk the calendar
                     fecha_a_buscar = fecha_inicio_por_materiales # ❗️ Usamos la nueva fecha
                     horas_pendientes = horas_necesarias_totales
@@ -288,36 +423,18 @@ def ejecutar_planificacion_diaria_mrp(fecha_simulada: date):
                     fecha_inicio_real_asignada = None
 
                     print(f"       Buscando nuevo hueco desde {fecha_a_buscar}...")
-                    
+
                     # --- INICIO: Bucle "Walk the Calendar" ---
                     while horas_pendientes > 0 and cantidad_pendiente_op > 0:
-                        # (Asegúrate que HORAS_LABORABLES_POR_DIA sea accesible globalmente)
-                        horas_libres_cuello_botella = HORAS_LABORABLES_POR_DIA
                         lineas_ids_producto = [c.id_linea_produccion_id for c in capacidades_linea]
-                        
-                        carga_existente = CalendarioProduccion.objects.filter(
-                            id_linea_produccion_id__in=lineas_ids_producto,
-                            fecha=fecha_a_buscar,
-                            id_orden_produccion__id_estado_orden_produccion__in=[estado_op_en_espera, estado_op_pendiente_inicio]
-                        ).values('id_linea_produccion_id').annotate(
-                            total_reservado=Sum('horas_reservadas')
-                        ).values('id_linea_produccion_id', 'total_reservado')
-                        
-                        carga_por_linea = {c['id_linea_produccion_id']: float(c['total_reservado']) for c in carga_existente}
-
-                        for linea_id in lineas_ids_producto:
-                            carga_dia = carga_por_linea.get(linea_id, 0.0)
-                            horas_libres_linea = max(0, HORAS_LABORABLES_POR_DIA - carga_dia)
-                            horas_libres_cuello_botella = min(horas_libres_cuello_botella, horas_libres_linea)
-
+                        horas_libres_cuello_botella = capacidad.horas_libres(lineas_ids_producto, fecha_a_buscar)
                         horas_libres_enteras = math.floor(horas_libres_cuello_botella)
 
                         if horas_libres_enteras <= 0:
-                            fecha_a_buscar += timedelta(days=1)
-                            while fecha_a_buscar.weekday() >= 5: fecha_a_buscar += timedelta(days=1)
+                            fecha_a_buscar = ctx.calendario.sumar_habiles(fecha_a_buscar, 1)
                             continue
-                            
-                        horas_a_reservar_hoy = min(horas_pendientes, horas_libres_enteras) 
+
+                        horas_a_reservar_hoy = min(horas_pendientes, horas_libres_enteras)
                         se_reservo_tiempo_en_fecha = False
 
                         for cap_linea in capacidades_linea:
@@ -325,12 +442,12 @@ def ejecutar_planificacion_diaria_mrp(fecha_simulada: date):
                             cantidad_real_linea = min(cantidad_pendiente_op, cantidad_calculada_linea)
 
                             if horas_a_reservar_hoy > 0 and cantidad_real_linea > 0:
-                                se_reservo_tiempo_en_fecha = True 
-                                
+                                se_reservo_tiempo_en_fecha = True
+
                                 reservas_a_crear_bulk.append(
                                     CalendarioProduccion(
-                                        id_orden_produccion=op, 
-                                        id_linea_produccion=cap_linea.id_linea_produccion,
+                                        id_orden_produccion=op,
+                                        id_linea_produccion_id=cap_linea.id_linea_produccion_id,
                                         fecha=fecha_a_buscar,
                                         horas_reservadas=horas_a_reservar_hoy,
                                         cantidad_a_producir=cantidad_real_linea
@@ -338,204 +455,203 @@ def ejecutar_planificacion_diaria_mrp(fecha_simulada: date):
                                 )
                                 cantidad_pendiente_op -= cantidad_real_linea
                                 if cantidad_pendiente_op <= 0:
-                                    break 
-                        
+                                    break
+
                         if se_reservo_tiempo_en_fecha:
-                            horas_pendientes -= horas_a_reservar_hoy 
+                            horas_pendientes -= horas_a_reservar_hoy
                             if fecha_inicio_real_asignada is None:
                                 fecha_inicio_real_asignada = fecha_a_buscar
                             print(f"       > Re-reservadas {horas_a_reservar_hoy}hs en {fecha_a_buscar}.")
-                        
+
                         if cantidad_pendiente_op <= 0:
-                            horas_pendientes = 0 
+                            horas_pendientes = 0
                             break
 
-                        fecha_a_buscar += timedelta(days=1)
-                        while fecha_a_buscar.weekday() >= 5:
-                            fecha_a_buscar += timedelta(days=1)
-                        
+                        fecha_a_buscar = ctx.calendario.sumar_habiles(fecha_a_buscar, 1)
+
                         if cantidad_pendiente_op > 0:
                             horas_pendientes = horas_necesarias_totales
                     # --- FIN: Bucle "Walk the Calendar" ---
 
                     if fecha_inicio_real_asignada is None:
                         fecha_inicio_real_asignada = fecha_inicio_por_materiales
-                    
-                    fecha_fin_real_asignada = fecha_a_buscar - timedelta(days=1)
-                    while fecha_fin_real_asignada.weekday() >= 5:
-                         fecha_fin_real_asignada -= timedelta(days=1)
+
+                    fecha_fin_real_asignada = ctx.calendario.sumar_habiles(fecha_a_buscar, -1)
                     if fecha_fin_real_asignada < fecha_inicio_real_asignada:
                         fecha_fin_real_asignada = fecha_inicio_real_asignada
-                    
+
                     # 4. Guardar OP y Calendario
-                    op.fecha_planificada = timezone.make_aware(datetime.combine(fecha_inicio_real_asignada, datetime.min.time()))
-                    op.fecha_fin_planificada = fecha_fin_real_asignada
-                    op.id_estado_orden_produccion = estado_op_en_espera # Pasa a 'En espera' porque necesita MP
-                    op.save()
-                    
-                    CalendarioProduccion.objects.bulk_create(reservas_a_crear_bulk)
-                    print(f"       ✅ OP {op.id_orden_produccion} REPLANIFICADA. Nuevo rango: {op.fecha_planificada.date()} a {op.fecha_fin_planificada}.")
+                    ctx.modificar_op(
+                        op, motivo="replanificada_por_mp",
+                        fecha_planificada=a_datetime(fecha_inicio_real_asignada),
+                        fecha_fin_planificada=fecha_fin_real_asignada,
+                        id_estado_orden_produccion=ctx.estado_op_en_espera # Pasa a 'En espera' porque necesita MP
+                    )
+
+                    capacidad.registrar(reservas_a_crear_bulk)
+                    print(f"       ✅ OP {op.id_orden_produccion} REPLANIFICADA. Nuevo rango: {fecha_inicio_real_asignada} a {op.fecha_fin_planificada}.")
 
                     # 5. REVISAR Y DESPLAZAR OVs VINCULADAS
-                    peggings = OrdenProduccionPegging.objects.filter(id_orden_produccion=op).select_related('id_orden_venta_producto__id_orden_venta')
-                    ovs_actualizadas = set() 
+                    ovs_actualizadas = set()
 
-                    for peg in peggings:
-                        ov = peg.id_orden_venta_producto.id_orden_venta
+                    for _linea_id, ov_id, _cantidad in ctx.peggings[op.pk]:
+                        ov = ctx.ovs[ov_id]
                         if ov.id_orden_venta in ovs_actualizadas:
                             continue
 
                         dias_totales_margen = DIAS_BUFFER_ENTREGA_PT + 1
-                        nueva_fecha_entrega_sugerida_date = op.fecha_fin_planificada + timedelta(days=dias_totales_margen)
-                        
-                        while nueva_fecha_entrega_sugerida_date.weekday() >= 5:
-                             nueva_fecha_entrega_sugerida_date += timedelta(days=1) 
+                        nueva_fecha_entrega_sugerida_date = ctx.calendario.proximo_habil(
+                            op.fecha_fin_planificada + timedelta(days=dias_totales_margen)
+                        )
 
-                        if nueva_fecha_entrega_sugerida_date > ov.fecha_entrega.date():
+                        if nueva_fecha_entrega_sugerida_date > a_fecha(ov.fecha_entrega):
                             print(f"    !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
                             print(f"    !!! ALERTA DE ENTREGA (REPLANIFICACIÓN): OP {op.id_orden_produccion}")
-                            print(f"    !!! Vinculada a: OV {ov.id_orden_venta} (Entrega actual: {ov.fecha_entrega.date()})")
+                            print(f"    !!! Vinculada a: OV {ov.id_orden_venta} (Entrega actual: {a_fecha(ov.fecha_entrega)})")
                             print(f"    !!! Producción AHORA termina el: {op.fecha_fin_planificada}")
                             print(f"    !!! DESPLAZANDO OV {ov.id_orden_venta} a {nueva_fecha_entrega_sugerida_date}")
                             print(f"    !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
-                            
-                            ov.fecha_entrega = nueva_fecha_entrega_sugerida_date
-                            ov.id_estado_venta = estado_ov_en_preparacion 
-                            ov.save(update_fields=['fecha_entrega', 'id_estado_venta'])
+
+                            ctx.modificar_ov(
+                                ov,
+                                fecha_entrega=a_datetime(nueva_fecha_entrega_sugerida_date),
+                                id_estado_venta=ctx.estado_ov_en_preparacion
+                            )
                             ovs_actualizadas.add(ov.id_orden_venta)
-                
+
                 # --- FIN LÓGICA DE REPLANIFICACIÓN ---
 
         except Receta.DoesNotExist:
             print(f"     ⚠️ OP {op.id_orden_produccion} no tiene receta. No se puede balancear MP.")
 
 
-
-    
-    # ===================================================================
-    # 🆕 PASO 0: CIERRE DE OVs PARA MAÑANA
-    # (Reservar Stock PT y cambiar estado a 'Pendiente de Pago')
-    # ===================================================================
+# ===================================================================
+# 🆕 PASO 0: CIERRE DE OVs PARA MAÑANA
+# (Reservar Stock PT y cambiar estado a 'Pendiente de Pago')
+# ===================================================================
+def _paso_0_cierre_ovs(ctx: ContextoMRP):
+    tomorrow = ctx.tomorrow
     print(f"\n[PASO 0] Verificando entregas para mañana ({tomorrow}) para paso a 'Pendiente de Pago'...")
 
     # 1. Buscar OVs en 'En Preparación' que se entreguen mañana
-    ovs_cierre = OrdenVenta.objects.filter(
-        id_estado_venta=estado_ov_en_preparacion,
-        fecha_entrega__date=tomorrow
-    )
+    ovs_cierre = [
+        ov for ov in ctx.ovs.values()
+        if ov.id_estado_venta_id == ctx.estado_ov_en_preparacion.pk
+        and ov.fecha_entrega and a_fecha(ov.fecha_entrega) == tomorrow
+    ]
 
     for ov in ovs_cierre:
         print(f"   > Procesando cierre de OV {ov.id_orden_venta}...")
         todas_lineas_listas = True
-        
-        lineas = OrdenVentaProducto.objects.filter(id_orden_venta=ov)
-        
-        for linea in lineas:
+
+        for linea in ctx.lineas_por_ov[ov.pk]:
             # A. Calcular cuánto falta reservar para esta línea
-            reservas_actuales = ReservaStock.objects.filter(
-                id_orden_venta_producto=linea,
-                id_estado_reserva=estado_reserva_activa
-            ).aggregate(total=Sum('cantidad_reservada'))['total'] or 0
-            
+            reservas_actuales = ctx.reservado_pt_linea[linea.pk]
+
             cantidad_pendiente_reserva = linea.cantidad - reservas_actuales
-            
+
             if cantidad_pendiente_reserva <= 0:
                 continue # Ya está todo reservado
-            
+
             # B. Verificar stock físico disponible (Lotes PT)
-            stock_fisico_disponible = get_stock_disponible_para_producto(linea.id_producto.id_producto)
-            
+            stock_fisico_disponible = ctx.stock_real_pt.get(linea.id_producto_id, 0)
+
             if stock_fisico_disponible >= cantidad_pendiente_reserva:
                 # C. Reservar lo que falta
-                _reservar_stock_pt(linea, cantidad_pendiente_reserva, estado_reserva_activa)
+                ctx.reservar_pt(linea, cantidad_pendiente_reserva, paso="0")
             else:
                 print(f"     ⚠️ ALERTA: Stock insuficiente para OV {ov.id_orden_venta}, Prod: {linea.id_producto.nombre}. (Faltan {cantidad_pendiente_reserva})")
                 todas_lineas_listas = False
                 break # Cortamos el proceso de esta OV, no se puede pasar de estado
-        
+
         # D. Si todas las líneas tienen su reserva completa, cambiamos estado
         if todas_lineas_listas:
-            ov.id_estado_venta = estado_ov_pendiente_pago
-            ov.save(update_fields=['id_estado_venta'])
+            ctx.modificar_ov(ov, id_estado_venta=ctx.estado_ov_pendiente_pago)
             print(f"     ✅ OV {ov.id_orden_venta} actualizada a 'Pendiente de Pago'. Stock reservado.")
         else:
             print(f"     ❌ OV {ov.id_orden_venta} no pudo cambiar de estado (falta stock).")
 
 
-    # ===================================================================
-    # 🆕 PASO 0.5: LIMPIEZA DE RESERVAS DE OVs CANCELADAS
-    # (Liberar stock PT retenido por ventas que se cancelaron)
-    # ===================================================================
+# ===================================================================
+# 🆕 PASO 0.5: LIMPIEZA DE RESERVAS DE OVs CANCELADAS
+# (Liberar stock PT retenido por ventas que se cancelaron)
+# ===================================================================
+def _paso_0_5_liberar_canceladas(ctx: ContextoMRP):
     print(f"\n[PASO 0.5] Liberando stock de Órdenes de Venta canceladas...")
 
-    # 1. Buscar el estado "Cancelada" (ajusta el string si tu estado se llama diferente, ej: "Anulada")
-    try:
-        estado_ov_cancelada = EstadoVenta.objects.get(descripcion__icontains="Cancelada")
-        
-        # 2. Borrar todas las reservas de stock asociadas a OVs en ese estado
-        #    Filtramos: Reserva -> LineaOV -> OV -> Estado
-        reservas_a_liberar = ReservaStock.objects.filter(
-            id_orden_venta_producto__id_orden_venta__id_estado_venta=estado_ov_cancelada
-        )
-        
-        cantidad_reservas = reservas_a_liberar.count()
-        
-        if cantidad_reservas > 0:
-            reservas_a_liberar.delete()
-            print(f"   ✅ Se liberaron {cantidad_reservas} reservas de stock. Ahora están disponibles para otras OVs.")
-        else:
-            print("   > No hay reservas retenidas por OVs canceladas.")
-            
-    except EstadoVenta.DoesNotExist:
+    if not ctx.estados_ov_cancelada:
         print("   ⚠️ No se encontró el estado 'Cancelada' en la BD. Saltando limpieza.")
-        
-    # ===================================================================
-    # PASO 1-3: JIT Y LÍNEAS PENDIENTES
-    # ===================================================================
+        return
+
+    # Reservas de OVs que SIGUEN canceladas (el PASO 0.6 puede haber reactivado alguna)
+    ids_cancelada = {e.pk for e in ctx.estados_ov_cancelada}
+    ovs_a_liberar = [
+        ov_id for ov_id in ctx.reservas_pt_canceladas
+        if ov_id not in ctx.ovs or ctx.ovs[ov_id].id_estado_venta_id in ids_cancelada
+    ]
+    cantidad_reservas = sum(ctx.reservas_pt_canceladas[ov_id]['reservas'] for ov_id in ovs_a_liberar)
+
+    if cantidad_reservas > 0:
+        liberado = defaultdict(int)
+        for ov_id in ovs_a_liberar:
+            for producto_id, cantidad in ctx.reservas_pt_canceladas[ov_id]['liberado'].items():
+                liberado[producto_id] += cantidad
+        for producto_id, cantidad in liberado.items():
+            ctx.stock_real_pt[producto_id] = ctx.stock_real_pt.get(producto_id, 0) + cantidad
+
+        ctx.plan.registrar('liberar_reservas_pt', ovs=ovs_a_liberar, reservas=cantidad_reservas, liberado=dict(liberado))
+        print(f"   ✅ Se liberaron {cantidad_reservas} reservas de stock. Ahora están disponibles para otras OVs.")
+    else:
+        print("   > No hay reservas retenidas por OVs canceladas.")
+
+
+# ===================================================================
+# PASO 1-3: JIT Y LÍNEAS PENDIENTES
+# ===================================================================
+def _paso_1_3_demandas_netas(ctx: ContextoMRP):
+    hoy, tomorrow = ctx.hoy, ctx.tomorrow
     print("\n[PASO 1-3/6] Identificando demandas netas y JIT (Revisión exhaustiva)...")
 
-    estados_ov_activos = [estado_ov_creada, estado_ov_en_preparacion]
+    estados_ov_activos_ids = {e.pk for e in ctx.estados_ov_activos}
+    desde, hasta = a_datetime(hoy), a_datetime(ctx.fecha_limite_ov)
 
     # 1. Traemos TODAS las líneas activas en el rango de fechas.
     # QUITAMOS el filtro 'ops_vinculadas__isnull=True' porque es el causante del error.
-    lineas_ov_candidatas = OrdenVentaProducto.objects.filter(
-        id_orden_venta__id_estado_venta__in=estados_ov_activos,
-        id_orden_venta__fecha_entrega__range=[hoy, fecha_limite_ov]
-    ).select_related(
-        'id_orden_venta', 'id_producto'
-    ).order_by('id_orden_venta__fecha_entrega', 'id_orden_venta__id_prioridad__id_prioridad')
+    lineas_ov_candidatas = [
+        linea for linea in ctx.lineas.values()
+        if linea.id_orden_venta.id_estado_venta_id in estados_ov_activos_ids
+        and ctx.en_alcance(linea.id_producto_id)
+        and linea.id_orden_venta.fecha_entrega is not None
+        and desde <= linea.id_orden_venta.fecha_entrega <= hasta
+    ]
+    lineas_ov_candidatas.sort(key=lambda l: (l.id_orden_venta.fecha_entrega, l.id_orden_venta.id_prioridad_id))
 
     # Inicializamos stock virtual de productos terminados
+    # (El PASO 0 reservó y el PASO 0.5 liberó stock PT: ya está descontado en memoria)
     stock_virtual_pt = {
-        p_id: get_stock_disponible_para_producto(p_id)
-        for p_id in lineas_ov_candidatas.values_list('id_producto_id', flat=True).distinct()
+        linea.id_producto_id: ctx.stock_real_pt.get(linea.id_producto_id, 0)
+        for linea in lineas_ov_candidatas
     }
 
-    lineas_para_producir = [] 
-    ovs_completamente_reservadas = set()
-
     # Definimos qué estados de OP consideramos "En Camino" (Stock futuro asegurado)
-    estados_op_activos = [estado_op_en_espera, estado_op_pendiente_inicio, estado_op_en_proceso]
+    estados_op_activos_ids = {e.pk for e in ctx.estados_op_activos}
 
     for linea_ov in lineas_ov_candidatas:
         ov = linea_ov.id_orden_venta
         producto_id = linea_ov.id_producto_id
-        
+
         # --- A. Calcular Cobertura Actual ---
-        
+
         # 1. ¿Cuánto ya tengo reservado físicamente (Hard allocation)?
-        cantidad_reservada_fisica = ReservaStock.objects.filter(
-            id_orden_venta_producto=linea_ov,
-            id_estado_reserva__descripcion='Activa'
-        ).aggregate(total=Sum('cantidad_reservada'))['total'] or 0
+        cantidad_reservada_fisica = ctx.reservado_pt_linea[linea_ov.pk]
 
         # 2. ¿Cuánto viene en camino (OPs activas vinculadas a esta línea)?
         # Ignoramos OPs Finalizadas o Canceladas, porque si están finalizadas y no hay reserva física,
         # significa que el stock se usó para otra cosa (tu problema actual).
-        cantidad_en_produccion = OrdenProduccionPegging.objects.filter(
-            id_orden_venta_producto=linea_ov,
-            id_orden_produccion__id_estado_orden_produccion__in=estados_op_activos
-        ).aggregate(total=Sum('cantidad_asignada'))['total'] or 0
+        cantidad_en_produccion = sum(
+            cantidad for op_id, cantidad in ctx.peggings_por_linea[linea_ov.pk]
+            if ctx.ops[op_id].id_estado_orden_produccion_id in estados_op_activos_ids
+        )
 
         cantidad_cubierta = cantidad_reservada_fisica + cantidad_en_produccion
         cantidad_realmente_faltante = linea_ov.cantidad - cantidad_cubierta
@@ -544,101 +660,61 @@ def ejecutar_planificacion_diaria_mrp(fecha_simulada: date):
             # Esta línea está cubierta (ya sea por stock reservado o por una OP que se está haciendo)
             continue
 
-        print(f"   > Revisando OV {ov.id_orden_venta} - Prod {linea_ov.id_producto.nombre}: Faltan {cantidad_realmente_faltante} (Total: {linea_ov.cantidad}, Res: {cantidad_reservada_fisica}, En Prod: {cantidad_en_produccion})")
+        print(f"   > Revisando OV {ov.id_orden_venta} - Prod {linea_ov.id_producto.nombre}: Faltan {cantidad_realmente_faltante} (Total: {linea_ov.cantidad}, Res: {cantidad_reservada_fisica}, En Prod: {cantidad_en_produccion})")
 
         # --- B. Intentar cubrir con Stock Libre (Virtual) ---
         stock_disp = stock_virtual_pt.get(producto_id, 0)
         tomar_de_stock = min(stock_disp, cantidad_realmente_faltante)
-        
+
         cantidad_para_producir = cantidad_realmente_faltante - tomar_de_stock
 
         if tomar_de_stock > 0:
             stock_virtual_pt[producto_id] -= tomar_de_stock
-            
+
             # Reservamos
-            if ov.fecha_entrega.date() <= tomorrow: # Si es urgente o para mañana
-                print(f"     -> Asignando stock físico urgente: {tomar_de_stock} u.")
-                _reservar_stock_pt(linea_ov, tomar_de_stock, estado_reserva_activa)
+            if a_fecha(ov.fecha_entrega) <= tomorrow: # Si es urgente o para mañana
+                print(f"     -> Asignando stock físico urgente: {tomar_de_stock} u.")
             else:
-                print(f"     -> Asignando stock virtual: {tomar_de_stock} u.")
-                _reservar_stock_pt(linea_ov, tomar_de_stock, estado_reserva_activa)
+                print(f"     -> Asignando stock virtual: {tomar_de_stock} u.")
+            ctx.reservar_pt(linea_ov, tomar_de_stock, paso="1-3")
 
         # --- C. Verificar si falta producir ---
         if cantidad_para_producir > 0:
-            print(f"     ⚠️ FALTANTE DETECTADO: Generar OP por {cantidad_para_producir} u.")
-            lineas_para_producir.append((linea_ov, cantidad_para_producir))
-            
+            print(f"     ⚠️ FALTANTE DETECTADO: Generar OP por {cantidad_para_producir} u.")
+            ctx.lineas_para_producir.append((linea_ov, cantidad_para_producir, a_fecha(ov.fecha_entrega)))
+
             # Marcamos la OV en preparación si no lo está
-            if ov.id_estado_venta != estado_ov_en_preparacion:
-                ov.id_estado_venta = estado_ov_en_preparacion
-                ov.save(update_fields=['id_estado_venta'])
-        
+            if ov.id_estado_venta_id != ctx.estado_ov_en_preparacion.pk:
+                ctx.modificar_ov(ov, id_estado_venta=ctx.estado_ov_en_preparacion)
+
         # Chequeo para OVs completas (Lógica original mantenida)
         elif cantidad_para_producir <= 0 and cantidad_realmente_faltante > 0:
              # Si entró aquí es porque lo cubrió todo con stock virtual en el paso B
-             if ov.id_estado_venta == estado_ov_creada:
+             if ov.id_estado_venta_id == ctx.estado_ov_creada.pk:
                 print(f"     -> OV {ov.id_orden_venta} cubierta con stock. Pasando a 'Pendiente de Pago'.")
-                ov.id_estado_venta = estado_ov_pendiente_pago
-                ov.save(update_fields=['id_estado_venta'])
+                ctx.modificar_ov(ov, id_estado_venta=ctx.estado_ov_pendiente_pago)
 
-    # ===================================================================
-    # ❗️ PASO 4: CANCELACIÓN DE OPs HUÉRFANAS
-    # ===================================================================
-    """
-    print(f"\n[PASO 4/6] Verificando OPs 'En espera' huérfanas (OVs canceladas)...")
 
-    ov_activas_ids = set(OrdenVenta.objects.filter(
-        id_estado_venta__in=estados_ov_activos
-    ).values_list('id_orden_venta', flat=True))
-
-    ops_en_espera = OrdenProduccion.objects.filter(
-        id_estado_orden_produccion=estado_op_en_espera
-    ).prefetch_related('ovs_vinculadas__id_orden_venta_producto__id_orden_venta') 
-
-    ops_a_cancelar = []
-
-  
-        for op in ops_en_espera:
-            ovs_vinculadas_activas = False
-            for peg in op.ovs_vinculadas.all():
-                if peg.id_orden_venta_producto.id_orden_venta_id in ov_activas_ids:
-                    ovs_vinculadas_activas = True
-                    break 
-            
-            if not ovs_vinculadas_activas:
-                ops_a_cancelar.append(op.id_orden_produccion)
-                print(f"   > OP {op.id_orden_produccion} está huérfana (OV cancelada/entregada). Marcando para cancelar.")
-
-
-             # --- De aquí para abajo es solo para las AUTOMÁTICAS ---
-        
-            ovs_vinculadas_activas = False
-            for peg in op.ovs_vinculadas.all():
-                if peg.id_orden_venta_producto.id_orden_venta_id in ov_activas_ids:
-                    ovs_vinculadas_activas = True
-                    break
-    """
-
-    # ===================================================================
-    # ❗️ PASO 4: CANCELACIÓN DE OPs HUÉRFANAS Y LIBERACIÓN DE MP
-    # ===================================================================
+# ===================================================================
+# ❗️ PASO 4: CANCELACIÓN DE OPs HUÉRFANAS Y LIBERACIÓN DE MP
+# ===================================================================
+def _paso_4_cancelar_huerfanas(ctx: ContextoMRP):
     print(f"\n[PASO 4/6] Verificando OPs 'En espera' huérfanas (OVs canceladas)...")
 
-    ov_activas_ids = set(OrdenVenta.objects.filter(
-        id_estado_venta__in=estados_ov_activos
-    ).values_list('id_orden_venta', flat=True))
+    estados_ov_activos_ids = {e.pk for e in ctx.estados_ov_activos}
+    ov_activas_ids = {
+        ov_id for ov_id, ov in ctx.ovs.items() if ov.id_estado_venta_id in estados_ov_activos_ids
+    }
 
-    ops_en_espera = OrdenProduccion.objects.filter(
-        id_estado_orden_produccion__in=[estado_op_en_espera, estado_op_pendiente_inicio]
-    ).prefetch_related(
-        'ovs_vinculadas__id_orden_venta_producto__id_orden_venta',
-        'reservamateriaprima_set' # ❗️ Asegurate que el related_name sea correcto, sino usa reserva_materia_prima_set
-    ) 
+    ops_en_espera = sorted(
+        ctx.ops_en_estado(ctx.estado_op_en_espera, ctx.estado_op_pendiente_inicio),
+        key=lambda op: op.pk
+    )
 
     ops_a_cancelar_objs = [] # Guardamos los objetos, no solo IDs
 
     for op in ops_en_espera:
-        
+
         # 1. Si es MANUAL, la ignoramos (no se cancela)
         # (Asumiendo que ya agregaste el campo es_generada_automaticamente)
         if getattr(op, 'es_generada_automaticamente', False) is False:
@@ -646,12 +722,8 @@ def ejecutar_planificacion_diaria_mrp(fecha_simulada: date):
              continue
 
         # 2. Verificar vinculaciones
-        ovs_vinculadas_activas = False
-        for peg in op.ovs_vinculadas.all():
-            if peg.id_orden_venta_producto.id_orden_venta_id in ov_activas_ids:
-                ovs_vinculadas_activas = True
-                break 
-        
+        ovs_vinculadas_activas = any(ov_id in ov_activas_ids for _linea_id, ov_id, _cant in ctx.peggings[op.pk])
+
         if not ovs_vinculadas_activas:
             ops_a_cancelar_objs.append(op)
             print(f"   > OP {op.id_orden_produccion} es HUÉRFANA. Marcando para cancelar.")
@@ -659,139 +731,140 @@ def ejecutar_planificacion_diaria_mrp(fecha_simulada: date):
     # PROCESO DE CANCELACIÓN Y DEVOLUCIÓN DE STOCK A MEMORIA
     if ops_a_cancelar_objs:
         print(f"   > Cancelando {len(ops_a_cancelar_objs)} OPs y liberando sus materiales...")
-        
+
         for op_cancelar in ops_a_cancelar_objs:
-            
+
             # A. Recuperar reservas de MP antes de borrarlas
-            # ❗️ Ajusta 'reserva_materia_prima_set' si tu related_name es diferente en el modelo ReservaMateriaPrima
-            reservas_mp = ReservaMateriaPrima.objects.filter(id_orden_produccion=op_cancelar)
-            
-            for reserva in reservas_mp:
-                mp_id = reserva.id_lote_materia_prima.id_materia_prima_id
-                cantidad_liberada = reserva.cantidad_reservada
-                
+            reservas_mp = ctx.reservas_mp_de_op(op_cancelar)
+            liberado = {}
+
+            for mp_id, reservado in reservas_mp.items():
+                cantidad_liberada = reservado['total']
+                liberado[mp_id] = cantidad_liberada
+
                 # B. DEVOLVER AL POOL VIRTUAL (Para que el Paso 5 la use)
-                if mp_id in stock_virtual_mp:
-                    stock_virtual_mp[mp_id] += cantidad_liberada
-                    print(f"     ♻️ Liberados {cantidad_liberada} de MP {mp_id} (Vuelven al pool virtual).")
-                else:
-                    # Si no estaba en el pool (raro), lo inicializamos
-                    stock_virtual_mp[mp_id] = cantidad_liberada
+                ctx.stock_virtual_mp[mp_id] = ctx.stock_virtual_mp.get(mp_id, 0) + cantidad_liberada
+                print(f"     ♻️ Liberados {cantidad_liberada} de MP {mp_id} (Vuelven al pool virtual).")
+
+                # Lo que estaba reservado sobre lotes disponibles vuelve al stock REAL
+                ctx.stock_real_mp[mp_id] = ctx.stock_real_mp.get(mp_id, 0) + reservado['activa_disponible']
+            reservas_mp.clear()
 
             # C. Borrar datos físicos
-            reservas_mp.delete() # Borra las reservas de MP
-            CalendarioProduccion.objects.filter(id_orden_produccion=op_cancelar).delete() # Borra calendario
-            
+            ctx.plan.registrar('liberar_reservas_mp', op=op_cancelar, liberado=liberado) # Borra las reservas de MP
+            ctx.capacidad.liberar_op(op_cancelar) # Libera calendario
+
             # D. Marcar OP como cancelada
-            op_cancelar.id_estado_orden_produccion = estado_op_cancelada
-            op_cancelar.save()
+            ctx.modificar_op(op_cancelar, motivo="cancelada", id_estado_orden_produccion=ctx.estado_op_cancelada)
 
 
-    # ===================================================================
-    # 🆕 PASO 4.5: REASIGNACIÓN DE STOCK A OPs "EN ESPERA"
-    # (Prioridad: Las OPs viejas comen antes que las nuevas)
-    # ===================================================================
+# ===================================================================
+# 🆕 PASO 4.5: REASIGNACIÓN DE STOCK A OPs "EN ESPERA"
+# (Prioridad: Las OPs viejas comen antes que las nuevas)
+# ===================================================================
+def _paso_4_5_reasignar_stock(ctx: ContextoMRP):
     print(f"\n[PASO 4.5] Intentando asignar stock liberado a OPs antiguas en espera...")
 
+    stock_virtual_mp, stock_real_mp = ctx.stock_virtual_mp, ctx.stock_real_mp
+
     # 1. Buscamos OPs que siguen esperando material
     # Ordenamos por fecha para respetar FIFO (primero entra, primero se sirve)
-    ops_remanentes = OrdenProduccion.objects.filter(
-        id_estado_orden_produccion=estado_op_en_espera
-    ).order_by('fecha_planificada')
+    ops_remanentes = ctx.ops_en_estado(ctx.estado_op_en_espera)
 
     for op in ops_remanentes:
         print(f"   > Re-evaluando OP {op.id_orden_produccion} (Producto: {op.id_producto.nombre})...")
-        
+
         try:
-            receta = Receta.objects.get(id_producto=op.id_producto)
-            ingredientes = RecetaMateriaPrima.objects.filter(id_receta=receta)
-            
+            ingredientes = ctx.explosion.ingredientes(op.id_producto_id)
+            reservas_op = ctx.reservas_mp_de_op(op)
+
             op_completo = True # Asumimos que sí, hasta que falte algo
-            
+
             for ing in ingredientes:
-                mp_id = ing.id_materia_prima_id
-                
+                mp_id = ing.id_materia_prima
+
                 # A. Calcular cuánto necesita TOTAL
                 cantidad_total_necesaria = ing.cantidad * op.cantidad
-                
+
                 # B. Calcular cuánto YA tiene reservado (de ejecuciones anteriores)
-                reservado_actual = ReservaMateriaPrima.objects.filter(
-                    id_orden_produccion=op,
-                    id_lote_materia_prima__id_materia_prima_id=mp_id
-                ).aggregate(total=Sum('cantidad_reservada'))['total'] or 0
-                
+                reservado_actual = reservas_op[mp_id]['total']
+
                 cantidad_faltante = cantidad_total_necesaria - reservado_actual
-                
+
                 if cantidad_faltante <= 0:
                     continue # Este ingrediente está cubierto
-                
+
                 # C. Intentar tomar del Stock Virtual (que incluye lo liberado en Paso 4)
                 stock_disp_virtual = stock_virtual_mp.get(mp_id, 0)
-                
+
                 tomar_ahora = min(stock_disp_virtual, cantidad_faltante)
-                
+
                 if tomar_ahora > 0:
                     # 1. Descontar del virtual
                     stock_virtual_mp[mp_id] -= tomar_ahora
-                    
-                    # 2. Crear la reserva física REAL en BD
+
+                    # 2. Crear la reserva física REAL
                     #    (Usamos stock REAL para buscar el lote, porque si está en virtual es que está en físico)
-                    stock_real_mp = get_stock_disponible_para_materia_prima(mp_id) 
-                    cant_a_reservar_bd = min(stock_real_mp, tomar_ahora) # Safety check
-                    
+                    cant_a_reservar_bd = min(stock_real_mp.get(mp_id, 0), tomar_ahora) # Safety check
+
                     if cant_a_reservar_bd > 0:
-                        _reservar_stock_mp(op, mp_id, cant_a_reservar_bd, estado_reserva_mp_activa)
+                        ctx.reservar_mp(op, mp_id, cant_a_reservar_bd, paso="4.5")
                         print(f"     ✅ Asignados {cant_a_reservar_bd} de MP {mp_id} a OP {op.id_orden_produccion} (Recuperado).")
-                    
+
                     # Recalcular faltante
                     cantidad_faltante -= tomar_ahora
 
                 if cantidad_faltante > 0:
                     op_completo = False # Todavía le falta, no puede iniciar
-            
+
             # D. Si consiguió TODO, actualizamos estado
             if op_completo:
-                op.id_estado_orden_produccion = estado_op_pendiente_inicio
-                op.save()
+                ctx.modificar_op(op, motivo="materiales_completos", id_estado_orden_produccion=ctx.estado_op_pendiente_inicio)
                 print(f"     🎉 ¡OP {op.id_orden_produccion} completó sus materiales! Pasa a 'Pendiente de inicio'.")
-                
+
         except Receta.DoesNotExist:
             print(f"     ⚠️ La OP {op.id_orden_produccion} no tiene receta activa.")
 
 
-    # ===================================================================
-    # ❗️ PASO 5: SCHEDULING (MTO) Y CÁLCULO DE MP Y OCs
-    # (Lógica de MP/OC movida ANTES del Calendar Walk)
-    # ===================================================================
-    print(f"\n[PASO 5/6] Planificando OPs (MTO) para {len(lineas_para_producir)} nuevas líneas de OV...")
+# ===================================================================
+# ❗️ PASO 5: SCHEDULING (MTO) Y CÁLCULO DE MP Y OCs
+# (Lógica de MP/OC movida ANTES del Calendar Walk)
+# ===================================================================
+def _paso_5_planificar_ops(ctx: ContextoMRP):
+    hoy = ctx.hoy
+    explosion, capacidad = ctx.explosion, ctx.capacidad
+    stock_virtual_mp, stock_virtual_oc, stock_real_mp = ctx.stock_virtual_mp, ctx.stock_virtual_oc, ctx.stock_real_mp
+    compras_agregadas_por_proveedor = ctx.compras_agregadas_por_proveedor
+    HORAS_LABORABLES_POR_DIA = ctx.horas_laborables_por_dia
+    DIAS_BUFFER_ENTREGA_PT = ctx.dias_buffer_entrega_pt
+    DIAS_BUFFER_RECEPCION_MP = ctx.dias_buffer_recepcion_mp
+
+    print(f"\n[PASO 5/6] Planificando OPs (MTO) para {len(ctx.lineas_para_producir)} nuevas líneas de OV...")
+
+    for linea_ov, cantidad_a_producir, fecha_entrega_ov in ctx.lineas_para_producir:
 
-    for linea_ov, cantidad_a_producir in lineas_para_producir:
-        
         producto = linea_ov.id_producto
         ov = linea_ov.id_orden_venta
-        fecha_entrega_ov = ov.fecha_entrega.date()
-        
+
         print(f"   --- Planificando para OV {ov.id_orden_venta} (Línea {linea_ov.id_orden_venta_producto}) ---")
 
         try:
             # --- A. CÁLCULO DE TIEMPO DE PRODUCCIÓN ---
-            capacidades_linea = ProductoLinea.objects.filter(id_producto=producto)
-            if not capacidades_linea.exists():
+            capacidades_linea = explosion.lineas(producto.id_producto)
+            if not capacidades_linea:
                 print(f"      !ERROR: {producto.nombre} no tiene líneas asignadas en 'ProductoLinea'. Omitiendo OP.")
                 continue
 
-            cant_total_por_hora = capacidades_linea.aggregate(
-                total=Sum('cant_por_hora')
-            )['total'] or 0
+            cant_total_por_hora = explosion.capacidad_total(producto.id_producto)
 
             if cant_total_por_hora <= 0:
                 print(f"      !ERROR: {producto.nombre} tiene capacidad total 0/hr. Omitiendo OP.")
                 continue
-            
+
             horas_necesarias_float = float(cantidad_a_producir) / float(cant_total_por_hora)
             horas_necesarias_totales = math.ceil(horas_necesarias_float)
             dias_produccion_estimados = math.ceil(horas_necesarias_totales / HORAS_LABORABLES_POR_DIA)
-            
+
             print(f"      > Necesita {horas_necesarias_float:.2f} horas-máquina (redondeado a {horas_necesarias_totales}hs enteras).")
 
             # --- B. CÁLCULO DE FECHA IDEAL DE INICIO (POR OV) ---
@@ -801,130 +874,103 @@ def ejecutar_planificacion_diaria_mrp(fecha_simulada: date):
 
             # --- ❗️ C. CHEQUEO DE MP Y CÁLCULO DE LEAD TIME (NUEVO) ---
             print(f"      > [PASO 5C] Calculando MP y Lead Time...")
-            receta = Receta.objects.get(id_producto=producto)
-            ingredientes_totales = RecetaMateriaPrima.objects.filter(id_receta=receta)
+            ingredientes_totales = explosion.ingredientes(producto.id_producto)
             max_lead_time_mp = 0
             op_tiene_todo_el_material_EN_STOCK = True
-            
-            # ❗️ Creamos la OP aquí (temporal) para poder usarla en _reservar_stock_mp
+
+            # ❗️ Creamos la OP aquí (en memoria). Se guarda al aplicar el plan.
             op = OrdenProduccion(
                 id_producto=producto,
-                id_estado_orden_produccion=estado_op_en_espera,
+                id_estado_orden_produccion=ctx.estado_op_en_espera,
                 cantidad=cantidad_a_producir,
                 es_generada_automaticamente=True
             )
-            # ❗️ NOTA: No la guardamos hasta tener la fecha real
+            ref_op = ctx.plan.etiqueta(op)
 
             for ingr in ingredientes_totales:
-                mp_id = ingr.id_materia_prima_id
-                mp = ingr.id_materia_prima
+                mp_id = ingr.id_materia_prima
+                mp = ingr.materia_prima
                 cantidad_requerida_op = ingr.cantidad * op.cantidad
                 cantidad_faltante_op = cantidad_requerida_op
 
                 stock_mp_disponible = stock_virtual_mp.get(mp_id, 0)
                 tomar_de_stock = min(stock_mp_disponible, cantidad_faltante_op)
-                
+
                 if tomar_de_stock > 0:
-                    # Reservamos del pool global (no creamos el objeto de BBDD aún)
+                    # Reservamos del pool global (la reserva física se hace en 5I)
                     stock_virtual_mp[mp_id] -= tomar_de_stock
                     cantidad_faltante_op -= tomar_de_stock
-                
+
                 if cantidad_faltante_op <= 0: continue
                 op_tiene_todo_el_material_EN_STOCK = False
-                
+
                 stock_oc_disponible = stock_virtual_oc.get(mp_id, 0)
                 tomar_de_oc = min(stock_oc_disponible, cantidad_faltante_op)
-                
+
                 if tomar_de_oc > 0:
                     stock_virtual_oc[mp_id] -= tomar_de_oc
                     cantidad_faltante_op -= tomar_de_oc
-                
+
                 if cantidad_faltante_op <= 0: continue
-                
+
                 cantidad_a_comprar = mp.calcular_cantidad_a_pedir(cantidad_faltante_op)
                 if cantidad_a_comprar > 0:
-                    lead_proveedor = ingr.id_materia_prima.id_proveedor.lead_time_days
+                    lead_proveedor = ingr.lead_time_days
                     max_lead_time_mp = max(max_lead_time_mp, lead_proveedor)
-                    
+
                     # Agregamos la compra al pool global
                     print(f"      ! Faltan {cantidad_a_comprar} de {mp.nombre}. Agregando a OC.")
-                    proveedor = mp.id_proveedor
+                    proveedor = ingr.proveedor
                     compra_agregada = compras_agregadas_por_proveedor[proveedor.id_proveedor]
                     compra_agregada["proveedor"] = proveedor
                     compra_agregada["items"][mp_id] += cantidad_a_comprar
-                    
+
                     # (La 'fecha_requerida_mas_temprana' se calculará en PASO 6)
-            
+
             # --- ❗️ D. CALCULAR FECHA DE INICIO MÍNIMA REAL ---
-            
+
             # 1. Calcular cuándo llega la MP (Lead Time puro)
-            fecha_recepcion_mp_pura = hoy + timedelta(days=max_lead_time_mp)
-            
             # Si la recepción cae Sábado o Domingo, pasamos al Lunes siguiente
-            while fecha_recepcion_mp_pura.weekday() >= 5:
-                fecha_recepcion_mp_pura += timedelta(days=1)
-            
+            fecha_recepcion_mp_pura = ctx.calendario.proximo_habil(hoy + timedelta(days=max_lead_time_mp))
+
             # 2. Sumar BUFFER para determinar cuándo puede INICIAR la producción
             # (Esto asegura que la producción empiece DESPUÉS de que llegue la MP)
-            fecha_inicio_por_materiales = fecha_recepcion_mp_pura + timedelta(days=DIAS_BUFFER_RECEPCION_MP)
-
-            # Si el inicio calculado cae finde, mover al Lunes
-            while fecha_inicio_por_materiales.weekday() >= 5:
-                fecha_inicio_por_materiales += timedelta(days=1)
+            # Si el inicio calculado cae en un día no hábil, mover al siguiente hábil
+            fecha_inicio_por_materiales = ctx.calendario.proximo_habil(fecha_recepcion_mp_pura + timedelta(days=DIAS_BUFFER_RECEPCION_MP))
 
             # La fecha MÍNIMA es la mayor entre la ideal (por venta) y la posible (por materiales)
             fecha_inicio_minima_real = max(fecha_planificada_ideal, fecha_inicio_por_materiales)
-            
+
             print(f"      > Fecha ideal (OV): {fecha_planificada_ideal}. Materiales listos: {fecha_inicio_por_materiales}.")
             print(f"      > Inicio MÍNIMO REAL (max): {fecha_inicio_minima_real}.")
 
 
             # --- E. LÓGICA "WALK THE CALENDAR" ---
-            
-            cantidad_pendiente_op = cantidad_a_producir 
-            horas_pendientes = horas_necesarias_totales 
-            
-            fecha_a_buscar = fecha_inicio_minima_real
-            
-            # Validación inicial de finde (por si acaso)
-            while fecha_a_buscar.weekday() >= 5:
-                fecha_a_buscar += timedelta(days=1)
+
+            cantidad_pendiente_op = cantidad_a_producir
+            horas_pendientes = horas_necesarias_totales
+
+            # Validación inicial de día hábil (por si acaso)
+            fecha_a_buscar = ctx.calendario.proximo_habil(fecha_inicio_minima_real)
 
             fecha_inicio_real_asignada = None
             ultimo_dia_trabajado = None
             fecha_fin_real_asignada = None
             reservas_a_crear_bulk = []
-            
+
             print(f"       > Buscando hueco desde {fecha_a_buscar}...")
 
             while horas_pendientes > 0 and cantidad_pendiente_op > 0:
-                horas_libres_cuello_botella = HORAS_LABORABLES_POR_DIA
                 lineas_ids_producto = [c.id_linea_produccion_id for c in capacidades_linea]
-                
-                carga_existente = CalendarioProduccion.objects.filter(
-                    id_linea_produccion_id__in=lineas_ids_producto,
-                    fecha=fecha_a_buscar,
-                    id_orden_produccion__id_estado_orden_produccion__in=[estado_op_en_espera, estado_op_pendiente_inicio]
-                ).values('id_linea_produccion_id').annotate(
-                    total_reservado=Sum('horas_reservadas')
-                ).values('id_linea_produccion_id', 'total_reservado')
-                
-                carga_por_linea = {c['id_linea_produccion_id']: float(c['total_reservado']) for c in carga_existente}
-
-                for linea_id in lineas_ids_producto:
-                    carga_dia = carga_por_linea.get(linea_id, 0.0)
-                    horas_libres_linea = max(0, HORAS_LABORABLES_POR_DIA - carga_dia)
-                    horas_libres_cuello_botella = min(horas_libres_cuello_botella, horas_libres_linea)
-
+                horas_libres_cuello_botella = capacidad.horas_libres(lineas_ids_producto, fecha_a_buscar)
                 horas_libres_enteras = math.floor(horas_libres_cuello_botella)
 
                 # Si no hay horas hoy, avanzar
                 if horas_libres_enteras <= 0:
-                    fecha_a_buscar += timedelta(days=1)
-                    while fecha_a_buscar.weekday() >= 5: fecha_a_buscar += timedelta(days=1)
+                    fecha_a_buscar = ctx.calendario.sumar_habiles(fecha_a_buscar, 1)
                     continue
-                    
-                horas_a_reservar_hoy = min(horas_pendientes, horas_libres_enteras) 
+
+                horas_a_reservar_hoy = min(horas_pendientes, horas_libres_enteras)
                 se_reservo_tiempo_en_fecha = False
 
                 for cap_linea in capacidades_linea:
@@ -932,45 +978,43 @@ def ejecutar_planificacion_diaria_mrp(fecha_simulada: date):
                     cantidad_real_linea = min(cantidad_pendiente_op, cantidad_calculada_linea)
 
                     if horas_a_reservar_hoy > 0 and cantidad_real_linea > 0:
-                        se_reservo_tiempo_en_fecha = True 
-                        
+                        se_reservo_tiempo_en_fecha = True
+
                         reservas_a_crear_bulk.append(
                             CalendarioProduccion(
-                                id_orden_produccion=op, 
-                                id_linea_produccion=cap_linea.id_linea_produccion,
+                                id_orden_produccion=op,
+                                id_linea_produccion_id=cap_linea.id_linea_produccion_id,
                                 fecha=fecha_a_buscar,
                                 horas_reservadas=horas_a_reservar_hoy,
                                 cantidad_a_producir=cantidad_real_linea
                             )
                         )
-                        
+
                         cantidad_pendiente_op -= cantidad_real_linea
-                        
+
                         if cantidad_pendiente_op <= 0:
-                            break 
-                
+                            break
+
                 # --- Gestión de avance de fechas ---
                 if se_reservo_tiempo_en_fecha:
-                    horas_pendientes -= horas_a_reservar_hoy 
-                
+                    horas_pendientes -= horas_a_reservar_hoy
+
                     ultimo_dia_trabajado = fecha_a_buscar
 
                     if fecha_inicio_real_asignada is None:
                         fecha_inicio_real_asignada = fecha_a_buscar
-                    
+
                     print(f"       > Reservadas {horas_a_reservar_hoy}hs enteras en {fecha_a_buscar}. Faltan {horas_pendientes}hs. Quedan {cantidad_pendiente_op} u.")
-                
+
                 # Si terminamos la cantidad, forzamos salida
                 if cantidad_pendiente_op <= 0:
-                    horas_pendientes = 0 
+                    horas_pendientes = 0
                     break
 
                 # Si todavía falta (cantidad u horas) o si no pudimos reservar hoy, AVANZAR
                 # (La lógica simplificada: siempre avanzamos al siguiente día hábil para la siguiente iteración)
-                fecha_a_buscar += timedelta(days=1)
-                while fecha_a_buscar.weekday() >= 5:
-                    fecha_a_buscar += timedelta(days=1)
-                
+                fecha_a_buscar = ctx.calendario.sumar_habiles(fecha_a_buscar, 1)
+
                 # Si cambiamos de día y aún falta cantidad, renovamos las horas disponibles para el nuevo día
                 if cantidad_pendiente_op > 0:
                     horas_pendientes = horas_necesarias_totales
@@ -979,205 +1023,190 @@ def ejecutar_planificacion_diaria_mrp(fecha_simulada: date):
             # --- Fuera del bucle while ---
             if fecha_inicio_real_asignada is None:
                 fecha_inicio_real_asignada = fecha_inicio_minima_real
-            
+
             # La fecha fin es el último día que se usó con éxito
-            # Como el bucle avanza 'fecha_a_buscar' al final, debemos retroceder uno.
-           # fecha_fin_real_asignada = fecha_a_buscar - timedelta(days=1)
             fecha_fin_real_asignada = ultimo_dia_trabajado if ultimo_dia_trabajado else fecha_inicio_real_asignada
-            while fecha_fin_real_asignada.weekday() >= 5: # Ajuste por si acaso retrocedió a finde
-                 fecha_fin_real_asignada -= timedelta(days=1)
+            # Ajuste por si acaso retrocedió a un día no hábil
+            fecha_fin_real_asignada = ctx.calendario.anterior_habil(fecha_fin_real_asignada)
 
             if fecha_fin_real_asignada < fecha_inicio_real_asignada:
                 fecha_fin_real_asignada = fecha_inicio_real_asignada
 
-            # --- F. GUARDAR OP, PEGGING Y RESERVAS DE CALENDARIO ---
-            
-            # Ahora guardamos la OP con sus fechas reales
-            op.fecha_planificada = timezone.make_aware(datetime.combine(fecha_inicio_real_asignada, datetime.min.time()))
+            # --- F. FECHAS REALES DE LA OP ---
+            op.fecha_planificada = a_datetime(fecha_inicio_real_asignada)
             op.fecha_fin_planificada = fecha_fin_real_asignada
-            op.save() # ❗️ Guardamos la OP (obtiene PK)
-            
-            print(f"      > CREADA OP {op.id_orden_produccion} (MTO) y vinculada a OV {ov.id_orden_venta}.")
-            
-            # Vinculamos el Pegging (ahora la OP tiene PK)
-            OrdenProduccionPegging.objects.create(
-                id_orden_produccion=op,
-                id_orden_venta_producto=linea_ov,
-                cantidad_asignada=cantidad_a_producir
-            )
-            
-            # Asignamos la OP (con PK) a las reservas y las creamos
-            for reserva in reservas_a_crear_bulk:
-                reserva.id_orden_produccion = op
-            CalendarioProduccion.objects.bulk_create(reservas_a_crear_bulk)
-            
-            print(f"      -> PLANIFICACIÓN REAL: {op.fecha_planificada.date()} a {op.fecha_fin_planificada}.")
-
-           # 1. Calculamos la nueva fecha sugerida (Fin Producción + Buffer + 1 día seguridad)
+
+            print(f"      > CREADA OP {ref_op} (MTO) y vinculada a OV {ov.id_orden_venta}.")
+            print(f"      -> PLANIFICACIÓN REAL: {fecha_inicio_real_asignada} a {op.fecha_fin_planificada}.")
+
+            # --- G. DESPLAZAR LA OV SI LA PRODUCCIÓN TERMINA TARDE ---
+            # 1. Calculamos la nueva fecha sugerida (Fin Producción + Buffer + 1 día seguridad)
             dias_totales_margen = DIAS_BUFFER_ENTREGA_PT + 1
-            nueva_fecha_entrega_sugerida_date = op.fecha_fin_planificada + timedelta(days=dias_totales_margen)
+            nueva_fecha_entrega_sugerida_date = ctx.calendario.proximo_habil(op.fecha_fin_planificada + timedelta(days=dias_totales_margen))
 
-            while nueva_fecha_entrega_sugerida_date.weekday() >= 5:
-                nueva_fecha_entrega_sugerida_date += timedelta(days=1) 
+            # 2. Verificamos si hay retraso (contra la fecha ACTUAL de la OV: otra línea pudo moverla)
+            if nueva_fecha_entrega_sugerida_date > a_fecha(ov.fecha_entrega):
 
-            # 2. Verificamos si hay retraso (Si la nueva fecha es MAYOR a la original)
-            if nueva_fecha_entrega_sugerida_date > ov.fecha_entrega.date():
-                
                 print(f"      !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
-                print(f"      !!! ALERTA DE ENTREGA: OP {op.id_orden_produccion}")
-                print(f"      !!! Vinculada a: OV {ov.id_orden_venta} (Entrega actual: {ov.fecha_entrega.date()})")
+                print(f"      !!! ALERTA DE ENTREGA: OP {ref_op}")
+                print(f"      !!! Vinculada a: OV {ov.id_orden_venta} (Entrega actual: {a_fecha(ov.fecha_entrega)})")
                 print(f"      !!! Producción termina el: {op.fecha_fin_planificada}")
                 print(f"      !!! Nueva fecha de entrega sugerida: {nueva_fecha_entrega_sugerida_date}")
                 print(f"      !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
 
                 print(f"      !!! DESPLAZANDO OV {ov.id_orden_venta} a {nueva_fecha_entrega_sugerida_date}")
-                
-                # ✅ SOLUCIÓN: Asignación DIRECTA.
-                # 'nueva_fecha_entrega_sugerida_date' ya es un objeto 'date' válido.
-                # No hace falta convertirlo a datetime ni agregar timezone.
-                # Django se encarga del resto.
-                
-                ov.fecha_entrega = nueva_fecha_entrega_sugerida_date
-                ov.id_estado_venta = estado_ov_en_preparacion 
-                
-                # Guardamos solo los campos modificados
-                ov.save(update_fields=['fecha_entrega', 'id_estado_venta'])
+
+                ctx.modificar_ov(
+                    ov,
+                    fecha_entrega=a_datetime(nueva_fecha_entrega_sugerida_date),
+                    id_estado_venta=ctx.estado_ov_en_preparacion
+                )
 
             # --- H. LÓGICA DE LOTE ---
-            try:
-                estado_lote_espera = EstadoLoteProduccion.objects.get(descripcion__iexact="En espera")
+            lote = None
+            if ctx.estado_lote_espera:
                 dias_duracion = getattr(producto, 'dias_duracion', 0) or 0
-                
-                lote = LoteProduccion.objects.create(
+
+                lote = LoteProduccion(
                     id_producto=op.id_producto,
-                    id_estado_lote_produccion=estado_lote_espera,
+                    id_estado_lote_produccion=ctx.estado_lote_espera,
                     cantidad=op.cantidad,
-                    fecha_produccion=timezone.now().date(), 
+                    fecha_produccion=timezone.now().date(),
                     fecha_vencimiento=timezone.now().date() + timedelta(days=dias_duracion)
                 )
-                op.id_lote_produccion = lote
-            except EstadoLoteProduccion.DoesNotExist:
+            else:
                 print(f"      !ERROR CRÍTICO: No se pudo crear Lote. Estado 'En espera' no existe.")
 
             # --- I. (PASO 5) ACTUALIZAR ESTADO Y RESERVAS DE MP ---
             print(f"      > [PASO 5I] Creando Reservas de MP y asignando Estado...")
-            
-            # Volvemos a iterar, esta vez para crear las Reservas de MP (ahora que OP tiene PK)
+
+            # Volvemos a iterar, esta vez para calcular las Reservas de MP
+            reservas_mp_op = []
+            tomado_real = defaultdict(int)
             for ingr in ingredientes_totales:
-                mp_id = ingr.id_materia_prima_id
+                mp_id = ingr.id_materia_prima
                 cantidad_requerida_op = ingr.cantidad * op.cantidad
-                cantidad_faltante_op = cantidad_requerida_op
 
-                # Usamos el pool global (que ya descontamos virtualmente)
-                stock_mp_disponible_real = get_stock_disponible_para_materia_prima(mp_id)
-                
                 # Cuánto debemos tomar del stock real (no del virtual)
-                tomar_de_stock = min(stock_mp_disponible_real, cantidad_faltante_op)
-                
+                stock_mp_disponible_real = stock_real_mp.get(mp_id, 0) - tomado_real[mp_id]
+                tomar_de_stock = min(stock_mp_disponible_real, cantidad_requerida_op)
+
                 if tomar_de_stock > 0:
-                    _reservar_stock_mp(op, mp_id, tomar_de_stock, estado_reserva_mp_activa)
+                    reservas_mp_op.append((mp_id, tomar_de_stock))
+                    tomado_real[mp_id] += tomar_de_stock
 
             if op_tiene_todo_el_material_EN_STOCK:
-                op.id_estado_orden_produccion = estado_op_pendiente_inicio
-                print(f"      > OP {op.id_orden_produccion} tiene toda la MP en Stock. Estado -> Pendiente de inicio")
+                op.id_estado_orden_produccion = ctx.estado_op_pendiente_inicio
+                print(f"      > OP {ref_op} tiene toda la MP en Stock. Estado -> Pendiente de inicio")
             else:
-                op.id_estado_orden_produccion = estado_op_en_espera
-                print(f"      > OP {op.id_orden_produccion} esperando MP (en tránsito o por comprar). Estado -> En espera")
+                op.id_estado_orden_produccion = ctx.estado_op_en_espera
+                print(f"      > OP {ref_op} esperando MP (en tránsito o por comprar). Estado -> En espera")
 
-            fecha_inicio_op = op.fecha_planificada.date() - timedelta(days=max_lead_time_mp + DIAS_BUFFER_RECEPCION_MP)
-            op.fecha_inicio = timezone.make_aware(datetime.combine(fecha_inicio_op, datetime.min.time()))
-            
-            # Guardamos todo al final
-            op.save()
+            fecha_inicio_op = fecha_inicio_real_asignada - timedelta(days=max_lead_time_mp + DIAS_BUFFER_RECEPCION_MP)
+            op.fecha_inicio = a_datetime(fecha_inicio_op)
+
+            # --- J. REGISTRAR OP, PEGGING, CALENDARIO Y RESERVAS EN EL PLAN ---
+            # (Recién acá: si algo falló antes, la OP no deja rastros)
+            ctx.plan.registrar('crear_op', op=op, linea_ov=linea_ov, lote=lote)
+            ctx.plan.registrar('crear_pegging', op=op, linea_ov=linea_ov, cantidad=cantidad_a_producir)
+            capacidad.registrar(reservas_a_crear_bulk)
+            for mp_id, cantidad in reservas_mp_op:
+                ctx.reservar_mp(op, mp_id, cantidad, paso="5I")
+            ctx.ops_nuevas.append(op)
 
         except Receta.DoesNotExist:
             print(f"      !ERROR: {producto.nombre} no tiene Receta. Omitiendo OP.")
-            if op and op.pk: op.delete()
         except Exception as e:
             print(f"      !ERROR al planificar OP para {producto.nombre}: {e}")
-            if op and op.pk: op.delete()
-            
-    # ===================================================================
-    # ❗️ PASO 6: CREACIÓN DE OCs (AGREGADAS)
-    # ===================================================================
+
+
+# ===================================================================
+# ❗️ PASO 6: CREACIÓN DE OCs (AGREGADAS)
+# ===================================================================
+def _paso_6_ordenes_compra(ctx: ContextoMRP):
+    hoy = ctx.hoy
+    DIAS_BUFFER_RECEPCION_MP = ctx.dias_buffer_recepcion_mp
+    compras_agregadas_por_proveedor = ctx.compras_agregadas_por_proveedor
+
     print(f"\n[PASO 6/6] Creando {len(compras_agregadas_por_proveedor)} OCs agrupadas por proveedor...")
 
-    # (La lógica de este paso no cambia, solo lee el diccionario
-    # 'compras_agregadas_por_proveedor' que llenamos en el PASO 5C)
-    
+    # Fecha de necesidad de cada MP en UNA pasada: la de la primera OP 'En espera'
+    # (ya planificadas en memoria, en orden de fecha) que la consume.
+    fecha_necesidad_por_mp = {}
+    for op in ctx.ops_en_estado(ctx.estado_op_en_espera):
+        if not op.fecha_planificada or not ctx.explosion.tiene_receta(op.id_producto_id):
+            continue
+        fecha_op = a_fecha(op.fecha_planificada)
+        for ingrediente in ctx.explosion.ingredientes(op.id_producto_id):
+            fecha_necesidad_por_mp.setdefault(ingrediente.id_materia_prima, fecha_op)
+
+    compras = []
     for proveedor_id, info in compras_agregadas_por_proveedor.items():
         proveedor = info["proveedor"]
         # ❗️ Calculamos la fecha de necesidad más temprana AHORA
-        fecha_requerida_mas_temprana = date(9999, 12, 31)
-        for mp_id in info["items"].keys():
-            # Buscamos la fecha más temprana para esta MP en las OPs 'En espera'
-            ops_necesitadas = OrdenProduccion.objects.filter(
-                id_estado_orden_produccion=estado_op_en_espera,
-                id_producto__receta__recetamateriaprima__id_materia_prima_id=mp_id
-            ).order_by('fecha_planificada')
-            
-            op_mas_temprana = ops_necesitadas.first()
-            if op_mas_temprana:
-                fecha_req_op = op_mas_temprana.fecha_planificada.date() - timedelta(days=DIAS_BUFFER_RECEPCION_MP)
-                if fecha_req_op < fecha_requerida_mas_temprana:
-                    fecha_requerida_mas_temprana = fecha_req_op
-        
-        if fecha_requerida_mas_temprana == date(9999, 12, 31):
-            fecha_requerida_mas_temprana = hoy # Fallback
-            
-        fecha_necesaria_mp = fecha_requerida_mas_temprana
-        lead_time = proveedor.lead_time_days
-
-        fecha_entrega_oc = fecha_necesaria_mp
+        fechas_ops = [fecha_necesidad_por_mp[mp_id] for mp_id in info["items"] if mp_id in fecha_necesidad_por_mp]
+        if fechas_ops:
+            fecha_necesaria_mp = min(fechas_ops) - timedelta(days=DIAS_BUFFER_RECEPCION_MP)
+        else:
+            fecha_necesaria_mp = hoy # Fallback
 
-        # Si cae Sábado (5) o Domingo (6), mover al Lunes siguiente
-        while fecha_entrega_oc.weekday() >= 5:
-            fecha_entrega_oc += timedelta(days=1)
+        lead_time = proveedor.lead_time_days
 
-        fecha_solicitud_oc = fecha_entrega_oc - timedelta(days=lead_time)
+        # Si cae en un día no hábil (finde, feriado, parada), mover al siguiente hábil
+        fecha_entrega_oc = ctx.calendario.proximo_habil(fecha_necesaria_mp)
 
-        # Si cae Sábado o Domingo, adelantar al VIERNES ANTERIOR (pedir antes)
-        while fecha_solicitud_oc.weekday() >= 5:
-            fecha_solicitud_oc -= timedelta(days=1)
+        # Si cae en un día no hábil, adelantar al hábil ANTERIOR (pedir antes)
+        fecha_solicitud_oc = ctx.calendario.anterior_habil(fecha_entrega_oc - timedelta(days=lead_time))
 
 
         if fecha_solicitud_oc < hoy:
             fecha_solicitud_oc = hoy
-            fecha_entrega_oc = hoy + timedelta(days=lead_time)
-
-            while fecha_entrega_oc.weekday() >= 5:
-                fecha_entrega_oc += timedelta(days=1)
+            fecha_entrega_oc = ctx.calendario.proximo_habil(hoy + timedelta(days=lead_time))
 
             print(f"   !ALERTA OC: Pedido a {proveedor.nombre} está retrasado. Nueva entrega: {fecha_entrega_oc}")
-            
-        oc, created = OrdenCompra.objects.get_or_create(
-            id_proveedor=proveedor,
-            id_estado_orden_compra=estado_oc_en_proceso,
-            fecha_entrega_estimada=fecha_entrega_oc,
-            defaults={'fecha_solicitud': fecha_solicitud_oc}
-        )
-        if created:
-            print(f"   > Generando NUEVA OC {oc.id_orden_compra} para {proveedor.nombre} (Entrega: {fecha_entrega_oc})")
-        else:
-            print(f"   > Usando OC EXISTENTE {oc.id_orden_compra} para {proveedor.nombre} (Entrega: {fecha_entrega_oc})")
-        
 
+        items = []
         for mp_id, cantidad_necesaria_hoy in info["items"].items():
-            mp = MateriaPrima.objects.get(id_materia_prima=mp_id)
-            cantidad_final = mp.calcular_cantidad_a_pedir(cantidad_necesaria_hoy)
-            
-            item_oc, item_created = OrdenCompraMateriaPrima.objects.get_or_create(
-                id_orden_compra=oc,
-                id_materia_prima_id=mp_id,
-                defaults={'cantidad': cantidad_final}
-            )
-            
-            if item_created:
-                print(f"      - NUEVO Item: {cantidad_final} de MP {mp_id} (necesitaba {cantidad_necesaria_hoy}, lote: {mp.cantidad_minima_pedido})")
-            else:
-                cantidad_anterior = item_oc.cantidad
-                item_oc.cantidad += cantidad_final 
-                item_oc.save()
-                print(f"      - Item existente (MP {mp_id}) en OC {oc.id_orden_compra} AUMENTADO de {cantidad_anterior} a {item_oc.cantidad} (lote: {mp.cantidad_minima_pedido})")
-
-    print("\n--- PLANIFICADOR MRP FINALIZADO ---")
\ No newline at end of file
+            mp = ctx.explosion.materia_prima(mp_id)
+            items.append({
+                "materia_prima": mp_id,
+                "cantidad": mp.calcular_cantidad_a_pedir(cantidad_necesaria_hoy),
+                "necesaria": cantidad_necesaria_hoy,
+                "lote_minimo": mp.cantidad_minima_pedido,
+            })
+
+        compras.append({
+            "proveedor": proveedor,
+            "fecha_solicitud": fecha_solicitud_oc,
+            "fecha_entrega": fecha_entrega_oc,
+            "items": items,
+        })
+
+    if ctx.simular:
+        # Solo lectura (1 consulta): ¿se sumaría a una OC existente o se crearía una nueva?
+        ocs_existentes = ctx.ocs_en_proceso((c["proveedor"].pk, c["fecha_entrega"]) for c in compras)
+        for compra in compras:
+            oc_existente = ocs_existentes.get((compra["proveedor"].pk, compra["fecha_entrega"]))
+            compra["oc"] = oc_existente.id_orden_compra if oc_existente else None
+            compra["oc_nueva"] = oc_existente is None
+            print(f"   > [SIMULACIÓN] OC para {compra['proveedor'].nombre} (Entrega: {compra['fecha_entrega']}): {len(compra['items'])} ítems.")
+
+    # El plan las aplica todas juntas (ver PlanMRP._aplicar_compras)
+    for compra in compras:
+        ctx.plan.registrar('comprar', **compra)
+
+
+# (clave del checkpoint, función) en orden de ejecución
+PASOS_MRP = (
+    ("0.6", _paso_0_6_balance_mp),
+    ("0", _paso_0_cierre_ovs),
+    ("0.5", _paso_0_5_liberar_canceladas),
+    ("1-3", _paso_1_3_demandas_netas),
+    ("4", _paso_4_cancelar_huerfanas),
+    ("4.5", _paso_4_5_reasignar_stock),
+    ("5", _paso_5_planificar_ops),
+    ("6", _paso_6_ordenes_compra),
+)
+# En el MRP en paralelo cada componente corre hasta el PASO 5; el PASO 6
+# junta las compras de todos los componentes (una OC por proveedor).
+PASOS_POR_COMPONENTE = tuple((clave, paso) for clave, paso in PASOS_MRP if clave != "6")
@@ -1,10 +1,11 @@
 import math
-from collections import defaultdict
+from bisect import bisect_left
+from decimal import Decimal
 from django.utils import timezone
 from django.db import transaction
 # ❗️ Importar Count para chequear tareas restantes
 from django.db.models import Q, Sum, Count 
-from datetime import timedelta, date, datetime, time
+from datetime import date, datetime, time
 
 from produccion.models import (
     OrdenProduccion,
@@ -16,20 +17,65 @@ from produccion.models import (
 )
 
 from recetas.models import ProductoLinea
-from ortools.sat.python import cp_model
+from trazabilidad.views import get_config, get_config_float
+from .models import MetricaPlanificador, SolucionSolver
+from .instrumentacion import MedidorPlanificador, medir_corrida
+from .calendario import get_calendario_laboral
+from . import solver_tandas
 
 
-HORIZONTE_MINUTOS = 16 * 60
+# Defaults de los parámetros del solver: se pueden cambiar en la tabla
+# Configuracion con la misma clave (ver parametros_solver)
 SOLVER_MAX_SECONDS = 30
+# Tiempo límite de cada subproblema independiente (una línea)
+SOLVER_MAX_SECONDS_SUBPROBLEMA = 10
 SOLVER_WORKERS = 8
+# Tandas completas como un bloque con cantidad entera (False: un intervalo por tanda)
+SOLVER_MODELO_COMPACTO = True
+# Días hábiles del horizonte rodante (1 = solo mañana, sin horizonte)
+DIAS_HORIZONTE_RODANTE = 1
 
 
-def ejecutar_planificador(fecha_simulada: date):
+def parametros_solver() -> dict:
+    """
+    Parámetros del solver táctico, frescos en cada corrida: la tabla
+    Configuracion manda y las constantes de este módulo son el default.
+    (HORIZONTE_MINUTOS es la ventana de cada día, desde las 06:00.)
+
+    SOLVER_MAX_SECONDS y SOLVER_MAX_SECONDS_SUBPROBLEMA aceptan decimales
+    (tipo_dato 'float', ej. "0.5"); SOLVER_WORKERS y HORIZONTE_MINUTOS son enteros.
+    """
+    return {
+        "max_segundos": max(0.1, get_config_float('SOLVER_MAX_SECONDS', SOLVER_MAX_SECONDS)),
+        "max_segundos_subproblema": max(
+            0.1, get_config_float('SOLVER_MAX_SECONDS_SUBPROBLEMA', SOLVER_MAX_SECONDS_SUBPROBLEMA)
+        ),
+        "workers": max(1, get_config('SOLVER_WORKERS', SOLVER_WORKERS)),
+        "horizonte_minutos": min(
+            max(60, get_config('HORIZONTE_MINUTOS', solver_tandas.HORIZONTE_MINUTOS)), solver_tandas.MINUTOS_DIA
+        ),
+    }
+
+
+def ejecutar_planificador(fecha_simulada: date, dias_horizonte: int = None):
     """
     NUEVA LÓGICA (Solver Táctico / Dispatcher):
     Lee las TAREAS del CalendarioProduccion para "mañana" y
     las optimiza para generar las OrdenesDeTrabajo (OTs).
+
+    Con 'dias_horizonte' > 1 (HORIZONTE RODANTE) el modelo ve también los
+    días hábiles siguientes, con lo que ya tienen reservado como capacidad
+    ocupada, pero solo se fija mañana: lo que no entra mañana se pospone
+    al primer día del horizonte con lugar (no simplemente al día siguiente).
+
+    Cada etapa (selección, reglas, modelo, solver, guardado) queda medida
+    en MetricaPlanificador.
     """
+    with medir_corrida(MetricaPlanificador.Proceso.SOLVER, fecha_simulada) as medidor:
+        return _ejecutar_planificador(fecha_simulada, medidor, dias_horizonte or DIAS_HORIZONTE_RODANTE)
+
+
+def _ejecutar_planificador(fecha_simulada: date, medidor: MedidorPlanificador, dias_horizonte: int = 1):
 
     # ❗️ CORRECCIÓN: El solver SÍ debe correr para "mañana". 
     # El MRP corre para 'fecha_simulada' (hoy) y planifica el futuro.
@@ -41,6 +87,7 @@ def ejecutar_planificador(fecha_simulada: date):
     # dia_de_planificacion = fecha_simulada 
     
     print(f"Iniciando Solver Táctico para {dia_de_planificacion}...")
+    medidor.pasar_a("seleccion_tareas")
 
     # ===================================================================
     # ✅ 1) SELECCIONAR TAREAS (CALENDARIO) PARA EL DÍA
@@ -52,6 +99,12 @@ def ejecutar_planificador(fecha_simulada: date):
     # ❗️ CORRECCIÓN: Sacamos "Finalizada" de aquí.
     estados_op_validos = ["Pendiente de inicio", "En proceso", "Finalizada"]
     
+    # Horizonte rodante: mañana y los (dias_horizonte - 1) días hábiles siguientes
+    calendario = get_calendario_laboral()
+    dias = [dia_de_planificacion] + [
+        calendario.sumar_habiles(dia_de_planificacion, k) for k in range(1, dias_horizonte)
+    ]
+
     tasks_today = list(
         CalendarioProduccion.objects.filter(
             fecha=dia_de_planificacion,
@@ -71,13 +124,13 @@ def ejecutar_planificador(fecha_simulada: date):
     # ===================================================================
     
     # ... (Esta sección no cambia) ...
+    medidor.pasar_a("reglas")
     lineas_activas = list(
         LineaProduccion.objects.filter(
             Q(id_estado_linea_produccion__descripcion="Disponible") |
             Q(id_estado_linea_produccion__descripcion="Ocupada")
         )
     )
-    lineas_activas_ids = set(l.id_linea_produccion for l in lineas_activas)
     if not lineas_activas:
         print("❌ No hay líneas disponibles.")
         return
@@ -102,149 +155,72 @@ def ejecutar_planificador(fecha_simulada: date):
     # ✅ 3) CREAR MODELO (Basado en TAREAS, no en OPs)
     # ===================================================================
     
-    model = cp_model.CpModel()
-    intervals_por_linea = defaultdict(list)
-    todas_tandas = []
-    all_end_vars = []
-    
-    # Variable auxiliar para calcular el techo de la producción total (para definir la variable del solver)
-    suma_total_objetivo_global = 0
-
+    medidor.pasar_a("modelo")
+    # Cada tarea del calendario se "explota" en tandas; el modelo CP-SAT se arma
+    # y resuelve en planificacion/solver_tandas.py (por línea, en paralelo).
     print("✅ Generando tandas según CalendarioProduccion...")
-
-    for cal_task in tasks_today:
-        op = cal_task.id_orden_produccion
-        linea = cal_task.id_linea_produccion
-        producto_id = op.id_producto_id
-        total_task_qty = int(cal_task.cantidad_a_producir)
-        max_horas_tarea = int(cal_task.horas_reservadas)
-        max_minutos_tarea = max_horas_tarea * 60
-        
-        # Validaciones básicas
-        if linea.id_linea_produccion not in lineas_activas_ids:
-            print(f"❌ Línea {linea.id_linea_produccion} no está disponible. Omitiendo tarea de OP {op.id_orden_produccion}.")
-            continue
-            
-        if (producto_id, linea.id_linea_produccion) not in capacidad_lookup:
-            print(f"❌ No hay regla para OP {op.id_orden_produccion} en Línea {linea.id_linea_produccion}. Omitiendo.")
-            continue
-            
-        regla = capacidad_lookup[(producto_id, linea.id_linea_produccion)]
-        tamano_tanda = regla["cant_por_hora"]
-        minimo = regla["cantidad_minima"] or 0
-        
-        if tamano_tanda <= 0:
-            print(f"⚠️ TAMAÑO TANDA 0: OP {op.id_orden_produccion} en línea {linea.id_linea_produccion}")
-            continue
-            
-        max_tandas = math.ceil(total_task_qty / tamano_tanda)
-        if max_tandas == 0:
-            continue
-            
-        task_tandas = [] 
-        
-        # 🆕 Variable para sumar lo que REALMENTE vamos a pedir al solver
-        # (Esto será >= total_task_qty si forzamos mínimos)
-        cantidad_objetivo_solver = 0
-        
-        for t in range(max_tandas):
-            
-            # Cálculo del tamaño de esta tanda específica
-            if t == max_tandas - 1:
-                # Es la última tanda
-                sobra = total_task_qty - (tamano_tanda * (max_tandas - 1))
-                
-                if sobra < minimo:
-                    # ✅ CORRECCIÓN: En lugar de 'continue', forzamos el mínimo.
-                    # Esto evita que la ecuación sea infactible.
-                    print(f"⚠️ Ajuste: Tanda final (OP {op.id_orden_produccion}) de {sobra}u es menor al mínimo ({minimo}u). Se producirá el mínimo ({minimo}u).")
-                    tamano_real = minimo # Producimos un poco de más (Stock sobra)
-                else:
-                    tamano_real = sobra
-            else:
-                # Tanda completa normal (intermedia)
-                tamano_real = tamano_tanda
-            
-            # Acumulamos la cantidad real que tendrá esta tanda para la restricción final
-            cantidad_objetivo_solver += tamano_real
-
-            # Cálculo de duración
-            duracion_real = math.ceil(60 * (tamano_real / tamano_tanda))
-            if duracion_real <= 0:
-                continue
-                
-            # Variables del Solver
-            lit = model.NewBoolVar(f"cal{cal_task.id}_t{t}")
-            start = model.NewIntVar(0, HORIZONTE_MINUTOS, f"start_{cal_task.id}_{t}")
-            end = model.NewIntVar(0, HORIZONTE_MINUTOS, f"end_{cal_task.id}_{t}")
-            interval = model.NewOptionalIntervalVar(start, duracion_real, end, lit, f"interval_{cal_task.id}_{t}")
-            
-            tanda_info = {
-                "literal": lit, "op": op, "linea": linea, "tamano": tamano_real,
-                "start": start, "end": end, "duracion": duracion_real, "cal_task_id": cal_task.id
-            }
-            
-            todas_tandas.append(tanda_info)
-            task_tandas.append(tanda_info)
-            intervals_por_linea[linea.id_linea_produccion].append(interval)
-            all_end_vars.append(end)
-        
-        # 🆕 RESTRICCIÓN DE CANTIDAD TOTAL
-        # La suma de las tandas activas debe ser igual al objetivo ajustado (incluyendo mínimos forzados)
-        model.Add(sum(tanda["literal"] * tanda["tamano"] for tanda in task_tandas) == cantidad_objetivo_solver)
-        
-        # RESTRICCIÓN DE TIEMPO (Calendario)
-        # Intentamos respetar las horas reservadas en el MRP
-        model.Add(sum(tanda["literal"] * tanda["duracion"] for tanda in task_tandas) <= max_minutos_tarea)
-
-        # Sumamos al total global para definir el dominio de la variable objetivo
-        suma_total_objetivo_global += cantidad_objetivo_solver
-
-    # RESTRICCIÓN DE NO SUPERPOSICIÓN
-    for linea_id, intervals in intervals_por_linea.items():
-        model.AddNoOverlap(intervals)
-        
-    # VARIABLES OBJETIVO
-    makespan = model.NewIntVar(0, HORIZONTE_MINUTOS, "makespan")
-    if all_end_vars:
-        model.AddMaxEquality(makespan, all_end_vars)
-    
-    # Maximizar la producción total realizada
-    # (Aunque forzamos la igualdad arriba, esto ayuda al solver a orientarse)
-    produccion_total = model.NewIntVar(0, suma_total_objetivo_global, "produccion_total")
-    model.Add(produccion_total == sum(tanda["literal"] * tanda["tamano"] for tanda in todas_tandas))
-    
-    model.Maximize(produccion_total)
+    tareas, todas_tandas = _armar_tareas(
+        [(task.id, task, 0) for task in tasks_today],
+        {linea.id_linea_produccion: linea for linea in lineas_activas},
+        capacidad_lookup
+    )
+    # Horizonte rodante: lo que ya está reservado los días siguientes (de cualquier OP)
+    # no se mueve; lo de mañana solo puede posponerse al hueco que queda
+    ocupado = _minutos_reservados(dias, lineas_ids) if len(dias) > 1 else {}
+
+    # WARM START: la última solución guardada (normalmente la de ayer) como pista
+    solucion_previa = SolucionSolver.objects.filter(
+        fecha_planificacion__lte=dia_de_planificacion,
+        estado__in=["OPTIMAL", "FEASIBLE"]
+    ).order_by('-fecha_planificacion', '-id_solucion_solver').first()
+    _asignar_pistas(tareas, todas_tandas, solucion_previa)
+    if solucion_previa:
+        print(f"🔁 Warm start: {sum(t['pista'] is not None for t in todas_tandas)}/{len(todas_tandas)} tandas con pista "
+              f"(solución del {solucion_previa.fecha_planificacion}).")
     
     # ===================================================================
     # ✅ 4) EJECUTAR SOLVER Y GUARDAR
     # ===================================================================
-    solver = cp_model.CpSolver()
-    solver.parameters.max_time_in_seconds = SOLVER_MAX_SECONDS
-    solver.parameters.num_search_workers = SOLVER_WORKERS
+    medidor.pasar_a("solver")
+    parametros = parametros_solver()
+    resultado = solver_tandas.resolver(
+        tareas,
+        max_segundos=parametros["max_segundos"],
+        max_segundos_subproblema=parametros["max_segundos_subproblema"],
+        workers=parametros["workers"],
+        compacto=SOLVER_MODELO_COMPACTO,
+        dias=len(dias),
+        horizonte=parametros["horizonte_minutos"],
+        ocupado=ocupado
+    )
+    print(f"⏱️ Solver: {resultado['estado']} en {resultado['segundos']:.2f}s, {resultado['subproblemas']} subproblemas "
+          f"(primera solución: {resultado['segundos_primera_solucion'] if resultado['segundos_primera_solucion'] is not None else '-'}s).")
+    print(f"   Modelo: {resultado['variables']} variables, {resultado['restricciones']} restricciones, "
+          f"{resultado['intervalos']} intervalos. Gap: {resultado['gap'] if resultado['gap'] is not None else '-'} "
+          f"({parametros['workers']} workers, límite {parametros['max_segundos']}s).")
 
-    status = solver.Solve(model)
+    # Horizonte rodante: se fija solo mañana; el resto de las tandas de mañana se pospone
+    posposiciones = {}
+    if len(dias) > 1 and resultado["estado"] in ("FEASIBLE", "OPTIMAL"):
+        todas_tandas, posposiciones = _fijar_primer_dia(resultado, todas_tandas, dias, calendario)
 
     # --- ❗️ INICIO DE CORRECCIÓN 2 ---
     # Lógica de "Snooze" (posponer) si el solver falla
     # ---
-    if status not in (cp_model.FEASIBLE, cp_model.OPTIMAL):
+    if resultado["estado"] not in ("FEASIBLE", "OPTIMAL"):
         print(f"❌ No se pudo generar una planificación para {dia_de_planificacion}. (El plan era infactible)")
+        # "Snooze button": las tareas de hoy pasan al día hábil siguiente (o al primero
+        # con lugar en la línea), sumándose a la tarea que la OP ya tenga ese día
+        siguiente_habil = calendario.sumar_habiles(dia_de_planificacion, 1)
+        with transaction.atomic():
+            _guardar_solucion(dia_de_planificacion, resultado, todas_tandas, solucion_previa, parametros, len(dias))
+            _posponer_tandas(
+                _posposiciones_de_tareas(tasks_today, todas_tandas, siguiente_habil),
+                [t.id for t in tasks_today], calendario, parametros["horizonte_minutos"]
+            )
         
-        # "Snooze button": Mover las tareas de hoy a mañana
-        tomorrow = dia_de_planificacion + timedelta(days=1)
-        task_ids_to_move = [t.id for t in tasks_today]
-        
-        # 1. Mover las tareas a mañana
-        #    (Esto es una simplificación. Idealmente, "combinaría"
-        #     las horas/cantidad con una tarea existente de mañana)
-        tasks_movidas = CalendarioProduccion.objects.filter(
-            id__in=task_ids_to_move
-        ).update(fecha=tomorrow)
-        
-        # 2. NO cambiamos el estado de la OP. La dejamos 'En proceso' / 'Pendiente de inicio'.
-        
-        print(f"⚠️ {tasks_movidas} tareas del calendario pospuestas de {dia_de_planificacion} a {tomorrow}.")
+        # NO cambiamos el estado de la OP. La dejamos 'En proceso' / 'Pendiente de inicio'.
+        print(f"⚠️ {len(tasks_today)} tareas del calendario pospuestas de {dia_de_planificacion} (desde {siguiente_habil}).")
         print(f"   La OP asociada seguirá 'En proceso' o 'Pendiente de inicio' y se re-intentará mañana.")
         return # Terminar la ejecución de hoy
     # ---
@@ -252,6 +228,7 @@ def ejecutar_planificador(fecha_simulada: date):
     # ---
 
     # ✅ Guardar resultados
+    medidor.pasar_a("guardado")
     estado_ot = EstadoOrdenTrabajo.objects.get(descripcion="Pendiente")
     estado_op_planificada = EstadoOrdenProduccion.objects.get(descripcion="Planificada")
     # estado_op_en_espera = EstadoOrdenProduccion.objects.get(descripcion="En espera") # Ya no lo usamos aquí
@@ -263,9 +240,8 @@ def ejecutar_planificador(fecha_simulada: date):
     cal_tasks_exitosas_ids = set() # ID de Tareas del Calendario completadas
 
     for tanda in todas_tandas:
-        if solver.Value(tanda["literal"]):
-            ini = solver.Value(tanda["start"])
-            fin = solver.Value(tanda["end"])
+        activa, ini, fin = resultado["valores"][(tanda["cal_task_id"], tanda["t"])]
+        if activa:
             ots_creadas.append(
                 OrdenDeTrabajo(
                     id_orden_produccion=tanda["op"],
@@ -288,6 +264,9 @@ def ejecutar_planificador(fecha_simulada: date):
 
 
     with transaction.atomic():
+        # 0. Guardar la solución (pista para la corrida de mañana)
+        _guardar_solucion(dia_de_planificacion, resultado, todas_tandas, solucion_previa, parametros, len(dias))
+
         # 1. Crear las OTs
         OrdenDeTrabajo.objects.bulk_create(ots_creadas)
         print(f"✅ {len(ots_creadas)} OTs creadas exitosamente para {dia_de_planificacion}.")
@@ -298,6 +277,13 @@ def ejecutar_planificador(fecha_simulada: date):
                 id__in=cal_tasks_exitosas_ids
             ).delete()
             print(f"🧹 Limpiadas {reservas_blandas_borradas[0]} reservas de calendario EXITOSAS.")
+
+        # 2b. Horizonte rodante: lo que no entró mañana va al día donde el modelo encontró lugar
+        if posposiciones:
+            # Las tareas de mañana que tenían tandas en el modelo quedaron pospuestas enteras
+            cal_tasks_pospuestas_ids = cal_tasks_fallidas_ids & {tanda["cal_task_id"] for tanda in todas_tandas}
+            _posponer_tandas(posposiciones, cal_tasks_pospuestas_ids, calendario, parametros["horizonte_minutos"])
+            cal_tasks_fallidas_ids -= cal_tasks_pospuestas_ids
         
         # 3. Actualizar estado de OPs exitosas
         if ops_planificadas_exitosamente:
@@ -333,14 +319,330 @@ def ejecutar_planificador(fecha_simulada: date):
         if cal_tasks_fallidas_ids:
             print(f"⚠️ {len(cal_tasks_fallidas_ids)} TAREAS de Calendario no pudieron ser planificadas hoy por el solver (maximizando).")
             
-            tomorrow = dia_de_planificacion + timedelta(days=1)
+            siguiente_habil = calendario.sumar_habiles(dia_de_planificacion, 1)
             
             # ❗️ "Snooze button" para las tareas que el solver decidió no hacer
-            tasks_movidas = CalendarioProduccion.objects.filter(
-                id__in=cal_tasks_fallidas_ids
-            ).update(fecha=tomorrow)
+            tasks_fallidas = [task for task in tasks_today if task.id in cal_tasks_fallidas_ids]
+            _posponer_tandas(
+                _posposiciones_de_tareas(tasks_fallidas, todas_tandas, siguiente_habil),
+                cal_tasks_fallidas_ids, calendario, parametros["horizonte_minutos"]
+            )
+            
+            print(f"⚠️ {len(tasks_fallidas)} tareas NO planificadas fueron pospuestas (desde {siguiente_habil}).")
+
+
+# ===================================================================
+# TANDAS
+# ===================================================================
+def _armar_tareas(tareas_calendario, lineas_activas, capacidad_lookup):
+    """
+    Explota cada tarea del calendario en tandas (una por hora de producción
+    de la línea, la última con lo que sobra o el mínimo de la regla).
+
+    - tareas_calendario: [(clave, CalendarioProduccion, índice del día)]
+    - lineas_activas: {linea_id: LineaProduccion} en las que se puede producir
+    - capacidad_lookup: {(producto_id, linea_id): {"cant_por_hora", "cantidad_minima"}}
+
+    Devuelve (tareas para solver_tandas.resolver, todas las tandas).
+    """
+    tareas = []
+    todas_tandas = []
+
+    for clave, cal_task, dia in tareas_calendario:
+        op = cal_task.id_orden_produccion
+        linea_id = cal_task.id_linea_produccion_id
+        producto_id = op.id_producto_id
+        total_task_qty = int(cal_task.cantidad_a_producir)
+        max_horas_tarea = int(cal_task.horas_reservadas)
+        max_minutos_tarea = max_horas_tarea * 60
+        
+        # Validaciones básicas
+        if linea_id not in lineas_activas:
+            print(f"❌ Línea {linea_id} no está disponible. Omitiendo tarea de OP {op.id_orden_produccion}.")
+            continue
+        linea = lineas_activas[linea_id]
+            
+        if (producto_id, linea.id_linea_produccion) not in capacidad_lookup:
+            print(f"❌ No hay regla para OP {op.id_orden_produccion} en Línea {linea.id_linea_produccion}. Omitiendo.")
+            continue
+            
+        regla = capacidad_lookup[(producto_id, linea.id_linea_produccion)]
+        tamano_tanda = regla["cant_por_hora"]
+        minimo = regla["cantidad_minima"] or 0
+        
+        if tamano_tanda <= 0:
+            print(f"⚠️ TAMAÑO TANDA 0: OP {op.id_orden_produccion} en línea {linea.id_linea_produccion}")
+            continue
+            
+        max_tandas = math.ceil(total_task_qty / tamano_tanda)
+        if max_tandas == 0:
+            continue
             
-            print(f"⚠️ {tasks_movidas} tareas NO planificadas fueron pospuestas a {tomorrow}.")
+        task_tandas = [] 
+        
+        # 🆕 Variable para sumar lo que REALMENTE vamos a pedir al solver
+        # (Esto será >= total_task_qty si forzamos mínimos)
+        cantidad_objetivo_solver = 0
+        
+        for t in range(max_tandas):
+            
+            # Cálculo del tamaño de esta tanda específica
+            if t == max_tandas - 1:
+                # Es la última tanda
+                sobra = total_task_qty - (tamano_tanda * (max_tandas - 1))
+                
+                if sobra < minimo:
+                    # ✅ CORRECCIÓN: En lugar de 'continue', forzamos el mínimo.
+                    # Esto evita que la ecuación sea infactible.
+                    print(f"⚠️ Ajuste: Tanda final (OP {op.id_orden_produccion}) de {sobra}u es menor al mínimo ({minimo}u). Se producirá el mínimo ({minimo}u).")
+                    tamano_real = minimo # Producimos un poco de más (Stock sobra)
+                else:
+                    tamano_real = sobra
+            else:
+                # Tanda completa normal (intermedia)
+                tamano_real = tamano_tanda
+            
+            # Acumulamos la cantidad real que tendrá esta tanda para la restricción final
+            cantidad_objetivo_solver += tamano_real
+
+            # Cálculo de duración
+            duracion_real = math.ceil(60 * (tamano_real / tamano_tanda))
+            if duracion_real <= 0:
+                continue
+                
+            tanda_info = {
+                "op": op, "linea": linea, "tamano": tamano_real,
+                "duracion": duracion_real, "cal_task_id": clave, "t": t, "pista": None,
+                "dia": dia
+            }
+            
+            todas_tandas.append(tanda_info)
+            task_tandas.append(tanda_info)
+
+        tareas.append({
+            "cal": clave,
+            "linea": linea.id_linea_produccion,
+            "objetivo": cantidad_objetivo_solver,
+            "max_minutos": max_minutos_tarea,
+            "dia": dia,
+            "tandas": [
+                {"t": tanda["t"], "tamano": tanda["tamano"], "duracion": tanda["duracion"], "pista": tanda["pista"]}
+                for tanda in task_tandas
+            ],
+        })
+
+    return tareas, todas_tandas
+
+
+# ===================================================================
+# HORIZONTE RODANTE
+# ===================================================================
+def _minutos_reservados(dias, lineas_ids):
+    """
+    {(linea, índice del día): minutos} ya reservados en el calendario para
+    los días del horizonte después de mañana (una reserva en un día no
+    hábil cuenta en el hábil siguiente).
+    """
+    ocupado = {}
+    reservas = CalendarioProduccion.objects.filter(
+        id_linea_produccion_id__in=lineas_ids, fecha__gt=dias[0], fecha__lte=dias[-1]
+    ).values_list('id_linea_produccion_id', 'fecha', 'horas_reservadas')
+    for linea_id, fecha, horas in reservas:
+        clave = (linea_id, bisect_left(dias, fecha))
+        ocupado[clave] = ocupado.get(clave, 0) + math.ceil(horas * 60)
+    return ocupado
+
+
+def _fijar_primer_dia(resultado, todas_tandas, dias, calendario):
+    """
+    Deja en 'resultado' y 'todas_tandas' solo las tandas de las tareas de
+    mañana (activa = el modelo la puso mañana). Devuelve también lo que
+    hay que posponer, tanda por tanda: {(op, linea, fecha): [(cantidad, minutos)]};
+    lo que no entró en el horizonte va al día hábil siguiente al último.
+    """
+    fuera_del_horizonte = calendario.sumar_habiles(dias[-1], 1)
+    valores_horizonte = resultado["valores"]
+    tandas_primer_dia = [tanda for tanda in todas_tandas if tanda["dia"] == 0]
+
+    valores = {}
+    posposiciones = {}
+    for tanda in tandas_primer_dia:
+        clave = (tanda["cal_task_id"], tanda["t"])
+        dia, ini, fin = valores_horizonte[clave]
+        valores[clave] = (dia == 0, ini, fin)
+        if dia != 0:
+            fecha = dias[dia] if dia is not None else fuera_del_horizonte
+            posposiciones.setdefault((tanda["op"], tanda["linea"], fecha), []).append(
+                (tanda["tamano"], tanda["duracion"])
+            )
+
+    resultado["valores"] = valores
+    for fecha in dias[1:] + [fuera_del_horizonte]:
+        pospuesto = sum(c for (_op, _linea, f), tandas in posposiciones.items() if f == fecha for c, _m in tandas)
+        if pospuesto:
+            print(f"   ↪️ {pospuesto}u de mañana pospuestas a {fecha}.")
+    return tandas_primer_dia, posposiciones
+
+
+def _posposiciones_de_tareas(tareas_calendario, todas_tandas, fecha):
+    """
+    Lo que hay que posponer de tareas enteras del calendario a partir de
+    'fecha', en el formato de _posponer_tandas: por tanda si la tarea
+    llegó al modelo y, si no (sin regla o línea inactiva), de una vez.
+    """
+    tandas_por_tarea = {}
+    for tanda in todas_tandas:
+        tandas_por_tarea.setdefault(tanda["cal_task_id"], []).append((tanda["tamano"], tanda["duracion"]))
+
+    posposiciones = {}
+    for task in tareas_calendario:
+        tandas = tandas_por_tarea.get(task.id) or [
+            (task.cantidad_a_producir, math.ceil(task.horas_reservadas * 60))
+        ]
+        posposiciones.setdefault((task.id_orden_produccion, task.id_linea_produccion, fecha), []).extend(tandas)
+    return posposiciones
+
+
+def _posponer_tandas(posposiciones, cal_tasks_pospuestas_ids, calendario, minutos_por_dia):
+    """
+    Borra las tareas de mañana que no se hicieron y reparte lo pospuesto
+    ({(op, linea, fecha): [(cantidad, minutos)]}): cada tanda va al primer
+    día hábil desde 'fecha' en que a la línea le queda lugar, contando todo
+    lo que ya tiene reservado (un día vacío acepta cualquier tanda). Lo de
+    cada día se suma a la tarea (OP, línea, fecha) que ya exista o crea una nueva.
+    """
+    CalendarioProduccion.objects.filter(id__in=cal_tasks_pospuestas_ids).delete()
+    if not posposiciones:
+        return
+
+    carga = {}
+    existentes = {}
+    for tarea in CalendarioProduccion.objects.filter(
+        id_linea_produccion_id__in={linea.id_linea_produccion for _op, linea, _fecha in posposiciones},
+        fecha__gte=min(fecha for _op, _linea, fecha in posposiciones)
+    ):
+        clave_dia = (tarea.id_linea_produccion_id, tarea.fecha)
+        carga[clave_dia] = carga.get(clave_dia, 0) + math.ceil(tarea.horas_reservadas * 60)
+        existentes[(tarea.id_orden_produccion_id, tarea.id_linea_produccion_id, tarea.fecha)] = tarea
+
+    repartido = {}
+    for (op, linea, desde), tandas in sorted(
+        posposiciones.items(), key=lambda item: (item[0][2], item[0][0].id_orden_produccion)
+    ):
+        fecha = calendario.proximo_habil(desde)
+        for cantidad, minutos in tandas:
+            while carga.get((linea.id_linea_produccion, fecha), 0) and \
+                    carga[(linea.id_linea_produccion, fecha)] + minutos > minutos_por_dia:
+                fecha = calendario.sumar_habiles(fecha, 1)
+            carga[(linea.id_linea_produccion, fecha)] = carga.get((linea.id_linea_produccion, fecha), 0) + minutos
+            pendiente = repartido.setdefault((op, linea, fecha), [0, 0])
+            pendiente[0] += cantidad
+            pendiente[1] += minutos
+
+    nuevas, actualizadas = [], []
+    for (op, linea, fecha), (cantidad, minutos) in repartido.items():
+        horas = Decimal(minutos) / 60
+        tarea = existentes.get((op.id_orden_produccion, linea.id_linea_produccion, fecha))
+        if tarea is None:
+            nuevas.append(CalendarioProduccion(
+                id_orden_produccion=op, id_linea_produccion=linea, fecha=fecha,
+                horas_reservadas=round(horas, 2), cantidad_a_producir=cantidad
+            ))
+        else:
+            tarea.horas_reservadas = round(tarea.horas_reservadas + horas, 2)
+            tarea.cantidad_a_producir += cantidad
+            actualizadas.append(tarea)
+
+    CalendarioProduccion.objects.bulk_create(nuevas)
+    CalendarioProduccion.objects.bulk_update(actualizadas, ['horas_reservadas', 'cantidad_a_producir'])
+    print(f"⚠️ {len(nuevas)} tareas de calendario creadas y {len(actualizadas)} ampliadas con lo pospuesto.")
+
+
+# ===================================================================
+# WARM START (pistas desde la solución anterior)
+# ===================================================================
+def _asignar_pistas(tareas, todas_tandas, solucion_previa):
+    """
+    Completa la 'pista' (activa, inicio) de cada tanda que figure en
+    'solucion_previa'. Una tanda se busca por la misma tarea del calendario;
+    si no, por la misma OP y línea (la OP sigue al día siguiente en otra
+    tarea); y si no, por el mismo producto y línea.
+    """
+    if solucion_previa is None:
+        return
+
+    anteriores = {}
+    for tanda in solucion_previa.tandas:
+        for clave in (
+            ("cal", tanda["cal"], tanda["t"]),
+            ("op", tanda["op"], tanda["linea"], tanda["t"]),
+            ("producto", tanda["producto"], tanda["linea"], tanda["t"]),
+        ):
+            anteriores.setdefault(clave, tanda)
+
+    pistas = {}
+    for tanda in todas_tandas:
+        op, linea_id = tanda["op"], tanda["linea"].id_linea_produccion
+        anterior = (
+            anteriores.get(("cal", tanda["cal_task_id"], tanda["t"]))
+            or anteriores.get(("op", op.id_orden_produccion, linea_id, tanda["t"]))
+            or anteriores.get(("producto", op.id_producto_id, linea_id, tanda["t"]))
+        )
+        if anterior is not None:
+            tanda["pista"] = {"activa": anterior["activa"], "inicio": anterior["inicio"]}
+            pistas[(tanda["cal_task_id"], tanda["t"])] = tanda["pista"]
+
+    for tarea in tareas:
+        for tanda in tarea["tandas"]:
+            tanda["pista"] = pistas.get((tarea["cal"], tanda["t"]))
+
+
+def _guardar_solucion(dia, resultado, todas_tandas, solucion_previa, parametros, dias_horizonte=1):
+    tandas = []
+    igual_pista = 0
+    for tanda in todas_tandas:
+        valores = resultado["valores"].get((tanda["cal_task_id"], tanda["t"]))
+        if valores is None:
+            continue
+        activa, inicio, _fin = valores
+        igual_pista += tanda["pista"] is not None and tanda["pista"]["activa"] == activa
+        tandas.append({
+            "cal": tanda["cal_task_id"],
+            "op": tanda["op"].id_orden_produccion,
+            "producto": tanda["op"].id_producto_id,
+            "linea": tanda["linea"].id_linea_produccion,
+            "t": tanda["t"],
+            "activa": activa,
+            "inicio": inicio,
+        })
+
+    SolucionSolver.objects.create(
+        fecha_planificacion=dia,
+        estado=resultado["estado"],
+        objetivo=resultado["objetivo"],
+        tandas=tandas,
+        id_solucion_pista=solucion_previa,
+        tandas_total=len(todas_tandas),
+        tandas_con_pista=sum(tanda["pista"] is not None for tanda in todas_tandas),
+        tandas_igual_pista=igual_pista,
+        max_segundos=parametros["max_segundos"],
+        max_segundos_subproblema=parametros["max_segundos_subproblema"],
+        workers=parametros["workers"],
+        horizonte_minutos=parametros["horizonte_minutos"],
+        dias_horizonte=dias_horizonte,
+        modelo_compacto=SOLVER_MODELO_COMPACTO,
+        segundos_solver=resultado["segundos"],
+        segundos_primera_solucion=resultado["segundos_primera_solucion"],
+        conflictos=resultado["conflictos"],
+        ramas=resultado["ramas"],
+        cota=resultado["cota"],
+        gap=resultado["gap"],
+        subproblemas=resultado["subproblemas"],
+        variables=resultado["variables"],
+        restricciones=resultado["restricciones"],
+        intervalos=resultado["intervalos"],
+        estadisticas_subproblemas=resultado["estadisticas"],
+    )
 
 
 # ---
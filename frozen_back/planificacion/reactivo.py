@@ -0,0 +1,253 @@
+import math
+import time as reloj
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.utils import timezone
+from ortools.sat.python import cp_model
+from simple_history.utils import bulk_update_with_history
+
+from produccion.models import LineaProduccion, OrdenDeTrabajo
+from recetas.models import ProductoLinea
+from .solver_tandas import HORIZONTE_MINUTOS
+from .planner_service import parametros_solver
+
+# Presupuesto del solver para TODA la llamada (todos los días): la respuesta
+# tiene que llegar en ~1 segundo
+REPROGRAMACION_MAX_SECONDS = 0.8
+REPROGRAMACION_WORKERS = 8
+
+# Estados de línea en los que se puede producir (los mismos que usa el solver táctico)
+ESTADOS_LINEA_ACTIVOS = ["disponible", "ocupada"]
+# OTs que todavía se pueden mover / que ya ocupan su línea
+ESTADOS_OT_SIN_INICIAR = ["pendiente", "planificada"]
+ESTADOS_OT_INICIADAS = ["en progreso", "en pausa"]
+
+# Penalidades del objetivo (en minutos equivalentes)
+PENALIDAD_SIN_LUGAR = 100 * HORIZONTE_MINUTOS
+PENALIDAD_CAMBIO_LINEA = 30
+# Un minuto de desvío de una OT cuya línea sigue activa pesa más que un minuto
+# ganado por las reprogramadas: ante un empate no se mueve lo que no hace falta
+PESO_DESVIO = 2
+
+
+def reprogramar_por_cambio_de_linea(linea_id, ahora: datetime = None, simular: bool = False,
+                                    estados_linea: dict = None) -> dict:
+    """
+    Reprogramación REACTIVA (ej. una línea pasa a no disponible en medio del turno):
+    re-secuencia solo las OTs todavía no iniciadas, sobre las líneas que
+    siguen activas, sin tocar las OTs en progreso o en pausa (que ocupan su
+    línea hasta su fin programado).
+
+    El plan actual (línea e inicio de cada OT, es decir la última solución
+    guardada) va como pista; el solver tiene REPROGRAMACION_MAX_SECONDS en
+    total, contados desde el inicio de la llamada.
+    Las OTs que estaban en la línea caída se terminan lo antes posible; las
+    demás se mueven lo menos posible de su fin programado. Cambiar de línea
+    cuesta un poco y dejar una OT sin lugar cuesta mucho: una OT que no
+    entra se deja como está y se informa en 'sin_lugar'.
+
+    Cada día se resuelve por separado, sobre la misma ventana que el solver
+    táctico (desde las 06:00, HORIZONTE_MINUTOS de Configuracion), y nunca antes de 'ahora'.
+    Los días van del más cercano al más lejano y cada uno recibe una parte
+    igual de lo que queda del presupuesto; si no queda nada, las OTs de los
+    días restantes se dejan como están y se informan en 'sin_reprogramar'.
+
+    'estados_linea' = {linea_id: estado_linea_produccion} pisa el estado
+    guardado de esas líneas: así una simulación ve el cambio sin aplicarlo.
+    """
+    inicio = reloj.perf_counter()
+    ahora = ahora or timezone.now()
+    estados_linea = estados_linea or {}
+
+    def estado_de(linea):
+        return estados_linea.get(linea.id_linea_produccion, linea.id_estado_linea_produccion)
+
+    linea_cambiada = LineaProduccion.objects.select_related('id_estado_linea_produccion').get(pk=linea_id)
+
+    lineas = {
+        linea.id_linea_produccion: linea
+        for linea in LineaProduccion.objects.select_related('id_estado_linea_produccion')
+        if estado_de(linea).descripcion.lower() in ESTADOS_LINEA_ACTIVOS
+    }
+
+    ots = list(
+        OrdenDeTrabajo.objects.filter(
+            hora_fin_programada__gt=ahora,
+            id_estado_orden_trabajo__descripcion__iregex=r'^(%s)$' % '|'.join(ESTADOS_OT_SIN_INICIAR + ESTADOS_OT_INICIADAS)
+        ).select_related('id_orden_produccion', 'id_estado_orden_trabajo')
+    )
+    sin_iniciar = [ot for ot in ots if ot.id_estado_orden_trabajo.descripcion.lower() in ESTADOS_OT_SIN_INICIAR]
+    iniciadas = [ot for ot in ots if ot.id_estado_orden_trabajo.descripcion.lower() in ESTADOS_OT_INICIADAS]
+
+    # (producto, línea) -> unidades por hora, solo para líneas activas
+    capacidad = {
+        (r["id_producto_id"], r["id_linea_produccion_id"]): r["cant_por_hora"]
+        for r in ProductoLinea.objects.filter(
+            id_producto_id__in={ot.id_orden_produccion.id_producto_id for ot in sin_iniciar},
+            id_linea_produccion_id__in=lineas,
+            cant_por_hora__gt=0
+        ).values("id_producto_id", "id_linea_produccion_id", "cant_por_hora")
+    }
+
+    print(f"⚡ Reprogramación reactiva: línea {linea_cambiada.id_linea_produccion} "
+          f"'{estado_de(linea_cambiada).descripcion}'. "
+          f"{len(sin_iniciar)} OTs sin iniciar, {len(iniciadas)} en curso, {len(lineas)} líneas activas.")
+
+    por_dia = {}
+    for ot in sin_iniciar:
+        por_dia.setdefault(timezone.localtime(ot.hora_inicio_programada).date(), []).append(ot)
+
+    horizonte = parametros_solver()["horizonte_minutos"]
+    cambios, sin_lugar, sin_reprogramar, estados = [], [], [], []
+    dias = sorted(por_dia.items())
+    for i, (dia, ots_dia) in enumerate(dias):
+        restante = REPROGRAMACION_MAX_SECONDS - (reloj.perf_counter() - inicio)
+        if restante <= 0:
+            print(f"   - {dia}: sin tiempo ({len(ots_dia)} OTs quedan como están).")
+            estados.append("SIN_TIEMPO")
+            sin_reprogramar += ots_dia
+            continue
+        base = timezone.make_aware(datetime.combine(dia, time(6, 0)))
+        ocupadas = [
+            ot for ot in iniciadas
+            if ot.id_linea_produccion_id in lineas and timezone.localtime(ot.hora_fin_programada).date() == dia
+        ]
+        estado, cambios_dia, sin_lugar_dia = _resolver_dia(
+            ots_dia, ocupadas, lineas, capacidad, base, ahora, horizonte, max_segundos=restante / (len(dias) - i)
+        )
+        estados.append(estado)
+        cambios += cambios_dia
+        sin_lugar += sin_lugar_dia
+
+    movidas = [c for c in cambios if c["cambio"]]
+    if movidas and not simular:
+        with transaction.atomic():
+            bulk_update_with_history(
+                [c["ot"] for c in movidas],
+                OrdenDeTrabajo,
+                ['id_linea_produccion', 'hora_inicio_programada', 'hora_fin_programada']
+            )
+
+    segundos = round(reloj.perf_counter() - inicio, 3)
+    print(f"⚡ {len(movidas)} OTs reprogramadas, {len(sin_lugar)} sin lugar, {len(sin_reprogramar)} sin reprogramar, en {segundos}s"
+          f"{' [SIMULACIÓN]' if simular else ''}.")
+
+    return {
+        "linea": linea_cambiada.id_linea_produccion,
+        "estado_linea": estado_de(linea_cambiada).descripcion,
+        "simulacion": simular,
+        "segundos": segundos,
+        "estados_solver": estados,
+        "ots": [
+            {
+                "id_orden_trabajo": c["ot"].id_orden_trabajo,
+                "id_orden_produccion": c["ot"].id_orden_produccion_id,
+                "linea_anterior": c["linea_anterior"],
+                "linea": c["ot"].id_linea_produccion_id,
+                "hora_inicio_programada": c["ot"].hora_inicio_programada,
+                "hora_fin_programada": c["ot"].hora_fin_programada,
+                "cambio": c["cambio"],
+            }
+            for c in cambios
+        ],
+        "sin_lugar": [ot.id_orden_trabajo for ot in sin_lugar],
+        "sin_reprogramar": [ot.id_orden_trabajo for ot in sin_reprogramar],
+    }
+
+
+def _minutos(desde: datetime, hasta: datetime) -> int:
+    return math.ceil((hasta - desde).total_seconds() / 60)
+
+
+def _resolver_dia(ots, ocupadas, lineas, capacidad, base: datetime, ahora: datetime, horizonte: int,
+                  max_segundos: float = REPROGRAMACION_MAX_SECONDS):
+    liberacion = min(max(0, _minutos(base, ahora)), horizonte)
+    model = cp_model.CpModel()
+    intervals_por_linea = {linea_id: [] for linea_id in lineas}
+
+    # OTs en curso: su línea está ocupada hasta su fin programado
+    for ot in ocupadas:
+        fin = min(max(liberacion, _minutos(base, ot.hora_fin_programada)), horizonte)
+        if fin > liberacion:
+            intervals_por_linea[ot.id_linea_produccion_id].append(
+                model.NewFixedSizeIntervalVar(liberacion, fin - liberacion, f"ocupada_{ot.id_orden_trabajo}")
+            )
+
+    variables = []
+    objetivo = []
+    for ot in ots:
+        producto_id = ot.id_orden_produccion.id_producto_id
+        fin_ot = model.NewIntVar(0, horizonte, f"fin_{ot.id_orden_trabajo}")
+        sin_lugar = model.NewBoolVar(f"sin_lugar_{ot.id_orden_trabajo}")
+        inicio_previo = _minutos(base, ot.hora_inicio_programada)
+        alternativas = []
+        for linea_id in lineas:
+            cant_por_hora = capacidad.get((producto_id, linea_id))
+            if not cant_por_hora:
+                continue
+            duracion = math.ceil(60 * ot.cantidad_programada / cant_por_hora)
+            if liberacion + duracion > horizonte:
+                continue
+            lit = model.NewBoolVar(f"ot{ot.id_orden_trabajo}_l{linea_id}")
+            start = model.NewIntVar(liberacion, horizonte - duracion, f"start_{ot.id_orden_trabajo}_{linea_id}")
+            interval = model.NewOptionalFixedSizeIntervalVar(start, duracion, lit, f"interval_{ot.id_orden_trabajo}_{linea_id}")
+            intervals_por_linea[linea_id].append(interval)
+            model.Add(fin_ot == start + duracion).OnlyEnforceIf(lit)
+            if linea_id != ot.id_linea_produccion_id:
+                objetivo.append(lit * PENALIDAD_CAMBIO_LINEA)
+
+            # Pista: la OT sigue donde estaba (si su línea sigue activa)
+            es_previa = linea_id == ot.id_linea_produccion_id
+            model.AddHint(lit, es_previa)
+            if es_previa and liberacion <= inicio_previo <= horizonte - duracion:
+                model.AddHint(start, inicio_previo)
+            alternativas.append({"linea_id": linea_id, "lit": lit, "start": start, "duracion": duracion})
+
+        model.AddExactlyOne([a["lit"] for a in alternativas] + [sin_lugar])
+        model.AddHint(sin_lugar, False)
+        objetivo.append(sin_lugar * PENALIDAD_SIN_LUGAR)
+        if ot.id_linea_produccion_id in lineas:
+            # Su línea sigue activa: lo mejor es no moverla
+            fin_previo = min(max(0, _minutos(base, ot.hora_fin_programada)), horizonte)
+            desvio = model.NewIntVar(0, horizonte, f"desvio_{ot.id_orden_trabajo}")
+            model.AddAbsEquality(desvio, fin_ot - fin_previo)
+            model.Add(desvio == 0).OnlyEnforceIf(sin_lugar)
+            objetivo.append(desvio * PESO_DESVIO)
+        else:
+            model.Add(fin_ot == 0).OnlyEnforceIf(sin_lugar)
+            objetivo.append(fin_ot)
+        variables.append((ot, sin_lugar, alternativas))
+
+    for intervals in intervals_por_linea.values():
+        model.AddNoOverlap(intervals)
+    model.Minimize(sum(objetivo))
+
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = max_segundos
+    solver.parameters.num_search_workers = REPROGRAMACION_WORKERS
+    status = solver.Solve(model)
+    print(f"   - {base.date()}: {solver.StatusName(status)} en {solver.WallTime():.2f}s ({len(ots)} OTs).")
+
+    if status not in (cp_model.FEASIBLE, cp_model.OPTIMAL):
+        return solver.StatusName(status), [], list(ots)
+
+    cambios, sin_lugar = [], []
+    for ot, sin_lugar_var, alternativas in variables:
+        if solver.Value(sin_lugar_var):
+            sin_lugar.append(ot)
+            continue
+        elegida = next(a for a in alternativas if solver.Value(a["lit"]))
+        linea_anterior = ot.id_linea_produccion_id
+        inicio = base + timedelta(minutes=solver.Value(elegida["start"]))
+        fin = inicio + timedelta(minutes=elegida["duracion"])
+        cambio = (
+            elegida["linea_id"] != linea_anterior
+            or inicio != ot.hora_inicio_programada
+            or fin != ot.hora_fin_programada
+        )
+        ot.id_linea_produccion = lineas[elegida["linea_id"]]
+        ot.hora_inicio_programada = inicio
+        ot.hora_fin_programada = fin
+        cambios.append({"ot": ot, "linea_anterior": linea_anterior, "cambio": cambio})
+    return solver.StatusName(status), cambios, sin_lugar
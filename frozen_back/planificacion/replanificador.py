@@ -9,6 +9,8 @@ import math
 from ventas.models import OrdenVenta, EstadoVenta
 from recetas.models import ProductoLinea
 from produccion.models import EstadoOrdenProduccion, OrdenProduccion, CalendarioProduccion, OrdenProduccionPegging, EstadoOrdenTrabajo
+from .capacidad import CapacidadLineas
+from .calendario import CalendarioLaboral
 # Constantes
 HORAS_LABORABLES_POR_DIA = 16
 DIAS_BUFFER_ENTREGA_PT = 1  # Días de buffer entre fin de producción y entrega al cliente
@@ -96,6 +98,14 @@ def replanificar_ops_por_capacidad(
     
     print(f"   > Encontradas {len(ops_a_replanificar)} OPs elegibles para replanificar.")
     
+    # Capacidad de líneas desde la fecha mínima (1 consulta; se vuelca al final)
+    capacidad = CapacidadLineas(
+        fecha_desde=fecha_minima_replanificacion,
+        estados_op=estados_activos_para_replanificar,
+        horas_por_dia=HORAS_LABORABLES_POR_DIA
+    )
+    calendario = CalendarioLaboral.cargar()
+
     for op in ops_a_replanificar:
         
         cantidad_a_producir_restante = op.cantidad_pendiente
@@ -119,11 +129,8 @@ def replanificar_ops_por_capacidad(
         # Obtener la fecha a partir de la cual se considerará 'futuro'
         fecha_borrado_minima = fecha_minima_replanificacion 
         
-        CalendarioProduccion.objects.filter(
-            id_orden_produccion=op,
-            # 🚨 FILTRO CLAVE: Solo borra las reservas en o después de la fecha mínima
-            fecha__gte=fecha_borrado_minima 
-        ).delete()
+        # 🚨 FILTRO CLAVE: Solo libera las reservas en o después de la fecha mínima
+        capacidad.liberar_op(op, desde=fecha_borrado_minima)
         print(f"     > Eliminadas reservas a partir de: {fecha_borrado_minima}.")
         
         # 5. Determinar Fecha de Inicio Mínima (punto de partida)
@@ -139,7 +146,7 @@ def replanificar_ops_por_capacidad(
         horas_pendientes = horas_necesarias_totales 
         fecha_a_buscar = fecha_inicio_minima_real
         
-        while fecha_a_buscar.weekday() >= 5: fecha_a_buscar += timedelta(days=1) 
+        fecha_a_buscar = calendario.proximo_habil(fecha_a_buscar)
 
         fecha_inicio_real_asignada = None
         ultimo_dia_trabajado = None
@@ -167,30 +174,13 @@ def replanificar_ops_por_capacidad(
         
         # --- INICIO LÓGICA DE CALENDAR WALK ---
         while horas_pendientes > 0 and cantidad_pendiente_op > 0:
-            horas_libres_cuello_botella = HORAS_LABORABLES_POR_DIA
             lineas_ids_producto = [c.id_linea_produccion_id for c in capacidades_linea]
-            
-            # Carga existente de OPs activas
-            carga_existente = CalendarioProduccion.objects.filter(
-                id_linea_produccion_id__in=lineas_ids_producto,
-                fecha=fecha_a_buscar,
-                id_orden_produccion__id_estado_orden_produccion__in=estados_activos_para_replanificar
-            ).values('id_linea_produccion_id').annotate(
-                total_reservado=Sum('horas_reservadas')
-            ).values('id_linea_produccion_id', 'total_reservado')
-            
-            carga_por_linea = {c['id_linea_produccion_id']: float(c['total_reservado']) for c in carga_existente}
-
-            for linea_id in lineas_ids_producto:
-                carga_dia = carga_por_linea.get(linea_id, 0.0)
-                horas_libres_linea = max(0, HORAS_LABORABLES_POR_DIA - carga_dia)
-                horas_libres_cuello_botella = min(horas_libres_cuello_botella, horas_libres_linea)
-
+            # Carga existente de OPs activas (desde el ledger en memoria)
+            horas_libres_cuello_botella = capacidad.horas_libres(lineas_ids_producto, fecha_a_buscar)
             horas_libres_enteras = math.floor(horas_libres_cuello_botella)
 
             if horas_libres_enteras <= 0:
-                fecha_a_buscar += timedelta(days=1)
-                while fecha_a_buscar.weekday() >= 5: fecha_a_buscar += timedelta(days=1)
+                fecha_a_buscar = calendario.sumar_habiles(fecha_a_buscar, 1)
                 continue
                     
             horas_a_reservar_hoy = min(horas_pendientes, horas_libres_enteras) 
@@ -206,7 +196,7 @@ def replanificar_ops_por_capacidad(
                     reservas_a_crear_bulk.append(
                         CalendarioProduccion(
                             id_orden_produccion=op, 
-                            id_linea_produccion=cap_linea.id_linea_produccion,
+                            id_linea_produccion_id=cap_linea.id_linea_produccion_id,
                             fecha=fecha_a_buscar,
                             horas_reservadas=horas_a_reservar_hoy,
                             cantidad_a_producir=cantidad_real_linea
@@ -226,8 +216,7 @@ def replanificar_ops_por_capacidad(
                 horas_pendientes = 0 
                 break
 
-            fecha_a_buscar += timedelta(days=1)
-            while fecha_a_buscar.weekday() >= 5: fecha_a_buscar += timedelta(days=1)
+            fecha_a_buscar = calendario.sumar_habiles(fecha_a_buscar, 1)
             
             if cantidad_pendiente_op > 0:
                 # Recalcular horas pendientes en base a la cantidad restante
@@ -240,8 +229,7 @@ def replanificar_ops_por_capacidad(
             fecha_inicio_real_asignada = fecha_inicio_minima_real
 
         fecha_fin_real_asignada = ultimo_dia_trabajado if ultimo_dia_trabajado else fecha_inicio_real_asignada
-        while fecha_fin_real_asignada.weekday() >= 5:
-             fecha_fin_real_asignada -= timedelta(days=1)
+        fecha_fin_real_asignada = calendario.anterior_habil(fecha_fin_real_asignada)
         if fecha_fin_real_asignada < fecha_inicio_real_asignada:
             fecha_fin_real_asignada = fecha_inicio_real_asignada
 
@@ -250,7 +238,7 @@ def replanificar_ops_por_capacidad(
         # No cambiamos el estado aquí, se mantiene 'Planificada', 'En espera' o 'Pendiente de inicio'
         op.save(update_fields=['fecha_planificada', 'fecha_fin_planificada'])
         
-        CalendarioProduccion.objects.bulk_create(reservas_a_crear_bulk)
+        capacidad.registrar(reservas_a_crear_bulk)
         
         print(f"     ✅ OP {op.id_orden_produccion} REPLANIFICADA. Nuevo rango: {op.fecha_planificada.date()} a {op.fecha_fin_planificada}.")
 
@@ -265,8 +253,7 @@ def replanificar_ops_por_capacidad(
             nueva_fecha_entrega_sugerida_date = op.fecha_fin_planificada + timedelta(days=dias_totales_margen)
             
             # Asegurar que el día sugerido sea laborable
-            while nueva_fecha_entrega_sugerida_date.weekday() >= 5:
-                nueva_fecha_entrega_sugerida_date += timedelta(days=1) 
+            nueva_fecha_entrega_sugerida_date = calendario.proximo_habil(nueva_fecha_entrega_sugerida_date)
 
             # 2. Obtener la fecha de entrega original de la OV como DATE
             # Esto resuelve el TypeError (date vs datetime), ya que ov.fecha_entrega es un DateTimeField
@@ -295,5 +282,8 @@ def replanificar_ops_por_capacidad(
             # 6. Guardar los cambios en la OV
             ov.save(update_fields=campos_a_actualizar)
 
+    borradas, creadas = capacidad.guardar()
+    print(f"\n   > Calendario de producción: {borradas} reservas borradas, {creadas} creadas.")
+
     print("\n--- REPLANIFICACIÓN POR CAPACIDAD FINALIZADA ---")
     return True
\ No newline at end of file
@@ -0,0 +1,93 @@
+from rest_framework import serializers
+from .models import DiaNoLaborable, TrabajoPlanificacion, SolucionSolver
+
+
+class DiaNoLaborableSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DiaNoLaborable
+        fields = ['id_dia_no_laborable', 'fecha', 'tipo', 'descripcion']
+
+
+class TrabajoPlanificacionSerializer(serializers.ModelSerializer):
+    """Estado y progreso de un trabajo (el resultado va aparte: puede ser grande)."""
+    tipo_display = serializers.CharField(source='get_tipo_display', read_only=True)
+
+    class Meta:
+        model = TrabajoPlanificacion
+        fields = [
+            'id_trabajo_planificacion', 'tipo', 'tipo_display', 'estado', 'parametros',
+            'progreso', 'fase_actual', 'fases', 'error', 'worker',
+            'fecha_creacion', 'fecha_inicio', 'fecha_fin'
+        ]
+        read_only_fields = fields
+
+
+class SolucionSolverSerializer(serializers.ModelSerializer):
+    """Parámetros y estadísticas de una corrida del solver (sin las tandas: pueden ser miles)."""
+
+    class Meta:
+        model = SolucionSolver
+        exclude = ['tandas']
+        read_only_fields = [f.name for f in SolucionSolver._meta.fields]
+
+
+class ProductoOvAdicionalSerializer(serializers.Serializer):
+    producto = serializers.IntegerField()
+    cantidad = serializers.IntegerField(min_value=1)
+
+
+class OvAdicionalSerializer(serializers.Serializer):
+    fecha_entrega = serializers.DateField()
+    prioridad = serializers.IntegerField(required=False)
+    productos = ProductoOvAdicionalSerializer(many=True, allow_empty=False)
+
+
+class EscenarioSerializer(serializers.Serializer):
+    """Cambios de un escenario "qué pasa si" (ver planificacion/escenarios.py)."""
+    nombre = serializers.CharField(max_length=100, required=False)
+    horas_laborables_por_dia = serializers.IntegerField(min_value=1, max_value=24, required=False)
+    # {proveedor_id: días}
+    lead_times = serializers.DictField(child=serializers.IntegerField(min_value=0), required=False)
+    lineas_fuera_de_servicio = serializers.ListField(child=serializers.IntegerField(), required=False)
+    ovs_adicionales = OvAdicionalSerializer(many=True, required=False)
+
+    def validate_lead_times(self, value):
+        if not all(str(proveedor_id).isdigit() for proveedor_id in value):
+            raise serializers.ValidationError("Las claves deben ser IDs de proveedor.")
+        return {int(proveedor_id): dias for proveedor_id, dias in value.items()}
+
+
+def _validar_escenarios(value):
+    from .escenarios import validar_escenarios
+
+    try:
+        validar_escenarios(value)
+    except ValueError as e:
+        raise serializers.ValidationError(str(e))
+    return value
+
+
+class SimularEscenariosSerializer(serializers.Serializer):
+    fecha = serializers.DateField(required=False)
+    escenarios = EscenarioSerializer(many=True, allow_empty=False)
+
+    def validate_escenarios(self, value):
+        return _validar_escenarios(value)
+
+
+class EncolarTrabajoSerializer(serializers.Serializer):
+    tipo = serializers.ChoiceField(choices=TrabajoPlanificacion.Tipo.choices)
+    fecha = serializers.DateField(required=False)
+    productos = serializers.ListField(child=serializers.IntegerField(), required=False)
+    # Solo MRP_Y_SOLVER y SOLVER: días hábiles del horizonte rodante del solver
+    dias_horizonte = serializers.IntegerField(min_value=1, max_value=15, required=False)
+    # Solo ESCENARIOS (obligatorio)
+    escenarios = EscenarioSerializer(many=True, allow_empty=False, required=False)
+
+    def validate_escenarios(self, value):
+        return _validar_escenarios(value)
+
+    def validate(self, data):
+        if data['tipo'] == TrabajoPlanificacion.Tipo.ESCENARIOS and not data.get('escenarios'):
+            raise serializers.ValidationError({"escenarios": "Obligatorio para simular escenarios."})
+        return data
@@ -0,0 +1,85 @@
+import threading
+from contextlib import contextmanager
+
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from ventas.models import OrdenVentaProducto
+from stock.models import LoteProduccion, LoteMateriaPrima, ReservaStock
+from compras.models import OrdenCompra, OrdenCompraMateriaPrima
+from .models import MarcaPendienteMRP, DiaNoLaborable
+from .calendario import invalidar_calendario_laboral
+
+_estado = threading.local()
+
+
+@contextmanager
+def suspender_marcas():
+    """
+    Mientras dura el bloque, los cambios NO marcan productos/MPs como pendientes.
+    Lo usa el propio MRP al aplicar su plan (ya tiene en cuenta lo que escribe).
+    """
+    anterior = getattr(_estado, "suspendidas", False)
+    _estado.suspendidas = True
+    try:
+        yield
+    finally:
+        _estado.suspendidas = anterior
+
+
+def marcar_pendientes(tipo, ids, motivo):
+    """Agrega (o refresca la fecha de) las marcas del dirty set del MRP."""
+    if getattr(_estado, "suspendidas", False):
+        return
+    marcas = [MarcaPendienteMRP(tipo=tipo, id_referencia=i, motivo=motivo) for i in set(ids) if i is not None]
+    if marcas:
+        MarcaPendienteMRP.objects.bulk_create(
+            marcas,
+            update_conflicts=True,
+            unique_fields=['tipo', 'id_referencia'],
+            update_fields=['motivo', 'fecha_marca']
+        )
+
+
+@receiver([post_save, post_delete], sender=OrdenVentaProducto)
+def marcar_por_linea_ov(sender, instance, **kwargs):
+    marcar_pendientes(MarcaPendienteMRP.Tipo.PRODUCTO, [instance.id_producto_id], "orden_venta")
+
+
+@receiver([post_save, post_delete], sender=LoteProduccion)
+def marcar_por_lote_produccion(sender, instance, **kwargs):
+    marcar_pendientes(MarcaPendienteMRP.Tipo.PRODUCTO, [instance.id_producto_id], "lote_produccion")
+
+
+@receiver([post_save, post_delete], sender=LoteMateriaPrima)
+def marcar_por_lote_mp(sender, instance, **kwargs):
+    marcar_pendientes(MarcaPendienteMRP.Tipo.MATERIA_PRIMA, [instance.id_materia_prima_id], "lote_materia_prima")
+
+
+@receiver([post_save, post_delete], sender=ReservaStock)
+def marcar_por_reserva_stock(sender, instance, **kwargs):
+    if getattr(_estado, "suspendidas", False):
+        return
+    if ReservaStock.id_lote_produccion.is_cached(instance):
+        producto_id = instance.id_lote_produccion.id_producto_id
+    else:
+        producto_id = LoteProduccion.objects.filter(
+            pk=instance.id_lote_produccion_id
+        ).values_list('id_producto_id', flat=True).first()
+    marcar_pendientes(MarcaPendienteMRP.Tipo.PRODUCTO, [producto_id], "reserva_stock")
+
+
+@receiver(post_save, sender=OrdenCompra)
+@receiver(pre_delete, sender=OrdenCompra)  # pre: después del borrado ya no están sus ítems
+def marcar_por_orden_compra(sender, instance, **kwargs):
+    if getattr(_estado, "suspendidas", False):
+        return
+    mps_ids = OrdenCompraMateriaPrima.objects.filter(
+        id_orden_compra_id=instance.pk
+    ).values_list('id_materia_prima_id', flat=True)
+    marcar_pendientes(MarcaPendienteMRP.Tipo.MATERIA_PRIMA, mps_ids, "orden_compra")
+
+
+@receiver([post_save, post_delete], sender=DiaNoLaborable)
+def invalidar_calendario_por_dia_no_laborable(sender, instance, **kwargs):
+    invalidar_calendario_laboral()
@@ -0,0 +1,415 @@
+"""
+Modelo CP-SAT del solver táctico, sin dependencias de Django: recibe las
+tareas del calendario ya "explotadas" en tandas (datos simples) y devuelve
+la decisión de cada tanda. Así se puede resolver en otros procesos.
+
+    tarea = {
+        "cal": id de la tarea (CalendarioProduccion), "linea": id de la línea,
+        "objetivo": cantidad a producir (con mínimos forzados),
+        "max_minutos": minutos reservados por el MRP,
+        "tandas": [{"t", "tamano", "duracion", "pista": None | {"activa", "inicio"}}],
+        "dia": índice del día de la tarea (solo en el horizonte rodante),
+    }
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from ortools.sat.python import cp_model
+
+HORIZONTE_MINUTOS = 16 * 60
+# En el horizonte rodante cada día ocupa su propia ventana de la línea de tiempo
+MINUTOS_DIA = 24 * 60
+# Con menos tandas que esto, los subproblemas se resuelven en el mismo proceso
+# (crear el pool cuesta más que resolverlos)
+TANDAS_MINIMAS_PARALELO = 200
+
+# Estados de CP-SAT de "peor" a "mejor", para combinar subproblemas
+_ORDEN_ESTADOS = ["MODEL_INVALID", "INFEASIBLE", "UNKNOWN", "FEASIBLE", "OPTIMAL"]
+
+
+def subproblemas_independientes(tareas, vinculos=()):
+    """
+    Agrupa las tareas en subproblemas que no comparten restricciones.
+    Hoy lo único que une tareas es el NoOverlap de cada línea, así que hay
+    un subproblema por línea. 'vinculos' son pares de líneas que una
+    restricción futura (entre líneas) obligaría a resolver juntas.
+    """
+    padre = {}
+
+    def raiz(linea):
+        padre.setdefault(linea, linea)
+        while padre[linea] != linea:
+            padre[linea] = padre[padre[linea]]
+            linea = padre[linea]
+        return linea
+
+    for linea_a, linea_b in vinculos:
+        padre[raiz(linea_a)] = raiz(linea_b)
+
+    subproblemas = {}
+    for tarea in tareas:
+        subproblemas.setdefault(raiz(tarea["linea"]), []).append(tarea)
+    return list(subproblemas.values())
+
+
+def resolver(tareas, max_segundos, max_segundos_subproblema, workers, vinculos=(), compacto=True, dias=1,
+             horizonte=HORIZONTE_MINUTOS, ocupado=None):
+    """
+    Resuelve las tareas por subproblemas independientes (en paralelo si
+    vale la pena) o, si todo está vinculado, con el modelo monolítico.
+    Resueltos en el mismo proceso, los subproblemas comparten 'max_segundos'.
+    'compacto' elige el modelo de bloques de tandas (ver _armar_tarea_compacta)
+    en lugar de un intervalo por tanda. Con 'dias' > 1 arma el horizonte
+    rodante (ver _armar_tarea_horizonte) y los valores son (dia, inicio, fin),
+    con dia = None si la tanda no entra en el horizonte. 'horizonte' son los
+    minutos de la ventana de cada día.
+
+    En el horizonte solo se deciden las tareas del primer día: las de los
+    días siguientes ya están reservadas y cuentan como capacidad ocupada
+    (no figuran en los valores), igual que 'ocupado' = {(linea, dia): minutos}
+    con las reservas que no vienen como tarea. Lo pospuesto solo llena el
+    hueco que queda.
+
+    Devuelve {"estado", "objetivo", "cota", "gap", "segundos", "segundos_primera_solucion",
+    "conflictos", "ramas", "variables", "restricciones", "intervalos", "subproblemas",
+    "estadisticas" (una entrada por subproblema), "valores": {(cal, t): (activa, inicio, fin)}}.
+    """
+    inicio = time.perf_counter()
+    subproblemas = subproblemas_independientes(tareas, vinculos)
+
+    if len(subproblemas) <= 1:
+        resultados = [_resolver_subproblema(tareas, max_segundos, workers, compacto, dias, horizonte, ocupado)]
+    elif sum(len(t["tandas"]) for t in tareas) < TANDAS_MINIMAS_PARALELO:
+        # Uno detrás del otro: 'max_segundos' es el tope de TODOS. Cada uno
+        # recibe su parte de lo que queda (lo que no usó uno lo aprovechan
+        # los siguientes), sin pasarse de 'max_segundos_subproblema'.
+        resultados = []
+        for i, subproblema in enumerate(subproblemas):
+            restante = max(0.0, max_segundos - (time.perf_counter() - inicio))
+            limite = min(max_segundos_subproblema, restante / (len(subproblemas) - i))
+            resultados.append(
+                _resolver_subproblema(subproblema, limite, workers, compacto, dias, horizonte, ocupado)
+            )
+    else:
+        procesos = min(len(subproblemas), os.cpu_count() or 1)
+        workers_por_proceso = max(1, workers // procesos)
+        # Los más grandes primero, para repartir mejor
+        subproblemas.sort(key=lambda s: -sum(len(t["tandas"]) for t in s))
+        with ProcessPoolExecutor(max_workers=procesos) as pool:
+            resultados = list(pool.map(
+                _resolver_subproblema,
+                subproblemas,
+                [max_segundos_subproblema] * len(subproblemas),
+                [workers_por_proceso] * len(subproblemas),
+                [compacto] * len(subproblemas),
+                [dias] * len(subproblemas),
+                [horizonte] * len(subproblemas),
+                [ocupado] * len(subproblemas),
+            ))
+
+    estado = min((r["estado"] for r in resultados), key=_ORDEN_ESTADOS.index)
+    factible = estado in ("FEASIBLE", "OPTIMAL")
+    primeras = [r["segundos_primera_solucion"] for r in resultados]
+    valores = {}
+    for r in resultados:
+        valores.update(r.pop("valores"))
+    objetivo = sum(r["objetivo"] for r in resultados) if factible else None
+    cota = sum(r["cota"] for r in resultados) if factible else None
+    return {
+        "estado": estado,
+        "objetivo": objetivo,
+        "cota": cota,
+        "gap": _gap(objetivo, cota),
+        "segundos": round(time.perf_counter() - inicio, 3),
+        # El último subproblema en tener solución
+        "segundos_primera_solucion": max(primeras) if factible and None not in primeras else None,
+        "conflictos": sum(r["conflictos"] for r in resultados),
+        "ramas": sum(r["ramas"] for r in resultados),
+        "variables": sum(r["variables"] for r in resultados),
+        "restricciones": sum(r["restricciones"] for r in resultados),
+        "intervalos": sum(r["intervalos"] for r in resultados),
+        "subproblemas": len(subproblemas),
+        "estadisticas": resultados,
+        "valores": valores if factible else {},
+    }
+
+
+def _gap(objetivo, cota):
+    """Gap relativo entre la mejor solución y la mejor cota (0 = óptimo probado)."""
+    if objetivo is None or cota is None:
+        return None
+    return round(abs(cota - objetivo) / max(1.0, abs(objetivo)), 6)
+
+
+class _PrimeraSolucion(cp_model.CpSolverSolutionCallback):
+    """Registra cuándo encontró el solver la primera solución factible."""
+
+    def __init__(self):
+        super().__init__()
+        self.segundos = None
+
+    def on_solution_callback(self):
+        if self.segundos is None:
+            self.segundos = round(self.WallTime(), 3)
+
+
+def _resolver_subproblema(tareas, max_segundos, workers, compacto=True, dias=1, horizonte=HORIZONTE_MINUTOS,
+                          ocupado=None):
+    model = cp_model.CpModel()
+    intervals_por_linea = {}
+    all_end_vars = []
+    produccion = []
+    lectores = []
+    suma_total_objetivo_global = 0
+
+    modeladas = tareas
+    # (linea, dia) -> largos de los bloques, para la cota de capacidad del horizonte
+    largos_por_dia = {}
+    # (linea, dia) -> minutos ya reservados en los días siguientes del horizonte
+    ocupado = dict(ocupado or {})
+    if dias > 1:
+        for tarea in tareas:
+            if tarea["dia"] > 0:
+                clave = (tarea["linea"], tarea["dia"])
+                ocupado[clave] = ocupado.get(clave, 0) + sum(tanda["duracion"] for tanda in tarea["tandas"])
+        modeladas = [tarea for tarea in tareas if tarea["dia"] == 0]
+        armar_tarea = lambda model, tarea: _armar_tarea_horizonte(model, tarea, dias, largos_por_dia, horizonte)
+    else:
+        armar = _armar_tarea_compacta if compacto else _armar_tarea_por_tanda
+        armar_tarea = lambda model, tarea: armar(model, tarea, horizonte)
+    for tarea in modeladas:
+        intervals, ends, producido, leer = armar_tarea(model, tarea)
+        intervals_por_linea.setdefault(tarea["linea"], []).extend(intervals)
+        all_end_vars += ends
+        produccion.append(producido)
+        lectores.append(leer)
+        suma_total_objetivo_global += tarea["objetivo"] * dias
+
+    for intervals in intervals_por_linea.values():
+        model.AddNoOverlap(intervals)
+    # Cota lineal por día; en los días siguientes, solo el hueco que dejan sus reservas
+    for (linea, dia), largos in largos_por_dia.items():
+        model.Add(sum(largos) <= max(0, horizonte - ocupado.get((linea, dia), 0)))
+
+    makespan = model.NewIntVar(0, (dias - 1) * MINUTOS_DIA + horizonte, "makespan")
+    if all_end_vars:
+        model.AddMaxEquality(makespan, all_end_vars)
+
+    produccion_total = model.NewIntVar(0, suma_total_objetivo_global, "produccion_total")
+    model.Add(produccion_total == sum(produccion))
+    model.Maximize(produccion_total)
+
+    solver = cp_model.CpSolver()
+    solver.parameters.max_time_in_seconds = max_segundos
+    solver.parameters.num_search_workers = workers
+    primera_solucion = _PrimeraSolucion()
+    status = solver.Solve(model, primera_solucion)
+
+    factible = status in (cp_model.FEASIBLE, cp_model.OPTIMAL)
+    valores = {}
+    if factible:
+        for leer in lectores:
+            valores.update(leer(solver))
+    objetivo = solver.ObjectiveValue() if factible else None
+    cota = solver.BestObjectiveBound() if factible else None
+    proto = model.Proto()
+    return {
+        "lineas": sorted({tarea["linea"] for tarea in tareas}),
+        "tareas": len(tareas),
+        "tandas": sum(len(tarea["tandas"]) for tarea in tareas),
+        "estado": solver.StatusName(status),
+        "objetivo": objetivo,
+        "cota": cota,
+        "gap": _gap(objetivo, cota),
+        "segundos": round(solver.WallTime(), 3),
+        "segundos_primera_solucion": primera_solucion.segundos,
+        "conflictos": solver.NumConflicts(),
+        "ramas": solver.NumBranches(),
+        # Tamaño del modelo
+        "variables": len(proto.variables),
+        "restricciones": len(proto.constraints),
+        "intervalos": sum(1 for c in proto.constraints if c.WhichOneof("constraint") == "interval"),
+        "valores": valores,
+    }
+
+
+def _armar_tarea_por_tanda(model, tarea, horizonte=HORIZONTE_MINUTOS):
+    """
+    Modelo original: un intervalo opcional (literal, inicio, fin) por tanda.
+    Devuelve (intervalos, fines, cantidad producida, lector de valores).
+    """
+    cal = tarea["cal"]
+    variables = []
+    for tanda in tarea["tandas"]:
+        t = tanda["t"]
+        lit = model.NewBoolVar(f"cal{cal}_t{t}")
+        start = model.NewIntVar(0, horizonte, f"start_{cal}_{t}")
+        end = model.NewIntVar(0, horizonte, f"end_{cal}_{t}")
+        interval = model.NewOptionalIntervalVar(start, tanda["duracion"], end, lit, f"interval_{cal}_{t}")
+        variables.append((tanda, lit, start, end, interval))
+
+        # Warm start: la decisión de la solución anterior como pista
+        pista = tanda["pista"]
+        if pista is not None:
+            model.AddHint(lit, pista["activa"])
+            if pista["activa"] and pista["inicio"] + tanda["duracion"] <= horizonte:
+                model.AddHint(start, pista["inicio"])
+                model.AddHint(end, pista["inicio"] + tanda["duracion"])
+
+    producido = sum(lit * tanda["tamano"] for tanda, lit, _s, _e, _i in variables)
+    # La suma de las tandas activas debe ser igual al objetivo ajustado (incluyendo mínimos forzados)
+    model.Add(producido == tarea["objetivo"])
+    # Intentamos respetar las horas reservadas en el MRP
+    model.Add(sum(lit * tanda["duracion"] for tanda, lit, _s, _e, _i in variables) <= tarea["max_minutos"])
+
+    def leer(solver):
+        return {
+            (cal, tanda["t"]): (bool(solver.Value(lit)), solver.Value(start), solver.Value(end))
+            for tanda, lit, start, end, _i in variables
+        }
+
+    return [v[4] for v in variables], [v[3] for v in variables], producido, leer
+
+
+def _armar_tarea_compacta(model, tarea, horizonte=HORIZONTE_MINUTOS):
+    """
+    Modelo compacto: las tandas iguales (mismo tamaño y duración; en la
+    práctica, todas las completas) son un único bloque contiguo con una
+    cantidad entera de tandas, y la tanda de resto otro bloque de 0 o 1.
+    Los bloques van en el orden de las tandas (el resto al final).
+
+    Como no hay ventanas de tiempo, partir un bloque o reordenarlo no hace
+    factible nada que no lo fuera: las soluciones son las mismas (a menos
+    de permutar tandas idénticas) con muchas menos variables.
+    """
+    cal = tarea["cal"]
+    grupos = {}
+    for tanda in sorted(tarea["tandas"], key=lambda tanda: tanda["t"]):
+        grupos.setdefault((tanda["tamano"], tanda["duracion"]), []).append(tanda)
+
+    bloques = []
+    for (tamano, duracion), tandas in grupos.items():
+        g = len(bloques)
+        cantidad = model.NewIntVar(0, len(tandas), f"cantidad_{cal}_{g}")
+        presente = model.NewBoolVar(f"cal{cal}_b{g}")
+        model.Add(cantidad >= 1).OnlyEnforceIf(presente)
+        model.Add(cantidad == 0).OnlyEnforceIf(presente.Not())
+        largo = model.NewIntVar(0, len(tandas) * duracion, f"largo_{cal}_{g}")
+        model.Add(largo == cantidad * duracion)
+        start = model.NewIntVar(0, horizonte, f"start_{cal}_{g}")
+        end = model.NewIntVar(0, horizonte, f"end_{cal}_{g}")
+        interval = model.NewOptionalIntervalVar(start, largo, end, presente, f"interval_{cal}_{g}")
+
+        # Ruptura de simetría: cada bloque empieza después del anterior
+        if bloques:
+            model.Add(start >= bloques[-1]["end"])
+
+        _pista_bloque(model, tandas, duracion, cantidad, presente, start, horizonte)
+
+        bloques.append({
+            "tandas": tandas, "tamano": tamano, "duracion": duracion,
+            "cantidad": cantidad, "start": start, "end": end, "interval": interval,
+        })
+
+    producido = sum(b["cantidad"] * b["tamano"] for b in bloques)
+    # La suma de las tandas activas debe ser igual al objetivo ajustado (incluyendo mínimos forzados)
+    model.Add(producido == tarea["objetivo"])
+    # Intentamos respetar las horas reservadas en el MRP
+    model.Add(sum(b["cantidad"] * b["duracion"] for b in bloques) <= tarea["max_minutos"])
+
+    def leer(solver):
+        # Las primeras 'cantidad' tandas del bloque, una detrás de otra
+        valores = {}
+        for b in bloques:
+            cantidad, inicio = solver.Value(b["cantidad"]), solver.Value(b["start"])
+            for i, tanda in enumerate(b["tandas"]):
+                if i < cantidad:
+                    ini = inicio + i * b["duracion"]
+                    valores[(cal, tanda["t"])] = (True, ini, ini + b["duracion"])
+                else:
+                    valores[(cal, tanda["t"])] = (False, 0, 0)
+        return valores
+
+    return [b["interval"] for b in bloques], [b["end"] for b in bloques], producido, leer
+
+
+def _armar_tarea_horizonte(model, tarea, dias, largos_por_dia, horizonte=HORIZONTE_MINUTOS):
+    """
+    Horizonte rodante: como el modelo compacto, pero cada bloque de tandas
+    iguales se reparte entre el día de la tarea y los siguientes del
+    horizonte (un bloque por día, cada uno dentro de la ventana de su día).
+    Ya no se exige producir todo: lo que no entra queda fuera del horizonte,
+    y producir antes vale más (peso dias - día).
+    """
+    cal, dia_tarea = tarea["cal"], tarea["dia"]
+    grupos = {}
+    for tanda in sorted(tarea["tandas"], key=lambda tanda: tanda["t"]):
+        grupos.setdefault((tanda["tamano"], tanda["duracion"]), []).append(tanda)
+
+    bloques = []
+    ultimo_por_dia = {}
+    for g, ((tamano, duracion), tandas) in enumerate(grupos.items()):
+        cantidades = []
+        for dia in range(dia_tarea, dias):
+            cantidad = model.NewIntVar(0, len(tandas), f"cantidad_{cal}_{g}_d{dia}")
+            presente = model.NewBoolVar(f"cal{cal}_b{g}_d{dia}")
+            model.Add(cantidad >= 1).OnlyEnforceIf(presente)
+            model.Add(cantidad == 0).OnlyEnforceIf(presente.Not())
+            largo = model.NewIntVar(0, len(tandas) * duracion, f"largo_{cal}_{g}_d{dia}")
+            model.Add(largo == cantidad * duracion)
+            largos_por_dia.setdefault((tarea["linea"], dia), []).append(largo)
+            desde = dia * MINUTOS_DIA
+            start = model.NewIntVar(desde, desde + horizonte, f"start_{cal}_{g}_d{dia}")
+            end = model.NewIntVar(desde, desde + horizonte, f"end_{cal}_{g}_d{dia}")
+            interval = model.NewOptionalIntervalVar(start, largo, end, presente, f"interval_{cal}_{g}_d{dia}")
+
+            # Ruptura de simetría: en cada día, los bloques en el orden de las tandas
+            if dia in ultimo_por_dia:
+                model.Add(start >= ultimo_por_dia[dia])
+            ultimo_por_dia[dia] = end
+
+            if dia == dia_tarea:
+                _pista_bloque(model, tandas, duracion, cantidad, presente, start, horizonte, desde)
+
+            cantidades.append(cantidad)
+            bloques.append({
+                "grupo": g, "dia": dia, "tandas": tandas, "tamano": tamano, "duracion": duracion,
+                "cantidad": cantidad, "start": start, "end": end, "interval": interval,
+            })
+        # Cada tanda se hace a lo sumo una vez en el horizonte
+        model.Add(sum(cantidades) <= len(tandas))
+
+    # Las horas reservadas por el MRP solo limitan el día de la tarea
+    model.Add(
+        sum(b["cantidad"] * b["duracion"] for b in bloques if b["dia"] == dia_tarea) <= tarea["max_minutos"]
+    )
+    producido = sum(b["cantidad"] * b["tamano"] * (dias - b["dia"]) for b in bloques)
+
+    def leer(solver):
+        # Las tandas del grupo, en orden, llenan primero los días más cercanos
+        valores = {(cal, tanda["t"]): (None, 0, 0) for tanda in tarea["tandas"]}
+        siguiente = {}
+        for b in bloques:
+            cantidad = solver.Value(b["cantidad"])
+            inicio = solver.Value(b["start"]) - b["dia"] * MINUTOS_DIA
+            primera = siguiente.get(b["grupo"], 0)
+            for i, tanda in enumerate(b["tandas"][primera:primera + cantidad]):
+                ini = inicio + i * b["duracion"]
+                valores[(cal, tanda["t"])] = (b["dia"], ini, ini + b["duracion"])
+            siguiente[b["grupo"]] = primera + cantidad
+        return valores
+
+    return [b["interval"] for b in bloques], [b["end"] for b in bloques], producido, leer
+
+
+def _pista_bloque(model, tandas, duracion, cantidad, presente, start, horizonte=HORIZONTE_MINUTOS, desde=0):
+    """Warm start de un bloque: cuántas de sus tandas estaban activas y desde cuándo."""
+    pistas = [tanda["pista"] for tanda in tandas if tanda["pista"] is not None]
+    if not pistas:
+        return
+    activas = [pista["inicio"] for pista in pistas if pista["activa"]]
+    model.AddHint(cantidad, len(activas))
+    model.AddHint(presente, bool(activas))
+    if activas and min(activas) + len(activas) * duracion <= horizonte:
+        model.AddHint(start, desde + min(activas))
@@ -1,3 +1,1199 @@
-from django.test import TestCase
+import contextlib
+import io
+import threading
+from datetime import date, datetime, timedelta
+from unittest import SkipTest, mock
 
-# Create your tests here.
+from django.core.cache import caches
+from django.db import connection, connections, transaction
+from django.db.models import Sum
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+
+from compras.models import OrdenCompraMateriaPrima
+from materias_primas.models import MateriaPrima, Proveedor, TipoMateriaPrima
+from produccion.models import (
+    CalendarioProduccion, EstadoOrdenProduccion, EstadoOrdenTrabajo, LineaProduccion, OrdenDeTrabajo, OrdenProduccion,
+    estado_linea_produccion
+)
+from productos.models import Producto, TipoProducto, Unidad
+from recetas.models import ProductoLinea, Receta, RecetaMateriaPrima
+from stock import services as stock_services
+from stock.models import LoteMateriaPrima, LoteProduccion, ReservaStock
+from trazabilidad.models import Configuracion
+from ventas.models import Cliente, OrdenVenta, OrdenVentaProducto, Prioridad
+from .benchmark import _crear_estados
+from . import calendario as calendario_mod
+from .calendario import (
+    CACHE_VERSIONES, CLAVE_VERSION_CALENDARIO, CalendarioLaboral, get_calendario_laboral, invalidar_calendario_laboral
+)
+from .capacidad import CapacidadLineas
+from .contexto import ContextoMRP
+from .models import DiaNoLaborable, EjecucionMRP, MarcaPendienteMRP, PasoEjecucionMRP, TrabajoPlanificacion
+from .paralelo import componentes_independientes, puede_paralelizar
+from . import planificador
+from .planificador import ejecutar_planificacion_diaria_mrp, ejecutar_planificacion_incremental_mrp
+from .planner_service import ejecutar_planificador, parametros_solver
+from . import reactivo
+from .reactivo import reprogramar_por_cambio_de_linea
+from .escenarios import KPIS_COMPARADOS, simular_escenarios
+from . import solver_tandas
+from .solver_tandas import HORIZONTE_MINUTOS, resolver, subproblemas_independientes
+from . import trabajos
+from .trabajos import correr_worker, encolar, ejecutar, marcar_colgados, tomar_siguiente
+from .views import TrabajoPlanificacionViewSet, reprogramar_linea_view, simular_escenarios_view
+
+
+HOY = date(2025, 6, 2)
+
+
+def _ops_creadas(resumen):
+    """OPs creadas sin su etiqueta (depende del orden en que se crearon)."""
+    return sorted(
+        (op["producto"], op["cantidad"], op["fecha_planificada"], op["linea_ov"])
+        for op in resumen["ops_creadas"]
+    )
+
+
+class PlantaPorFamiliasMixin:
+    """
+    Planta con FAMILIAS familias independientes: cada una tiene sus MPs (de
+    su proveedor), su línea y sus OVs, así que es un componente del MRP.
+    """
+
+    FAMILIAS = 3
+
+    def setUp(self):
+        stock_services._estado_activa_ids.clear()
+        estados = _crear_estados()
+        unidad = Unidad.objects.create(descripcion="kg")
+        tipo_producto = TipoProducto.objects.create(descripcion="Congelados")
+        tipo_mp = TipoMateriaPrima.objects.create(descripcion="Insumo")
+        cliente = Cliente.objects.create(nombre="Cliente")
+        prioridad = Prioridad.objects.create(descripcion="Normal")
+
+        # Cada familia tiene sus MPs, su línea y sus OVs: un componente por familia
+        self.familias = []
+        for familia in range(self.FAMILIAS):
+            proveedor = Proveedor.objects.create(nombre=f"Proveedor {familia}", lead_time_days=familia + 2)
+            mps = [
+                MateriaPrima.objects.create(
+                    nombre=f"MP {familia}-{i}", precio=1, id_tipo_materia_prima=tipo_mp, id_unidad=unidad,
+                    id_proveedor=proveedor, cantidad_minima_pedido=10
+                )
+                for i in range(2)
+            ]
+            LoteMateriaPrima.objects.create(
+                id_materia_prima=mps[0], cantidad=300, id_estado_lote_materia_prima=estados["lote_mp_disponible"],
+                fecha_vencimiento=HOY + timedelta(days=60)
+            )
+            linea = LineaProduccion.objects.create(
+                descripcion=f"Línea {familia}", id_estado_linea_produccion=estados["linea_disponible"]
+            )
+            productos = []
+            for i in range(2):
+                producto = Producto.objects.create(
+                    nombre=f"Producto {familia}-{i}", precio=1, id_tipo_producto=tipo_producto,
+                    id_unidad=unidad, dias_duracion=30, umbral_minimo=5
+                )
+                receta = Receta.objects.create(id_producto=producto)
+                for mp in mps:
+                    RecetaMateriaPrima.objects.create(id_receta=receta, id_materia_prima=mp, cantidad=i + 1)
+                ProductoLinea.objects.create(
+                    id_producto=producto, id_linea_produccion=linea, cant_por_hora=40, cantidad_minima=5
+                )
+                productos.append(producto)
+            LoteProduccion.objects.create(
+                id_producto=productos[0], cantidad=30, id_estado_lote_produccion=estados["lote_pt_disponible"],
+                fecha_vencimiento=HOY + timedelta(days=20)
+            )
+            for dias in (2, 4, 6):
+                ov = OrdenVenta.objects.create(
+                    id_cliente=cliente, id_estado_venta=estados["ov_creada"], id_prioridad=prioridad,
+                    fecha_entrega=timezone.make_aware(datetime.combine(HOY + timedelta(days=dias), datetime.min.time()))
+                )
+                for producto in productos:
+                    OrdenVentaProducto.objects.create(id_orden_venta=ov, id_producto=producto, cantidad=40 * dias)
+            self.familias.append({"proveedor": proveedor, "linea": linea, "productos": productos})
+
+
+class MRPEnParaleloTest(PlantaPorFamiliasMixin, TransactionTestCase):
+    """
+    El MRP en paralelo tiene que decidir lo mismo que el serial, aunque haya
+    más componentes que procesos (cada proceso del pool planifica varios).
+    Es TransactionTestCase: dentro de una transacción no se paraleliza.
+    """
+
+    def _simular(self, procesos):
+        Configuracion.objects.update_or_create(
+            nombre_clave='MRP_PROCESOS_PARALELOS', defaults={'valor': str(procesos)}
+        )
+        with contextlib.redirect_stdout(io.StringIO()):
+            return ejecutar_planificacion_diaria_mrp(HOY, simular=True)
+
+    def test_mas_componentes_que_procesos_da_lo_mismo_que_serial(self):
+        if not puede_paralelizar():
+            self.skipTest("Sin 'fork' no hay MRP en paralelo.")
+
+        serial = self._simular(1)
+        paralelo = self._simular(2)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(len(componentes_independientes(ContextoMRP(HOY, simular=True))), self.FAMILIAS)
+        self.assertEqual(paralelo["totales"], serial["totales"])
+        self.assertEqual(_ops_creadas(paralelo), _ops_creadas(serial))
+        self.assertGreater(len(serial["ops_creadas"]), 0)
+
+
+    def test_el_componente_copia_solo_lo_suyo_y_no_toca_el_contexto(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            ctx = ContextoMRP(HOY, simular=True)
+        componentes = componentes_independientes(ctx)
+        ops_antes = {op_id: op.cantidad for op_id, op in ctx.ops.items()}
+        lineas_antes = {pk: linea.cantidad for pk, linea in ctx.lineas.items()}
+        stock_antes = dict(ctx.stock_real_mp)
+
+        componente = ctx.componente(componentes[0])
+
+        self.assertEqual(componente.productos, set(componentes[0]))
+        self.assertTrue(all(op.id_producto_id in componente.productos for op in componente.ops.values()))
+        self.assertLess(len(componente.stock_real_mp), len(ctx.stock_real_mp))
+        # Lo acotado es una copia; lo de solo lectura se comparte
+        for op_id, op in componente.ops.items():
+            self.assertIsNot(op, ctx.ops[op_id])
+            op.cantidad += 1
+        for linea in componente.lineas.values():
+            linea.cantidad += 1
+        for mp_id in componente.stock_real_mp:
+            componente.stock_real_mp[mp_id] = 0
+        self.assertIsNot(componente.capacidad, ctx.capacidad)
+        self.assertIs(componente.explosion, ctx.explosion)
+        self.assertEqual({op_id: op.cantidad for op_id, op in ctx.ops.items()}, ops_antes)
+        self.assertEqual({pk: linea.cantidad for pk, linea in ctx.lineas.items()}, lineas_antes)
+        self.assertTrue(componente.lineas)
+        self.assertEqual(ctx.stock_real_mp, stock_antes)
+
+
+class CapacidadLineasTest(TestCase):
+    """Ledger de capacidad: lo que ve en memoria tiene que coincidir con lo que guarda."""
+
+    HORAS_POR_DIA = 16
+
+    def setUp(self):
+        self.planificada = EstadoOrdenProduccion.objects.create(descripcion="Planificada")
+        cancelada = EstadoOrdenProduccion.objects.create(descripcion="Cancelado")
+        estado_linea = estado_linea_produccion.objects.create(descripcion="Disponible")
+        self.linea_1 = LineaProduccion.objects.create(descripcion="Línea 1", id_estado_linea_produccion=estado_linea)
+        self.linea_2 = LineaProduccion.objects.create(descripcion="Línea 2", id_estado_linea_produccion=estado_linea)
+        self.dia_1, self.dia_2 = HOY, HOY + timedelta(days=1)
+
+        self.op = self._op(self.planificada)
+        self._fila(self.op, self.linea_1, self.dia_1, 4)
+        self._fila(self.op, self.linea_1, self.dia_2, 6)
+        self._fila(self.op, self.linea_1, HOY - timedelta(days=1), 8)  # antes de 'fecha_desde'
+        self.op_cancelada = self._op(cancelada)
+        self._fila(self.op_cancelada, self.linea_1, self.dia_1, 3)  # estado que no cuenta
+
+    def _op(self, estado):
+        return OrdenProduccion.objects.create(cantidad=10, id_estado_orden_produccion=estado)
+
+    def _fila(self, op, linea, fecha, horas, guardar=True):
+        fila = CalendarioProduccion(
+            id_orden_produccion=op, id_linea_produccion=linea, fecha=fecha, horas_reservadas=horas
+        )
+        if guardar:
+            fila.save()
+        return fila
+
+    def _capacidad(self):
+        return CapacidadLineas(HOY, [self.planificada], self.HORAS_POR_DIA)
+
+    def test_horas_libres_del_cuello_de_botella(self):
+        capacidad = self._capacidad()
+
+        self.assertEqual(capacidad.carga(self.linea_1.pk, self.dia_1), 4)
+        self.assertEqual(capacidad.horas_libres([self.linea_1.pk, self.linea_2.pk], self.dia_1), 12)
+        self.assertEqual(capacidad.horas_libres([self.linea_2.pk], self.dia_1), 16)
+
+        # Una línea sobrecargada no da horas negativas
+        capacidad.registrar([self._fila(self._op(self.planificada), self.linea_2, self.dia_1, 20, guardar=False)])
+        self.assertEqual(capacidad.horas_libres([self.linea_1.pk, self.linea_2.pk], self.dia_1), 0)
+
+    def test_liberar_op_entera_o_desde_una_fecha(self):
+        capacidad = self._capacidad()
+        capacidad.liberar_op(self.op, desde=self.dia_2)
+
+        self.assertEqual(capacidad.carga(self.linea_1.pk, self.dia_1), 4)
+        self.assertEqual(capacidad.carga(self.linea_1.pk, self.dia_2), 0)
+        self.assertFalse(capacidad.liberada(self.op.pk, self.dia_1))
+        self.assertTrue(capacidad.liberada(self.op.pk, self.dia_2))
+
+        capacidad.liberar_op(self.op)
+        self.assertEqual(capacidad.carga(self.linea_1.pk, self.dia_1), 0)
+        self.assertTrue(capacidad.liberada(self.op.pk, self.dia_1))
+
+    def test_liberar_op_sin_guardar_descarta_sus_altas(self):
+        capacidad = self._capacidad()
+        op_nueva = OrdenProduccion(cantidad=5, id_estado_orden_produccion=self.planificada)
+        capacidad.registrar([
+            self._fila(op_nueva, self.linea_2, self.dia_1, 5, guardar=False),
+            self._fila(op_nueva, self.linea_2, self.dia_2, 5, guardar=False),
+        ])
+
+        capacidad.liberar_op(op_nueva, desde=self.dia_2)
+
+        self.assertEqual(capacidad.carga(self.linea_2.pk, self.dia_1), 5)
+        self.assertEqual(capacidad.carga(self.linea_2.pk, self.dia_2), 0)
+        self.assertEqual([fila.fecha for fila in capacidad.altas_del_dia(self.dia_1)], [self.dia_1])
+        self.assertEqual(capacidad.altas_del_dia(self.dia_2), [])
+
+    def test_guardar_borra_por_corte_y_crea_en_bloque(self):
+        capacidad = self._capacidad()
+        op_nueva = self._op(self.planificada)
+        capacidad.liberar_op(self.op, desde=self.dia_2)
+        capacidad.registrar([self._fila(op_nueva, self.linea_2, self.dia_2, 7, guardar=False)])
+
+        self.assertEqual(capacidad.guardar(), (1, 1))
+        self.assertEqual(
+            sorted(CalendarioProduccion.objects.filter(fecha__gte=HOY).values_list(
+                'id_orden_produccion_id', 'id_linea_produccion_id', 'fecha'
+            )),
+            sorted([
+                (self.op.pk, self.linea_1.pk, self.dia_1),
+                (op_nueva.pk, self.linea_2.pk, self.dia_2),
+                (self.op_cancelada.pk, self.linea_1.pk, self.dia_1),
+            ])
+        )
+        # Un segundo guardar no repite nada
+        self.assertEqual(capacidad.guardar(), (0, 0))
+
+        # Lo recién insertado se libera (y se borra) igual que lo cargado de la BD
+        capacidad.liberar_op(op_nueva)
+        self.assertEqual(capacidad.carga(self.linea_2.pk, self.dia_2), 0)
+        self.assertEqual(capacidad.guardar(), (1, 0))
+        self.assertFalse(CalendarioProduccion.objects.filter(id_orden_produccion=op_nueva).exists())
+
+    def test_exportar_e_incorporar_en_otro_ledger(self):
+        componente = self._capacidad()
+        op_nueva = self._op(self.planificada)
+        componente.liberar_op(self.op, desde=self.dia_2)
+        componente.registrar([self._fila(op_nueva, self.linea_1, self.dia_2, 9, guardar=False)])
+
+        completo = self._capacidad()
+        completo.incorporar(componente.exportar({self.linea_1.pk}, {self.op.pk, op_nueva.pk}))
+
+        self.assertEqual(completo.carga(self.linea_1.pk, self.dia_1), 4)
+        self.assertEqual(completo.carga(self.linea_1.pk, self.dia_2), 9)
+        self.assertTrue(completo.liberada(self.op.pk, self.dia_2))
+        self.assertEqual(len(completo.movimientos), 2)
+        self.assertEqual(completo.guardar(), (1, 1))
+        self.assertEqual(
+            CalendarioProduccion.objects.get(id_linea_produccion=self.linea_1, fecha=self.dia_2).id_orden_produccion_id,
+            op_nueva.pk
+        )
+
+        # Acotado a una línea: sin lo pendiente y sin tocar el original (cada componente del MRP)
+        acotado = componente.acotar({self.linea_1.pk}, {self.op.pk})
+        self.assertEqual((acotado.exportar(set(), set())["altas"], acotado.movimientos), ([], []))
+        acotado.liberar_op(self.op)
+        self.assertEqual((acotado.carga(self.linea_1.pk, self.dia_1), componente.carga(self.linea_1.pk, self.dia_1)), (0, 4))
+        self.assertEqual(len(componente.movimientos), 2)
+        self.assertEqual(componente.acotar({self.linea_2.pk}, set()).carga(self.linea_1.pk, self.dia_1), 0)
+
+
+class CalendarioLaboralTest(TestCase):
+    """
+    Semana de referencia (junio 2025): lunes 2 a viernes 6, con el viernes 6
+    como parada de planta y el lunes 9 como feriado.
+    """
+
+    LUNES = date(2025, 6, 2)
+
+    def setUp(self):
+        self.viernes = self.LUNES + timedelta(days=4)
+        self.sabado = self.LUNES + timedelta(days=5)
+        self.lunes_siguiente = self.LUNES + timedelta(days=7)
+        self.no_laborables = {self.viernes, self.lunes_siguiente}
+        self.calendario = CalendarioLaboral(
+            self.no_laborables, self.LUNES - timedelta(days=10), self.LUNES + timedelta(days=10)
+        )
+
+    def _dia(self, offset):
+        return self.LUNES + timedelta(days=offset)
+
+    def _sumar_a_mano(self, fecha, dias):
+        """Referencia: recorrer día por día."""
+        es_habil = lambda d: d.weekday() < 5 and d not in self.no_laborables
+        if dias == 0:
+            while not es_habil(fecha):
+                fecha += timedelta(days=1)
+            return fecha
+        paso = timedelta(days=1 if dias > 0 else -1)
+        for _ in range(abs(dias)):
+            fecha += paso
+            while not es_habil(fecha):
+                fecha += paso
+        return fecha
+
+    def test_saltea_fines_de_semana_y_dias_no_laborables(self):
+        self.assertEqual(self.calendario.sumar_habiles(self.LUNES, 1), self._dia(1))
+        # Jueves + 1: viernes parada, fin de semana y lunes feriado -> martes
+        self.assertEqual(self.calendario.sumar_habiles(self._dia(3), 1), self._dia(8))
+        self.assertEqual(self.calendario.sumar_habiles(self.sabado, 1), self._dia(8))
+        self.assertEqual(self.calendario.sumar_habiles(self.LUNES, 4), self._dia(8))
+        self.assertEqual(self.calendario.sumar_habiles(self.LUNES, 5), self._dia(9))
+        self.assertFalse(self.calendario.es_habil(self.viernes))
+        self.assertFalse(self.calendario.es_habil(self.sabado))
+
+    def test_cero_dias_es_el_proximo_habil(self):
+        self.assertEqual(self.calendario.sumar_habiles(self._dia(1), 0), self._dia(1))
+        self.assertEqual(self.calendario.sumar_habiles(self.viernes, 0), self._dia(8))
+        self.assertEqual(self.calendario.proximo_habil(self.sabado), self._dia(8))
+        self.assertEqual(self.calendario.anterior_habil(self.sabado), self._dia(3))
+
+    def test_dias_negativos(self):
+        self.assertEqual(self.calendario.sumar_habiles(self._dia(8), -1), self._dia(3))
+        self.assertEqual(self.calendario.sumar_habiles(self.sabado, -1), self._dia(3))
+        # Lunes - 1: el viernes anterior (30 de mayo, hábil)
+        self.assertEqual(self.calendario.sumar_habiles(self.LUNES, -1), self._dia(-3))
+        for offset in range(-3, 4):
+            ida = self.calendario.sumar_habiles(self._dia(1), offset)
+            self.assertEqual(self.calendario.sumar_habiles(ida, -offset), self._dia(1))
+
+    def test_coincide_con_recorrer_dia_por_dia_aun_fuera_del_indice(self):
+        # El índice cubre ±10 días: los saltos largos lo extienden
+        for offset in range(-20, 21, 3):
+            for dias in (-40, -7, -1, 0, 1, 7, 40):
+                fecha = self._dia(offset)
+                esperado = self._sumar_a_mano(fecha, dias)
+                self.assertEqual(self.calendario.sumar_habiles(fecha, dias), esperado, (fecha, dias))
+
+    def test_habiles_entre(self):
+        self.assertEqual(self.calendario.habiles_entre(self.LUNES, self._dia(7)), 4)
+        self.assertEqual(self.calendario.habiles_entre(self._dia(7), self.LUNES), -4)
+        self.assertEqual(self.calendario.habiles_entre(self.LUNES, self.LUNES), 0)
+
+    def test_calendario_cacheado_se_invalida_al_cargar_un_dia_no_laborable(self):
+        invalidar_calendario_laboral()
+        self.assertEqual(get_calendario_laboral().sumar_habiles(self._dia(3), 1), self.viernes)
+
+        DiaNoLaborable.objects.create(fecha=self.viernes, tipo=DiaNoLaborable.Tipo.PARADA_PLANTA)
+
+        self.assertEqual(get_calendario_laboral().sumar_habiles(self._dia(3), 1), self.lunes_siguiente)
+        self.assertEqual(CalendarioLaboral.cargar().sumar_habiles(self._dia(3), -4), self._dia(-3))
+
+    def test_los_demas_workers_recargan_al_confirmarse_el_cambio(self):
+        versiones = caches[CACHE_VERSIONES]
+        invalidar_calendario_laboral()
+        calendario = get_calendario_laboral()
+        version = versiones.get(CLAVE_VERSION_CALENDARIO)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            DiaNoLaborable.objects.create(fecha=self.viernes, tipo=DiaNoLaborable.Tipo.PARADA_PLANTA)
+        self.assertEqual(versiones.get(CLAVE_VERSION_CALENDARIO), version)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(versiones.get(CLAVE_VERSION_CALENDARIO), version)
+
+        # Otro worker con el calendario viejo y la versión vieja recarga en la próxima lectura
+        calendario_mod._cache.update(calendario=calendario, version=version)
+        self.assertEqual(get_calendario_laboral().sumar_habiles(self._dia(3), 1), self.lunes_siguiente)
+
+
+def _tarea(cal, linea, completas, tamano, duracion, resto=0, objetivo=None, max_minutos=HORIZONTE_MINUTOS, dia=0):
+    """Tarea del solver con 'completas' tandas iguales y, si 'resto', una tanda final más chica."""
+    tandas = [{"t": t, "tamano": tamano, "duracion": duracion, "pista": None} for t in range(completas)]
+    if resto:
+        tandas.append({"t": completas, "tamano": resto, "duracion": max(1, duracion * resto // tamano), "pista": None})
+    return {
+        "cal": cal, "linea": linea, "tandas": tandas, "max_minutos": max_minutos, "dia": dia,
+        "objetivo": completas * tamano + resto if objetivo is None else objetivo,
+    }
+
+
+class SolverTandasTest(SimpleTestCase):
+    """El modelo compacto (bloques de tandas) decide lo mismo que el de un intervalo por tanda."""
+
+    def _resolver(self, tareas, **kwargs):
+        return resolver(tareas, max_segundos=10, max_segundos_subproblema=10, workers=1, **kwargs)
+
+    def _verificar_valores(self, tareas, resultado):
+        """Cada tarea produce su objetivo y las tandas de una línea no se pisan."""
+        por_linea = {}
+        for tarea in tareas:
+            producido = 0
+            for tanda in tarea["tandas"]:
+                activa, inicio, fin = resultado["valores"][(tarea["cal"], tanda["t"])]
+                if activa:
+                    producido += tanda["tamano"]
+                    self.assertEqual(fin - inicio, tanda["duracion"])
+                    self.assertLessEqual(fin, HORIZONTE_MINUTOS)
+                    por_linea.setdefault(tarea["linea"], []).append((inicio, fin))
+            self.assertEqual(producido, tarea["objetivo"])
+        for intervalos in por_linea.values():
+            intervalos.sort()
+            for (_inicio, fin), (inicio_siguiente, _fin) in zip(intervalos, intervalos[1:]):
+                self.assertLessEqual(fin, inicio_siguiente)
+
+    def test_compacto_y_por_tanda_dan_el_mismo_resultado(self):
+        tareas = [
+            _tarea(1, linea=10, completas=4, tamano=50, duracion=60, resto=20),
+            _tarea(2, linea=10, completas=3, tamano=40, duracion=90),
+            _tarea(3, linea=20, completas=2, tamano=100, duracion=120, resto=30),
+        ]
+
+        compacto = self._resolver(tareas, compacto=True)
+        por_tanda = self._resolver(tareas, compacto=False)
+
+        self.assertEqual(compacto["estado"], "OPTIMAL")
+        self.assertEqual((compacto["estado"], compacto["objetivo"]), (por_tanda["estado"], por_tanda["objetivo"]))
+        self.assertEqual(compacto["objetivo"], sum(tarea["objetivo"] for tarea in tareas))
+        # El compacto tiene menos intervalos: uno por bloque y no uno por tanda
+        self.assertLess(compacto["intervalos"], por_tanda["intervalos"])
+        self._verificar_valores(tareas, compacto)
+        self._verificar_valores(tareas, por_tanda)
+
+    def test_en_secuencia_los_subproblemas_comparten_el_tiempo_total(self):
+        tareas = [_tarea(cal, linea=cal * 10, completas=2, tamano=50, duracion=60) for cal in (1, 2, 3)]
+
+        with mock.patch.object(solver_tandas, "_resolver_subproblema", wraps=solver_tandas._resolver_subproblema) as espia:
+            resultado = resolver(tareas, max_segundos=1.5, max_segundos_subproblema=10, workers=1)
+
+        self.assertEqual(resultado["estado"], "OPTIMAL")
+        limites = [llamada.args[1] for llamada in espia.call_args_list]
+        self.assertEqual(len(limites), 3)
+        # A cada uno le toca, como mucho, su parte de lo que queda
+        for i, limite in enumerate(limites):
+            self.assertLessEqual(limite * (len(limites) - i), 1.5)
+        self.assertAlmostEqual(limites[0], 0.5, places=2)
+
+    def test_compacto_y_por_tanda_coinciden_cuando_no_entra(self):
+        # 10 tandas de 2 horas no entran en las 16 horas de la línea
+        tareas = [_tarea(1, linea=10, completas=10, tamano=50, duracion=120)]
+
+        compacto = self._resolver(tareas, compacto=True)
+        por_tanda = self._resolver(tareas, compacto=False)
+
+        self.assertEqual(compacto["estado"], "INFEASIBLE")
+        self.assertEqual((compacto["estado"], compacto["objetivo"]), (por_tanda["estado"], por_tanda["objetivo"]))
+
+    def test_subproblemas_por_linea_y_vinculos(self):
+        tareas = [_tarea(cal, linea, 1, 10, 10) for cal, linea in [(1, 10), (2, 20), (3, 10), (4, 30)]]
+        lineas = lambda subproblemas: sorted(sorted({t["linea"] for t in s}) for s in subproblemas)
+
+        self.assertEqual(lineas(subproblemas_independientes(tareas)), [[10], [20], [30]])
+        self.assertEqual(lineas(subproblemas_independientes(tareas, vinculos=[(10, 30)])), [[10, 30], [20]])
+        # Los vínculos son transitivos
+        self.assertEqual(lineas(subproblemas_independientes(tareas, vinculos=[(10, 20), (20, 30)])), [[10, 20, 30]])
+        # Las tareas de una misma línea quedan juntas y en orden
+        self.assertEqual(
+            [[t["cal"] for t in s] for s in subproblemas_independientes(tareas, vinculos=[(10, 30)])],
+            [[1, 3, 4], [2]]
+        )
+
+    def test_por_subproblemas_o_monolitico_da_el_mismo_objetivo(self):
+        tareas = [
+            _tarea(1, linea=10, completas=3, tamano=50, duracion=60),
+            _tarea(2, linea=20, completas=2, tamano=40, duracion=90, resto=10),
+        ]
+
+        separados = self._resolver(tareas)
+        juntos = self._resolver(tareas, vinculos=[(10, 20)])
+
+        self.assertEqual((separados["subproblemas"], juntos["subproblemas"]), (2, 1))
+        self.assertEqual((separados["estado"], separados["objetivo"]), (juntos["estado"], juntos["objetivo"]))
+
+
+    def test_en_el_horizonte_lo_pospuesto_no_desplaza_las_tareas_de_los_dias_siguientes(self):
+        # A tiene 20 horas mañana y B llena las 16 de pasado mañana: lo que sobra de A queda afuera
+        tareas = [
+            _tarea(1, linea=10, completas=20, tamano=60, duracion=60, max_minutos=20 * 60),
+            _tarea(2, linea=10, completas=16, tamano=60, duracion=60, dia=1),
+        ]
+
+        resultado = self._resolver(tareas, dias=2)
+
+        self.assertEqual(resultado["estado"], "OPTIMAL")
+        dias = [resultado["valores"][(1, t)][0] for t in range(20)]
+        self.assertEqual((dias.count(0), dias.count(1), dias.count(None)), (16, 0, 4))
+        # B no se decide: sus reservas son capacidad ocupada
+        self.assertNotIn((2, 0), resultado["valores"])
+
+    def test_en_el_horizonte_lo_pospuesto_llena_solo_el_hueco(self):
+        tareas = [_tarea(1, linea=10, completas=20, tamano=60, duracion=60, max_minutos=20 * 60)]
+
+        resultado = self._resolver(tareas, dias=2, ocupado={(10, 1): 14 * 60})
+
+        dias = [resultado["valores"][(1, t)][0] for t in range(20)]
+        self.assertEqual((dias.count(0), dias.count(1), dias.count(None)), (16, 2, 2))
+
+
+class HorizonteRodanteTest(TestCase):
+    """
+    Solver táctico con dias_horizonte=3. Corre el jueves 5/6/2025: planifica
+    el viernes 6 y el horizonte sigue el lunes 9 y el martes 10 (el fin de
+    semana no es hábil). Línea de 16 horas y tandas de 1 hora (60u).
+    """
+
+    JUEVES = date(2025, 6, 5)
+
+    def setUp(self):
+        invalidar_calendario_laboral()
+        self.addCleanup(invalidar_calendario_laboral)
+        self.viernes = self.JUEVES + timedelta(days=1)
+        self.lunes = self.JUEVES + timedelta(days=4)
+        self.martes = self.JUEVES + timedelta(days=5)
+        self.miercoles = self.JUEVES + timedelta(days=6)
+
+        for descripcion in ["Pendiente de inicio", "En proceso", "Planificada"]:
+            EstadoOrdenProduccion.objects.create(descripcion=descripcion)
+        EstadoOrdenTrabajo.objects.create(descripcion="Pendiente")
+        self.linea = LineaProduccion.objects.create(
+            descripcion="Línea 1",
+            id_estado_linea_produccion=estado_linea_produccion.objects.create(descripcion="Disponible")
+        )
+        self.producto = Producto.objects.create(
+            nombre="Helado", precio=1, id_tipo_producto=TipoProducto.objects.create(descripcion="Congelados"),
+            id_unidad=Unidad.objects.create(descripcion="kg"), dias_duracion=30, umbral_minimo=0
+        )
+        ProductoLinea.objects.create(
+            id_producto=self.producto, id_linea_produccion=self.linea, cant_por_hora=60, cantidad_minima=0
+        )
+
+    def _op(self):
+        return OrdenProduccion.objects.create(
+            cantidad=1, id_producto=self.producto,
+            id_estado_orden_produccion=EstadoOrdenProduccion.objects.get(descripcion="Pendiente de inicio")
+        )
+
+    def _tarea(self, op, fecha, horas):
+        return CalendarioProduccion.objects.create(
+            id_orden_produccion=op, id_linea_produccion=self.linea, fecha=fecha,
+            horas_reservadas=horas, cantidad_a_producir=60 * horas
+        )
+
+    def _planificar(self, dias_horizonte=3):
+        with contextlib.redirect_stdout(io.StringIO()):
+            ejecutar_planificador(self.JUEVES, dias_horizonte=dias_horizonte)
+
+    def _cantidad_por_fecha(self):
+        return dict(
+            CalendarioProduccion.objects.order_by('fecha').values('fecha')
+            .annotate(total=Sum('cantidad_a_producir')).values_list('fecha', 'total')
+        )
+
+    def _verificar_sin_duplicados(self):
+        filas = list(CalendarioProduccion.objects.values_list('id_linea_produccion_id', 'fecha', 'id_orden_produccion_id'))
+        self.assertEqual(len(filas), len(set(filas)))
+
+    def _horas_por_fecha(self):
+        return dict(
+            CalendarioProduccion.objects.order_by('fecha').values('fecha')
+            .annotate(total=Sum('horas_reservadas')).values_list('fecha', 'total')
+        )
+
+    def test_lo_que_no_entra_el_viernes_va_al_lunes(self):
+        op_a, op_b = self._op(), self._op()
+        self._tarea(op_a, self.viernes, 20)
+        self._tarea(op_a, self.lunes, 10)
+        self._tarea(op_b, self.viernes, 2)
+
+        self._planificar()
+
+        # Viernes: 16 horas de OTs; las 6 que sobran van al lunes (no al sábado) y lo llenan
+        ots = OrdenDeTrabajo.objects.filter(id_linea_produccion=self.linea)
+        self.assertEqual(ots.count(), 16)
+        self.assertTrue(all(ot.hora_inicio_programada.date() == self.viernes for ot in ots))
+        self.assertEqual(self._cantidad_por_fecha(), {self.lunes: 60 * 16})
+        self.assertEqual(
+            CalendarioProduccion.objects.filter(fecha=self.lunes).aggregate(total=Sum('horas_reservadas'))["total"], 16
+        )
+        # Lo pospuesto de la OP A se suma a su tarea del lunes
+        self.assertEqual(CalendarioProduccion.objects.filter(id_orden_produccion=op_a).count(), 1)
+        self.assertEqual(
+            ots.aggregate(total=Sum('cantidad_programada'))["total"] + sum(self._cantidad_por_fecha().values()),
+            60 * 32
+        )
+        self._verificar_sin_duplicados()
+
+    def test_con_el_lunes_lleno_lo_que_no_entra_el_viernes_va_al_martes(self):
+        op_a, op_b = self._op(), self._op()
+        self._tarea(op_a, self.viernes, 20)
+        self._tarea(op_b, self.lunes, 16)
+
+        self._planificar()
+
+        # Las reservas del lunes no se mueven: las 4 horas de A van al martes
+        self.assertEqual(OrdenDeTrabajo.objects.count(), 16)
+        self.assertEqual(self._cantidad_por_fecha(), {self.lunes: 60 * 16, self.martes: 60 * 4})
+        self.assertEqual(
+            list(CalendarioProduccion.objects.filter(fecha=self.lunes).values_list('id_orden_produccion', flat=True)),
+            [op_b.id_orden_produccion]
+        )
+        self._verificar_sin_duplicados()
+
+    def test_una_reserva_de_otra_op_sin_planificar_tambien_ocupa_la_linea(self):
+        op_a, op_b = self._op(), self._op()
+        op_b.id_estado_orden_produccion = EstadoOrdenProduccion.objects.get(descripcion="Planificada")
+        op_b.save()
+        self._tarea(op_a, self.viernes, 20)
+        self._tarea(op_b, self.lunes, 14)
+
+        self._planificar()
+
+        self.assertEqual(self._cantidad_por_fecha(), {self.lunes: 60 * 16, self.martes: 60 * 2})
+        self._verificar_sin_duplicados()
+
+    def test_lo_que_no_entra_en_el_horizonte_va_al_dia_habil_siguiente(self):
+        op = self._op()
+        self._tarea(op, self.viernes, 50)
+
+        self._planificar()
+
+        self.assertEqual(OrdenDeTrabajo.objects.count(), 16)
+        self.assertEqual(
+            self._cantidad_por_fecha(), {self.lunes: 60 * 16, self.martes: 60 * 16, self.miercoles: 60 * 2}
+        )
+        self._verificar_sin_duplicados()
+
+    def test_sin_horizonte_lo_infactible_se_pospone_con_lugar_en_la_linea(self):
+        op_a, op_b = self._op(), self._op()
+        self._tarea(op_a, self.viernes, 20)
+        self._tarea(op_a, self.lunes, 2)
+        self._tarea(op_b, self.lunes, 12)
+
+        self._planificar(dias_horizonte=1)
+
+        # 20 horas no entran el viernes: nada al sábado, el lunes completa sus 16 y el resto sigue
+        self.assertEqual(OrdenDeTrabajo.objects.count(), 0)
+        self.assertEqual(self._horas_por_fecha(), {self.lunes: 16, self.martes: 16, self.miercoles: 2})
+        self.assertEqual(
+            CalendarioProduccion.objects.get(id_orden_produccion=op_a, fecha=self.lunes).cantidad_a_producir, 60 * 4
+        )
+        self.assertEqual(sum(self._cantidad_por_fecha().values()), 60 * 34)
+        self._verificar_sin_duplicados()
+
+    def test_una_tarea_sin_regla_se_pospone_al_primer_dia_con_lugar(self):
+        op_a, op_b = self._op(), self._op()
+        otro = Producto.objects.create(
+            nombre="Sin regla", precio=1, id_tipo_producto=self.producto.id_tipo_producto,
+            id_unidad=self.producto.id_unidad, dias_duracion=30, umbral_minimo=0
+        )
+        op_c = OrdenProduccion.objects.create(
+            cantidad=1, id_producto=otro, id_estado_orden_produccion=op_a.id_estado_orden_produccion
+        )
+        self._tarea(op_a, self.viernes, 4)
+        self._tarea(op_c, self.viernes, 3)
+        self._tarea(op_b, self.lunes, 16)
+
+        self._planificar(dias_horizonte=1)
+
+        self.assertEqual(OrdenDeTrabajo.objects.count(), 4)
+        self.assertEqual(
+            list(CalendarioProduccion.objects.filter(id_orden_produccion=op_c).values_list('fecha', 'horas_reservadas')),
+            [(self.martes, 3)]
+        )
+        self._verificar_sin_duplicados()
+
+
+class ParametrosSolverTest(TestCase):
+
+    def _configurar(self, **valores):
+        for clave, valor in valores.items():
+            Configuracion.objects.create(nombre_clave=clave, valor=valor)
+
+    def test_los_segundos_aceptan_decimales(self):
+        self._configurar(SOLVER_MAX_SECONDS="2.5", SOLVER_MAX_SECONDS_SUBPROBLEMA="0,5", SOLVER_WORKERS="4")
+
+        parametros = parametros_solver()
+
+        self.assertEqual(parametros["max_segundos"], 2.5)
+        self.assertEqual(parametros["max_segundos_subproblema"], 0.5)
+        self.assertEqual(parametros["workers"], 4)
+
+    def test_valores_invalidos_o_fuera_de_rango(self):
+        self._configurar(SOLVER_MAX_SECONDS="mucho", SOLVER_MAX_SECONDS_SUBPROBLEMA="0", SOLVER_WORKERS="1.5")
+
+        parametros = parametros_solver()
+
+        self.assertEqual(parametros["max_segundos"], 30)
+        self.assertEqual(parametros["max_segundos_subproblema"], 0.1)
+        self.assertEqual(parametros["workers"], 8)
+
+
+class ReprogramacionReactivaTest(TestCase):
+    """
+    Reprogramación reactiva: dos líneas de 60u/hora; la línea 1 tiene dos OTs
+    de una hora pasado mañana y la línea 2 una.
+    """
+
+    def setUp(self):
+        self.dia = timezone.localdate() + timedelta(days=2)
+        self.base = timezone.make_aware(datetime.combine(self.dia, datetime.min.time())) + timedelta(hours=6)
+        self.disponible = estado_linea_produccion.objects.create(descripcion="Disponible")
+        self.detenida = estado_linea_produccion.objects.create(descripcion="Detenida")
+        self.linea_1 = LineaProduccion.objects.create(descripcion="Línea 1", id_estado_linea_produccion=self.disponible)
+        self.linea_2 = LineaProduccion.objects.create(descripcion="Línea 2", id_estado_linea_produccion=self.disponible)
+        producto = Producto.objects.create(
+            nombre="Helado", precio=1, id_tipo_producto=TipoProducto.objects.create(descripcion="Congelados"),
+            id_unidad=Unidad.objects.create(descripcion="kg"), dias_duracion=30, umbral_minimo=0
+        )
+        for linea in (self.linea_1, self.linea_2):
+            ProductoLinea.objects.create(id_producto=producto, id_linea_produccion=linea, cant_por_hora=60)
+        op = OrdenProduccion.objects.create(
+            cantidad=180, id_producto=producto,
+            id_estado_orden_produccion=EstadoOrdenProduccion.objects.create(descripcion="En proceso")
+        )
+        pendiente = EstadoOrdenTrabajo.objects.create(descripcion="Pendiente")
+        self.ots = [
+            OrdenDeTrabajo.objects.create(
+                id_orden_produccion=op, id_linea_produccion=linea, cantidad_programada=60,
+                hora_inicio_programada=self.base + timedelta(hours=hora),
+                hora_fin_programada=self.base + timedelta(hours=hora + 1),
+                id_estado_orden_trabajo=pendiente
+            )
+            for linea, hora in [(self.linea_1, 0), (self.linea_1, 1), (self.linea_2, 0)]
+        ]
+
+    def _reprogramar(self, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return reprogramar_por_cambio_de_linea(self.linea_1.pk, **kwargs)
+
+    def _verificar_en_linea_2(self, ots):
+        self.assertTrue(all(ot["linea"] == self.linea_2.pk for ot in ots))
+        intervalos = sorted((ot["hora_inicio_programada"], ot["hora_fin_programada"]) for ot in ots)
+        for (_inicio, fin), (inicio_siguiente, _fin) in zip(intervalos, intervalos[1:]):
+            self.assertLessEqual(fin, inicio_siguiente)
+
+    def test_simular_con_el_estado_pisado_no_toca_la_base(self):
+        resultado = self._reprogramar(simular=True, estados_linea={self.linea_1.pk: self.detenida})
+
+        self.assertEqual(resultado["estado_linea"], "Detenida")
+        self._verificar_en_linea_2(resultado["ots"])
+        self.assertEqual(
+            sorted(ot["id_orden_trabajo"] for ot in resultado["ots"] if ot["cambio"]),
+            [self.ots[0].pk, self.ots[1].pk]
+        )
+        self.assertEqual(OrdenDeTrabajo.objects.filter(id_linea_produccion=self.linea_1).count(), 2)
+
+    def test_sin_pisar_el_estado_la_simulacion_no_mueve_nada(self):
+        resultado = self._reprogramar(simular=True)
+
+        self.assertEqual(resultado["estado_linea"], "Disponible")
+        self.assertFalse(any(ot["cambio"] for ot in resultado["ots"]))
+
+    def test_la_vista_simula_con_el_estado_enviado_sin_aplicarlo(self):
+        request = APIRequestFactory().post(
+            "/api/planificacion/reprogramar-linea/",
+            {"linea": self.linea_1.pk, "estado": "Detenida", "simular": True}, format="json"
+        )
+        with contextlib.redirect_stdout(io.StringIO()):
+            respuesta = reprogramar_linea_view(request)
+
+        self.assertEqual(respuesta.status_code, 200)
+        self._verificar_en_linea_2(respuesta.data["resultado"]["ots"])
+        self.linea_1.refresh_from_db()
+        self.assertEqual(self.linea_1.id_estado_linea_produccion, self.disponible)
+        self.assertEqual(OrdenDeTrabajo.objects.filter(id_linea_produccion=self.linea_1).count(), 2)
+
+    def _ots_en_otros_dias(self, dias):
+        for dias_despues in range(1, dias + 1):
+            ot = self.ots[0]
+            OrdenDeTrabajo.objects.create(
+                id_orden_produccion=ot.id_orden_produccion, id_linea_produccion=self.linea_1, cantidad_programada=60,
+                hora_inicio_programada=ot.hora_inicio_programada + timedelta(days=dias_despues),
+                hora_fin_programada=ot.hora_fin_programada + timedelta(days=dias_despues),
+                id_estado_orden_trabajo=ot.id_estado_orden_trabajo
+            )
+
+    def test_reprograma_y_guarda(self):
+        self.linea_1.id_estado_linea_produccion = self.detenida
+        self.linea_1.save()
+
+        resultado = self._reprogramar()
+
+        self.assertEqual(resultado["sin_lugar"], [])
+        self.assertFalse(OrdenDeTrabajo.objects.filter(id_linea_produccion=self.linea_1).exists())
+        self._verificar_en_linea_2([
+            {"linea": ot.id_linea_produccion_id, "hora_inicio_programada": ot.hora_inicio_programada,
+             "hora_fin_programada": ot.hora_fin_programada}
+            for ot in OrdenDeTrabajo.objects.all()
+        ])
+
+    def test_el_presupuesto_del_solver_es_para_toda_la_llamada(self):
+        self._ots_en_otros_dias(3)
+
+        with mock.patch.object(reactivo, "_resolver_dia", wraps=reactivo._resolver_dia) as resolver_dia:
+            resultado = self._reprogramar(simular=True, estados_linea={self.linea_1.pk: self.detenida})
+
+        limites = [llamada.kwargs["max_segundos"] for llamada in resolver_dia.call_args_list]
+        self.assertEqual(len(limites), 4)
+        self.assertTrue(all(limite > 0 for limite in limites))
+        # Cada día recibe a lo sumo su parte de lo que queda: nunca se pasa del total
+        for i, limite in enumerate(limites):
+            self.assertLessEqual(limite * (len(limites) - i), reactivo.REPROGRAMACION_MAX_SECONDS)
+        self.assertEqual(resultado["sin_reprogramar"], [])
+
+    def test_sin_presupuesto_las_ots_quedan_como_estan(self):
+        self._ots_en_otros_dias(1)
+
+        with mock.patch.object(reactivo, "REPROGRAMACION_MAX_SECONDS", 0):
+            resultado = self._reprogramar(estados_linea={self.linea_1.pk: self.detenida})
+
+        self.assertEqual(resultado["estados_solver"], ["SIN_TIEMPO", "SIN_TIEMPO"])
+        self.assertEqual(len(resultado["sin_reprogramar"]), 4)
+        self.assertEqual(OrdenDeTrabajo.objects.filter(id_linea_produccion=self.linea_1).count(), 3)
+
+
+class _Deshacer(Exception):
+    pass
+
+
+class MRPReanudableTest(PlantaPorFamiliasMixin, TestCase):
+    """
+    Una corrida del MRP que falla en un paso deja confirmados los anteriores;
+    la siguiente corrida para la misma fecha sigue desde ahí y termina igual
+    que una corrida sin cortes.
+    """
+
+    def _correr(self, pasos=None):
+        with contextlib.redirect_stdout(io.StringIO()), mock.patch.object(
+            planificador, "PASOS_MRP", pasos or planificador.PASOS_MRP
+        ):
+            return ejecutar_planificacion_diaria_mrp(HOY)
+
+    def _estado(self):
+        return {
+            "ops": sorted(OrdenProduccion.objects.values_list('id_producto_id', 'cantidad', 'fecha_planificada')),
+            "calendario": sorted(
+                CalendarioProduccion.objects.values_list('id_linea_produccion_id', 'fecha', 'horas_reservadas')
+            ),
+            "compras": sorted(OrdenCompraMateriaPrima.objects.values_list('id_materia_prima_id', 'cantidad')),
+            "reservas_pt": ReservaStock.objects.aggregate(total=Sum('cantidad_reservada'))["total"],
+        }
+
+    def _pasos_con(self, reemplazos):
+        return tuple((clave, reemplazos.get(clave, paso)) for clave, paso in planificador.PASOS_MRP)
+
+    def test_se_reanuda_desde_el_paso_que_fallo(self):
+        # Referencia: la corrida sin cortes (se deshace)
+        try:
+            with transaction.atomic():
+                self._correr()
+                esperado = self._estado()
+                raise _Deshacer()
+        except _Deshacer:
+            pass
+        self.assertTrue(esperado["ops"] and esperado["compras"])
+
+        def falla(ctx):
+            raise RuntimeError("se cortó la conexión")
+
+        with self.assertRaises(RuntimeError):
+            self._correr(self._pasos_con({"5": falla}))
+
+        ejecucion = EjecucionMRP.objects.get()
+        self.assertEqual((ejecucion.estado, ejecucion.ultimo_paso_completado), (EjecucionMRP.Estado.FALLIDA, "4.5"))
+        self.assertEqual(ejecucion.error, "PASO 5: se cortó la conexión")
+        self.assertEqual(
+            list(ejecucion.pasos.filter(estado=PasoEjecucionMRP.Estado.FALLIDO).values_list('paso', flat=True)), ["5"]
+        )
+        # Lo del paso que falló no se escribió
+        self.assertFalse(OrdenProduccion.objects.exists())
+
+        # Los pasos confirmados no se vuelven a correr
+        corridos = []
+
+        def espiar(clave, paso):
+            def envuelto(ctx):
+                corridos.append(clave)
+                return paso(ctx)
+            return envuelto
+
+        self._correr(tuple((clave, espiar(clave, paso)) for clave, paso in planificador.PASOS_MRP))
+
+        self.assertEqual(corridos, ["5", "6"])
+        ejecucion.refresh_from_db()
+        self.assertEqual((ejecucion.estado, ejecucion.error), (EjecucionMRP.Estado.COMPLETADA, None))
+        self.assertEqual(EjecucionMRP.objects.count(), 1)
+        self.assertEqual(self._estado(), esperado)
+
+    def test_si_falla_el_primer_paso_la_proxima_empieza_de_cero(self):
+        def falla(ctx):
+            raise RuntimeError("sin datos")
+
+        with self.assertRaises(RuntimeError):
+            self._correr(self._pasos_con({"0.6": falla}))
+        self._correr()
+
+        fallida, completada = EjecucionMRP.objects.order_by('id_ejecucion_mrp')
+        self.assertEqual(fallida.estado, EjecucionMRP.Estado.FALLIDA)
+        self.assertEqual(completada.estado, EjecucionMRP.Estado.COMPLETADA)
+        self.assertEqual(
+            list(completada.pasos.values_list('paso', flat=True).order_by('id_paso_ejecucion_mrp')),
+            [clave for clave, _paso in planificador.PASOS_MRP]
+        )
+
+
+class MRPIncrementalTest(PlantaPorFamiliasMixin, TestCase):
+    """Después de la corrida diaria, el incremental replanifica solo lo marcado (y lo que comparte MPs)."""
+
+    def setUp(self):
+        super().setUp()
+        with contextlib.redirect_stdout(io.StringIO()):
+            ejecutar_planificacion_diaria_mrp(HOY)
+
+    def _incremental(self, simular=False):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return ejecutar_planificacion_incremental_mrp(HOY, simular=simular)
+
+    def _ops_por_familia(self):
+        return [
+            sorted(
+                OrdenProduccion.objects.filter(id_producto__in=familia["productos"])
+                .values_list('pk', 'id_producto_id', 'cantidad', 'fecha_planificada')
+            )
+            for familia in self.familias
+        ]
+
+    def test_sin_marcas_no_hace_nada(self):
+        self.assertFalse(MarcaPendienteMRP.objects.exists())
+        self.assertEqual(self._incremental()["productos"], [])
+
+    def test_replanifica_solo_la_familia_marcada(self):
+        producto, hermano = self.familias[1]["productos"]
+        antes = self._ops_por_familia()
+        # Un pedido nuevo, igual a uno existente de la familia 1
+        ov = OrdenVentaProducto.objects.filter(id_producto=producto).first().id_orden_venta
+        ov.pk = None
+        ov.save()
+        OrdenVentaProducto.objects.create(id_orden_venta=ov, id_producto=producto, cantidad=200)
+        self.assertEqual(
+            list(MarcaPendienteMRP.objects.values_list('tipo', 'id_referencia')),
+            [(MarcaPendienteMRP.Tipo.PRODUCTO, producto.pk)]
+        )
+
+        # La simulación no consume las marcas
+        self.assertEqual(self._incremental(simular=True)["productos"], sorted([producto.pk, hermano.pk]))
+        self.assertTrue(MarcaPendienteMRP.objects.exists())
+
+        resultado = self._incremental()
+
+        # El hermano comparte las MPs: entra aunque no esté marcado
+        self.assertEqual(resultado["productos"], sorted([producto.pk, hermano.pk]))
+        self.assertFalse(MarcaPendienteMRP.objects.exists())
+        despues = self._ops_por_familia()
+        self.assertEqual((despues[0], despues[2]), (antes[0], antes[2]))
+        producido = OrdenProduccion.objects.filter(id_producto=producto).aggregate(total=Sum('cantidad'))["total"]
+        antes_producto = sum(cantidad for _pk, producto_id, cantidad, _fecha in antes[1] if producto_id == producto.pk)
+        self.assertGreaterEqual(producido, antes_producto + 200)
+
+
+class EscenariosTest(PlantaPorFamiliasMixin, TestCase):
+    """Escenarios "qué pasa si" sobre la planta de tres familias, sin escribir nada."""
+
+    def _conteos(self):
+        return [
+            modelo.objects.count()
+            for modelo in (OrdenProduccion, OrdenVenta, CalendarioProduccion, LoteMateriaPrima, TrabajoPlanificacion)
+        ]
+
+    def _post(self, datos):
+        request = APIRequestFactory().post("/api/planificacion/escenarios/", datos, format="json")
+        with contextlib.redirect_stdout(io.StringIO()):
+            return simular_escenarios_view(request)
+
+    def test_la_base_es_el_mrp_simulado_y_no_se_escribe_nada(self):
+        linea_0 = self.familias[0]["linea"].pk
+        antes = self._conteos()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            mrp = ejecutar_planificacion_diaria_mrp(HOY, simular=True)
+            resultado = simular_escenarios(HOY, [{"nombre": "sin línea 0", "lineas_fuera_de_servicio": [linea_0]}])
+
+        self.assertEqual(self._conteos(), antes)
+        base, sin_linea = resultado["escenarios"]
+        self.assertEqual((base["nombre"], sin_linea["nombre"]), ("base", "sin línea 0"))
+        self.assertEqual(base["mrp"]["totales"], mrp["totales"])
+        self.assertGreater(base["mrp"]["utilizacion_lineas"][linea_0], 0)
+        # Sin su línea, la familia 0 no se puede producir
+        self.assertEqual(sin_linea["mrp"]["utilizacion_lineas"][linea_0], 0)
+        self.assertLess(sin_linea["mrp"]["ops_creadas"], base["mrp"]["ops_creadas"])
+        self.assertEqual(set(resultado["comparacion"]), {f"{seccion}.{kpi}" for seccion, kpi in KPIS_COMPARADOS})
+        self.assertEqual(
+            resultado["comparacion"]["mrp.ops_creadas"],
+            {"base": base["mrp"]["ops_creadas"], "sin línea 0": sin_linea["mrp"]["ops_creadas"]}
+        )
+
+    def test_la_vista_encola_y_el_worker_devuelve_la_comparacion(self):
+        producto = self.familias[1]["productos"][0]
+        respuesta = self._post({
+            "fecha": HOY.isoformat(),
+            "escenarios": [
+                {"nombre": "pedido grande", "ovs_adicionales": [
+                    {"fecha_entrega": (HOY + timedelta(days=3)).isoformat(),
+                     "productos": [{"producto": producto.pk, "cantidad": 500}]}
+                ]},
+                {"nombre": "proveedor atrasado", "lead_times": {str(self.familias[2]["proveedor"].pk): 10}},
+            ]
+        })
+
+        self.assertEqual(respuesta.status_code, 202)
+        trabajo = TrabajoPlanificacion.objects.get(pk=respuesta.data["id_trabajo"])
+        self.assertEqual((trabajo.tipo, trabajo.estado), (TrabajoPlanificacion.Tipo.ESCENARIOS, "PENDIENTE"))
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            correr_worker(una_vez=True)
+
+        trabajo.refresh_from_db()
+        self.assertEqual((trabajo.estado, trabajo.progreso, trabajo.error), ("COMPLETADO", 100, None))
+        self.assertEqual([fase["fase"] for fase in trabajo.fases], ["escenarios"])
+        self.assertEqual(
+            set(trabajo.resultado["comparacion"]["mrp.ops_creadas"]), {"base", "pedido grande", "proveedor atrasado"}
+        )
+        pedido = trabajo.resultado["escenarios"][1]["mrp"]["ovs_adicionales"]
+        self.assertEqual(pedido[0]["fecha_entrega_pedida"], (HOY + timedelta(days=3)).isoformat())
+
+    def test_escenarios_invalidos_no_se_encolan(self):
+        repetido = self._post({"escenarios": [{"nombre": "base"}]})
+        sin_escenarios = APIRequestFactory().post(
+            "/api/planificacion/trabajos-planificacion/", {"tipo": "ESCENARIOS"}, format="json"
+        )
+
+        self.assertEqual(repetido.status_code, 400)
+        self.assertIn("escenarios", repetido.data)
+        respuesta = TrabajoPlanificacionViewSet.as_view({"post": "create"})(sin_escenarios)
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertFalse(TrabajoPlanificacion.objects.exists())
+
+
+class TrabajosPlanificacionTest(TestCase):
+    """Cola de trabajos: cada trabajo lo toma un solo worker y deja su avance por fases."""
+
+    def _encolar(self, cantidad=1):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return [encolar(TrabajoPlanificacion.Tipo.SOLVER, HOY) for _ in range(cantidad)]
+
+    def _ejecutar(self, trabajo, ejecutor):
+        with mock.patch.dict(trabajos.EJECUTORES, {TrabajoPlanificacion.Tipo.SOLVER: ejecutor}), \
+                contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            return ejecutar(trabajo)
+
+    def test_un_trabajo_que_otro_worker_tomo_en_el_medio_se_saltea(self):
+        primero, segundo = self._encolar(2)
+        ahora = timezone.now
+
+        # Entre la lectura de los pendientes y el UPDATE, otro worker toma el primero
+        def otro_worker_se_adelanta():
+            if not TrabajoPlanificacion.objects.filter(worker="otro").exists():
+                TrabajoPlanificacion.objects.filter(pk=primero.pk).update(
+                    estado=TrabajoPlanificacion.Estado.EN_CURSO, worker="otro"
+                )
+            return ahora()
+
+        with mock.patch.object(trabajos.timezone, "now", side_effect=otro_worker_se_adelanta):
+            tomado = tomar_siguiente("este")
+
+        self.assertEqual(tomado.pk, segundo.pk)
+        self.assertEqual(
+            dict(TrabajoPlanificacion.objects.values_list('pk', 'worker')), {primero.pk: "otro", segundo.pk: "este"}
+        )
+        self.assertIsNone(tomar_siguiente("este"))
+
+    def test_el_progreso_se_guarda_por_fase(self):
+        trabajo, = self._encolar()
+        trabajo = tomar_siguiente("este")
+        vistos = []
+
+        def ejecutor(progreso, fecha, parametros):
+            with progreso.fase("lectura", 30):
+                pass
+            with progreso.fase("calculo", 70):
+                # Lo que ve quien consulta el trabajo mientras corre
+                vistos.append(TrabajoPlanificacion.objects.values_list('fase_actual', 'progreso').get(pk=trabajo.pk))
+            return {"fecha": fecha}
+
+        self._ejecutar(trabajo, ejecutor)
+
+        trabajo.refresh_from_db()
+        self.assertEqual(vistos, [("calculo", 30)])
+        self.assertEqual((trabajo.estado, trabajo.progreso, trabajo.fase_actual), ("COMPLETADO", 100, None))
+        self.assertEqual([fase["fase"] for fase in trabajo.fases], ["lectura", "calculo"])
+        self.assertEqual(trabajo.resultado, {"fecha": HOY.isoformat()})
+
+    def test_un_trabajo_que_falla_deja_el_error_y_la_fase(self):
+        trabajo, = self._encolar()
+        trabajo = tomar_siguiente("este")
+
+        def ejecutor(progreso, fecha, parametros):
+            with progreso.fase("lectura", 30):
+                pass
+            with progreso.fase("calculo", 70):
+                raise RuntimeError("sin líneas")
+
+        self._ejecutar(trabajo, ejecutor)
+
+        trabajo.refresh_from_db()
+        self.assertEqual((trabajo.estado, trabajo.error, trabajo.resultado), ("FALLIDO", "sin líneas", None))
+        self.assertEqual([fase["fase"] for fase in trabajo.fases], ["lectura", "calculo"])
+        self.assertIsNotNone(trabajo.fecha_fin)
+
+    def test_los_trabajos_colgados_se_marcan_fallidos(self):
+        colgado, activo = self._encolar(2)
+        TrabajoPlanificacion.objects.update(estado=TrabajoPlanificacion.Estado.EN_CURSO)
+        TrabajoPlanificacion.objects.filter(pk=colgado.pk).update(
+            fecha_actualizacion=timezone.now() - timedelta(minutes=trabajos.MINUTOS_TRABAJO_COLGADO + 1)
+        )
+
+        self.assertEqual(marcar_colgados(), 1)
+        self.assertEqual(
+            dict(TrabajoPlanificacion.objects.values_list('pk', 'estado')),
+            {colgado.pk: "FALLIDO", activo.pk: "EN_CURSO"}
+        )
+
+
+class TrabajosConcurrentesTest(TransactionTestCase):
+    """
+    Varios workers piden trabajo a la vez: cada trabajo lo toma uno solo.
+    Como las reservas concurrentes (stock/tests.py), con la SQLite en memoria
+    de los tests se saltea.
+    """
+    WORKERS = 8
+    TRABAJOS = 5
+
+    @classmethod
+    def setUpClass(cls):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            raise SkipTest("Los workers concurrentes necesitan una base real (no SQLite en memoria).")
+        super().setUpClass()
+
+    def test_cada_trabajo_lo_toma_un_solo_worker(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(self.TRABAJOS):
+                encolar(TrabajoPlanificacion.Tipo.SOLVER, HOY)
+        barrera = threading.Barrier(self.WORKERS)
+        tomados, errores = [], []
+
+        def worker(nombre):
+            try:
+                barrera.wait()
+                while (trabajo := tomar_siguiente(nombre)) is not None:
+                    tomados.append((trabajo.pk, nombre))
+            except Exception as e:
+                errores.append(e)
+            finally:
+                connections.close_all()
+
+        hilos = [threading.Thread(target=worker, args=(f"worker-{i}",)) for i in range(self.WORKERS)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(errores, [])
+        self.assertEqual(len(tomados), self.TRABAJOS)
+        self.assertEqual(
+            dict(tomados), dict(TrabajoPlanificacion.objects.values_list('pk', 'worker'))
+        )
+        self.assertFalse(TrabajoPlanificacion.objects.exclude(estado=TrabajoPlanificacion.Estado.EN_CURSO).exists())
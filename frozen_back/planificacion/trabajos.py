@@ -0,0 +1,203 @@
+import os
+import socket
+import time
+import traceback
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import TrabajoPlanificacion
+
+# Un trabajo EN_CURSO que no se actualiza hace más que esto quedó colgado
+# (el worker murió): se marca FALLIDO al arrancar un worker.
+MINUTOS_TRABAJO_COLGADO = 60
+
+
+# ===================================================================
+# ENCOLAR
+# ===================================================================
+def encolar(tipo, fecha: date, **parametros) -> TrabajoPlanificacion:
+    """Crea el trabajo PENDIENTE; lo toma el primer worker libre."""
+    trabajo = TrabajoPlanificacion.objects.create(
+        tipo=tipo,
+        parametros={"fecha": fecha, **parametros}
+    )
+    print(f"📥 Trabajo {trabajo.id_trabajo_planificacion} ({trabajo.get_tipo_display()}) encolado para {fecha}.")
+    return trabajo
+
+
+# ===================================================================
+# PROGRESO
+# ===================================================================
+class Progreso:
+    """
+    Registra en el trabajo la fase en curso, el porcentaje y el tiempo de
+    cada fase. Cada fase pesa 'peso' puntos de los 100 del trabajo.
+    """
+
+    def __init__(self, trabajo: TrabajoPlanificacion):
+        self.trabajo = trabajo
+
+    @contextmanager
+    def fase(self, nombre, peso):
+        trabajo = self.trabajo
+        inicio = timezone.now()
+        trabajo.fase_actual = nombre
+        trabajo.save(update_fields=['fase_actual', 'fecha_actualizacion'])
+        try:
+            yield
+        finally:
+            fin = timezone.now()
+            trabajo.fases.append({
+                "fase": nombre,
+                "fecha_inicio": inicio,
+                "fecha_fin": fin,
+                "segundos": round((fin - inicio).total_seconds(), 3),
+            })
+            trabajo.progreso = min(trabajo.progreso + peso, 100)
+            trabajo.save(update_fields=['fases', 'progreso', 'fecha_actualizacion'])
+
+
+# ===================================================================
+# TIPOS DE TRABAJO
+# ===================================================================
+def _mrp_y_solver(progreso: Progreso, fecha: date, parametros):
+    from .planificador import ejecutar_planificacion_diaria_mrp
+    from .planner_service import ejecutar_planificador
+
+    with progreso.fase("mrp", 60):
+        resumen = ejecutar_planificacion_diaria_mrp(fecha)
+    with progreso.fase("solver", 40):
+        ejecutar_planificador(fecha, parametros.get("dias_horizonte"))
+    return {"mrp": resumen}
+
+
+def _solver(progreso: Progreso, fecha: date, parametros):
+    from .planner_service import ejecutar_planificador
+
+    with progreso.fase("solver", 100):
+        ejecutar_planificador(fecha, parametros.get("dias_horizonte"))
+    return {"dia_planificado": fecha + timedelta(days=1)}
+
+
+def _replanificacion_capacidad(progreso: Progreso, fecha: date, parametros):
+    from .replanificador import replanificar_ops_por_capacidad
+
+    productos = parametros.get("productos")
+    with progreso.fase("replanificacion", 100):
+        replanificar_ops_por_capacidad(fecha_simulada=fecha, productos_a_replanificar_ids=productos)
+    return {"productos": productos}
+
+
+def _escenarios(progreso: Progreso, fecha: date, parametros):
+    from .escenarios import simular_escenarios
+    from .serializers import EscenarioSerializer
+
+    # Vuelven del JSON como texto (fechas, claves de lead_times): se validan de nuevo
+    escenarios = EscenarioSerializer(data=parametros["escenarios"], many=True)
+    escenarios.is_valid(raise_exception=True)
+    with progreso.fase("escenarios", 100):
+        return simular_escenarios(fecha, escenarios.validated_data)
+
+
+EJECUTORES = {
+    TrabajoPlanificacion.Tipo.MRP_Y_SOLVER: _mrp_y_solver,
+    TrabajoPlanificacion.Tipo.SOLVER: _solver,
+    TrabajoPlanificacion.Tipo.REPLANIFICACION_CAPACIDAD: _replanificacion_capacidad,
+    TrabajoPlanificacion.Tipo.ESCENARIOS: _escenarios,
+}
+
+
+# ===================================================================
+# WORKER
+# ===================================================================
+def nombre_worker() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def tomar_siguiente(worker: str):
+    """
+    Toma el trabajo PENDIENTE más antiguo. El UPDATE condicional (solo si
+    sigue PENDIENTE) evita que dos workers tomen el mismo.
+    """
+    pendientes = TrabajoPlanificacion.objects.filter(
+        estado=TrabajoPlanificacion.Estado.PENDIENTE
+    ).order_by('id_trabajo_planificacion').values_list('id_trabajo_planificacion', flat=True)
+
+    for trabajo_id in pendientes[:10]:
+        tomado = TrabajoPlanificacion.objects.filter(
+            id_trabajo_planificacion=trabajo_id,
+            estado=TrabajoPlanificacion.Estado.PENDIENTE
+        ).update(
+            estado=TrabajoPlanificacion.Estado.EN_CURSO,
+            worker=worker,
+            fecha_inicio=timezone.now(),
+            fecha_actualizacion=timezone.now()
+        )
+        if tomado:
+            return TrabajoPlanificacion.objects.get(id_trabajo_planificacion=trabajo_id)
+    return None
+
+
+def ejecutar(trabajo: TrabajoPlanificacion):
+    """Corre el trabajo (ya EN_CURSO) y deja el resultado o el error."""
+    fecha = trabajo.parametros["fecha"]
+    if isinstance(fecha, str):
+        fecha = datetime.strptime(fecha, "%Y-%m-%d").date()
+
+    print(f"⚙️ Trabajo {trabajo.id_trabajo_planificacion} ({trabajo.get_tipo_display()}) para {fecha}...")
+    try:
+        resultado = EJECUTORES[trabajo.tipo](Progreso(trabajo), fecha, trabajo.parametros)
+    except Exception as e:
+        traceback.print_exc()
+        trabajo.estado = TrabajoPlanificacion.Estado.FALLIDO
+        trabajo.error = str(e)
+        print(f"❌ Trabajo {trabajo.id_trabajo_planificacion} falló: {e}")
+    else:
+        trabajo.estado = TrabajoPlanificacion.Estado.COMPLETADO
+        trabajo.resultado = resultado
+        trabajo.progreso = 100
+        print(f"✅ Trabajo {trabajo.id_trabajo_planificacion} completado.")
+
+    trabajo.fase_actual = None
+    trabajo.fecha_fin = timezone.now()
+    trabajo.save(update_fields=[
+        'estado', 'error', 'resultado', 'progreso', 'fase_actual', 'fecha_fin', 'fecha_actualizacion'
+    ])
+    return trabajo
+
+
+def marcar_colgados() -> int:
+    """Los EN_CURSO sin novedades hace MINUTOS_TRABAJO_COLGADO pasan a FALLIDO."""
+    limite = timezone.now() - timedelta(minutes=MINUTOS_TRABAJO_COLGADO)
+    return TrabajoPlanificacion.objects.filter(
+        estado=TrabajoPlanificacion.Estado.EN_CURSO,
+        fecha_actualizacion__lt=limite
+    ).update(
+        estado=TrabajoPlanificacion.Estado.FALLIDO,
+        error="El worker dejó de responder.",
+        fecha_fin=timezone.now()
+    )
+
+
+def correr_worker(intervalo: float = 2, una_vez: bool = False):
+    """
+    Bucle del worker: toma y corre trabajos de a uno. Con 'una_vez' vacía la
+    cola y termina (útil para cron o pruebas).
+    """
+    worker = nombre_worker()
+    colgados = marcar_colgados()
+    print(f"👷 Worker de planificación {worker} iniciado"
+          f"{f' ({colgados} trabajos colgados marcados como fallidos)' if colgados else ''}.")
+
+    while True:
+        close_old_connections()
+        trabajo = tomar_siguiente(worker)
+        if trabajo is not None:
+            ejecutar(trabajo)
+            continue
+        if una_vez:
+            return
+        time.sleep(intervalo)
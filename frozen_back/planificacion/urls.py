@@ -1,16 +1,28 @@
-from django.urls import path
+from django.urls import path, include
+from rest_framework.routers import DefaultRouter
 from . import views
 
+router = DefaultRouter()
+router.register(r'dias-no-laborables', views.DiaNoLaborableViewSet)
+router.register(r'trabajos-planificacion', views.TrabajoPlanificacionViewSet)
+router.register(r'soluciones-solver', views.SolucionSolverViewSet)
+
 urlpatterns = [
     # Registra la vista en la URL 'api/planificacion/ejecutar/'
     path('planificacion/', views.ejecutar_planificacion_view, name='ejecutar-planificacion'),
     path('replanificar/', views.replanificar_produccion_view, name='replanificar_produccion'),
     path('ejecutar-mrp/', views.ejecutar_planificador_view, name='ejecutar-mrp'),
+    path('simular-mrp/', views.simular_planificador_view, name='simular-mrp'),
+    path('escenarios/', views.simular_escenarios_view, name='simular-escenarios'),
+    path('ejecutar-mrp-incremental/', views.ejecutar_mrp_incremental_view, name='ejecutar-mrp-incremental'),
     path(
         'calendario/', 
         views.CalendarioPlanificacionView.as_view(), 
         name='calendario_planificacion_feed'
     ),
+    path('metricas-planificador/', views.MetricasPlanificadorView.as_view(), name='metricas-planificador'),
     path('replanificar-ops-por-capacidad/', views.replanificar_capacidad_view, name='replanificar-ops-por-capacidad'),
+    path('reprogramar-linea/', views.reprogramar_linea_view, name='reprogramar-linea'),
+    path('', include(router.urls)),
 
 ]
\ No newline at end of file
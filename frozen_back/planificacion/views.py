@@ -1,51 +1,54 @@
-from django.shortcuts import render
-
-# Create your views here.
-from rest_framework.decorators import api_view
-from rest_framework.response import Response
-from rest_framework import status
-from compras.models import OrdenCompra
-from ventas.models import OrdenVenta
-from produccion.models import OrdenProduccion
-from planificacion.planner_service import ejecutar_planificador, replanificar_produccion
-from planificacion.planificador import ejecutar_planificacion_diaria_mrp
 import traceback
 from datetime import timedelta, date, datetime
+
+from django.db.models import Sum, Max, Avg, Count, Q
 from django.utils import timezone
-from produccion.models import OrdenProduccion
-from compras.models import OrdenCompra
-from ventas.models import OrdenVenta # Necesitas importar este modelo
-from django.db import models
-from produccion.models import CalendarioProduccion
-from rest_framework.views import APIView
+from rest_framework import status, viewsets
+from rest_framework.decorators import api_view, action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from django.db.models import F, Case, When, Value, CharField, Sum
-from django.utils import timezone
-from datetime import timedelta, datetime
-from planificacion.replanificador import replanificar_ops_por_capacidad
+from rest_framework.views import APIView
+
+from compras.models import OrdenCompra
+from ventas.models import OrdenVenta
+from produccion.models import CalendarioProduccion, LineaProduccion, estado_linea_produccion
+from planificacion.planner_service import replanificar_produccion
+from planificacion.planificador import ejecutar_planificacion_diaria_mrp, ejecutar_planificacion_incremental_mrp
+from planificacion.models import MetricaPlanificador, DiaNoLaborable, TrabajoPlanificacion, SolucionSolver
+from planificacion.serializers import (
+    DiaNoLaborableSerializer, TrabajoPlanificacionSerializer, EncolarTrabajoSerializer,
+    SimularEscenariosSerializer, SolucionSolverSerializer
+)
+from planificacion.trabajos import encolar
+from planificacion.reactivo import reprogramar_por_cambio_de_linea
 
 @api_view(['POST']) # Define que esta vista solo acepta POST
 def ejecutar_planificacion_view(request):
     """
     Endpoint para disparar el script de planificación de Google OR-Tools.
+    Encola el trabajo y responde al instante con su ID
+    (ver /trabajos-planificacion/<id>/).
+
+    Opcionalmente, acepta un JSON para simular una fecha:
+    {
+        "fecha": "YYYY-MM-DD"
+    }
     """
-    try:
-        print("Iniciando planificador desde el endpoint /planificacion/...")
-        
-        # Llama a tu función principal del planner_service
-        ejecutar_planificador() 
-        
-        return Response(
-            {"mensaje": "Planificador ejecutado exitosamente. Se crearon las Órdenes de Trabajo."}, 
-            status=status.HTTP_200_OK
-        )
-    
-    except Exception as e:
-        print(f"Error al ejecutar el planificador desde API: {str(e)}")
-        return Response(
-            {"error": f"Ocurrió un error al ejecutar el planificador: {str(e)}"}, 
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+    fecha_enviada = request.data.get('fecha')
+
+    if fecha_enviada:
+        try:
+            fecha_a_usar = datetime.strptime(fecha_enviada, "%Y-%m-%d").date()
+        except ValueError:
+            return Response(
+                {"error": "Formato de fecha inválido. Use YYYY-MM-DD."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    else:
+        fecha_a_usar = timezone.localdate()
+
+    trabajo = encolar(TrabajoPlanificacion.Tipo.SOLVER, fecha_a_usar)
+    return _respuesta_trabajo(trabajo, "Planificador encolado. Las Órdenes de Trabajo se crean al terminar el trabajo.")
     
 
 @api_view(['POST']) # Define que esta vista solo acepta POST
@@ -77,7 +80,9 @@ def replanificar_produccion_view(request):
 @api_view(['POST'])
 def ejecutar_planificador_view(request):
     """
-    Endpoint para disparar manualmente el Planificador MRP Diario.
+    Endpoint para disparar manualmente el Planificador MRP Diario (y el
+    solver táctico a continuación). Encola el trabajo y responde al instante
+    con su ID (ver /trabajos-planificacion/<id>/).
     
     Opcionalmente, acepta un JSON para simular una fecha:
     {
@@ -103,42 +108,130 @@ def ejecutar_planificador_view(request):
         fecha_a_usar = timezone.localdate()
         print(f"Ejecutando planificador para la fecha actual: {fecha_a_usar}")
 
+    # 1. MRP (QUÉ producir y CUÁNDO) y 2. Scheduler (OTs de MAÑANA), en un trabajo en segundo plano
+    trabajo = encolar(TrabajoPlanificacion.Tipo.MRP_Y_SOLVER, fecha_a_usar)
+    return _respuesta_trabajo(trabajo, f"Planificador MRP encolado para {fecha_a_usar}.")
+    
+@api_view(['POST'])
+def simular_planificador_view(request):
+    """
+    Corre el Planificador MRP en modo SIMULACIÓN: no escribe nada en la BD y
+    devuelve lo que haría (OPs a crear/modificar/cancelar, reservas,
+    calendario, OVs desplazadas y OCs).
+
+    Opcionalmente, acepta un JSON para simular una fecha:
+    {
+        "fecha": "YYYY-MM-DD"
+    }
+    """
+    fecha_enviada = request.data.get('fecha')
+
+    if fecha_enviada:
+        try:
+            fecha_a_usar = datetime.strptime(fecha_enviada, "%Y-%m-%d").date()
+        except ValueError:
+            return Response(
+                {"status": "error", "message": "Formato de fecha inválido. Use YYYY-MM-DD."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    else:
+        fecha_a_usar = timezone.localdate()
+
+    print(f"Simulando Planificador MRP (sin escribir) para la fecha: {fecha_a_usar}")
+
     try:
-       # --- INICIO DE LÓGICA MODIFICADA ---
-        
-        # 1. Primero, corre el MRP para determinar QUÉ producir y CUÁNDO (Crea OPs "Pendiente de inicio")
-        print("\n--- INICIANDO FASE 1: MRP (Planificación de Materiales) ---")
-        ejecutar_planificacion_diaria_mrp(fecha_a_usar)
-        print("--- FASE 1: MRP COMPLETADA ---")
-
-        # 2. Segundo, corre el Scheduler para planificar el día de MAÑANA
-        #    (Toma las OPs "Pendiente de inicio" para mañana y crea las OTs)
-        print("\n--- INICIANDO FASE 2: SCHEDULER (Planificación de Taller) ---")
-        # Nota: El scheduler usa 'timezone.localdate() + 1' internamente,
-        # así que no necesita la fecha simulada (a menos que quieras cambiarlo).
-        ejecutar_planificador(fecha_a_usar)
-        print("--- FASE 2: SCHEDULER COMPLETADA ---")
-        
-        # --- FIN DE LÓGICA MODIFICADA ---
-        print("Planificador MRP ejecutado exitosamente desde la API.")
+        resumen = ejecutar_planificacion_diaria_mrp(fecha_a_usar, simular=True)
         return Response(
-            {"status": "ok", "message": f"Planificador MRP ejecutado para {fecha_a_usar}." },
+            {"status": "ok", "message": f"Simulación del MRP para {fecha_a_usar}.", "resumen": resumen},
             status=status.HTTP_200_OK
         )
     except Exception as e:
-        # Captura cualquier error que ocurra durante la planificación
-        print(f"ERROR al ejecutar planificador desde API: {e}")
-        traceback.print_exc() # Imprime el error completo en la consola del servidor
+        print(f"ERROR al simular el planificador desde API: {e}")
+        traceback.print_exc()
         return Response(
-            {"status": "error", "message": f"Error al ejecutar el planificador: {str(e)}"},
+            {"status": "error", "message": f"Error al simular el planificador: {str(e)}"},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
-    
+
+@api_view(['POST'])
+def simular_escenarios_view(request):
+    """
+    Escenarios "qué pasa si" (MRP + solver táctico en SIMULACIÓN, sin escribir
+    nada). Encola el trabajo y responde al instante con su ID: el resultado
+    (KPIs de cada escenario junto a los del escenario "base", lado a lado en
+    'comparacion') queda en /trabajos-planificacion/<id>/resultado/.
+
+    Acepta un JSON con:
+    {
+        "fecha": "YYYY-MM-DD",                       // Opcional (default: hoy)
+        "escenarios": [
+            {"nombre": "turno extra", "horas_laborables_por_dia": 24},
+            {"nombre": "proveedor 3 atrasado", "lead_times": {"3": 10}},
+            {"nombre": "sin línea 2", "lineas_fuera_de_servicio": [2]},
+            {"nombre": "pedido grande", "ovs_adicionales": [
+                {"fecha_entrega": "YYYY-MM-DD", "productos": [{"producto": 1, "cantidad": 5000}]}
+            ]}
+        ]
+    }
+    """
+    serializer = SimularEscenariosSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    fecha_a_usar = serializer.validated_data.get('fecha') or timezone.localdate()
+    escenarios = serializer.validated_data['escenarios']
+
+    trabajo = encolar(TrabajoPlanificacion.Tipo.ESCENARIOS, fecha_a_usar, escenarios=escenarios)
+    return _respuesta_trabajo(trabajo, f"Simulación de {len(escenarios)} escenarios encolada para {fecha_a_usar}.")
+
+@api_view(['POST'])
+def ejecutar_mrp_incremental_view(request):
+    """
+    Corre el MRP INCREMENTAL: solo replanifica los productos marcados como
+    pendientes desde la última corrida (y los que comparten MP con ellos).
+
+    Opcionalmente, acepta un JSON:
+    {
+        "fecha": "YYYY-MM-DD",
+        "simular": true
+    }
+    """
+    fecha_enviada = request.data.get('fecha')
+    simular = bool(request.data.get('simular', False))
+
+    if fecha_enviada:
+        try:
+            fecha_a_usar = datetime.strptime(fecha_enviada, "%Y-%m-%d").date()
+        except ValueError:
+            return Response(
+                {"status": "error", "message": "Formato de fecha inválido. Use YYYY-MM-DD."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    else:
+        fecha_a_usar = timezone.localdate()
+
+    try:
+        resumen = ejecutar_planificacion_incremental_mrp(fecha_a_usar, simular=simular)
+        return Response(
+            {
+                "status": "ok",
+                "message": f"MRP incremental para {fecha_a_usar}: {len(resumen['productos'])} productos replanificados.",
+                "resumen": resumen
+            },
+            status=status.HTTP_200_OK
+        )
+    except Exception as e:
+        print(f"ERROR al ejecutar el MRP incremental desde API: {e}")
+        traceback.print_exc()
+        return Response(
+            {"status": "error", "message": f"Error al ejecutar el MRP incremental: {str(e)}"},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
 @api_view(['POST'])
 def replanificar_capacidad_view(request):
     """
     Endpoint dedicado para disparar la Replanificación por Capacidad
     (se recomienda ejecutar inmediatamente después de cambiar 'cant_por_hora').
+    Encola el trabajo y responde al instante con su ID.
     
     Acepta un JSON con:
     {
@@ -163,32 +256,76 @@ def replanificar_capacidad_view(request):
     else:
         fecha_a_usar = timezone.localdate()
 
-    print(f"Iniciando Replanificación de Capacidad para fecha: {fecha_a_usar}")
+    # --- 2. Encolar Replanificación ---
+    trabajo = encolar(TrabajoPlanificacion.Tipo.REPLANIFICACION_CAPACIDAD, fecha_a_usar, productos=productos_ids)
+
+    mensaje = f"Replanificación por capacidad encolada para {fecha_a_usar}."
+    if productos_ids:
+        mensaje += f" Productos enfocados: {productos_ids}."
+    return _respuesta_trabajo(trabajo, mensaje)
+
+
+def _respuesta_trabajo(trabajo, mensaje):
+    return Response(
+        {
+            "status": "ok",
+            "message": mensaje,
+            "id_trabajo": trabajo.id_trabajo_planificacion,
+            "estado": trabajo.estado,
+        },
+        status=status.HTTP_202_ACCEPTED
+    )
     
-    # --- 2. Ejecutar Replanificación ---
+
+@api_view(['POST'])
+def reprogramar_linea_view(request):
+    """
+    Reprogramación REACTIVA cuando una línea cambia de estado en medio del
+    turno: re-secuencia las OTs no iniciadas sobre las líneas activas en
+    ~1 segundo (sin esperar al solver de la noche).
+
+    Acepta un JSON con:
+    {
+        "linea": 3,               // Obligatorio
+        "estado": "Detenida",     // Opcional: nuevo estado de la línea (se aplica antes)
+        "simular": true           // Opcional: devuelve el plan sin guardarlo (ni el estado,
+                                  // que solo se usa para la simulación)
+    }
+    """
+    linea_id = request.data.get('linea')
+    estado_enviado = request.data.get('estado')
+    simular = bool(request.data.get('simular', False))
+
+    linea = LineaProduccion.objects.filter(pk=linea_id).first() if linea_id else None
+    if linea is None:
+        return Response({"error": "Debe indicar una 'linea' existente."}, status=status.HTTP_400_BAD_REQUEST)
+
+    estados_linea = {}
+    if estado_enviado:
+        nuevo_estado = estado_linea_produccion.objects.filter(descripcion__iexact=estado_enviado).first()
+        if nuevo_estado is None:
+            return Response(
+                {"error": f"Estado de Línea '{estado_enviado}' no encontrado."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not simular:
+            linea.id_estado_linea_produccion = nuevo_estado
+            linea.save(update_fields=['id_estado_linea_produccion'])
+        estados_linea[linea.id_linea_produccion] = nuevo_estado
+
     try:
-        replanificar_ops_por_capacidad(
-            fecha_simulada=fecha_a_usar,
-            productos_a_replanificar_ids=productos_ids
-        )
-        
-        mensaje = f"Replanificación por capacidad ejecutada para {fecha_a_usar}."
-        if productos_ids:
-            mensaje += f" Productos enfocados: {productos_ids}."
-            
-        return Response(
-            {"status": "ok", "message": mensaje },
-            status=status.HTTP_200_OK
+        resultado = reprogramar_por_cambio_de_linea(
+            linea.id_linea_produccion, simular=simular, estados_linea=estados_linea
         )
-            
+        return Response({"status": "ok", "resultado": resultado}, status=status.HTTP_200_OK)
     except Exception as e:
-        print(f"ERROR CRÍTICO al ejecutar replanificación de capacidad: {e}")
+        print(f"ERROR en la reprogramación reactiva: {e}")
         traceback.print_exc()
         return Response(
-            {"status": "error", "message": f"Error en la replanificación de capacidad: {str(e)}"},
+            {"status": "error", "message": f"Error en la reprogramación reactiva: {str(e)}"},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
-    
+
 
 class CalendarioPlanificacionView(APIView):
     """
@@ -339,4 +476,174 @@ class CalendarioPlanificacionView(APIView):
             return Response(
                 {"error": "Ocurrió un error interno al generar el calendario.", "detalle": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
\ No newline at end of file
+            )
+
+class MetricasPlanificadorView(APIView):
+    """
+    Métricas de las últimas corridas del planificador (MRP y solver), una
+    entrada por corrida con sus etapas: tiempo, consultas, tiempo en BD y
+    filas escritas.
+
+    Filtros opcionales (query params):
+    - proceso: MRP | MRP_INCREMENTAL | SOLVER
+    - fecha: YYYY-MM-DD (fecha de planificación)
+    - limite: cantidad de corridas (default 20, máx. 200)
+    """
+    def get(self, request):
+        metricas = MetricaPlanificador.objects.all()
+
+        proceso = request.query_params.get('proceso')
+        if proceso:
+            metricas = metricas.filter(proceso=proceso)
+
+        fecha = request.query_params.get('fecha')
+        if fecha:
+            try:
+                metricas = metricas.filter(fecha_planificacion=datetime.strptime(fecha, "%Y-%m-%d").date())
+            except ValueError:
+                return Response(
+                    {"error": "Formato de fecha inválido. Use YYYY-MM-DD."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+        try:
+            limite = min(int(request.query_params.get('limite', 20)), 200)
+        except ValueError:
+            return Response({"error": "'limite' debe ser un número."}, status=status.HTTP_400_BAD_REQUEST)
+
+        corridas_ids = list(
+            metricas.order_by().values('corrida').annotate(
+                ultima=Max('id_metrica_planificador')
+            ).order_by('-ultima').values_list('corrida', flat=True)[:limite]
+        )
+
+        corridas = {}
+        for m in metricas.filter(corrida__in=corridas_ids).order_by('orden'):
+            corrida = corridas.setdefault(m.corrida, {
+                "corrida": m.corrida,
+                "proceso": m.proceso,
+                "fecha_planificacion": m.fecha_planificacion,
+                "id_ejecucion_mrp": m.id_ejecucion_mrp_id,
+                "fecha_inicio": m.fecha_inicio,
+                "duracion_ms": 0,
+                "consultas": 0,
+                "tiempo_db_ms": 0,
+                "filas_escritas": 0,
+                "etapas": [],
+            })
+            for campo in ("duracion_ms", "consultas", "tiempo_db_ms", "filas_escritas"):
+                corrida[campo] += getattr(m, campo)
+            corrida["etapas"].append({
+                "etapa": m.etapa,
+                "fecha_inicio": m.fecha_inicio,
+                "duracion_ms": m.duracion_ms,
+                "consultas": m.consultas,
+                "tiempo_db_ms": m.tiempo_db_ms,
+                "filas_escritas": m.filas_escritas,
+                "error": m.error,
+            })
+
+        for corrida in corridas.values():
+            corrida["duracion_ms"] = round(corrida["duracion_ms"], 2)
+            corrida["tiempo_db_ms"] = round(corrida["tiempo_db_ms"], 2)
+
+        return Response([corridas[c] for c in corridas_ids if c in corridas], status=status.HTTP_200_OK)
+
+
+class DiaNoLaborableViewSet(viewsets.ModelViewSet):
+    """ABM de feriados y paradas de planta (calendario laboral de los planificadores)."""
+    queryset = DiaNoLaborable.objects.all()
+    serializer_class = DiaNoLaborableSerializer
+
+
+class TrabajoPlanificacionViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Trabajos de planificación en segundo plano (los corre 'manage.py worker_planificacion').
+
+    - GET  /trabajos-planificacion/                  últimos trabajos (?estado=, ?tipo=)
+    - POST /trabajos-planificacion/                  encola {"tipo", "fecha"?, "productos"?, "dias_horizonte"?, "escenarios"?}
+    - GET  /trabajos-planificacion/<id>/             estado, progreso (%) y tiempos por fase
+    - GET  /trabajos-planificacion/<id>/resultado/   resultado (409 si todavía no terminó)
+    """
+    queryset = TrabajoPlanificacion.objects.all()
+    serializer_class = TrabajoPlanificacionSerializer
+
+    def get_queryset(self):
+        trabajos = super().get_queryset()
+        for campo in ('estado', 'tipo'):
+            valor = self.request.query_params.get(campo)
+            if valor:
+                trabajos = trabajos.filter(**{campo: valor})
+        return trabajos
+
+    def create(self, request):
+        datos = EncolarTrabajoSerializer(data=request.data)
+        datos.is_valid(raise_exception=True)
+        parametros = dict(datos.validated_data)
+        tipo = parametros.pop('tipo')
+        fecha = parametros.pop('fecha', None) or timezone.localdate()
+        trabajo = encolar(tipo, fecha, **parametros)
+        return Response(self.get_serializer(trabajo).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['get'])
+    def resultado(self, request, pk=None):
+        trabajo = self.get_object()
+        if trabajo.estado == TrabajoPlanificacion.Estado.COMPLETADO:
+            return Response(trabajo.resultado, status=status.HTTP_200_OK)
+        if trabajo.estado == TrabajoPlanificacion.Estado.FALLIDO:
+            return Response({"error": trabajo.error}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response(
+            {"estado": trabajo.estado, "progreso": trabajo.progreso},
+            status=status.HTTP_409_CONFLICT
+        )
+
+
+class SolucionSolverViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Corridas del solver táctico: parámetros (de Configuracion), tamaño del
+    modelo y estadísticas (estado, objetivo, cota, gap, tiempo, conflictos, ramas).
+
+    - GET /soluciones-solver/           corridas (?fecha_desde=, ?fecha_hasta=, ?estado=, ?workers=)
+    - GET /soluciones-solver/<id>/      una corrida, con el detalle por subproblema
+    - GET /soluciones-solver/resumen/   agregado por combinación de parámetros (mismos filtros)
+    """
+    queryset = SolucionSolver.objects.all()
+    serializer_class = SolucionSolverSerializer
+
+    def get_queryset(self):
+        soluciones = super().get_queryset().defer('tandas')
+        params = self.request.query_params
+        for param, filtro in (('fecha_desde', 'fecha_planificacion__gte'), ('fecha_hasta', 'fecha_planificacion__lte')):
+            if params.get(param):
+                try:
+                    soluciones = soluciones.filter(**{filtro: datetime.strptime(params[param], "%Y-%m-%d").date()})
+                except ValueError:
+                    raise ValidationError({param: "Formato de fecha inválido. Use YYYY-MM-DD."})
+        if params.get('estado'):
+            soluciones = soluciones.filter(estado=params['estado'].upper())
+        if params.get('workers'):
+            if not params['workers'].isdigit():
+                raise ValidationError({"workers": "Debe ser un número."})
+            soluciones = soluciones.filter(workers=int(params['workers']))
+        return soluciones
+
+    @action(detail=False, methods=['get'])
+    def resumen(self, request):
+        parametros = ['workers', 'max_segundos', 'max_segundos_subproblema', 'horizonte_minutos']
+        grupos = self.get_queryset().order_by().values(*parametros).annotate(
+            corridas=Count('id_solucion_solver'),
+            optimas=Count('id_solucion_solver', filter=Q(estado='OPTIMAL')),
+            segundos_promedio=Avg('segundos_solver'),
+            segundos_max=Max('segundos_solver'),
+            gap_promedio=Avg('gap'),
+            variables_promedio=Avg('variables'),
+        ).order_by(*parametros)
+
+        resumen = []
+        for grupo in grupos:
+            grupo["porcentaje_optimas"] = round(100 * grupo.pop("optimas") / grupo["corridas"], 1)
+            for campo in ("segundos_promedio", "segundos_max", "gap_promedio", "variables_promedio"):
+                if grupo[campo] is not None:
+                    grupo[campo] = round(grupo[campo], 4)
+            resumen.append(grupo)
+        return Response(resumen, status=status.HTTP_200_OK)
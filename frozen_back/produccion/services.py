@@ -1,12 +1,11 @@
 
 from django.db import transaction, models
 from django.db.models import Sum, Q
-from .models import OrdenProduccion, EstadoOrdenProduccion, OrdenProduccion
-from stock.models import LoteMateriaPrima, EstadoLoteMateriaPrima, LoteProduccionMateria, ReservaMateriaPrima, EstadoReservaMateria
-from recetas.models import Receta, RecetaMateriaPrima
-from django.core.exceptions import ValidationError
-from recetas.models import Receta, RecetaMateriaPrima
-from stock.services import verificar_stock_mp_y_enviar_alerta
+from .models import OrdenProduccion, EstadoOrdenProduccion
+from stock.models import EstadoLoteMateriaPrima, LoteProduccionMateria, ReservaMateriaPrima, EstadoReservaMateria
+from stock.services import verificar_stock_mp_y_enviar_alerta, reservar_stock_mp_fefo
+from recetas.services import get_explosion_recetas
+from collections import defaultdict
 
 from stock.models import EstadoLoteProduccion
 
@@ -40,115 +39,62 @@ def procesar_ordenes_en_espera(materia_prima_ingresada):
         print("No hay órdenes en espera que requieran esta materia prima.")
         return
 
-    print(f"Se encontraron {ordenes_a_revisar.count()} órdenes para revisar.")
-
-    # 3. Iterar sobre cada orden y verificar si AHORA tiene stock completo
+    ordenes_a_revisar = list(ordenes_a_revisar)
+    print(f"Se encontraron {len(ordenes_a_revisar)} órdenes para revisar.")
+
+    # 3. Reservas ACTIVAS que ya tienen (una consulta para todas las órdenes)
+    reservas_existentes = defaultdict(int)
+    for op_id, mp_id, total in ReservaMateriaPrima.objects.filter(
+        id_orden_produccion__in=ordenes_a_revisar,
+        id_estado_reserva_materia=estado_activa_reserva
+    ).order_by().values(
+        'id_orden_produccion_id', 'id_lote_materia_prima__id_materia_prima_id'
+    ).annotate(total=Sum('cantidad_reservada')).values_list(
+        'id_orden_produccion_id', 'id_lote_materia_prima__id_materia_prima_id', 'total'
+    ):
+        reservas_existentes[(op_id, mp_id)] = total or 0
+
+    # 4. Cuánto le falta a cada orden de cada MP (según su receta)
+    explosion = get_explosion_recetas()
+    demandas = []
     for orden in ordenes_a_revisar:
-        print(f"Revisando stock para la Orden de Producción #{orden.id_orden_produccion}...")
-        
-        try:
-            receta = Receta.objects.get(id_producto=orden.id_producto)
-            ingredientes = RecetaMateriaPrima.objects.filter(id_receta=receta)
-            
-            stock_suficiente = True
-            # Verificar stock DISPONIBLE (considerando reservas existentes)
-            for ingrediente in ingredientes:
-                materia = ingrediente.id_materia_prima
-                cantidad_necesaria = ingrediente.cantidad * orden.cantidad
-                
-                # 🔹 CALCULAR: Cuánto ya tenemos reservado vs cuánto nos falta
-                reservas_existentes = ReservaMateriaPrima.objects.filter(
-                    id_orden_produccion=orden,
-                    id_estado_reserva_materia=estado_activa_reserva,
-                    id_lote_materia_prima__id_materia_prima=materia
-                ).aggregate(total_reservado=Sum('cantidad_reservada'))['total_reservado'] or 0
-                
-                cantidad_faltante = max(0, cantidad_necesaria - reservas_existentes)
-                
-                if cantidad_faltante > 0:
-                    # Calcular stock disponible para completar lo que falta
-                    lotes_disponibles = LoteMateriaPrima.objects.filter(
-                        id_materia_prima=materia,
-                        id_estado_lote_materia_prima=estado_disponible_mp
-                    )
-                    stock_disponible_total = 0
-
-                    for lote in lotes_disponibles:
-                        stock_disponible_total += lote.cantidad_disponible
-
-                    if stock_disponible_total < cantidad_faltante:
-                        stock_suficiente = False
-                        print(f"Falta stock disponible para {materia.nombre}. Ya reservado: {reservas_existentes}, Faltante: {cantidad_faltante}, Disponible: {stock_disponible_total}.")
-                        break
-                    else:
-                        print(f"✅ {materia.nombre}: Ya reservado: {reservas_existentes}, Faltante: {cantidad_faltante}, Disponible: {stock_disponible_total}")
-                else:
-                    print(f"✅ {materia.nombre}: Ya completamente reservado ({reservas_existentes}/{cantidad_necesaria})")
-
-            # 4. Si hay stock para completar lo faltante, crear RESERVAS adicionales
-            if stock_suficiente:
-                print(f"¡Stock suficiente para completar la Orden #{orden.id_orden_produccion}! Creando/actualizando reservas...")
-                
-                reservas_creadas = 0
-                # Completar reservas para cada ingrediente que lo necesite
-                for ingrediente in ingredientes:
-                    materia = ingrediente.id_materia_prima
-                    cantidad_necesaria = ingrediente.cantidad * orden.cantidad
-                    
-                    # Calcular cuánto ya está reservado y cuánto falta
-                    reservas_existentes = ReservaMateriaPrima.objects.filter(
-                        id_orden_produccion=orden,
-                        id_estado_reserva_materia=estado_activa_reserva,
-                        id_lote_materia_prima__id_materia_prima=materia
-                    ).aggregate(total_reservado=Sum('cantidad_reservada'))['total_reservado'] or 0
-                    
-                    cantidad_faltante = max(0, cantidad_necesaria - reservas_existentes)
-                    
-                    if cantidad_faltante > 0:
-                        print(f"  Completando reserva para {materia.nombre}: faltan {cantidad_faltante} unidades")
-                        
-                        lotes_mp = LoteMateriaPrima.objects.filter(
-                            id_materia_prima=materia,
-                            id_estado_lote_materia_prima=estado_disponible_mp
-                        ).order_by('fecha_vencimiento')
-
-                        cantidad_a_reservar = cantidad_faltante
-
-                        for lote in lotes_mp:
-                            if cantidad_a_reservar <= 0: 
-                                break
-                            
-                            disponible_lote = lote.cantidad_disponible
-                            if disponible_lote <= 0:
-                                continue
-                                
-                            cantidad_reservada = min(disponible_lote, cantidad_a_reservar)
-                            
-                            # Crear nueva reserva para completar lo faltante
-                            ReservaMateriaPrima.objects.create(
-                                id_orden_produccion=orden,
-                                id_lote_materia_prima=lote,
-                                cantidad_reservada=cantidad_reservada,
-                                id_estado_reserva_materia=estado_activa_reserva
-                            )
-                            
-                            cantidad_a_reservar -= cantidad_reservada
-                            reservas_creadas += 1
-                            print(f"    → Reservados {cantidad_reservada} de {materia.nombre} (Lote: {lote.id_lote_materia_prima})")
-                
-                # Cambiar estado de la orden
-                orden.id_estado_orden_produccion = estado_pendiente
-                orden.save()
-                
-                print(f"✅ Orden #{orden.id_orden_produccion} actualizada a 'Pendiente de inicio'. Reservas creadas: {reservas_creadas}")
+        if not explosion.tiene_receta(orden.id_producto_id):
+            print(f"Advertencia: La orden #{orden.id_orden_produccion} no tiene receta asociada. Se omite.")
+            continue
+
+        necesario = defaultdict(int)
+        for ingrediente in explosion.ingredientes(orden.id_producto_id):
+            necesario[ingrediente.id_materia_prima] += ingrediente.cantidad * orden.cantidad
 
+        faltantes = {}
+        for mp_id, cantidad_necesaria in necesario.items():
+            reservado = reservas_existentes[(orden.id_orden_produccion, mp_id)]
+            cantidad_faltante = max(0, cantidad_necesaria - reservado)
+            if cantidad_faltante > 0:
+                faltantes[mp_id] = cantidad_faltante
             else:
-                print(f"❌ Stock insuficiente para completar la Orden #{orden.id_orden_produccion}. Permanece en espera.")
+                print(f"✅ OP #{orden.id_orden_produccion} - {explosion.materia_prima(mp_id).nombre}: Ya completamente reservado ({reservado}/{cantidad_necesaria})")
+        demandas.append((orden, faltantes))
 
-        except Receta.DoesNotExist:
-            print(f"Advertencia: La orden #{orden.id_orden_produccion} no tiene receta asociada. Se omite.")
+    # 5. Reservar lo que falta (FEFO, por antigüedad de la orden): cada orden
+    #    recibe TODAS sus MPs o ninguna, y las que no alcanzan no le quitan
+    #    stock a las siguientes.
+    reservados = reservar_stock_mp_fefo(demandas, estado_activa_reserva, completa=True)
+
+    for (orden, faltantes), reservado in zip(demandas, reservados):
+        if any(reservado[mp_id] < cantidad for mp_id, cantidad in faltantes.items()):
+            print(f"❌ Stock insuficiente para completar la Orden #{orden.id_orden_produccion}. Permanece en espera.")
             continue
 
+        for mp_id, cantidad in faltantes.items():
+            print(f"    → Reservados {cantidad} de {explosion.materia_prima(mp_id).nombre} (OP #{orden.id_orden_produccion})")
+
+        # Cambiar estado de la orden
+        orden.id_estado_orden_produccion = estado_pendiente
+        orden.save()
+
+        print(f"✅ Orden #{orden.id_orden_produccion} actualizada a 'Pendiente de inicio'. MPs completadas: {len(faltantes)}")
+
 
 
 
@@ -513,9 +513,8 @@ class OrdenProduccionViewSet(viewsets.ModelViewSet):
 
                 # --- ERROR POTENCIAL CORREGIDO ---
                 # No debes hacer 'lote_mp.cantidad_disponible += ...'
-                # El @property 'cantidad_disponible' es calculado, no un campo de BBDD.
-                # Simplemente cambiando el estado de la reserva a "Cancelada"
-                # el @property 'cantidad_disponible' del lote se recalculará correctamente.
+                # Al guardar la reserva como "Cancelada", stock/signals.py
+                # devuelve su cantidad al 'cantidad_disponible' del lote.
                 for reserva in reservas:
                     reserva.id_estado_reserva_materia = estado_cancelada_reserva
                     reserva.save()
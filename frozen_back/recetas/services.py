@@ -0,0 +1,195 @@
+import copy
+import uuid
+from collections import defaultdict
+from typing import NamedTuple
+
+from django.core.cache import caches
+from django.db import transaction
+
+from materias_primas.models import MateriaPrima, Proveedor
+from .models import Receta, RecetaMateriaPrima, ProductoLinea
+
+
+class Ingrediente(NamedTuple):
+    """Un renglón de la receta ya 'explotado' (MP + proveedor + lead time)."""
+    id_materia_prima: int
+    cantidad: int
+    materia_prima: MateriaPrima
+    proveedor: Proveedor
+    lead_time_days: int
+
+
+class ExplosionRecetas:
+    """
+    Explosión de recetas (BOM) de TODOS los productos, cargada de una sola vez:
+
+    - 1 consulta: ingredientes con su MP, proveedor y lead time.
+    - 1 consulta: recetas (para los productos con receta pero sin ingredientes).
+    - 1 consulta: líneas de producción por producto (ProductoLinea).
+
+    Después de 'cargar()' ninguna lectura vuelve a la BD.
+    """
+
+    def __init__(self, ingredientes_por_producto, lineas_por_producto):
+        self._ingredientes = ingredientes_por_producto
+        self._lineas = lineas_por_producto
+
+        self._productos_por_mp = defaultdict(set)
+        self._materias_primas = {}
+        for producto_id, ingredientes in ingredientes_por_producto.items():
+            for ing in ingredientes:
+                self._productos_por_mp[ing.id_materia_prima].add(producto_id)
+                self._materias_primas[ing.id_materia_prima] = ing.materia_prima
+
+    @classmethod
+    def cargar(cls):
+        # Si un producto tiene más de una receta, se usa la primera (menor id)
+        receta_por_producto = {}
+        for id_receta, producto_id in Receta.objects.order_by('-id_receta').values_list('id_receta', 'id_producto_id'):
+            receta_por_producto[producto_id] = id_receta
+        producto_por_receta = {id_receta: producto_id for producto_id, id_receta in receta_por_producto.items()}
+
+        ingredientes = defaultdict(list)
+        filas = RecetaMateriaPrima.objects.select_related(
+            'id_materia_prima__id_proveedor'
+        ).order_by('id_receta_materia_prima')
+
+        for fila in filas:
+            producto_id = producto_por_receta.get(fila.id_receta_id)
+            if producto_id is None:
+                continue
+            mp = fila.id_materia_prima
+            proveedor = mp.id_proveedor
+            ingredientes[producto_id].append(Ingrediente(
+                id_materia_prima=fila.id_materia_prima_id,
+                cantidad=fila.cantidad,
+                materia_prima=mp,
+                proveedor=proveedor,
+                lead_time_days=proveedor.lead_time_days if proveedor else 0,
+            ))
+
+        ingredientes_por_producto = {
+            producto_id: tuple(ingredientes.get(producto_id, ()))
+            for producto_id in receta_por_producto
+        }
+
+        lineas = defaultdict(list)
+        for cap in ProductoLinea.objects.order_by('id_producto_linea'):
+            lineas[cap.id_producto_id].append(cap)
+        lineas_por_producto = {producto_id: tuple(caps) for producto_id, caps in lineas.items()}
+
+        return cls(ingredientes_por_producto, lineas_por_producto)
+
+    def variante(self, lead_times=None, lineas_excluidas=()):
+        """
+        Copia para un escenario "qué pasa si" (no toca la BD ni esta instancia):
+
+        - lead_times: {proveedor_id: días} reemplaza el lead time de esos proveedores.
+        - lineas_excluidas: líneas de producción que no se pueden usar.
+        """
+        lead_times = lead_times or {}
+        lineas_excluidas = set(lineas_excluidas)
+
+        # Una copia por proveedor: el PASO 6 lee el lead time del proveedor de la compra
+        proveedores = {}
+
+        def con_lead_time(ing):
+            if ing.proveedor is None or ing.proveedor.pk not in lead_times:
+                return ing
+            proveedor = proveedores.get(ing.proveedor.pk)
+            if proveedor is None:
+                proveedor = copy.copy(ing.proveedor)
+                proveedor.lead_time_days = lead_times[proveedor.pk]
+                proveedores[proveedor.pk] = proveedor
+            return ing._replace(proveedor=proveedor, lead_time_days=proveedor.lead_time_days)
+
+        ingredientes_por_producto = {
+            producto_id: tuple(con_lead_time(ing) for ing in ingredientes)
+            for producto_id, ingredientes in self._ingredientes.items()
+        }
+        lineas_por_producto = {
+            producto_id: tuple(cap for cap in caps if cap.id_linea_produccion_id not in lineas_excluidas)
+            for producto_id, caps in self._lineas.items()
+        }
+        return ExplosionRecetas(ingredientes_por_producto, lineas_por_producto)
+
+    # ------------------------------------------------------------------
+    # Recetas
+    # ------------------------------------------------------------------
+    def tiene_receta(self, producto_id) -> bool:
+        return producto_id in self._ingredientes
+
+    def ingredientes(self, producto_id):
+        """
+        Ingredientes del producto. Lanza Receta.DoesNotExist si no tiene receta,
+        igual que Receta.objects.get(id_producto=...).
+        """
+        try:
+            return self._ingredientes[producto_id]
+        except KeyError:
+            raise Receta.DoesNotExist(f"El producto {producto_id} no tiene receta.")
+
+    def productos_que_usan(self, mp_id):
+        """IDs de los productos cuya receta lleva la MP indicada."""
+        return self._productos_por_mp.get(mp_id, set())
+
+    def materia_prima(self, mp_id) -> MateriaPrima:
+        """MateriaPrima (con su proveedor) de una MP que figura en alguna receta."""
+        return self._materias_primas[mp_id]
+
+    # ------------------------------------------------------------------
+    # Líneas de producción
+    # ------------------------------------------------------------------
+    def lineas(self, producto_id):
+        """ProductoLinea del producto (tupla vacía si no tiene líneas)."""
+        return self._lineas.get(producto_id, ())
+
+    def capacidad_total(self, producto_id) -> int:
+        """Suma de 'cant_por_hora' de todas las líneas del producto."""
+        return sum(cap.cant_por_hora or 0 for cap in self.lineas(producto_id))
+
+
+# ===================================================================
+# CACHÉ EN MEMORIA (por proceso)
+# ===================================================================
+# Cada proceso guarda su explosión junto con la versión con la que la cargó.
+# La versión vigente vive en el caché compartido 'versiones' (settings.CACHES):
+# las señales de recetas/signals.py la cambian al confirmarse la transacción,
+# y cualquier worker que tenga otra versión recarga en la próxima lectura.
+CACHE_VERSIONES = 'versiones'
+CLAVE_VERSION_EXPLOSION = "version:explosion_recetas"
+
+_cache = {"explosion": None, "version": None}
+
+
+def _version_explosion():
+    cache = caches[CACHE_VERSIONES]
+    version = cache.get(CLAVE_VERSION_EXPLOSION)
+    if version is None:
+        # Caché vacío (primer uso o se limpió): gana el primer proceso que la escribe
+        cache.add(CLAVE_VERSION_EXPLOSION, uuid.uuid4().hex)
+        version = cache.get(CLAVE_VERSION_EXPLOSION)
+    return version
+
+
+def get_explosion_recetas() -> ExplosionRecetas:
+    """Devuelve la explosión de recetas cacheada (la recarga si cambió la versión o se invalidó)."""
+    # La versión se lee antes de cargar: un cambio durante la carga fuerza otra recarga
+    version = _version_explosion()
+    explosion = _cache["explosion"]
+    if explosion is None or _cache["version"] != version:
+        explosion = ExplosionRecetas.cargar()
+        _cache["explosion"] = explosion
+        _cache["version"] = version
+    return explosion
+
+
+def invalidar_explosion_recetas():
+    """
+    Este proceso recarga ya (ve los cambios de su transacción); los demás,
+    cuando se confirma y se publica una versión nueva.
+    """
+    _cache["explosion"] = None
+    transaction.on_commit(
+        lambda: caches[CACHE_VERSIONES].set(CLAVE_VERSION_EXPLOSION, uuid.uuid4().hex)
+    )
@@ -0,0 +1,16 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from materias_primas.models import MateriaPrima, Proveedor
+from .models import Receta, RecetaMateriaPrima, ProductoLinea
+from .services import invalidar_explosion_recetas
+
+
+@receiver([post_save, post_delete], sender=Receta)
+@receiver([post_save, post_delete], sender=RecetaMateriaPrima)
+@receiver([post_save, post_delete], sender=ProductoLinea)
+@receiver([post_save, post_delete], sender=MateriaPrima)
+@receiver([post_save, post_delete], sender=Proveedor)
+def invalidar_explosion_por_cambio(sender, **kwargs):
+    """La explosión incluye MP, proveedores y lead times: cualquier cambio la invalida."""
+    invalidar_explosion_recetas()
@@ -1,3 +1,38 @@
+from django.core.cache import caches
 from django.test import TestCase
 
-# Create your tests here.
+from materias_primas.models import Proveedor
+from .services import CACHE_VERSIONES, CLAVE_VERSION_EXPLOSION, get_explosion_recetas
+
+
+class ExplosionCacheadaTest(TestCase):
+    """La explosión en memoria de cada proceso sigue la versión del caché compartido."""
+
+    def setUp(self):
+        self.versiones = caches[CACHE_VERSIONES]
+        self.versiones.delete(CLAVE_VERSION_EXPLOSION)
+
+    def test_se_recarga_cuando_otro_worker_publica_una_version(self):
+        explosion = get_explosion_recetas()
+        self.assertIs(get_explosion_recetas(), explosion)
+
+        self.versiones.set(CLAVE_VERSION_EXPLOSION, "de-otro-worker")
+
+        recargada = get_explosion_recetas()
+        self.assertIsNot(recargada, explosion)
+        self.assertIs(get_explosion_recetas(), recargada)
+
+    def test_un_cambio_publica_la_version_nueva_al_confirmarse(self):
+        antes = get_explosion_recetas()
+        version = self.versiones.get(CLAVE_VERSION_EXPLOSION)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            Proveedor.objects.create(nombre="Proveedor", lead_time_days=3)
+
+        # Este proceso ya recarga (ve su propia transacción); los demás, al confirmarse
+        self.assertIsNot(get_explosion_recetas(), antes)
+        self.assertEqual(self.versiones.get(CLAVE_VERSION_EXPLOSION), version)
+
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(self.versiones.get(CLAVE_VERSION_EXPLOSION), version)
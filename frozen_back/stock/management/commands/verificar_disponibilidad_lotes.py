@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from stock.models import ReservaStock, ReservaMateriaPrima
+from stock.services import lotes_con_disponibilidad_inconsistente, recalcular_disponibilidad_lotes
+
+TIPOS = {
+    "pt": ("Lotes de producción", ReservaStock),
+    "mp": ("Lotes de materia prima", ReservaMateriaPrima),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Verifica que las columnas 'cantidad_reservada_activa' y 'cantidad_disponible' "
+        "de los lotes (PT y MP) coincidan con sus reservas 'Activas'. "
+        "Con --reparar las recalcula desde las reservas."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--tipo", choices=["pt", "mp", "todos"], default="todos",
+            help="Lotes a revisar: pt, mp o todos (default: todos)."
+        )
+        parser.add_argument("--reparar", action="store_true", help="Corregir los lotes inconsistentes.")
+        parser.add_argument(
+            "--todos", action="store_true",
+            help="Con --reparar, recalcular TODOS los lotes (no solo los inconsistentes)."
+        )
+        parser.add_argument("--mostrar", type=int, default=20, help="Lotes inconsistentes a listar (default: 20).")
+
+    def handle(self, *args, **options):
+        tipos = TIPOS if options["tipo"] == "todos" else {options["tipo"]: TIPOS[options["tipo"]]}
+        pendientes = 0
+
+        for nombre, modelo_reserva in tipos.values():
+            inconsistentes = lotes_con_disponibilidad_inconsistente(modelo_reserva)
+            self.stdout.write(f"{nombre}: {len(inconsistentes)} inconsistentes.")
+            for lote_id, reservada, reservada_real, disponible, disponible_real in inconsistentes[:options["mostrar"]]:
+                self.stdout.write(
+                    f"   - Lote {lote_id}: reservada {reservada} (real {reservada_real}), "
+                    f"disponible {disponible} (real {disponible_real})"
+                )
+
+            if options["reparar"] and (inconsistentes or options["todos"]):
+                lotes_ids = None if options["todos"] else [fila[0] for fila in inconsistentes]
+                actualizados = recalcular_disponibilidad_lotes(modelo_reserva, lotes_ids)
+                self.stdout.write(self.style.SUCCESS(f"   ✅ {actualizados} lotes recalculados."))
+            else:
+                pendientes += len(inconsistentes)
+
+        if pendientes:
+            raise CommandError(f"{pendientes} lotes con disponibilidad inconsistente (usar --reparar).")
+        self.stdout.write(self.style.SUCCESS("Disponibilidad de lotes consistente."))
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.6 on 2026-10-18 04:56
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def calcular_disponibilidad(apps, schema_editor):
+    """Llena las columnas nuevas desde las reservas 'Activas' existentes."""
+    for modelo_lote, modelo_reserva, campo_lote, campo_estado in (
+        ('LoteProduccion', 'ReservaStock', 'id_lote_produccion', 'id_estado_reserva'),
+        ('LoteMateriaPrima', 'ReservaMateriaPrima', 'id_lote_materia_prima', 'id_estado_reserva_materia'),
+    ):
+        Lote = apps.get_model('stock', modelo_lote)
+        Reserva = apps.get_model('stock', modelo_reserva)
+        reservado = Coalesce(Subquery(
+            Reserva.objects.filter(**{
+                campo_lote: OuterRef('pk'), f'{campo_estado}__descripcion': 'Activa'
+            }).order_by().values(campo_lote).annotate(total=Sum('cantidad_reservada')).values('total')
+        ), 0)
+        Lote.objects.update(cantidad_reservada_activa=reservado, cantidad_disponible=F('cantidad') - reservado)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materias_primas', '0005_materiaprima_id_proveedor'),
+        ('productos', '0007_comboproducto_precio_unitario_imagencombo'),
+        ('stock', '0007_historicallotemateriaprima_historicalloteproduccion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lotemateriaprima',
+            name='cantidad_disponible',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='lotemateriaprima',
+            name='cantidad_reservada_activa',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='loteproduccion',
+            name='cantidad_disponible',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='loteproduccion',
+            name='cantidad_reservada_activa',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='lotemateriaprima',
+            index=models.Index(fields=['id_materia_prima', 'cantidad_disponible'], name='lote_mp_disponible_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loteproduccion',
+            index=models.Index(fields=['id_producto', 'cantidad_disponible'], name='lote_prod_disponible_idx'),
+        ),
+        migrations.RunPython(calcular_disponibilidad, migrations.RunPython.noop),
+    ]
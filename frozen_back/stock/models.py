@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from productos.models import Producto
 from materias_primas.models import MateriaPrima
 from simple_history.models import HistoricalRecords
@@ -19,59 +20,81 @@ class EstadoLoteMateriaPrima(models.Model):
         db_table = "estado_lote_materia_prima"
 
 
-class LoteProduccion(models.Model):
+# Columnas desnormalizadas de los lotes: las mantienen las reservas (ver
+# stock/signals.py y la sección DISPONIBILIDAD POR LOTE de stock/services.py)
+# y se verifican/reparan con 'manage.py verificar_disponibilidad_lotes'.
+CAMPOS_DISPONIBILIDAD = ('cantidad_reservada_activa', 'cantidad_disponible')
+
+
+class DisponibilidadLoteMixin:
+    """
+    Guarda un lote sin pisar las columnas de disponibilidad: las reservas las
+    actualizan con UPDATE atómicos (F), así que lo que haya en memoria puede
+    estar viejo. Si cambió 'cantidad', el disponible se recalcula en la BD.
+    """
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            # Un lote nuevo todavía no tiene reservas
+            self.cantidad_reservada_activa = 0
+            self.cantidad_disponible = self.cantidad
+            return super().save(*args, **kwargs)
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            update_fields = [f.name for f in self._meta.concrete_fields if not f.primary_key]
+        kwargs['update_fields'] = [campo for campo in update_fields if campo not in CAMPOS_DISPONIBILIDAD]
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if 'cantidad' in kwargs['update_fields']:
+                type(self).objects.filter(pk=self.pk).update(
+                    cantidad_disponible=F('cantidad') - F('cantidad_reservada_activa')
+                )
+                self.refresh_from_db(fields=CAMPOS_DISPONIBILIDAD)
+
+    @property
+    def cantidad_reservada(self):
+        """Cantidad reservada por las reservas 'Activas' del lote."""
+        return self.cantidad_reservada_activa
+
+
+class LoteProduccion(DisponibilidadLoteMixin, models.Model):
     id_lote_produccion = models.AutoField(primary_key=True)
     id_producto = models.ForeignKey(Producto, on_delete=models.CASCADE, db_column="id_producto")
     fecha_produccion = models.DateField(blank=True, null=True)
     fecha_vencimiento = models.DateField(blank=True, null=True)
     cantidad = models.IntegerField()
-  
-    @property
-    def cantidad_reservada(self):
-        """Calcula la cantidad total reservada para este lote sumando solo las reservas 'Activas'."""
-        # --- CAMBIO CLAVE: Añadimos el filtro por el estado de la reserva ---
-        total_reservado = self.reservas.filter(id_estado_reserva__descripcion='Activa').aggregate(
-            total=models.Sum('cantidad_reservada')
-        )['total']
-        return total_reservado or 0
-
-    @property
-    def cantidad_disponible(self):
-        """Calcula la cantidad real disponible para nuevas reservas."""
-        return self.cantidad - self.cantidad_reservada
+    # Suma de las reservas 'Activas' y cantidad - esa suma (desnormalizadas)
+    cantidad_reservada_activa = models.IntegerField(default=0, editable=False)
+    cantidad_disponible = models.IntegerField(default=0, editable=False)
     
     id_estado_lote_produccion = models.ForeignKey(EstadoLoteProduccion, on_delete=models.CASCADE, db_column="id_estado_lote_produccion")
 
-    history = HistoricalRecords()
+    history = HistoricalRecords(excluded_fields=list(CAMPOS_DISPONIBILIDAD))
     class Meta:
         db_table = "lote_produccion"
+        indexes = [
+            models.Index(fields=['id_producto', 'cantidad_disponible'], name='lote_prod_disponible_idx'),
+        ]
 
 
-class LoteMateriaPrima(models.Model):
+class LoteMateriaPrima(DisponibilidadLoteMixin, models.Model):
     id_lote_materia_prima = models.AutoField(primary_key=True)
     id_materia_prima = models.ForeignKey(MateriaPrima, on_delete=models.CASCADE, db_column="id_materia_prima")
     fecha_vencimiento = models.DateField(blank=True, null=True)
     cantidad = models.IntegerField()
     id_estado_lote_materia_prima = models.ForeignKey(EstadoLoteMateriaPrima, on_delete=models.CASCADE, db_column="id_estado_lote_materia_prima")
+    # Suma de las reservas 'Activas' y cantidad - esa suma (desnormalizadas)
+    cantidad_reservada_activa = models.IntegerField(default=0, editable=False)
+    cantidad_disponible = models.IntegerField(default=0, editable=False)
 
-    @property
-    def cantidad_reservada(self):
-        """Calcula la cantidad total reservada para este lote sumando las reservas."""
-        # Suma todas las 'cantidad_reservada' de los registros de ReservaStock
-        # que apuntan a este lote (self).
-        total_reservado = self.reservas.filter(
-            id_estado_reserva_materia__descripcion__in=["Activa"]
-        ).aggregate(total=models.Sum('cantidad_reservada'))['total']
-        return total_reservado or 0
-
-    @property
-    def cantidad_disponible(self):
-        """Calcula la cantidad real disponible para nuevas reservas."""
-        return self.cantidad - self.cantidad_reservada
-
-    history = HistoricalRecords()
+    history = HistoricalRecords(excluded_fields=list(CAMPOS_DISPONIBILIDAD))
     class Meta:
         db_table = "lote_materia_prima"
+        indexes = [
+            models.Index(fields=['id_materia_prima', 'cantidad_disponible'], name='lote_mp_disponible_idx'),
+        ]
 
 
 class LoteProduccionMateria(models.Model):
@@ -122,6 +145,11 @@ class ReservaStock(models.Model):
         # Quitamos unique_together para permitir múltiples reservas (ej. una cancelada y una nueva activa)
         # unique_together = ('id_orden_venta_producto', 'id_lote_produccion')
 
+    def save(self, *args, **kwargs):
+        # La reserva y la disponibilidad de su lote (stock/signals.py) se guardan juntas
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 class EstadoReservaMateria(models.Model):
     id_estado_reserva_materia = models.AutoField(primary_key=True)
     descripcion = models.CharField(max_length=100)
@@ -144,7 +172,7 @@ class ReservaMateriaPrima(models.Model):
         "LoteMateriaPrima",
         on_delete=models.CASCADE,
         db_column="id_lote_materia_prima",
-        related_name="reservas"  # 👈 para que funcione cantidad_reservada
+        related_name="reservas"
     )
     cantidad_reservada = models.IntegerField()
     id_estado_reserva_materia = models.ForeignKey(
@@ -156,5 +184,10 @@ class ReservaMateriaPrima(models.Model):
     class Meta:
         db_table = "reserva_materia_prima"
 
+    def save(self, *args, **kwargs):
+        # La reserva y la disponibilidad de su lote (stock/signals.py) se guardan juntas
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     def __str__(self):
         return f"Reserva {self.id_reserva_materia} - {self.id_lote_materia_prima}"
\ No newline at end of file
@@ -6,6 +6,7 @@ from .models import (
     LoteMateriaPrima,
     LoteProduccionMateria
 )
+from .services import MAX_IDS_DISPONIBILIDAD
 
 class EstadoLoteProduccionSerializer(serializers.ModelSerializer):
     class Meta:
@@ -60,7 +61,7 @@ class LoteProduccionSerializer(serializers.ModelSerializer):
     # 3. Muestra la descripción del estado del lote en lugar de solo su ID.
     estado = serializers.CharField(source='id_estado_lote_produccion.descripcion', read_only=True)
     
-    # 4. Expone las propiedades calculadas 'cantidad_reservada' y 'cantidad_disponible' en la API.
+    # 4. Expone 'cantidad_reservada' (reservas 'Activas') y 'cantidad_disponible' en la API.
     cantidad_reservada = serializers.ReadOnlyField()
     cantidad_disponible = serializers.ReadOnlyField()
 
@@ -76,7 +77,7 @@ class LoteProduccionSerializer(serializers.ModelSerializer):
             'fecha_vencimiento',
             'cantidad',          # Stock físico
             'cantidad_reservada',# <-- Propiedad
-            'cantidad_disponible',# <-- Propiedad
+            'cantidad_disponible',# <-- Columna (la mantienen las reservas)
             'id_estado_lote_produccion',
             'estado',            # <-- Nuevo
         ]
@@ -121,4 +122,21 @@ class HistoricalLoteMateriaPrimaSerializer(serializers.ModelSerializer):
             'id_lote_materia_prima', 'id_materia_prima', 'materia_prima_nombre',
             'id_estado_lote_materia_prima', 'estado_lote',
             'cantidad', 'fecha_vencimiento'
-        ]
\ No newline at end of file
+        ]
+
+class DisponibilidadEnLoteSerializer(serializers.Serializer):
+    """Parámetros de la consulta de disponibilidad de varios productos / MPs a la vez."""
+    productos = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False, default=list,
+        max_length=MAX_IDS_DISPONIBILIDAD
+    )
+    materias_primas = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False, default=list,
+        max_length=MAX_IDS_DISPONIBILIDAD
+    )
+    lotes = serializers.BooleanField(required=False, default=True)
+
+    def validate(self, data):
+        if not data["productos"] and not data["materias_primas"]:
+            raise serializers.ValidationError("Debe indicar al menos un producto o una materia prima.")
+        return data
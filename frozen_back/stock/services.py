@@ -1,15 +1,20 @@
 from django.db import models, transaction
 from django.core.mail import send_mail
 from productos.models import Producto
-from .models import LoteProduccion, EstadoLoteProduccion, LoteMateriaPrima, EstadoLoteMateriaPrima, ReservaMateriaPrima, EstadoReservaMateria, ReservaStock
+from .models import LoteProduccion, EstadoLoteProduccion, LoteMateriaPrima, EstadoLoteMateriaPrima, ReservaMateriaPrima, EstadoReservaMateria, ReservaStock, EstadoReserva
 from materias_primas.models import MateriaPrima
 from django.db.models import Sum, F, Q
 from django.db.models.functions import Coalesce
 from django.conf import settings
+from django.core.cache import caches
 import threading
 import requests
+from collections import defaultdict
 from stock.models import ReservaStock
 from produccion.models import OrdenProduccion, EstadoOrdenProduccion
+from compras.models import OrdenCompraMateriaPrima
+from planificacion.models import MarcaPendienteMRP
+from planificacion.signals import marcar_pendientes
 
 def cantidad_total_producto(id_producto):
     """
@@ -31,82 +36,706 @@ def cantidad_total_producto(id_producto):
 
 def get_stock_disponible_todos_los_productos():
     """
-    Devuelve un QuerySet con la cantidad total DISPONIBLE de cada producto.
-    Calcula el stock basándose en lotes 'Disponibles' y reservas 'Activas'.
+    Devuelve una lista con la cantidad total DISPONIBLE de cada producto
+    (lotes 'Disponibles' menos sus reservas 'Activas').
+    El disponible sale del caché de disponibilidad (ver disponibles_cacheados):
+    solo los productos que cambiaron desde la última consulta se recalculan.
+    """
+    productos = list(
+        Producto.objects.values('id_producto', 'nombre', 'umbral_minimo', 'descripcion').order_by('id_producto')
+    )
+    disponibles = disponibles_cacheados('pt', [p['id_producto'] for p in productos])
+
+    return [
+        {
+            'id_producto': p['id_producto'],
+            'nombre': p['nombre'],
+            'cantidad_disponible': disponibles[p['id_producto']],
+            'umbral_minimo': p['umbral_minimo'],
+            'descripcion': p['descripcion'],
+        }
+        for p in productos
+    ]
+
+
+
+def get_materias_primas_con_stock():
+    """
+    QuerySet (de diccionarios) con cada materia prima, su unidad, su proveedor
+    y su stock: disponible y reservado (columnas de los lotes 'disponibles')
+    y en tránsito (OCs 'En proceso'). Todo en UNA consulta; se le pueden
+    encadenar filtros y paginar.
     """
-    
-    # 1. Filtro para sumar solo la cantidad de lotes 'Disponibles'
     filtro_lotes_disponibles = Q(
-        loteproduccion__id_estado_lote_produccion__descripcion="Disponible"
+        lotemateriaprima__id_estado_lote_materia_prima__descripcion="disponible"
     )
-    
-    # 2. Filtro para sumar solo la cantidad reservada de reservas 'Activas'
-    #    que pertenezcan a lotes 'Disponibles'.
-    filtro_reservas_activas = (
-        Q(loteproduccion__id_estado_lote_produccion__descripcion="Disponible") &
-        Q(loteproduccion__reservas__id_estado_reserva__descripcion='Activa')
+    # Subconsulta: un JOIN más con las OCs multiplicaría las sumas de los lotes
+    en_transito = OrdenCompraMateriaPrima.objects.filter(
+        id_materia_prima=models.OuterRef('pk'),
+        id_orden_compra__id_estado_orden_compra__descripcion="En proceso"
+    ).order_by().values('id_materia_prima').annotate(
+        total=Sum('cantidad')
+    ).values('total')
+
+    return MateriaPrima.objects.annotate(
+        cantidad_disponible=Coalesce(
+            Sum('lotemateriaprima__cantidad_disponible', filter=filtro_lotes_disponibles), 0
+        ),
+        cantidad_reservada=Coalesce(
+            Sum('lotemateriaprima__cantidad_reservada_activa', filter=filtro_lotes_disponibles), 0
+        ),
+        en_transito=Coalesce(models.Subquery(en_transito), 0),
+    ).values(
+        'id_materia_prima',
+        'nombre',
+        'umbral_minimo',
+        'cantidad_disponible',
+        'cantidad_reservada',
+        'en_transito',
+        'id_proveedor',
+        unidad_medida=F('id_unidad__descripcion'),
+        proveedor=F('id_proveedor__nombre'),
+    ).order_by('id_materia_prima')
+
+
+
+def get_stock_disponible_para_producto(id_producto):
+    """
+    Devuelve la cantidad total DISPONIBLE de un producto: suma de la columna
+    'cantidad_disponible' (cantidad menos reservas 'Activas') de sus lotes 'Disponibles'.
+    """
+    total_disponible = LoteProduccion.objects.filter(
+        id_producto_id=id_producto,
+        id_estado_lote_produccion__descripcion="Disponible"
+    ).aggregate(
+        total=Sum('cantidad_disponible')
+    ).get('total') or 0
+
+    return total_disponible
+
+
+
+
+
+
+
+class StockSnapshot:
+    """
+    Foto del stock DISPONIBLE de todas las materias primas y/o todos los productos.
+
+    Usa los mismos criterios que get_stock_disponible_para_producto y
+    get_stock_disponible_para_materia_prima (lotes 'Disponible'/'disponible'
+    menos sus reservas 'Activas'), pero con UNA consulta agrupada por tipo
+    en lugar de una consulta por ítem.
+
+        snapshot = StockSnapshot()
+        snapshot.disponible_mp(mp_id)
+        snapshot.disponible_pt(producto_id)
+    """
+
+    def __init__(self, materias_primas: bool = True, productos: bool = True):
+        self.mp = self._cargar_mp() if materias_primas else {}
+        self.pt = self._cargar_pt() if productos else {}
+
+    @staticmethod
+    def _cargar_mp():
+        filas = LoteMateriaPrima.objects.filter(
+            id_estado_lote_materia_prima__descripcion="disponible"
+        ).order_by().values('id_materia_prima_id').annotate(
+            total=Sum('cantidad_disponible')
+        ).values_list('id_materia_prima_id', 'total')
+
+        return {mp_id: total or 0 for mp_id, total in filas}
+
+    @staticmethod
+    def _cargar_pt():
+        filas = LoteProduccion.objects.filter(
+            id_estado_lote_produccion__descripcion="Disponible"
+        ).order_by().values('id_producto_id').annotate(
+            total=Sum('cantidad_disponible')
+        ).values_list('id_producto_id', 'total')
+
+        return {producto_id: total or 0 for producto_id, total in filas}
+
+    def disponible_mp(self, id_materia_prima) -> int:
+        return self.mp.get(id_materia_prima, 0)
+
+    def disponible_pt(self, id_producto) -> int:
+        return self.pt.get(id_producto, 0)
+
+
+# ===================================================================
+# DISPONIBILIDAD DE VARIOS PRODUCTOS / MPs A LA VEZ
+# ===================================================================
+# Máximo de IDs por tipo en una consulta (lo valida la API)
+MAX_IDS_DISPONIBILIDAD = 500
+
+
+def _disponibilidad_items(items, lotes, campo_item, campo_lote):
+    """Arma {item_id: {...}} con los totales y el detalle de los lotes 'Disponibles'."""
+    resultado = {}
+    for item in items:
+        resultado[item["id"]] = {
+            **item,
+            "cantidad": 0,
+            "reservado": 0,
+            "disponible": 0,
+            "lotes": [],
+        }
+    for lote in lotes:
+        datos = resultado[lote[campo_item]]
+        datos["cantidad"] += lote["cantidad"]
+        datos["reservado"] += lote["cantidad_reservada_activa"]
+        datos["disponible"] += lote["cantidad_disponible"]
+        datos["lotes"].append({
+            "id_lote": lote[campo_lote],
+            "fecha_vencimiento": lote["fecha_vencimiento"],
+            "cantidad": lote["cantidad"],
+            "reservado": lote["cantidad_reservada_activa"],
+            "disponible": lote["cantidad_disponible"],
+        })
+    return resultado
+
+
+def disponibilidad_en_lote(productos_ids=(), materias_primas_ids=(), con_lotes=True) -> dict:
+    """
+    Stock de muchos productos y/o materias primas en una cantidad FIJA de
+    consultas (no una por ítem):
+
+    - productos: 1 consulta de productos + 1 de sus lotes 'Disponibles'.
+    - materias primas: 1 de MPs + 1 de lotes 'disponibles' + 1 de OCs 'En proceso'.
+
+    Por ítem: cantidad física, reservado (reservas 'Activas'), disponible y,
+    con 'con_lotes', el detalle por lote (orden FEFO). Las MPs suman lo que
+    está en tránsito (OCs 'En proceso'). Los IDs que no existen van en
+    'no_encontrados'.
+    """
+    productos_ids = set(productos_ids)
+    materias_primas_ids = set(materias_primas_ids)
+    campos_lote = ('fecha_vencimiento', 'cantidad', 'cantidad_reservada_activa', 'cantidad_disponible')
+    resultado = {
+        "productos": {},
+        "materias_primas": {},
+        "no_encontrados": {"productos": [], "materias_primas": []},
+    }
+
+    if productos_ids:
+        productos = Producto.objects.filter(pk__in=productos_ids).values(
+            'nombre', 'umbral_minimo', id=F('id_producto'), unidad=F('id_unidad__descripcion')
+        )
+        lotes = LoteProduccion.objects.filter(
+            id_producto_id__in=productos_ids,
+            id_estado_lote_produccion__descripcion="Disponible"
+        ).order_by('fecha_vencimiento', 'id_lote_produccion').values(
+            'id_producto_id', 'id_lote_produccion', *campos_lote
+        )
+        resultado["productos"] = _disponibilidad_items(
+            productos, lotes, 'id_producto_id', 'id_lote_produccion'
+        )
+
+    if materias_primas_ids:
+        materias_primas = MateriaPrima.objects.filter(pk__in=materias_primas_ids).values(
+            'nombre', 'umbral_minimo', id=F('id_materia_prima'), unidad=F('id_unidad__descripcion')
+        )
+        lotes = LoteMateriaPrima.objects.filter(
+            id_materia_prima_id__in=materias_primas_ids,
+            id_estado_lote_materia_prima__descripcion="disponible"
+        ).order_by('fecha_vencimiento', 'id_lote_materia_prima').values(
+            'id_materia_prima_id', 'id_lote_materia_prima', *campos_lote
+        )
+        resultado["materias_primas"] = _disponibilidad_items(
+            materias_primas, lotes, 'id_materia_prima_id', 'id_lote_materia_prima'
+        )
+
+        en_transito = OrdenCompraMateriaPrima.objects.filter(
+            id_materia_prima_id__in=materias_primas_ids,
+            id_orden_compra__id_estado_orden_compra__descripcion="En proceso"
+        ).order_by().values('id_materia_prima_id').annotate(
+            total=Sum('cantidad')
+        ).values_list('id_materia_prima_id', 'total')
+        for datos in resultado["materias_primas"].values():
+            datos["en_transito"] = 0
+        for mp_id, total in en_transito:
+            resultado["materias_primas"][mp_id]["en_transito"] = total or 0
+
+    for tipo, ids in (("productos", productos_ids), ("materias_primas", materias_primas_ids)):
+        if not con_lotes:
+            for datos in resultado[tipo].values():
+                del datos["lotes"]
+        resultado["no_encontrados"][tipo] = sorted(ids - set(resultado[tipo]))
+
+    return resultado
+
+
+
+# ===================================================================
+# DISPONIBILIDAD POR LOTE (columnas desnormalizadas)
+# ===================================================================
+# 'cantidad_reservada_activa' y 'cantidad_disponible' de cada lote se mueven
+# con UPDATE ... SET x = x + delta (F), en la misma transacción que la
+# reserva: dos escrituras concurrentes sobre el mismo lote se serializan en
+# el lock de la fila y ninguna pisa a la otra.
+#   - Alta/cambio/baja de UNA reserva (save, delete, borrados en cascada): stock/signals.py
+#   - bulk_create de reservas: reservar_stock_pt_fefo / reservar_stock_mp_fefo
+#     (decremento condicional, sin sobreventa: ver _tomar_de_lotes)
+#   - Cambio de estado en bloque (queryset.update): cambiar_estado_reservas
+# 'recalcular_disponibilidad_lotes' rehace las columnas desde las reservas.
+
+# Modelo de reserva -> (modelo de lote, FK al lote, FK al estado, modelo de estado)
+RESERVAS_LOTE = {
+    ReservaStock: (LoteProduccion, 'id_lote_produccion_id', 'id_estado_reserva_id', EstadoReserva),
+    ReservaMateriaPrima: (LoteMateriaPrima, 'id_lote_materia_prima_id', 'id_estado_reserva_materia_id', EstadoReservaMateria),
+}
+
+# Los estados son un catálogo fijo: el id de 'Activa' se busca una vez por proceso
+_estado_activa_ids = {}
+
+
+def estado_activa_id(modelo_reserva):
+    """ID del estado 'Activa' de las reservas de 'modelo_reserva' (None si no existe)."""
+    modelo_estado = RESERVAS_LOTE[modelo_reserva][3]
+    if modelo_estado not in _estado_activa_ids:
+        estado_id = modelo_estado.objects.filter(descripcion='Activa').values_list('pk', flat=True).first()
+        if estado_id is None:
+            return None
+        _estado_activa_ids[modelo_estado] = estado_id
+    return _estado_activa_ids[modelo_estado]
+
+
+def ajustar_reservado_lotes(modelo_lote, deltas, items_ids=None, solo_si_alcanza=False):
+    """
+    Suma 'delta' a la cantidad reservada activa de cada lote (y se lo resta
+    al disponible). deltas: {lote_id: delta}. Un único UPDATE.
+    Con solo_si_alcanza=True es un decremento CONDICIONAL: un lote cuyo
+    disponible ya no cubre su delta no se toca (el llamador compara la
+    cantidad de lotes actualizados, que es lo que devuelve).
+    Invalida el disponible cacheado de los ítems de esos lotes ('items_ids'
+    si el llamador ya los conoce; si no, se buscan).
+    """
+    deltas = {lote_id: delta for lote_id, delta in deltas.items() if delta}
+    if not deltas:
+        return 0
+    delta = models.Case(
+        *[models.When(pk=lote_id, then=models.Value(d)) for lote_id, d in deltas.items()],
+        output_field=models.IntegerField()
     )
+    lotes = modelo_lote.objects.filter(pk__in=deltas)
+    if solo_si_alcanza:
+        lotes = lotes.filter(cantidad_disponible__gte=delta)
+    actualizados = lotes.update(
+        cantidad_reservada_activa=F('cantidad_reservada_activa') + delta,
+        cantidad_disponible=F('cantidad_disponible') - delta
+    )
+    if items_ids is None:
+        invalidar_disponibilidad_lotes(modelo_lote, deltas)
+    else:
+        invalidar_disponibilidad(_TIPO_POR_LOTE[modelo_lote], items_ids)
+    return actualizados
 
-    # 3. Consultamos desde Producto y anotamos los totales
-    productos_con_stock = Producto.objects.annotate(
-        # Suma total de 'cantidad' de todos sus lotes 'Disponibles'
-        total_producido=Coalesce(
-            Sum('loteproduccion__cantidad', filter=filtro_lotes_disponibles), 
-            0
-        ),
-        # Suma total de 'cantidad_reservada' de sus reservas 'Activas'
-        total_reservado=Coalesce(
-            Sum('loteproduccion__reservas__cantidad_reservada', filter=filtro_reservas_activas), 
-            0
+
+@transaction.atomic
+def cambiar_estado_reservas(reservas, nuevo_estado):
+    """
+    reservas.update(estado=nuevo_estado) que además mueve la disponibilidad
+    de los lotes: las que dejan de estar 'Activas' liberan su cantidad y las
+    que pasan a 'Activa' la toman. Devuelve la cantidad de reservas cambiadas.
+    """
+    modelo_reserva = reservas.model
+    modelo_lote, campo_lote, campo_estado, _modelo_estado = RESERVAS_LOTE[modelo_reserva]
+    activa_id = estado_activa_id(modelo_reserva)
+    pasa_a_activa = nuevo_estado.pk == activa_id
+    # FK del lote a su ítem, vía el lote de la reserva (ej. 'id_lote_produccion__id_producto_id')
+    campo_item = campo_lote.removesuffix('_id') + '__' + _LOTES_POR_TIPO[_TIPO_POR_LOTE[modelo_lote]][1]
+
+    # Se bloquean las reservas: nadie más les cambia el estado hasta el commit
+    filas = list(
+        reservas.select_for_update(of=('self',)).order_by().values_list(
+            'pk', campo_lote, campo_estado, 'cantidad_reservada', campo_item
         )
+    )
+    deltas = defaultdict(int)
+    for _pk, lote_id, estado_id, cantidad, _item_id in filas:
+        deltas[lote_id] += cantidad * (int(pasa_a_activa) - int(estado_id == activa_id))
+
+    cambiadas = modelo_reserva.objects.filter(pk__in=[fila[0] for fila in filas]).update(
+        **{campo_estado: nuevo_estado.pk}
+    )
+    ajustar_reservado_lotes(modelo_lote, deltas, {fila[4] for fila in filas})
+    return cambiadas
+
+
+def _reservado_activo(modelo_reserva):
+    """Subconsulta: suma de las reservas 'Activas' del lote de la fila (0 si no tiene)."""
+    _modelo_lote, campo_lote, campo_estado, _modelo_estado = RESERVAS_LOTE[modelo_reserva]
+    return Coalesce(models.Subquery(
+        modelo_reserva.objects.filter(
+            **{campo_lote: models.OuterRef('pk'), campo_estado: estado_activa_id(modelo_reserva)}
+        ).order_by().values(campo_lote).annotate(
+            total=Sum('cantidad_reservada')
+        ).values('total')
+    ), 0)
+
+
+def lotes_con_disponibilidad_inconsistente(modelo_reserva):
+    """
+    Lotes cuyas columnas no coinciden con sus reservas 'Activas':
+    [(lote_id, reservada, reservada_real, disponible, disponible_real)].
+    """
+    modelo_lote = RESERVAS_LOTE[modelo_reserva][0]
+    lotes = modelo_lote.objects.annotate(
+        reservada_real=_reservado_activo(modelo_reserva)
     ).annotate(
-        # 4. Calculamos el disponible final para cada producto
-        cantidad_disponible=F('total_producido') - F('total_reservado')
+        disponible_real=F('cantidad') - F('reservada_real')
+    ).filter(
+        ~Q(cantidad_reservada_activa=F('reservada_real')) | ~Q(cantidad_disponible=F('disponible_real'))
+    ).order_by('pk')
+    return list(lotes.values_list(
+        'pk', 'cantidad_reservada_activa', 'reservada_real', 'cantidad_disponible', 'disponible_real'
+    ))
+
+
+@transaction.atomic
+def recalcular_disponibilidad_lotes(modelo_reserva, lotes_ids=None):
+    """
+    Rehace las columnas de disponibilidad desde las reservas 'Activas'
+    (de todos los lotes, o solo de 'lotes_ids'). Devuelve los lotes actualizados.
+    """
+    modelo_lote = RESERVAS_LOTE[modelo_reserva][0]
+    lotes = modelo_lote.objects.all()
+    if lotes_ids is not None:
+        lotes = lotes.filter(pk__in=lotes_ids)
+    tipo = _TIPO_POR_LOTE[modelo_lote]
+    # Bloquea los lotes: las reservas que lleguen mientras tanto esperan al commit
+    bloqueados = lotes.select_for_update().values_list(_LOTES_POR_TIPO[tipo][1], flat=True)
+    invalidar_disponibilidad(tipo, list(bloqueados))
+
+    reservado = _reservado_activo(modelo_reserva)
+    return lotes.update(
+        cantidad_reservada_activa=reservado,
+        cantidad_disponible=F('cantidad') - reservado
     )
 
-    # 5. Devolvemos los campos que nos interesan
-    #    (Añado 'nombre' porque es muy útil y no tiene costo de rendimiento aquí)
-    return productos_con_stock.values(
-        'id_producto', 
-        'nombre', 
-        'cantidad_disponible',
-        'umbral_minimo',
-        'descripcion'
-    ).order_by('id_producto')
 
 
+# ===================================================================
+# CACHÉ DE DISPONIBILIDAD (por producto / MP)
+# ===================================================================
+# Para los listados que el front consulta todo el tiempo. Cada entrada es el
+# disponible de UN ítem ("disponible:pt:<id>" / "disponible:mp:<id>") en el
+# caché 'stock' (settings.CACHES). Se invalida solo el ítem que cambió, al
+# confirmarse la transacción (si se invalidara antes, otra lectura podría
+# volver a cachear el valor viejo):
+#   - Alta/cambio/baja de un lote: stock/signals.py
+#   - Reservas (señales, bulk_create FEFO, cambio de estado): ajustar_reservado_lotes
+#   - recalcular_disponibilidad_lotes
+# Los contadores de aciertos/fallos también viven en el caché (compartidos
+# entre workers; con el backend en archivos el incremento no es atómico,
+# alcanza para una estadística).
+CACHE_DISPONIBILIDAD = 'stock'
 
-def get_stock_disponible_para_producto(id_producto):
+# tipo -> (modelo de lote, FK al ítem, filtro de lotes 'Disponibles')
+_LOTES_POR_TIPO = {
+    'pt': (LoteProduccion, 'id_producto_id', {'id_estado_lote_produccion__descripcion': "Disponible"}),
+    'mp': (LoteMateriaPrima, 'id_materia_prima_id', {'id_estado_lote_materia_prima__descripcion': "disponible"}),
+}
+_TIPO_POR_LOTE = {modelo_lote: tipo for tipo, (modelo_lote, _campo, _filtro) in _LOTES_POR_TIPO.items()}
+
+_CLAVE_ACIERTOS = "disponible:aciertos"
+_CLAVE_FALLOS = "disponible:fallos"
+
+
+def _cache_disponibilidad():
+    return caches[CACHE_DISPONIBILIDAD]
+
+
+def _clave_disponible(tipo, item_id):
+    return f"disponible:{tipo}:{item_id}"
+
+
+def _contar(clave, cantidad):
+    if not cantidad:
+        return
+    cache = _cache_disponibilidad()
+    cache.add(clave, 0, timeout=None)
+    try:
+        cache.incr(clave, cantidad)
+    except ValueError:
+        # La entrada se borró entre el add y el incr
+        cache.set(clave, cantidad, timeout=None)
+
+
+def disponibles_cacheados(tipo, items_ids) -> dict:
     """
-    Devuelve la cantidad total DISPONIBLE de un producto.
-    Calcula el total reservado para cada lote sumando ÚNICAMENTE las reservas 'Activas'.
+    {item_id: disponible} de productos (tipo 'pt') o materias primas ('mp').
+    Lo que no está en el caché se calcula en UNA consulta agrupada (solo
+    para esos ítems) y se guarda; un ítem sin lotes 'Disponibles' vale 0.
     """
-    # 1. Creamos un filtro para las reservas activas que usaremos en la suma.
-    filtro_reservas_activas = Q(reservas__id_estado_reserva__descripcion='Activa')
+    items_ids = set(items_ids)
+    if not items_ids:
+        return {}
+    cache = _cache_disponibilidad()
+    claves = {_clave_disponible(tipo, item_id): item_id for item_id in items_ids}
+    disponibles = {claves[clave]: valor for clave, valor in cache.get_many(claves).items()}
+
+    faltan = items_ids - set(disponibles)
+    if faltan:
+        modelo_lote, campo_item, filtro = _LOTES_POR_TIPO[tipo]
+        calculados = dict.fromkeys(faltan, 0)
+        calculados.update(
+            modelo_lote.objects.filter(**{f"{campo_item}__in": faltan}, **filtro)
+            .order_by().values(campo_item).annotate(total=Sum('cantidad_disponible'))
+            .values_list(campo_item, 'total')
+        )
+        # Dentro de una transacción se podría cachear algo que después se deshace
+        if not transaction.get_connection().in_atomic_block:
+            cache.set_many({_clave_disponible(tipo, item_id): total or 0 for item_id, total in calculados.items()})
+        disponibles.update(calculados)
 
-    # 2. Anotamos cada lote con la suma de sus reservas activas.
-    lotes_con_reservas = LoteProduccion.objects.filter(
-        id_producto_id=id_producto,
-        id_estado_lote_produccion__descripcion="Disponible"
+    _contar(_CLAVE_ACIERTOS, len(items_ids) - len(faltan))
+    _contar(_CLAVE_FALLOS, len(faltan))
+    return {item_id: disponibles[item_id] or 0 for item_id in items_ids}
+
+
+def invalidar_disponibilidad(tipo, items_ids):
+    """Borra del caché el disponible de esos ítems cuando se confirma la transacción en curso."""
+    claves = [_clave_disponible(tipo, item_id) for item_id in set(items_ids) if item_id is not None]
+    if claves:
+        transaction.on_commit(lambda: _cache_disponibilidad().delete_many(claves))
+
+
+def invalidar_disponibilidad_lotes(modelo_lote, lotes_ids):
+    """Como invalidar_disponibilidad, pero a partir de lotes (1 consulta para saber sus ítems)."""
+    if not lotes_ids:
+        return
+    tipo = _TIPO_POR_LOTE[modelo_lote]
+    campo_item = _LOTES_POR_TIPO[tipo][1]
+    invalidar_disponibilidad(tipo, modelo_lote.objects.filter(pk__in=lotes_ids).values_list(campo_item, flat=True))
+
+
+def estadisticas_cache_disponibilidad() -> dict:
+    cache = _cache_disponibilidad()
+    contadores = cache.get_many([_CLAVE_ACIERTOS, _CLAVE_FALLOS])
+    aciertos = contadores.get(_CLAVE_ACIERTOS, 0)
+    fallos = contadores.get(_CLAVE_FALLOS, 0)
+    consultas = aciertos + fallos
+    return {
+        "backend": settings.CACHES[CACHE_DISPONIBILIDAD]["BACKEND"].rsplit(".", 1)[-1],
+        "aciertos": aciertos,
+        "fallos": fallos,
+        "tasa_aciertos": round(aciertos / consultas, 4) if consultas else None,
+    }
+
+
+def reiniciar_estadisticas_cache_disponibilidad():
+    _cache_disponibilidad().delete_many([_CLAVE_ACIERTOS, _CLAVE_FALLOS])
+
+
+# ===================================================================
+# RESERVAS EN LOTE (FEFO)
+# ===================================================================
+# Reservan stock para MUCHAS demandas a la vez: una consulta para los lotes
+# candidatos de todos los productos/MPs involucrados, asignación en memoria
+# por fecha de vencimiento (FEFO) y un solo bulk_create de las reservas.
+# Las demandas se atienden en el orden recibido.
+
+def _lotes_pt_disponibles(productos_ids):
+    return LoteProduccion.objects.filter(
+        id_producto_id__in=productos_ids,
+        id_estado_lote_produccion__descripcion="Disponible",
+        cantidad_disponible__gt=0
     ).annotate(
-        total_reservado=Coalesce(Sum('reservas__cantidad_reservada', filter=filtro_reservas_activas), 0)
-    )
+        disponible=F('cantidad_disponible')
+    ).order_by('fecha_vencimiento', 'id_lote_produccion')
 
-    # 3. Anotamos la cantidad disponible para cada lote.
-    lotes_con_disponible = lotes_con_reservas.annotate(
-        disponible=F('cantidad') - F('total_reservado')
-    )
 
-    # 4. Finalmente, sumamos el total de las cantidades disponibles de todos los lotes.
-    resultado_agregado = lotes_con_disponible.aggregate(
-        total=Sum('disponible')
+def _lotes_mp_disponibles(materias_primas_ids):
+    return LoteMateriaPrima.objects.filter(
+        id_materia_prima_id__in=materias_primas_ids,
+        id_estado_lote_materia_prima__descripcion="disponible",
+        cantidad_disponible__gt=0
+    ).annotate(
+        disponible=F('cantidad_disponible')
+    ).order_by('fecha_vencimiento', 'id_lote_materia_prima')
+
+
+def _asignar_fefo(lotes_por_item, pedidos, completa):
+    """
+    lotes_por_item: item_id -> [lote (con 'disponible')] ordenados por vencimiento.
+    pedidos: [{item_id: cantidad}]. Con completa=True, un pedido que no se
+    puede cubrir ENTERO no toma nada (y no le quita stock a los siguientes).
+
+    Devuelve, por pedido, la lista de (item_id, lote, cantidad) asignados.
+    """
+    asignaciones = []
+    for pedido in pedidos:
+        tomado = []
+        for item_id, cantidad in pedido.items():
+            pendiente = cantidad
+            for lote in lotes_por_item.get(item_id, ()):
+                if pendiente <= 0:
+                    break
+                a_tomar = min(lote.disponible, pendiente)
+                if a_tomar > 0:
+                    lote.disponible -= a_tomar
+                    tomado.append((item_id, lote, a_tomar))
+                    pendiente -= a_tomar
+            if pendiente > 0 and completa:
+                for _item_id, lote, cantidad_tomada in tomado:
+                    lote.disponible += cantidad_tomada
+                tomado = []
+                break
+        asignaciones.append(tomado)
+    return asignaciones
+
+
+def _agrupar_lotes(lotes, campo_item):
+    lotes_por_item = {}
+    for lote in lotes:
+        lotes_por_item.setdefault(getattr(lote, campo_item), []).append(lote)
+    return lotes_por_item
+
+
+# --- Sin sobreventa con reservas concurrentes ---
+# Dos checkouts pueden leer el mismo disponible al mismo tiempo. Por eso el
+# stock se TOMA de los lotes con un decremento condicional: solo se resta si
+# al lote todavía le alcanza. Antes se bloquean (en orden de pk, para que dos
+# transacciones no se esperen en cruz) SOLO los lotes elegidos: reservas sobre
+# lotes distintos corren en paralelo y las que compiten por el mismo lote se
+# serializan. Si otra reserva ganó la carrera, el intento se deshace y se repite
+# con todos los lotes candidatos bloqueados (ya no puede volver a perder).
+
+class _LoteSinDisponible(Exception):
+    """Entre la lectura y la reserva, otra transacción tomó stock de un lote elegido."""
+
+
+def _bloquear_lotes(modelo_lote, lotes_ids):
+    list(modelo_lote.objects.filter(pk__in=lotes_ids).select_for_update().order_by('pk').values_list('pk', flat=True))
+
+
+def _tomar_de_lotes(modelo_lote, asignaciones):
+    """Descuenta del disponible de los lotes lo asignado; _LoteSinDisponible si a alguno ya no le alcanza."""
+    deltas = defaultdict(int)
+    for tomado in asignaciones:
+        for _item_id, lote, cantidad in tomado:
+            deltas[lote.pk] += cantidad
+    _bloquear_lotes(modelo_lote, deltas)
+    items_ids = {item_id for tomado in asignaciones for item_id, _lote, _cantidad in tomado}
+    if ajustar_reservado_lotes(modelo_lote, deltas, items_ids, solo_si_alcanza=True) < len(deltas):
+        raise _LoteSinDisponible()
+
+
+def _marcar_items_reservados(tipo, asignaciones, motivo):
+    """
+    bulk_create no dispara las señales de las reservas: se marcan acá, para el
+    MRP incremental, los ítems que se reservaron (ver planificacion/signals.py).
+    """
+    marcar_pendientes(tipo, {item_id for tomado in asignaciones for item_id, _lote, _cantidad in tomado}, motivo)
+
+
+def _reservar_sin_sobreventa(modelo_lote, candidatos, reservar):
+    """
+    reservar(lotes): asigna FEFO sobre 'lotes', los descuenta con _tomar_de_lotes
+    y crea las reservas. Primero sin bloquear los candidatos; si pierde la
+    carrera, de nuevo con los candidatos bloqueados.
+    Cada intento vuelve a leer los candidatos ('.all()': el queryset no
+    reutiliza la lectura anterior).
+    """
+    try:
+        with transaction.atomic():
+            return reservar(list(candidatos.all()))
+    except _LoteSinDisponible:
+        print(f"🔁 Otra reserva tomó stock de los mismos lotes ({modelo_lote.__name__}): se reintenta con los lotes bloqueados.")
+    _bloquear_lotes(modelo_lote, candidatos.values('pk'))
+    return reservar(list(candidatos.all()))
+
+
+@transaction.atomic
+def reservar_stock_pt_fefo(demandas, estado_activa, completa=False):
+    """
+    Reserva stock PT para varias líneas de OV.
+
+    demandas: [(linea_ov, cantidad)]. Con completa=True cada línea se
+    reserva entera o no se reserva.
+    Devuelve la cantidad reservada para cada demanda (mismo orden).
+    """
+    demandas = [(linea_ov, cantidad) for linea_ov, cantidad in demandas]
+    if not demandas:
+        return []
+
+    def reservar(lotes):
+        asignaciones = _asignar_fefo(
+            _agrupar_lotes(lotes, 'id_producto_id'),
+            [{linea_ov.id_producto_id: cantidad} for linea_ov, cantidad in demandas],
+            completa
+        )
+        _tomar_de_lotes(LoteProduccion, asignaciones)
+        ReservaStock.objects.bulk_create([
+            ReservaStock(
+                id_orden_venta_producto=linea_ov,
+                id_lote_produccion=lote,
+                cantidad_reservada=cantidad,
+                id_estado_reserva=estado_activa
+            )
+            for (linea_ov, _cantidad), tomado in zip(demandas, asignaciones)
+            for _producto_id, lote, cantidad in tomado
+        ])
+        _marcar_items_reservados(MarcaPendienteMRP.Tipo.PRODUCTO, asignaciones, "reserva_stock")
+        return asignaciones
+
+    asignaciones = _reservar_sin_sobreventa(
+        LoteProduccion,
+        _lotes_pt_disponibles({linea_ov.id_producto_id for linea_ov, _cantidad in demandas}),
+        reservar
     )
+    return [sum(cantidad for _item, _lote, cantidad in tomado) for tomado in asignaciones]
 
-    total_disponible = resultado_agregado.get('total') or 0
 
-    return total_disponible
+@transaction.atomic
+def reservar_stock_mp_fefo(demandas, estado_activa, completa=False):
+    """
+    Reserva materias primas para varias OPs.
 
+    demandas: [(op, {mp_id: cantidad})]. Con completa=True cada OP recibe
+    TODAS sus MPs o ninguna.
+    Devuelve, para cada demanda, {mp_id: cantidad reservada}.
+    """
+    demandas = [(op, dict(cantidades)) for op, cantidades in demandas]
+    if not demandas:
+        return []
+
+    def reservar(lotes):
+        asignaciones = _asignar_fefo(
+            _agrupar_lotes(lotes, 'id_materia_prima_id'),
+            [cantidades for _op, cantidades in demandas],
+            completa
+        )
+        _tomar_de_lotes(LoteMateriaPrima, asignaciones)
+        ReservaMateriaPrima.objects.bulk_create([
+            ReservaMateriaPrima(
+                id_orden_produccion=op,
+                id_lote_materia_prima=lote,
+                cantidad_reservada=cantidad,
+                id_estado_reserva_materia=estado_activa
+            )
+            for (op, _cantidades), tomado in zip(demandas, asignaciones)
+            for _mp_id, lote, cantidad in tomado
+        ])
+        _marcar_items_reservados(MarcaPendienteMRP.Tipo.MATERIA_PRIMA, asignaciones, "reserva_materia_prima")
+        return asignaciones
+
+    asignaciones = _reservar_sin_sobreventa(
+        LoteMateriaPrima,
+        _lotes_mp_disponibles({mp_id for _op, cantidades in demandas for mp_id in cantidades}),
+        reservar
+    )
 
+    reservado = []
+    for (_op, cantidades), tomado in zip(demandas, asignaciones):
+        por_mp = dict.fromkeys(cantidades, 0)
+        for mp_id, _lote, cantidad in tomado:
+            por_mp[mp_id] += cantidad
+        reservado.append(por_mp)
+    return reservado
 
 
 
@@ -208,32 +837,15 @@ def _enviar_telegram_async(mensaje):
 
 def get_stock_disponible_para_materia_prima(id_materia_prima):
     """
-    Devuelve la cantidad total DISPONIBLE de una materia prima.
-    Calcula el total reservado para cada lote sumando ÚNICAMENTE las reservas 'Activas'.
+    Devuelve la cantidad total DISPONIBLE de una materia prima: suma de la columna
+    'cantidad_disponible' (cantidad menos reservas 'Activas') de sus lotes 'disponibles'.
     """
-    
-    # 1. Filtro para reservas activas (materias primas)
-    filtro_reservas_activas = Q(reservas__id_estado_reserva_materia__descripcion='Activa')
-
-    # 2. Anotamos cada lote de MP con la suma de sus reservas activas.
-    lotes_con_reservas = LoteMateriaPrima.objects.filter(
+    total_disponible = LoteMateriaPrima.objects.filter(
         id_materia_prima_id=id_materia_prima,
         id_estado_lote_materia_prima__descripcion="disponible"
-    ).annotate(
-        total_reservado=Coalesce(Sum('reservas__cantidad_reservada', filter=filtro_reservas_activas), 0)
-    )
-
-    # 3. Anotamos la cantidad disponible para cada lote (stock físico - reservado).
-    lotes_con_disponible = lotes_con_reservas.annotate(
-        disponible=F('cantidad') - F('total_reservado')
-    )
-
-    # 4. Finalmente, sumamos el total de las cantidades disponibles de todos los lotes.
-    resultado_agregado = lotes_con_disponible.aggregate(
-        total=Sum('disponible')
-    )
-
-    total_disponible = resultado_agregado.get('total') or 0
+    ).aggregate(
+        total=Sum('cantidad_disponible')
+    ).get('total') or 0
 
     return total_disponible
 
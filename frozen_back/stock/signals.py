@@ -0,0 +1,65 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import ReservaStock, ReservaMateriaPrima, LoteProduccion, LoteMateriaPrima
+from .services import RESERVAS_LOTE, ajustar_reservado_lotes, estado_activa_id, invalidar_disponibilidad
+
+
+def _reservado(sender, lote_id, estado_id, cantidad):
+    """{lote_id: cantidad} si la reserva está 'Activa', si no {}."""
+    if lote_id is None or estado_id != estado_activa_id(sender):
+        return {}
+    return {lote_id: cantidad or 0}
+
+
+@receiver(pre_save, sender=ReservaStock)
+@receiver(pre_save, sender=ReservaMateriaPrima)
+def recordar_reserva_previa(sender, instance, raw=False, **kwargs):
+    """Lo que la reserva tenía en la BD antes de guardarla (para el delta del post_save)."""
+    if raw:
+        return
+    _modelo_lote, campo_lote, campo_estado, _modelo_estado = RESERVAS_LOTE[sender]
+    previa = None
+    if instance.pk is not None:
+        # Reserva.save() corre en una transacción: la fila queda bloqueada hasta el post_save
+        previa = sender.objects.select_for_update().filter(pk=instance.pk).values_list(
+            campo_lote, campo_estado, 'cantidad_reservada'
+        ).first()
+    instance._reservado_previo = _reservado(sender, *previa) if previa else {}
+
+
+@receiver(post_save, sender=ReservaStock)
+@receiver(post_save, sender=ReservaMateriaPrima)
+def actualizar_disponibilidad_por_reserva(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    modelo_lote, campo_lote, campo_estado, _modelo_estado = RESERVAS_LOTE[sender]
+    deltas = dict(_reservado(
+        sender, getattr(instance, campo_lote), getattr(instance, campo_estado), instance.cantidad_reservada
+    ))
+    for lote_id, cantidad in getattr(instance, '_reservado_previo', {}).items():
+        deltas[lote_id] = deltas.get(lote_id, 0) - cantidad
+    instance._reservado_previo = {}
+    ajustar_reservado_lotes(modelo_lote, deltas)
+
+
+@receiver(post_delete, sender=ReservaStock)
+@receiver(post_delete, sender=ReservaMateriaPrima)
+def liberar_disponibilidad_por_reserva(sender, instance, **kwargs):
+    # También corre en los borrados en cascada (OV, OP o lote borrados)
+    modelo_lote, campo_lote, campo_estado, _modelo_estado = RESERVAS_LOTE[sender]
+    reservado = _reservado(
+        sender, getattr(instance, campo_lote), getattr(instance, campo_estado), instance.cantidad_reservada
+    )
+    ajustar_reservado_lotes(modelo_lote, {lote_id: -cantidad for lote_id, cantidad in reservado.items()})
+
+
+@receiver([post_save, post_delete], sender=LoteProduccion)
+def invalidar_disponibilidad_producto(sender, instance, **kwargs):
+    # Cantidad, estado o vencimiento del lote: cambia el disponible de su producto
+    invalidar_disponibilidad('pt', [instance.id_producto_id])
+
+
+@receiver([post_save, post_delete], sender=LoteMateriaPrima)
+def invalidar_disponibilidad_materia_prima(sender, instance, **kwargs):
+    invalidar_disponibilidad('mp', [instance.id_materia_prima_id])
@@ -1,3 +1,715 @@
-from django.test import TestCase
+import contextlib
+import io
+import threading
+from datetime import date, timedelta
+from types import SimpleNamespace
+from unittest import SkipTest
 
-# Create your tests here.
+from django.core.cache import caches
+from django.db import connection, connections, transaction
+from django.db.models import F, Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIRequestFactory
+
+from compras.models import EstadoOrdenCompra, OrdenCompra, OrdenCompraMateriaPrima
+from materias_primas.models import MateriaPrima, Proveedor, TipoMateriaPrima
+from planificacion.models import MarcaPendienteMRP
+from produccion.models import EstadoOrdenProduccion, OrdenProduccion
+from productos.models import Producto, TipoProducto, Unidad
+from ventas.models import Cliente, EstadoVenta, OrdenVenta, OrdenVentaProducto, Prioridad
+from ventas.services import procesar_orden_venta_online
+from .models import (
+    EstadoLoteMateriaPrima, EstadoLoteProduccion, EstadoReserva, EstadoReservaMateria, LoteMateriaPrima,
+    LoteProduccion, ReservaMateriaPrima, ReservaStock
+)
+from . import services
+from .services import (
+    MAX_IDS_DISPONIBILIDAD, ajustar_reservado_lotes, cambiar_estado_reservas, disponibilidad_en_lote,
+    disponibles_cacheados, estadisticas_cache_disponibilidad, get_materias_primas_con_stock,
+    get_stock_disponible_todos_los_productos, lotes_con_disponibilidad_inconsistente, recalcular_disponibilidad_lotes,
+    reiniciar_estadisticas_cache_disponibilidad, reservar_stock_mp_fefo, reservar_stock_pt_fefo
+)
+from .views import disponibilidad_en_lote_view, listar_materias_primas
+
+
+class DatosDeStockMixin:
+    """Estados, catálogos y helpers comunes a los tests de reservas."""
+
+    def setUp(self):
+        # Los estados que procesar_orden_venta_online busca con get_or_create
+        # tienen que existir: si no, cada hilo crearía el suyo
+        for descripcion in ["Creada", "Pendiente de Pago", "Cancelada por Stock"]:
+            EstadoVenta.objects.create(descripcion=descripcion)
+        EstadoReserva.objects.create(descripcion="Activa")
+        # Cada test arranca con otra base: el id de 'Activa' cacheado del test anterior ya no vale
+        services._estado_activa_ids.clear()
+        self.estado_disponible = EstadoLoteProduccion.objects.create(descripcion="Disponible")
+        self.unidad = Unidad.objects.create(descripcion="kg")
+        self.tipo = TipoProducto.objects.create(descripcion="Congelado")
+        self.cliente = Cliente.objects.create(nombre="Cliente")
+        self.prioridad = Prioridad.objects.create(descripcion="Alta")
+
+    def _producto(self, nombre, cantidades_lotes):
+        producto = Producto.objects.create(
+            nombre=nombre, precio=1, id_tipo_producto=self.tipo, id_unidad=self.unidad,
+            dias_duracion=30, umbral_minimo=0
+        )
+        for i, cantidad in enumerate(cantidades_lotes):
+            LoteProduccion.objects.create(
+                id_producto=producto, cantidad=cantidad, id_estado_lote_produccion=self.estado_disponible,
+                fecha_vencimiento=date.today() + timedelta(days=10 + i)
+            )
+        return producto
+
+    def _orden_online(self, producto, cantidad):
+        orden = OrdenVenta.objects.create(
+            id_cliente=self.cliente, id_prioridad=self.prioridad,
+            id_estado_venta=EstadoVenta.objects.get(descripcion="Creada")
+        )
+        OrdenVentaProducto.objects.create(id_orden_venta=orden, id_producto=producto, cantidad=cantidad)
+        return orden
+
+    def _verificar_lotes(self):
+        self.assertFalse(LoteProduccion.objects.filter(cantidad_disponible__lt=0).exists())
+        self.assertEqual(lotes_con_disponibilidad_inconsistente(ReservaStock), [])
+
+
+class ReservasConcurrentesTest(DatosDeStockMixin, TransactionTestCase):
+    """
+    Stress de reservas concurrentes: muchos checkouts online, cada uno en su
+    hilo (y con su propia conexión), compiten por el mismo stock al mismo
+    tiempo. Nunca se puede reservar más de lo que tienen los lotes.
+
+    Necesita una base que acepte escrituras concurrentes: PostgreSQL (o SQLite
+    en archivo con transaction_mode IMMEDIATE). Con la SQLite en memoria de
+    los tests se saltea.
+    """
+    HILOS = 24
+
+    @classmethod
+    def setUpClass(cls):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            raise SkipTest("Las reservas concurrentes necesitan una base real (no SQLite en memoria).")
+        super().setUpClass()
+
+    def _en_paralelo(self, funcion, argumentos):
+        """Corre funcion(arg) para cada argumento, todos en su hilo y arrancando a la vez."""
+        barrera = threading.Barrier(len(argumentos))
+        resultados = [None] * len(argumentos)
+        errores = []
+
+        def correr(i, argumento):
+            try:
+                barrera.wait()
+                resultados[i] = funcion(argumento)
+            except Exception as e:
+                errores.append(e)
+            finally:
+                connections.close_all()
+
+        hilos = [threading.Thread(target=correr, args=(i, a)) for i, a in enumerate(argumentos)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        self.assertEqual(errores, [])
+        return resultados
+
+    def test_checkouts_del_mismo_producto_no_sobrevenden(self):
+        # 45 unidades en 3 lotes y 24 compras de 4: entran 11 (44 unidades)
+        producto = self._producto("Helado", [10, 15, 20])
+        ordenes = [self._orden_online(producto, 4) for _ in range(self.HILOS)]
+
+        resultados = self._en_paralelo(procesar_orden_venta_online, ordenes)
+
+        exitosas = sum(resultado["exito"] for resultado in resultados)
+        reservado = ReservaStock.objects.aggregate(total=Sum("cantidad_reservada"))["total"]
+        self.assertEqual(exitosas, 11)
+        self.assertEqual(reservado, 4 * exitosas)
+        self.assertEqual(
+            OrdenVenta.objects.filter(id_estado_venta__descripcion="Pendiente de Pago").count(), exitosas
+        )
+        self._verificar_lotes()
+
+    def test_checkouts_de_lotes_distintos_entran_todos(self):
+        # Cada compra va a su propio producto (y lote): ninguna le quita stock a otra
+        ordenes = [
+            self._orden_online(self._producto(f"Producto {i}", [5]), 5)
+            for i in range(self.HILOS)
+        ]
+
+        resultados = self._en_paralelo(procesar_orden_venta_online, ordenes)
+
+        self.assertTrue(all(resultado["exito"] for resultado in resultados))
+        self.assertEqual(ReservaStock.objects.aggregate(total=Sum("cantidad_reservada"))["total"], 5 * self.HILOS)
+        self.assertFalse(LoteProduccion.objects.filter(cantidad_disponible__gt=0).exists())
+        self._verificar_lotes()
+
+
+class ReservasSinSobreventaTest(DatosDeStockMixin, TestCase):
+    """
+    Las piezas de la reserva sin sobreventa, en un solo hilo (corre con la
+    base de los tests, sin concurrencia real).
+    """
+
+    def _lote(self, producto):
+        return LoteProduccion.objects.filter(id_producto=producto).order_by('fecha_vencimiento').first()
+
+    def test_decremento_condicional_no_toca_el_lote_que_no_alcanza(self):
+        producto = self._producto("Helado", [10, 5])
+        primero, segundo = LoteProduccion.objects.filter(id_producto=producto).order_by('fecha_vencimiento')
+
+        self.assertEqual(ajustar_reservado_lotes(LoteProduccion, {primero.pk: 8}, solo_si_alcanza=True), 1)
+        # Al primero le quedan 2: no cubre 5 y queda como estaba; el segundo sí cubre 1
+        self.assertEqual(
+            ajustar_reservado_lotes(LoteProduccion, {primero.pk: 5, segundo.pk: 1}, solo_si_alcanza=True), 1
+        )
+
+        primero.refresh_from_db()
+        segundo.refresh_from_db()
+        self.assertEqual((primero.cantidad_reservada_activa, primero.cantidad_disponible), (8, 2))
+        self.assertEqual((segundo.cantidad_reservada_activa, segundo.cantidad_disponible), (1, 4))
+
+        # Sin solo_si_alcanza el ajuste es incondicional (liberar reservas, recalcular)
+        self.assertEqual(ajustar_reservado_lotes(LoteProduccion, {primero.pk: 5}), 1)
+        primero.refresh_from_db()
+        self.assertEqual(primero.cantidad_disponible, -3)
+
+    def test_tomar_de_un_lote_leido_viejo_falla_sin_tocarlo(self):
+        producto = self._producto("Helado", [10])
+        lotes = list(services._lotes_pt_disponibles({producto.pk}))
+        # Otra reserva se lleva 6 después de la lectura
+        ajustar_reservado_lotes(LoteProduccion, {lotes[0].pk: 6})
+
+        asignaciones = services._asignar_fefo(services._agrupar_lotes(lotes, 'id_producto_id'), [{producto.pk: 8}], False)
+        with self.assertRaises(services._LoteSinDisponible):
+            services._tomar_de_lotes(LoteProduccion, asignaciones)
+
+        lote = self._lote(producto)
+        self.assertEqual((lote.cantidad_reservada_activa, lote.cantidad_disponible), (6, 4))
+
+    def test_reserva_que_pierde_la_carrera_se_reintenta_con_lo_que_queda(self):
+        producto = self._producto("Helado", [10])
+        candidatos = services._lotes_pt_disponibles({producto.pk})
+        leidos_antes = list(candidatos)
+        ajustar_reservado_lotes(LoteProduccion, {leidos_antes[0].pk: 6})
+
+        intentos = []
+
+        def reservar(lotes):
+            # El primer intento trabaja con la lectura de antes de que otra reserva tomara stock
+            intentos.append(lotes)
+            asignaciones = services._asignar_fefo(
+                services._agrupar_lotes(leidos_antes if len(intentos) == 1 else lotes, 'id_producto_id'),
+                [{producto.pk: 8}], False
+            )
+            services._tomar_de_lotes(LoteProduccion, asignaciones)
+            return asignaciones
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            asignaciones = services._reservar_sin_sobreventa(LoteProduccion, candidatos, reservar)
+
+        self.assertEqual(len(intentos), 2)
+        self.assertEqual([cantidad for _item, _lote, cantidad in asignaciones[0]], [4])
+        lote = self._lote(producto)
+        self.assertEqual((lote.cantidad_reservada_activa, lote.cantidad_disponible), (10, 0))
+
+    def test_columnas_consistentes_despues_de_reservar_y_cancelar(self):
+        producto = self._producto("Helado", [10, 15])
+        activa = EstadoReserva.objects.get(descripcion="Activa")
+        cancelada = EstadoReserva.objects.create(descripcion="Cancelada")
+        ordenes = [self._orden_online(producto, cantidad) for cantidad in (12, 6)]
+        lineas = [orden.ordenventaproducto_set.get() for orden in ordenes]
+
+        self.assertEqual(reservar_stock_pt_fefo([(linea, linea.cantidad) for linea in lineas], activa), [12, 6])
+        self._verificar_lotes()
+
+        # Cancelar (update masivo de estado), reactivar y borrar una reserva
+        cambiar_estado_reservas(ReservaStock.objects.filter(id_orden_venta_producto=lineas[0]), cancelada)
+        self._verificar_lotes()
+        cambiar_estado_reservas(ReservaStock.objects.filter(id_orden_venta_producto=lineas[0]), activa)
+        self._verificar_lotes()
+        ReservaStock.objects.filter(id_orden_venta_producto=lineas[1]).first().delete()
+        self._verificar_lotes()
+        self.assertEqual(
+            LoteProduccion.objects.filter(id_producto=producto).aggregate(total=Sum('cantidad_reservada_activa'))["total"],
+            ReservaStock.objects.filter(id_estado_reserva=activa).aggregate(total=Sum('cantidad_reservada'))["total"]
+        )
+
+        # Un update que saltea las señales deja el lote inconsistente: se detecta y se recalcula
+        lote = self._lote(producto)
+        LoteProduccion.objects.filter(pk=lote.pk).update(cantidad_disponible=F('cantidad_disponible') + 3)
+        self.assertEqual([fila[0] for fila in lotes_con_disponibilidad_inconsistente(ReservaStock)], [lote.pk])
+        self.assertEqual(recalcular_disponibilidad_lotes(ReservaStock), 2)
+        self._verificar_lotes()
+
+
+class ReservasFefoTest(DatosDeStockMixin, TestCase):
+    """Reservas en lote: primero vence, primero se reserva."""
+
+    def setUp(self):
+        super().setUp()
+        self.activa_mp = EstadoReservaMateria.objects.create(descripcion="Activa")
+        self.activa = EstadoReserva.objects.get(descripcion="Activa")
+        self.mp_disponible = EstadoLoteMateriaPrima.objects.create(descripcion="disponible")
+        self.proveedor = Proveedor.objects.create(nombre="Proveedor")
+        self.tipo_mp = TipoMateriaPrima.objects.create(descripcion="Insumo")
+        self.estado_op = EstadoOrdenProduccion.objects.create(descripcion="Planificada")
+
+    def _lote_pt(self, producto, cantidad, dias):
+        return LoteProduccion.objects.create(
+            id_producto=producto, cantidad=cantidad, id_estado_lote_produccion=self.estado_disponible,
+            fecha_vencimiento=date.today() + timedelta(days=dias)
+        )
+
+    def _materia_prima(self, nombre, lotes):
+        """lotes: [(cantidad, días hasta el vencimiento)]"""
+        materia_prima = MateriaPrima.objects.create(
+            nombre=nombre, precio=1, id_tipo_materia_prima=self.tipo_mp, id_unidad=self.unidad,
+            id_proveedor=self.proveedor
+        )
+        for cantidad, dias in lotes:
+            LoteMateriaPrima.objects.create(
+                id_materia_prima=materia_prima, cantidad=cantidad, id_estado_lote_materia_prima=self.mp_disponible,
+                fecha_vencimiento=date.today() + timedelta(days=dias)
+            )
+        return materia_prima
+
+    def _op(self):
+        return OrdenProduccion.objects.create(cantidad=1, id_estado_orden_produccion=self.estado_op)
+
+    def _lineas(self, producto, cantidades):
+        return [self._orden_online(producto, cantidad).ordenventaproducto_set.get() for cantidad in cantidades]
+
+    def _reservado_por_lote(self, linea):
+        return list(
+            ReservaStock.objects.filter(id_orden_venta_producto=linea).order_by('pk')
+            .values_list('id_lote_produccion_id', 'cantidad_reservada')
+        )
+
+    def test_asignar_fefo_recorre_los_lotes_en_orden(self):
+        lotes = {1: [SimpleNamespace(disponible=3), SimpleNamespace(disponible=5)]}
+
+        asignaciones = services._asignar_fefo(lotes, [{1: 4}, {1: 6}, {1: 2}], completa=False)
+
+        self.assertEqual(
+            [[cantidad for _item, _lote, cantidad in tomado] for tomado in asignaciones], [[3, 1], [4], []]
+        )
+        self.assertEqual([lote.disponible for lote in lotes[1]], [0, 0])
+
+    def test_el_lote_que_vence_primero_se_reserva_primero(self):
+        producto = self._producto("Helado", [])
+        tardio = self._lote_pt(producto, 10, 30)
+        temprano = self._lote_pt(producto, 10, 5)
+        linea, = self._lineas(producto, [4])
+
+        self.assertEqual(reservar_stock_pt_fefo([(linea, 4)], self.activa), [4])
+        self.assertEqual(self._reservado_por_lote(linea), [(temprano.pk, 4)])
+        tardio.refresh_from_db()
+        self.assertEqual(tardio.cantidad_disponible, 10)
+
+    def test_una_demanda_se_reparte_entre_lotes(self):
+        producto = self._producto("Helado", [])
+        tardio = self._lote_pt(producto, 10, 30)
+        temprano = self._lote_pt(producto, 10, 5)
+        linea, = self._lineas(producto, [15])
+
+        self.assertEqual(reservar_stock_pt_fefo([(linea, 15)], self.activa), [15])
+        self.assertEqual(self._reservado_por_lote(linea), [(temprano.pk, 10), (tardio.pk, 5)])
+        self._verificar_lotes()
+
+    def test_varias_demandas_del_mismo_producto_en_una_llamada(self):
+        producto = self._producto("Helado", [])
+        tardio = self._lote_pt(producto, 10, 30)
+        temprano = self._lote_pt(producto, 10, 5)
+        lineas = self._lineas(producto, [12, 6, 5])
+
+        self.assertEqual(
+            reservar_stock_pt_fefo([(linea, linea.cantidad) for linea in lineas], self.activa), [12, 6, 2]
+        )
+        self.assertEqual(
+            [self._reservado_por_lote(linea) for linea in lineas],
+            [[(temprano.pk, 10), (tardio.pk, 2)], [(tardio.pk, 6)], [(tardio.pk, 2)]]
+        )
+        self._verificar_lotes()
+
+    def test_completa_es_todo_o_nada(self):
+        producto = self._producto("Helado", [10, 10])
+        lineas = self._lineas(producto, [25, 8])
+
+        # La primera no entra entera: no reserva nada ni le quita stock a la segunda
+        self.assertEqual(
+            reservar_stock_pt_fefo([(linea, linea.cantidad) for linea in lineas], self.activa, completa=True), [0, 8]
+        )
+        self.assertFalse(ReservaStock.objects.filter(id_orden_venta_producto=lineas[0]).exists())
+        self._verificar_lotes()
+
+    def test_materias_primas_de_varias_ops(self):
+        harina = self._materia_prima("Harina", [(20, 40), (5, 10)])
+        azucar = self._materia_prima("Azúcar", [(3, 10)])
+        op_1, op_2 = self._op(), self._op()
+
+        reservado = reservar_stock_mp_fefo([(op_1, {harina.pk: 8, azucar.pk: 2}), (op_2, {harina.pk: 4})], self.activa_mp)
+
+        self.assertEqual(reservado, [{harina.pk: 8, azucar.pk: 2}, {harina.pk: 4}])
+        primero_en_vencer = LoteMateriaPrima.objects.get(id_materia_prima=harina, cantidad=5)
+        self.assertEqual(
+            list(ReservaMateriaPrima.objects.filter(id_orden_produccion=op_1, id_lote_materia_prima__id_materia_prima=harina)
+                 .order_by('pk').values_list('id_lote_materia_prima_id', 'cantidad_reservada'))[0],
+            (primero_en_vencer.pk, 5)
+        )
+        self.assertEqual(lotes_con_disponibilidad_inconsistente(ReservaMateriaPrima), [])
+
+    def test_materias_primas_completa_es_todo_o_nada_por_op(self):
+        harina = self._materia_prima("Harina", [(20, 40)])
+        azucar = self._materia_prima("Azúcar", [(3, 10)])
+        op_1, op_2 = self._op(), self._op()
+
+        reservado = reservar_stock_mp_fefo(
+            [(op_1, {harina.pk: 8, azucar.pk: 5}), (op_2, {harina.pk: 15})], self.activa_mp, completa=True
+        )
+
+        # A la primera OP le falta azúcar: no se lleva ni la harina
+        self.assertEqual(reservado, [{harina.pk: 0, azucar.pk: 0}, {harina.pk: 15}])
+        self.assertFalse(ReservaMateriaPrima.objects.filter(id_orden_produccion=op_1).exists())
+        self.assertEqual(lotes_con_disponibilidad_inconsistente(ReservaMateriaPrima), [])
+
+    def test_las_reservas_en_lote_marcan_los_items_para_el_mrp(self):
+        helado = self._producto("Helado", [10])
+        sin_stock = self._producto("Sin stock", [])
+        harina = self._materia_prima("Harina", [(20, 40)])
+        lineas = self._lineas(helado, [4]) + self._lineas(sin_stock, [2])
+        # Los lotes y las OVs ya marcaron lo suyo: solo interesa lo que marca la reserva
+        MarcaPendienteMRP.objects.all().delete()
+
+        reservar_stock_pt_fefo([(linea, linea.cantidad) for linea in lineas], self.activa)
+        reservar_stock_mp_fefo([(self._op(), {harina.pk: 8})], self.activa_mp)
+
+        self.assertEqual(
+            sorted(MarcaPendienteMRP.objects.values_list('tipo', 'id_referencia', 'motivo')),
+            [
+                (MarcaPendienteMRP.Tipo.MATERIA_PRIMA, harina.pk, "reserva_materia_prima"),
+                (MarcaPendienteMRP.Tipo.PRODUCTO, helado.pk, "reserva_stock"),
+            ]
+        )
+
+
+class DisponibilidadEnLoteTest(DatosDeStockMixin, TestCase):
+    """Disponibilidad de varios productos y MPs en una sola llamada (stock/disponibilidad/)."""
+
+    def setUp(self):
+        super().setUp()
+        self.activa = EstadoReserva.objects.get(descripcion="Activa")
+        self.helado = self._producto("Helado", [10, 15])
+        self.palito = self._producto("Palito", [8])
+        linea = self._orden_online(self.helado, 4).ordenventaproducto_set.get()
+        reservar_stock_pt_fefo([(linea, 4)], self.activa)
+
+        proveedor = Proveedor.objects.create(nombre="Proveedor")
+        self.harina = MateriaPrima.objects.create(
+            nombre="Harina", precio=1, id_tipo_materia_prima=TipoMateriaPrima.objects.create(descripcion="Insumo"),
+            id_unidad=self.unidad, id_proveedor=proveedor
+        )
+        LoteMateriaPrima.objects.create(
+            id_materia_prima=self.harina, cantidad=20,
+            id_estado_lote_materia_prima=EstadoLoteMateriaPrima.objects.create(descripcion="disponible"),
+            fecha_vencimiento=date.today() + timedelta(days=30)
+        )
+        # Solo lo de las OCs 'En proceso' está en tránsito
+        for descripcion, cantidad in [("En proceso", 7), ("En proceso", 3), ("Recibida", 100)]:
+            orden = OrdenCompra.objects.create(
+                id_estado_orden_compra=EstadoOrdenCompra.objects.get_or_create(descripcion=descripcion)[0],
+                id_proveedor=proveedor, fecha_solicitud=date.today(), fecha_entrega_estimada=date.today()
+            )
+            OrdenCompraMateriaPrima.objects.create(id_orden_compra=orden, id_materia_prima=self.harina, cantidad=cantidad)
+
+    def _get(self, **parametros):
+        return disponibilidad_en_lote_view(APIRequestFactory().get("/api/stock/disponibilidad/", parametros))
+
+    def _post(self, datos):
+        return disponibilidad_en_lote_view(APIRequestFactory().post("/api/stock/disponibilidad/", datos, format="json"))
+
+    def test_get_con_productos_mps_e_ids_inexistentes(self):
+        respuesta = self._get(
+            productos=f"{self.helado.pk},{self.palito.pk},99999", materias_primas=str(self.harina.pk), lotes="false"
+        )
+
+        self.assertEqual(respuesta.status_code, 200)
+        helado = respuesta.data["productos"][self.helado.pk]
+        self.assertEqual((helado["cantidad"], helado["reservado"], helado["disponible"]), (25, 4, 21))
+        self.assertNotIn("lotes", helado)
+        self.assertEqual(respuesta.data["productos"][self.palito.pk]["disponible"], 8)
+        harina = respuesta.data["materias_primas"][self.harina.pk]
+        self.assertEqual((harina["disponible"], harina["en_transito"]), (20, 10))
+        self.assertEqual(respuesta.data["no_encontrados"], {"productos": [99999], "materias_primas": []})
+
+    def test_post_con_el_detalle_por_lote_en_orden_fefo(self):
+        respuesta = self._post({"productos": [self.helado.pk]})
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.data["materias_primas"], {})
+        lotes = respuesta.data["productos"][self.helado.pk]["lotes"]
+        self.assertEqual(
+            [(lote["cantidad"], lote["reservado"], lote["disponible"]) for lote in lotes], [(10, 4, 6), (15, 0, 15)]
+        )
+
+    def test_las_consultas_no_dependen_de_la_cantidad_de_items(self):
+        otros = [self._producto(f"Producto {i}", [5, 5]) for i in range(5)]
+
+        with self.assertNumQueries(5):
+            disponibilidad_en_lote([self.helado.pk], [self.harina.pk])
+        with self.assertNumQueries(5):
+            disponibilidad_en_lote([self.helado.pk, self.palito.pk, *(p.pk for p in otros)], [self.harina.pk])
+
+    def test_parametros_invalidos(self):
+        self.assertEqual(self._get().status_code, 400)
+        self.assertEqual(self._get(productos="1,abc").status_code, 400)
+        self.assertEqual(self._post({"productos": list(range(1, MAX_IDS_DISPONIBILIDAD + 2))}).status_code, 400)
+
+
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    services.CACHE_DISPONIBILIDAD: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-stock'},
+    'versiones': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-versiones'},
+})
+class CacheDisponibilidadTest(DatosDeStockMixin, TransactionTestCase):
+    """
+    Después de cualquier cambio de lotes o reservas, la siguiente lectura del
+    disponible cacheado es la de la BD. Es TransactionTestCase: el caché solo
+    se escribe fuera de una transacción y se invalida al confirmarla.
+    """
+
+    def setUp(self):
+        super().setUp()
+        caches[services.CACHE_DISPONIBILIDAD].clear()
+        self.activa = EstadoReserva.objects.get(descripcion="Activa")
+        self.producto = self._producto("Helado", [10, 15])
+        self.lote = LoteProduccion.objects.filter(id_producto=self.producto).order_by('fecha_vencimiento').first()
+        self.linea = self._orden_online(self.producto, 5).ordenventaproducto_set.get()
+
+    def _disponible(self):
+        return disponibles_cacheados('pt', [self.producto.pk])[self.producto.pk]
+
+    def _en_cache(self):
+        return caches[services.CACHE_DISPONIBILIDAD].get(services._clave_disponible('pt', self.producto.pk))
+
+    def _calentar(self, esperado):
+        self.assertEqual(self._disponible(), esperado)
+        self.assertEqual(self._en_cache(), esperado)
+
+    def test_lecturas_repetidas_salen_del_cache(self):
+        reiniciar_estadisticas_cache_disponibilidad()
+        self._calentar(25)
+        self.assertEqual(self._disponible(), 25)
+        estadisticas = estadisticas_cache_disponibilidad()
+        self.assertEqual((estadisticas["aciertos"], estadisticas["fallos"]), (1, 1))
+
+    def test_cambios_de_lotes_por_el_orm(self):
+        self._calentar(25)
+        self.lote.cantidad = 4
+        self.lote.save()
+        self.assertEqual(self._disponible(), 19)
+
+        # Un lote que deja de estar 'Disponible' no cuenta
+        self._calentar(19)
+        self.lote.id_estado_lote_produccion = EstadoLoteProduccion.objects.create(descripcion="Vencido")
+        self.lote.save()
+        self.assertEqual(self._disponible(), 15)
+
+        self._calentar(15)
+        LoteProduccion.objects.filter(id_producto=self.producto, id_estado_lote_produccion=self.estado_disponible).delete()
+        self.assertEqual(self._disponible(), 0)
+
+    def test_reservas_por_el_orm(self):
+        self._calentar(25)
+        reserva = ReservaStock.objects.create(
+            id_orden_venta_producto=self.linea, id_lote_produccion=self.lote, cantidad_reservada=5,
+            id_estado_reserva=self.activa
+        )
+        self.assertEqual(self._disponible(), 20)
+
+        self._calentar(20)
+        reserva.cantidad_reservada = 7
+        reserva.save()
+        self.assertEqual(self._disponible(), 18)
+
+        self._calentar(18)
+        cancelada = EstadoReserva.objects.create(descripcion="Cancelada")
+        cambiar_estado_reservas(ReservaStock.objects.filter(pk=reserva.pk), cancelada)
+        self.assertEqual(self._disponible(), 25)
+
+        self._calentar(25)
+        reserva.refresh_from_db()
+        reserva.delete()
+        self.assertEqual(self._disponible(), 25)
+
+    def test_ajustar_reservado_lotes_y_reservas_en_lote(self):
+        self._calentar(25)
+        ajustar_reservado_lotes(LoteProduccion, {self.lote.pk: 3})
+        self.assertEqual(self._disponible(), 22)
+
+        self._calentar(22)
+        self.assertEqual(reservar_stock_pt_fefo([(self.linea, 5)], self.activa), [5])
+        self.assertEqual(self._disponible(), 17)
+
+        self._calentar(17)
+        recalcular_disponibilidad_lotes(ReservaStock)
+        self.assertEqual(self._disponible(), 20)
+        self.assertEqual(get_stock_disponible_todos_los_productos()[0]['cantidad_disponible'], 20)
+
+    def test_dentro_de_una_transaccion_no_se_escribe_el_cache(self):
+        with transaction.atomic():
+            self.assertEqual(self._disponible(), 25)
+            self.assertIsNone(self._en_cache())
+            ajustar_reservado_lotes(LoteProduccion, {self.lote.pk: 10})
+            self.assertEqual(self._disponible(), 15)
+            transaction.set_rollback(True)
+
+        # Lo que se vio dentro de la transacción deshecha no quedó cacheado
+        self.assertEqual(self._disponible(), 25)
+        self.assertEqual(self._en_cache(), 25)
+
+    def test_la_invalidacion_espera_al_commit(self):
+        self._calentar(25)
+        with transaction.atomic():
+            ajustar_reservado_lotes(LoteProduccion, {self.lote.pk: 10})
+            # Otra conexión todavía no ve el cambio: el valor cacheado sigue valiendo
+            self.assertEqual(self._en_cache(), 25)
+        self.assertIsNone(self._en_cache())
+        self.assertEqual(self._disponible(), 15)
+
+
+class ListadoMateriasPrimasTest(TestCase):
+    """GET /api/stock/materiasprimas/ (listar_materias_primas)."""
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        unidad = Unidad.objects.create(descripcion="kg")
+        self.proveedor_1 = Proveedor.objects.create(nombre="Molino")
+        self.proveedor_2 = Proveedor.objects.create(nombre="Ingenio")
+        self.tipo_1 = TipoMateriaPrima.objects.create(descripcion="Harinas")
+        self.tipo_2 = TipoMateriaPrima.objects.create(descripcion="Otros")
+        disponible = EstadoLoteMateriaPrima.objects.create(descripcion="disponible")
+        vencido = EstadoLoteMateriaPrima.objects.create(descripcion="vencido")
+        en_proceso = EstadoOrdenCompra.objects.create(descripcion="En proceso")
+        recibida = EstadoOrdenCompra.objects.create(descripcion="Recibida")
+
+        def materia_prima(nombre, proveedor, tipo, umbral):
+            return MateriaPrima.objects.create(
+                nombre=nombre, precio=1, id_tipo_materia_prima=tipo, id_unidad=unidad,
+                id_proveedor=proveedor, umbral_minimo=umbral
+            )
+
+        def lote(materia_prima, cantidad, estado):
+            return LoteMateriaPrima.objects.create(
+                id_materia_prima=materia_prima, cantidad=cantidad, id_estado_lote_materia_prima=estado,
+                fecha_vencimiento=date.today() + timedelta(days=30)
+            )
+
+        def compra(estado, items):
+            orden = OrdenCompra.objects.create(
+                id_estado_orden_compra=estado, id_proveedor=self.proveedor_1,
+                fecha_solicitud=date.today(), fecha_entrega_estimada=date.today() + timedelta(days=3)
+            )
+            for materia_prima, cantidad in items:
+                OrdenCompraMateriaPrima.objects.create(
+                    id_orden_compra=orden, id_materia_prima=materia_prima, cantidad=cantidad
+                )
+
+        self.harina = materia_prima("Harina", self.proveedor_1, self.tipo_1, 10)
+        self.azucar = materia_prima("Azúcar", self.proveedor_2, self.tipo_2, 10)
+        self.sal = materia_prima("Sal", self.proveedor_1, self.tipo_2, 5)
+
+        # Dos lotes y dos OCs de la misma MP: un JOIN en vez de la subconsulta daría el doble
+        lote_harina = lote(self.harina, 100, disponible)
+        lote(self.harina, 50, disponible)
+        lote(self.harina, 30, vencido)
+        ajustar_reservado_lotes(LoteMateriaPrima, {lote_harina.pk: 20})
+        compra(en_proceso, [(self.harina, 40), (self.azucar, 10)])
+        compra(en_proceso, [(self.harina, 60)])
+        compra(recibida, [(self.harina, 500)])
+        lote(self.azucar, 8, disponible)
+
+    def _get(self, parametros=None, **encabezados):
+        return listar_materias_primas(self.factory.get("/api/stock/materiasprimas/", parametros or {}, **encabezados))
+
+    def _esperado_lote_por_lote(self):
+        """El cálculo de antes: recorrer los lotes y las OCs de cada MP."""
+        esperado = {}
+        for materia_prima in MateriaPrima.objects.all():
+            lotes = LoteMateriaPrima.objects.filter(
+                id_materia_prima=materia_prima, id_estado_lote_materia_prima__descripcion="disponible"
+            )
+            compras = OrdenCompraMateriaPrima.objects.filter(
+                id_materia_prima=materia_prima, id_orden_compra__id_estado_orden_compra__descripcion="En proceso"
+            )
+            esperado[materia_prima.pk] = (
+                sum(lote.cantidad_disponible for lote in lotes),
+                sum(lote.cantidad_reservada_activa for lote in lotes),
+                sum(compra.cantidad for compra in compras),
+            )
+        return esperado
+
+    def test_totales_iguales_al_calculo_lote_por_lote(self):
+        filas = {
+            fila["id_materia_prima"]: (fila["cantidad_disponible"], fila["cantidad_reservada"], fila["en_transito"])
+            for fila in get_materias_primas_con_stock()
+        }
+        self.assertEqual(filas, self._esperado_lote_por_lote())
+        self.assertEqual(filas[self.harina.pk], (130, 20, 100))
+        self.assertEqual(filas[self.sal.pk], (0, 0, 0))
+
+    def test_lista_completa_sin_paginar(self):
+        respuesta = self._get()
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertIsInstance(respuesta.data, list)
+        self.assertEqual([fila["nombre"] for fila in respuesta.data], ["Harina", "Azúcar", "Sal"])
+        harina = respuesta.data[0]
+        self.assertEqual((harina["unidad_medida"], harina["proveedor"]), ("kg", "Molino"))
+
+    def test_paginada(self):
+        respuesta = self._get({"page": 2, "page_size": 2})
+
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.data["count"], 3)
+        self.assertIsNone(respuesta.data["next"])
+        self.assertIsNotNone(respuesta.data["previous"])
+        self.assertEqual([fila["nombre"] for fila in respuesta.data["results"]], ["Sal"])
+
+    def test_filtros(self):
+        nombres = lambda parametros: [fila["nombre"] for fila in self._get(parametros).data]
+
+        self.assertEqual(nombres({"proveedor": self.proveedor_1.pk}), ["Harina", "Sal"])
+        self.assertEqual(nombres({"tipo": self.tipo_2.pk}), ["Azúcar", "Sal"])
+        self.assertEqual(nombres({"proveedor": self.proveedor_1.pk, "tipo": self.tipo_2.pk}), ["Sal"])
+        self.assertEqual(nombres({"search": "har"}), ["Harina"])
+        self.assertEqual(nombres({"bajo_umbral": "true"}), ["Azúcar", "Sal"])
+
+    def test_proveedor_o_tipo_no_numerico_es_400(self):
+        for parametro in ("proveedor", "tipo"):
+            respuesta = self._get({parametro: "abc"})
+            self.assertEqual(respuesta.status_code, 400)
+            self.assertIn(parametro, respuesta.data["error"])
+
+    def test_etag_y_304(self):
+        primera = self._get()
+        etag = primera["ETag"]
+
+        sin_cambios = self._get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(sin_cambios.status_code, 304)
+        self.assertEqual(sin_cambios.content, b"")
+
+        # Otro filtro u otra página es otro contenido: otro ETag
+        self.assertNotEqual(self._get({"page": 1, "page_size": 2})["ETag"], etag)
+
+        # Si cambia el stock cambia el ETag y se devuelve la lista nueva
+        LoteMateriaPrima.objects.create(
+            id_materia_prima=self.sal, cantidad=7,
+            id_estado_lote_materia_prima=EstadoLoteMateriaPrima.objects.get(descripcion="disponible"),
+            fecha_vencimiento=date.today() + timedelta(days=30)
+        )
+        cambiada = self._get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cambiada.status_code, 200)
+        self.assertNotEqual(cambiada["ETag"], etag)
+        self.assertEqual(cambiada.data[2]["cantidad_disponible"], 7)
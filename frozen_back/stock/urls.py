@@ -12,6 +12,8 @@ from .views import (
     restar_cantidad_lote,
     verificar_stock_view,
     lista_cantidad_total_productos_view,
+    disponibilidad_en_lote_view,
+    estadisticas_cache_disponibilidad_view,
     obtener_lotes_de_materia_prima,
     HistorialLoteProduccionViewSet,
     HistorialLoteMateriaPrimaViewSet
@@ -31,6 +33,8 @@ urlpatterns = [
     path('', include(router.urls)),
     path('cantidad-disponible/<int:id_producto>/', cantidad_total_producto_view),
     path('cantidad-disponible/', lista_cantidad_total_productos_view),
+    path('disponibilidad/', disponibilidad_en_lote_view, name='disponibilidad_en_lote'),
+    path('disponibilidad/cache/', estadisticas_cache_disponibilidad_view, name='estadisticas_cache_disponibilidad'),
     path('verificar-stock/<int:id_producto>/', verificar_stock_view),
     path("materias_primas/agregar/", agregar_o_crear_lote, name="agregar_o_crear_lote"),
     path("materias_primas/restar/", restar_cantidad_lote, name="restar_cantidad_lote"),
@@ -1,3 +1,4 @@
+import hashlib
 import json
 from django.http import JsonResponse
 from django.shortcuts import render
@@ -7,11 +8,13 @@ from rest_framework import viewsets, filters
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.decorators import api_view, action  # <- IMPORT IMPORTANTE
+from rest_framework.pagination import PageNumberPagination
 from django_filters.rest_framework import DjangoFilterBackend
-from stock.services import get_stock_disponible_para_producto,  verificar_stock_y_enviar_alerta, get_stock_disponible_todos_los_productos, actualizar_estado_lote_producto
+from stock.services import get_stock_disponible_para_producto,  verificar_stock_y_enviar_alerta, get_stock_disponible_todos_los_productos, actualizar_estado_lote_producto, disponibilidad_en_lote, estadisticas_cache_disponibilidad, reiniciar_estadisticas_cache_disponibilidad, get_materias_primas_con_stock
 from django.views.decorators.csrf import csrf_exempt
 from produccion.services import procesar_ordenes_en_espera
-from django.db.models import Sum
+from django.db.models import Sum, F
+from django.utils.cache import get_conditional_response
 from django.db import transaction
 from produccion.models import OrdenProduccion, EstadoOrdenProduccion
 
@@ -32,7 +35,8 @@ from .serializers import (
     LoteMateriaPrimaSerializer,
     LoteProduccionMateriaSerializer,
     HistoricalLoteProduccionSerializer, 
-    HistoricalLoteMateriaPrimaSerializer
+    HistoricalLoteMateriaPrimaSerializer,
+    DisponibilidadEnLoteSerializer
 )
 
 # ----- Estados -----
@@ -315,14 +319,25 @@ def lista_cantidad_total_productos_view(request):
     """
     Endpoint que devuelve la cantidad total disponible de TODOS los productos.
     """
-    # 1. Llamamos a la nueva función helper
+    # 1. Llamamos a la nueva función helper (el disponible sale del caché)
     stock_data = get_stock_disponible_todos_los_productos()
     
-    # 2. La función ya devuelve un QuerySet de diccionarios, 
-    #    listo para ser serializado por la Response.
+    # 2. La función ya devuelve una lista de diccionarios, 
+    #    lista para ser serializada por la Response.
     return Response(stock_data, status=status.HTTP_200_OK)
 
 
+@api_view(["GET", "DELETE"])
+def estadisticas_cache_disponibilidad_view(request):
+    """
+    Aciertos / fallos del caché de disponibilidad por producto y MP.
+    DELETE pone los contadores en cero.
+    """
+    if request.method == "DELETE":
+        reiniciar_estadisticas_cache_disponibilidad()
+    return Response(estadisticas_cache_disponibilidad(), status=status.HTTP_200_OK)
+
+
 
 @api_view(["GET"])
 def cantidad_total_materia_view(request, id_producto):
@@ -338,6 +353,35 @@ def cantidad_total_materia_view(request, id_producto):
 
 
 
+@api_view(["GET", "POST"])
+def disponibilidad_en_lote_view(request):
+    """
+    Disponibilidad de varios productos y/o materias primas en una sola llamada
+    (cantidad, reservado, disponible, en tránsito para MPs y detalle por lote).
+
+    GET  ?productos=1,2,3&materias_primas=4,5&lotes=false
+    POST {"productos": [1, 2, 3], "materias_primas": [4, 5], "lotes": false}
+    """
+    if request.method == "GET":
+        datos = {
+            campo: [i for i in request.query_params.get(campo, "").split(",") if i.strip()]
+            for campo in ("productos", "materias_primas")
+        }
+        if "lotes" in request.query_params:
+            datos["lotes"] = request.query_params["lotes"]
+    else:
+        datos = request.data
+
+    serializer = DisponibilidadEnLoteSerializer(data=datos)
+    serializer.is_valid(raise_exception=True)
+    resultado = disponibilidad_en_lote(
+        serializer.validated_data["productos"],
+        serializer.validated_data["materias_primas"],
+        con_lotes=serializer.validated_data["lotes"]
+    )
+    return Response(resultado, status=status.HTTP_200_OK)
+
+
 @api_view(["GET"])
 def verificar_stock_view(request, id_producto):
     """
@@ -448,42 +492,58 @@ def restar_cantidad_lote(request):
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
 
+class PaginacionMateriasPrimas(PageNumberPagination):
+    page_size_query_param = "page_size"
+    max_page_size = 200
+
+
+def _respuesta_con_etag(request, respuesta):
+    """Agrega un ETag (hash del contenido); si coincide con If-None-Match devuelve 304 sin cuerpo."""
+    contenido = json.dumps(respuesta.data, sort_keys=True, default=str)
+    respuesta["ETag"] = f'"{hashlib.md5(contenido.encode()).hexdigest()}"'
+    return get_conditional_response(request, etag=respuesta["ETag"], response=respuesta)
+
+
 #METODO TEMPORAL PARA EL FRONT
+@api_view(["GET"])
 def listar_materias_primas(request):
-    if request.method != "GET":
-        return JsonResponse({"error": "Método no permitido"}, status=405)
-
-    # Buscamos el estado "Disponible"
-    try:
-        estado_disponible = EstadoLoteMateriaPrima.objects.get(descripcion__iexact="disponible")
-    except EstadoLoteMateriaPrima.DoesNotExist:
-        return JsonResponse({"error": "No existe el estado 'Disponible' en la tabla estado_lote_materia_prima"}, status=500)
-
-    materias = MateriaPrima.objects.all()
-    data = []
-
-    for materia in materias:
-        # Obtenemos todos los lotes disponibles para esta materia prima
-        lotes_disponibles = LoteMateriaPrima.objects.filter(
-            id_materia_prima=materia.id_materia_prima,
-            id_estado_lote_materia_prima=estado_disponible.id_estado_lote_materia_prima
-        )
-        
-        # Calculamos la suma de cantidad_disponible para todos los lotes
-        cantidad_disponible_total = 0
-        for lote in lotes_disponibles:
-            cantidad_disponible_total += lote.cantidad_disponible
-            # cantidad_reservada += lote.cantidad_reservada()
-
-        data.append({
-            "id_materia_prima": materia.id_materia_prima,
-            "nombre": materia.nombre,
-            "unidad_medida": materia.id_unidad.descripcion,
-            "umbral_minimo": materia.umbral_minimo,
-            "cantidad_disponible": max(cantidad_disponible_total, 0),  # Evitamos valores negativos
-        })
+    """
+    Materias primas con unidad, proveedor y stock (disponible, reservado y
+    en tránsito), en UNA consulta.
 
-    return JsonResponse(data, safe=False)
+    Filtros opcionales: ?search=<nombre>, ?proveedor=<id>, ?tipo=<id>, ?bajo_umbral=true
+    Con ?page (y ?page_size) la respuesta viene paginada; sin ellos, la lista completa.
+    Responde 304 si la lista no cambió desde el ETag que manda el cliente (If-None-Match).
+    """
+    materias = get_materias_primas_con_stock()
+
+    search = request.query_params.get("search")
+    if search:
+        materias = materias.filter(nombre__icontains=search)
+    for parametro, campo in (("proveedor", "id_proveedor"), ("tipo", "id_tipo_materia_prima")):
+        valor = request.query_params.get(parametro)
+        if valor:
+            if not valor.isdigit():
+                return Response(
+                    {"error": f"El parámetro '{parametro}' debe ser un ID numérico."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            materias = materias.filter(**{campo: valor})
+    if request.query_params.get("bajo_umbral", "").lower() in ("1", "true", "si"):
+        materias = materias.filter(cantidad_disponible__lt=F("umbral_minimo"))
+
+    def como_respuesta(filas):
+        # Evitamos valores negativos
+        return [{**fila, "cantidad_disponible": max(fila["cantidad_disponible"], 0)} for fila in filas]
+
+    if "page" in request.query_params or "page_size" in request.query_params:
+        paginador = PaginacionMateriasPrimas()
+        pagina = paginador.paginate_queryset(materias, request)
+        respuesta = paginador.get_paginated_response(como_respuesta(pagina))
+    else:
+        respuesta = Response(como_respuesta(materias), status=status.HTTP_200_OK)
+
+    return _respuesta_con_etag(request, respuesta)
 
 
 
@@ -398,6 +398,18 @@ def get_config(clave: str, default_val: int) -> int:
         # Si no existe la clave o el valor no es un número, usamos el default
         # Opcional: Podrías crear el registro automáticamente aquí si no existe
         return default_val
+
+
+def get_config_float(clave: str, default_val: float) -> float:
+    """
+    Como get_config, pero para valores con decimales (ej. segundos: "0.5").
+    Acepta coma o punto como separador decimal.
+    """
+    try:
+        config = Configuracion.objects.get(nombre_clave=clave)
+        return float(config.valor.strip().replace(',', '.'))
+    except (Configuracion.DoesNotExist, ValueError):
+        return default_val
     
 
 
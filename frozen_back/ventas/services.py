@@ -1,20 +1,20 @@
 from django.db import transaction
-from .models import OrdenVentaProducto, EstadoVenta, OrdenVenta, Factura, NotaCredito
+from .models import EstadoVenta, OrdenVenta, Factura, NotaCredito
 from stock.models import LoteProduccion, ReservaStock, EstadoLoteProduccion, EstadoReserva 
 from stock.services import verificar_stock_y_enviar_alerta
 from stock.models import ReservaStock
-from django.db.models import Sum, F, Q, ExpressionWrapper, FloatField
 from collections import defaultdict
 from datetime import date, timedelta
 from django.utils import timezone
 import math
-from django.db.models.functions import Coalesce
 
 # Importar modelos
 from productos.models import Producto
-from recetas.models import Receta, RecetaMateriaPrima, ProductoLinea
+from recetas.models import Receta
+from recetas.services import get_explosion_recetas
+from planificacion.calendario import get_calendario_laboral
 from produccion.models import CalendarioProduccion, EstadoOrdenProduccion
-from stock.services import get_stock_disponible_para_producto, get_stock_disponible_para_materia_prima
+from stock.services import disponibilidad_en_lote, reservar_stock_pt_fefo, cambiar_estado_reservas
 
 # Constantes (Las mismas de tu planificador)
 HORAS_LABORABLES_POR_DIA = 16
@@ -68,7 +68,7 @@ def facturar_orden_y_descontar_stock(orden_venta: OrdenVenta):
         productos_afectados.add(reserva.id_orden_venta_producto.id_producto.pk)
 
     estado_utilizada, _ = EstadoReserva.objects.get_or_create(descripcion="Utilizada")
-    reservas.update(id_estado_reserva=estado_utilizada)
+    cambiar_estado_reservas(reservas, estado_utilizada)
     
     estado_facturada, _ = EstadoVenta.objects.get_or_create(descripcion__iexact="Pagada")
     orden_venta.id_estado_venta = estado_facturada
@@ -97,7 +97,7 @@ def cancelar_orden_venta(orden_venta):
     )
     
 
-    reservas_a_cancelar.update(id_estado_reserva=estado_cancelada)
+    cambiar_estado_reservas(reservas_a_cancelar, estado_cancelada)
     
     estado_orden_cancelada, _ = EstadoVenta.objects.get_or_create(descripcion__iexact="Cancelada")
     orden_venta.id_estado_venta = estado_orden_cancelada
@@ -167,7 +167,7 @@ def crear_nota_credito_y_devolver_stock(orden_venta: OrdenVenta, motivo: str = N
         )
 
     # 8. Actualizar Reservas y Orden
-    reservas_utilizadas.update(id_estado_reserva=estado_reserva_devuelta)
+    cambiar_estado_reservas(reservas_utilizadas, estado_reserva_devuelta)
     orden_venta.id_estado_venta = estado_orden_devuelta
     orden_venta.save()
 
@@ -199,12 +199,28 @@ def verificar_orden_completa(items):
     es_toda_factible = True
     warning_global = None
 
+    # Recetas y líneas de todos los productos (caché en memoria, sin consultas por ítem)
+    explosion = get_explosion_recetas()
+    # Días hábiles (fines de semana, feriados y paradas de planta; caché en memoria)
+    calendario = get_calendario_laboral()
+    # Stock disponible SOLO de los productos pedidos y las MPs de sus recetas
+    # (cantidad fija de consultas, sin recorrer el stock de toda la planta)
+    productos_ids = {item['producto_id'] for item in items}
+    mps_ids = {
+        ing.id_materia_prima
+        for p_id in productos_ids if explosion.tiene_receta(p_id)
+        for ing in explosion.ingredientes(p_id)
+    }
+    stock = disponibilidad_en_lote(productos_ids, mps_ids, con_lotes=False)
+    stock_pt = {p_id: datos["disponible"] for p_id, datos in stock["productos"].items()}
+    stock_mp = {mp_id: datos["disponible"] for mp_id, datos in stock["materias_primas"].items()}
+
     for item in items:
         p_id = item['producto_id']
         cant_solicitada = int(item['cantidad'])
         
         # --- A. Consumo de Stock PT ---
-        stock_real_pt = get_stock_disponible_para_producto(p_id)
+        stock_real_pt = stock_pt.get(p_id, 0)
         stock_virtual_disponible = max(0, stock_real_pt - virtual_stock_pt_consumido[p_id])
         
         tomar_de_stock = min(stock_virtual_disponible, cant_solicitada)
@@ -223,20 +239,19 @@ def verificar_orden_completa(items):
             
             # 1. Chequeo MP (Acumulativo)
             try:
-                receta = Receta.objects.get(id_producto=p_id)
-                ingredientes = RecetaMateriaPrima.objects.filter(id_receta=receta)
+                ingredientes = explosion.ingredientes(p_id)
                 
                 for ing in ingredientes:
-                    mp_id = ing.id_materia_prima.id_materia_prima
+                    mp_id = ing.id_materia_prima
                     cant_necesaria = ing.cantidad * a_producir
                     
-                    stock_real_mp = get_stock_disponible_para_materia_prima(mp_id)
+                    stock_real_mp = stock_mp.get(mp_id, 0)
                     # Restamos lo que ya consumieron los items anteriores de esta lista
                     stock_mp_virtual = max(0, stock_real_mp - virtual_stock_mp_consumido[mp_id])
                     
                     if stock_mp_virtual < cant_necesaria:
                         # Falta MP, calculamos Lead Time
-                        lt = ing.id_materia_prima.id_proveedor.lead_time_days
+                        lt = ing.lead_time_days
                         max_lead_time_mp = max(max_lead_time_mp, lt)
                         # Asumimos que compramos lo que falta, no consumimos del virtual negativo
                     else:
@@ -247,41 +262,38 @@ def verificar_orden_completa(items):
                 warning_global = f"Producto {p_id} sin receta."
             
             # 2. Calcular Fechas MP
-            fecha_llegada_mp = hoy + timedelta(days=max_lead_time_mp)
-            while fecha_llegada_mp.weekday() >= 5: fecha_llegada_mp += timedelta(days=1)
+            fecha_llegada_mp = calendario.proximo_habil(hoy + timedelta(days=max_lead_time_mp))
             
-            fecha_inicio_prod = fecha_llegada_mp + timedelta(days=DIAS_BUFFER_RECEPCION_MP)
-            while fecha_inicio_prod.weekday() >= 5: fecha_inicio_prod += timedelta(days=1)
+            fecha_inicio_prod = calendario.proximo_habil(fecha_llegada_mp + timedelta(days=DIAS_BUFFER_RECEPCION_MP))
 
             # 3. Calcular Tiempo Máquina (Acumulativo sobre la línea)
-            capacidades = ProductoLinea.objects.filter(id_producto=p_id)
-            if capacidades.exists():
-                cap_total = capacidades.aggregate(total=Sum('cant_por_hora'))['total'] or 1
+            capacidades = explosion.lineas(p_id)
+            if capacidades:
+                cap_total = explosion.capacidad_total(p_id) or 1
                 horas_nec = math.ceil(a_producir / cap_total)
                 dias_prod = math.ceil(horas_nec / HORAS_LABORABLES_POR_DIA)
                 
                 # Buscamos cuándo se libera la línea más ocupada
                 fecha_base_linea = fecha_inicio_prod
                 for cap in capacidades:
-                    fecha_linea = virtual_calendario_lineas[cap.id_linea_produccion]
+                    fecha_linea = virtual_calendario_lineas[cap.id_linea_produccion_id]
                     if fecha_linea > fecha_base_linea:
                         fecha_base_linea = fecha_linea
                 
                 # Sumamos días de trabajo
-                fecha_fin_prod = fecha_base_linea + timedelta(days=dias_prod)
-                while fecha_fin_prod.weekday() >= 5: fecha_fin_prod += timedelta(days=1)
+                fecha_fin_prod = calendario.proximo_habil(fecha_base_linea + timedelta(days=dias_prod))
                 
                 # Actualizamos el calendario virtual de esas líneas
                 # (El próximo producto que use esta línea tendrá que esperar a esta fecha)
                 for cap in capacidades:
-                    virtual_calendario_lineas[cap.id_linea_produccion] = fecha_fin_prod
+                    virtual_calendario_lineas[cap.id_linea_produccion_id] = fecha_fin_prod
                 
                 fecha_entrega_item = fecha_fin_prod + timedelta(days=DIAS_BUFFER_ENTREGA_PT + 1)
             else:
                 fecha_entrega_item = fecha_inicio_prod # Fallback sin lineas
 
-        # Ajuste final fines de semana
-        while fecha_entrega_item.weekday() >= 5: fecha_entrega_item += timedelta(days=1)
+        # Ajuste final a día hábil (fines de semana, feriados y paradas de planta)
+        fecha_entrega_item = calendario.proximo_habil(fecha_entrega_item)
 
         # Actualizar fecha global de la orden
         if fecha_entrega_item > fecha_final_orden:
@@ -322,12 +334,11 @@ def procesar_orden_venta_online(orden_venta: OrdenVenta):
     todas_reservadas = True
     errores = []
 
-    # 2. Iterar productos y reservar
-    for linea in orden_venta.ordenventaproducto_set.all():
-        exito_reserva = _reservar_stock_inmediato(linea, estado_reserva_activa)
-        if not exito_reserva:
-            todas_reservadas = False
-            errores.append(f"Falta stock para {linea.id_producto.descripcion}")
+    # 2. Reservar todos los productos juntos
+    lineas = list(orden_venta.ordenventaproducto_set.select_related('id_producto'))
+    for linea in _reservar_stock_inmediato(lineas, estado_reserva_activa):
+        todas_reservadas = False
+        errores.append(f"Falta stock para {linea.id_producto.descripcion}")
 
     # 3. Actualizar Estado de la Venta
     if todas_reservadas:
@@ -342,53 +353,18 @@ def procesar_orden_venta_online(orden_venta: OrdenVenta):
         print(f"❌ Venta Online #{orden_venta.pk} -> Falta stock")
         return {'exito': False, 'mensaje': ", ".join(errores)}
 
-def _reservar_stock_inmediato(linea_ov: OrdenVentaProducto, estado_activa: EstadoReserva) -> bool:
+def _reservar_stock_inmediato(lineas_ov, estado_activa: EstadoReserva) -> list:
     """
-    Intenta reservar el 100% de la cantidad solicitada.
-    Retorna True si logró reservar todo, False si falta algo.
+    Intenta reservar el 100% de la cantidad solicitada de cada línea
+    (todo o nada por línea, FEFO). Una sola consulta de lotes para todas.
+    Retorna las líneas que NO se pudieron reservar (falta stock).
     """
-    cantidad_necesaria = linea_ov.cantidad
-    
-    filtro_reservas_activas = Q(reservas__id_estado_reserva__descripcion='Activa')
-    
-    lotes_disponibles = LoteProduccion.objects.filter(
-        id_producto=linea_ov.id_producto,
-        id_estado_lote_produccion__descripcion="Disponible"
-    ).annotate(
-        total_reservado=Coalesce(Sum('reservas__cantidad_reservada', filter=filtro_reservas_activas), 0)
-    ).annotate(
-        # --- CORRECCIÓN AQUÍ ---
-        # Usamos ExpressionWrapper para manejar la resta entre Entero y Flotante
-        disponible_real=ExpressionWrapper(
-            F('cantidad') - F('total_reservado'),
-            output_field=FloatField()
-        )
-    ).filter(
-        disponible_real__gt=0
-    ).order_by('fecha_vencimiento')
-
-    # Verificamos si hay suficiente stock TOTAL antes de empezar a reservar
-    total_existente = sum(l.disponible_real for l in lotes_disponibles)
-    
-    # Nota: Al comparar floats, es bueno tener cuidado, pero para stock suele funcionar directo
-    if total_existente < cantidad_necesaria:
-        return False 
-
-    cantidad_pendiente = cantidad_necesaria
-    
-    for lote in lotes_disponibles:
-        if cantidad_pendiente <= 0: break
-        
-        a_tomar = min(lote.disponible_real, cantidad_pendiente)
-        
-        ReservaStock.objects.create(
-            id_orden_venta_producto=linea_ov,
-            id_lote_produccion=lote,
-            cantidad_reservada=a_tomar,
-            id_estado_reserva=estado_activa
-        )
-        cantidad_pendiente -= a_tomar
-
-    # Usamos una pequeña tolerancia para comparación de floats si es necesario, 
-    # o simplemente comparamos con 0 si tus cantidades son enteras.
-    return cantidad_pendiente <= 0
\ No newline at end of file
+    reservados = reservar_stock_pt_fefo(
+        [(linea_ov, linea_ov.cantidad) for linea_ov in lineas_ov],
+        estado_activa,
+        completa=True
+    )
+    return [
+        linea_ov for linea_ov, reservado in zip(lineas_ov, reservados)
+        if reservado < linea_ov.cantidad
+    ]